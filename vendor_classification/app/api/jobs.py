@@ -26,6 +26,7 @@ from tasks.classification_tasks import reclassify_flagged_vendors_task
 # --- END CORRECTED IMPORT PATH ---
 # --- ADDED: Import file service for merge ---
 from services.file_service import generate_output_file
+from services.result_store import query_job_results, get_job_results, update_job_results, save_job_results, iter_job_results, has_stored_results
 # --- END ADDED ---
 
 
@@ -165,12 +166,22 @@ async def read_job_results(
     job_id: str = Path(..., title="The ID of the job to get detailed results for"),
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user),
+    skip: int = Query(0, ge=0, description="Number of results to skip"),
+    limit: Optional[int] = Query(None, ge=1, le=10000, description="Page size; omit for all results"),
+    final_status: Optional[str] = Query(None, alias="status", description="Filter by final_status (CLASSIFICATION jobs)"),
+    source: Optional[str] = Query(None, description="Filter by classification_source (CLASSIFICATION jobs)"),
+    achieved_level: Optional[int] = Query(None, ge=0, le=5, description="Filter by achieved_level (CLASSIFICATION jobs)"),
+    search: Optional[str] = Query(None, max_length=200, description="Substring of the vendor or a category name (CLASSIFICATION jobs)"),
+    sort_by: str = Query("position", description="Result field to sort by ('position' = input order)"),
+    sort_desc: bool = Query(False, description="Sort descending"),
 ):
     """
     Retrieve the detailed classification results for a specific completed job.
     Ensures the current user owns the job or is an admin.
     Returns a structure containing the job_id, job_type, and a list of results
     (either JobResultItem or ReviewResultItem depending on the job_type).
+    CLASSIFICATION results are paged, filtered and sorted in the database (job_result_items);
+    `total` is the number of matching results.
     """
     set_log_context({"username": current_user.username, "target_job_id": job_id, "is_superuser": current_user.is_superuser})
     logger.info(f"Fetching detailed results for job ID: {job_id}")
@@ -194,18 +205,28 @@ async def read_job_results(
         # Return empty list in the correct response structure
         return JobResultsResponse(job_id=job_id, job_type=JobType(job.job_type), results=[]) # Cast job_type to enum
 
+    if job.job_type == JobType.CLASSIFICATION.value:
+        try:
+            total, page = query_job_results(db, job, skip=skip, limit=limit, final_status=final_status, classification_source=source,
+                                            achieved_level=achieved_level, search=search, sort_by=sort_by, sort_desc=sort_desc)
+        except ValueError as sort_err:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(sort_err))
+        logger.info(f"Returning {len(page)} of {total} detailed result items for job ID: {job_id}",
+                    extra={"job_type": job.job_type, "skip": skip, "limit": limit})
+        return JobResultsResponse(job_id=job_id, job_type=JobType(job.job_type), results=page, total=total, skip=skip, limit=limit)
+
     if not job.detailed_results:
         logger.warning(f"Job {job_id} is completed but has no detailed results stored.", extra={"job_id": job_id, "job_type": job.job_type})
         return JobResultsResponse(job_id=job_id, job_type=JobType(job.job_type), results=[]) # Cast job_type to enum
 
-    # The detailed_results field should contain a list of dicts matching the expected schema.
+    # REVIEW jobs keep their (small) ReviewResultItem list in detailed_results.
     # Pydantic will validate this structure upon return based on the response_model.
-    # We trust the background task stored the correct structure based on job_type.
     results_count = len(job.detailed_results)
-    logger.info(f"Returning {results_count} detailed result items for job ID: {job_id}", extra={"job_type": job.job_type})
+    page = job.detailed_results[skip:None if limit is None else skip + limit]
+    logger.info(f"Returning {len(page)} of {results_count} detailed result items for job ID: {job_id}", extra={"job_type": job.job_type})
 
     # Pydantic should automatically validate based on the Union in JobResultsResponse
-    return JobResultsResponse(job_id=job_id, job_type=JobType(job.job_type), results=job.detailed_results) # Cast job_type to enum
+    return JobResultsResponse(job_id=job_id, job_type=JobType(job.job_type), results=page, total=results_count, skip=skip, limit=limit) # Cast job_type to enum
 # --- END UPDATED ---
 
 
@@ -412,10 +433,11 @@ async def merge_review_results(
     if parent_job.job_type != JobType.CLASSIFICATION.value:
         logger.error(f"Parent job {parent_job.id} is not a CLASSIFICATION job.", extra={"parent_job_type": parent_job.job_type})
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Parent job is not a classification job.")
-    if not parent_job.detailed_results:
-        logger.warning(f"Parent job {parent_job.id} has no detailed results to update. Initializing as empty list.", extra={"parent_job_id": parent_job.id})
-        # Initialize as empty list if missing
-        parent_job.detailed_results = []
+    if not has_stored_results(db, parent_job.id) and parent_job.detailed_results:
+        # Legacy parent job: move its detailed_results list into job_result_items first
+        logger.info(f"Moving {len(parent_job.detailed_results)} legacy detailed results of parent job {parent_job.id} into job_result_items.")
+        save_job_results(db, parent_job.id, parent_job.detailed_results)
+        parent_job.detailed_results = None
 
     set_log_context({"parent_job_id": parent_job.id}) # Add parent job ID to context
     logger.info(f"Found parent job {parent_job.id} for merging.")
@@ -426,15 +448,14 @@ async def merge_review_results(
         review_results_data: List[ReviewResultItem] = [ReviewResultItem.model_validate(item) for item in review_job.detailed_results]
         logger.info(f"Loaded {len(review_results_data)} items from review job {review_job_id}.")
 
-        # Load original results (List[JobResultItem])
-        original_results_data: List[JobResultItem] = [JobResultItem.model_validate(item) for item in parent_job.detailed_results]
-        logger.info(f"Loaded {len(original_results_data)} items from parent job {parent_job.id}.")
-
-        # Create a map of original results keyed by vendor_name for efficient updates
-        original_results_map: Dict[str, JobResultItem] = {item.vendor_name: item for item in original_results_data}
+        # Load only the reviewed vendors' original results (primary key lookups in job_result_items)
+        original_results_data = get_job_results(db, parent_job, vendor_names=[item.vendor_name for item in review_results_data])
+        original_results_map: Dict[str, Any] = {item["vendor_name"]: item for item in original_results_data}
+        logger.info(f"Loaded {len(original_results_map)} reviewed vendors' original results from parent job {parent_job.id}.")
 
-        # Iterate through review results and update the map
+        # Iterate through review results and collect the updated rows
         updated_count = 0
+        updated_items: List[Dict[str, Any]] = []
         for review_item in review_results_data:
             vendor_name = review_item.vendor_name
             # The 'new_result' field in ReviewResultItem is already a dict matching JobResultItem structure
@@ -444,21 +465,17 @@ async def merge_review_results(
                 new_result_dict['classification_source'] = 'Review'
                 # Validate the new result dict against the schema before replacing
                 validated_new_result = JobResultItem.model_validate(new_result_dict)
-                original_results_map[vendor_name] = validated_new_result
+                updated_items.append(validated_new_result.model_dump())
                 updated_count += 1
                 logger.debug(f"Updated result for vendor '{vendor_name}' in parent job map.")
             else:
                 logger.warning(f"Vendor '{vendor_name}' from review job {review_job_id} not found in parent job {parent_job.id} results. Skipping update for this vendor.")
 
-        logger.info(f"Updated {updated_count} vendor results in the parent job map.")
-
-        # Convert the updated map back into a List[JobResultItem]
-        updated_detailed_results_list: List[Dict[str, Any]] = [item.model_dump() for item in original_results_map.values()]
-
-        # 6. Update the parent job's detailed_results
-        parent_job.detailed_results = updated_detailed_results_list
+        # 6. Update the reviewed rows of the parent job (bulk UPDATE by (job_id, vendor_name))
+        update_job_results(db, parent_job.id, updated_items)
+        db.flush()
         parent_job.updated_at = datetime.now(timezone.utc) # Mark parent job as updated
-        logger.info(f"Updated detailed_results field on parent job {parent_job.id}.")
+        logger.info(f"Updated {updated_count} vendor results of parent job {parent_job.id}.")
 
         # 7. Regenerate the Excel file for the parent job
         try:
@@ -467,7 +484,7 @@ async def merge_review_results(
             # Ensure generate_output_file accepts List[JobResultItem] or adapt here
             new_output_filename = generate_output_file(
                 job_id=parent_job.id,
-                detailed_results=[JobResultItem.model_validate(item) for item in updated_detailed_results_list] # Pass validated models
+                detailed_results=[JobResultItem.model_validate(item) for item in iter_job_results(db, parent_job.id)] # Pass validated models
             )
             parent_job.output_file_name = new_output_filename
             logger.info(f"Successfully regenerated Excel file for parent job {parent_job.id}: {new_output_filename}")
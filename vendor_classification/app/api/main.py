@@ -27,7 +27,7 @@ from models.job import Job, JobStatus, ProcessingStage # Keep top-level imports
 from models.user import User
 
 # --- Service Imports ---
-from services.file_service import save_upload_file, validate_file_header
+from services.file_service import save_upload_file, validate_file_header, is_supported_upload
 
 # --- Task Imports ---
 from tasks.classification_tasks import process_vendor_file # Keep this specific import
@@ -270,9 +270,9 @@ async def validate_uploaded_file_header(
     if not file.filename:
         logger.warning("Validation attempt with no filename.", extra=log_extra)
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No filename provided.")
-    if not file.filename.lower().endswith(('.xlsx', '.xls')):
+    if not is_supported_upload(file.filename):
         logger.warning(f"Invalid file type for validation: {file.filename}", extra=log_extra)
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file type. Please upload an Excel file (.xlsx or .xls).")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file type. Please upload an Excel (.xlsx, .xls), CSV or Parquet file.")
 
     try:
         validation_result = validate_file_header(file)
@@ -340,9 +340,9 @@ async def upload_vendor_file(
     if not file.filename:
         logger.warning("Upload attempt with no filename.", extra={"job_id": job_id})
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="No filename provided.")
-    if not file.filename.lower().endswith(('.xlsx', '.xls')):
+    if not is_supported_upload(file.filename):
         logger.warning(f"Invalid file type uploaded: {file.filename}", extra={"job_id": job_id})
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file type. Please upload an Excel file (.xlsx or .xls).")
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid file type. Please upload an Excel (.xlsx, .xls), CSV or Parquet file.")
 
     saved_file_path = None
     try:
@@ -19,7 +19,7 @@ logger = logging.getLogger("vendor_classification.db_init")
 logger.info("Importing models for database initialization")
 try:
     from models.user import User
-    from models.job import Job
+    from models.job import Job, JobVendorResult, JobResultRecord
     # Import other models here if they exist
     logger.info("Models imported successfully.")
 except ImportError as e:
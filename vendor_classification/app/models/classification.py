@@ -32,6 +32,8 @@ class ApiUsage(BaseModel):
     openrouter_prompt_tokens: int = 0
     openrouter_completion_tokens: int = 0
     openrouter_total_tokens: int = 0
+    openrouter_cached_tokens: int = 0 # Prompt tokens served from the provider prompt cache
+    by_model: Dict[str, Dict[str, int]] = Field(default_factory=dict) # model -> calls/prompt/completion/total/cached tokens
     tavily_search_calls: int = 0
     cost_estimate_usd: float = 0.0
 
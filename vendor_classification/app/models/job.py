@@ -123,4 +123,64 @@ class Job(Base):
         self.completed_at = None
         # --- UPDATED: Ensure detailed_results is Null if it failed ---
         self.detailed_results = None
-        # --- END UPDATED ---
\ No newline at end of file
+        # --- END UPDATED ---
+
+
+class JobVendorResult(Base):
+    """
+    Append-only checkpoint of a CLASSIFICATION job's per-vendor results (services/job_checkpoint.py).
+    result_key is 'level1'..'level5' (one initial classification) or 'search' (the raw search + recursive
+    classification output). A restarted job restores these and skips the work they cover; rows are deleted
+    once the job completes.
+    """
+
+    __tablename__ = "job_vendor_results"
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    job_id = Column(String, ForeignKey("jobs.id", ondelete="CASCADE"), nullable=False)
+    vendor_name = Column(String, nullable=False)
+    result_key = Column(String(16), nullable=False)
+    result = Column(JSON, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        Index('ix_job_vendor_results_job_id', 'job_id'),
+    )
+
+
+
+class JobResultRecord(Base):
+    """
+    One vendor's final result for a CLASSIFICATION job (the JobResultItem schema as columns), keyed by
+    (job_id, vendor_name). Replaces the Job.detailed_results JSON list for classification jobs; read and
+    written through services/result_store.py. `position` keeps the input order.
+    """
+
+    __tablename__ = "job_result_items"
+
+    job_id = Column(String, ForeignKey("jobs.id", ondelete="CASCADE"), primary_key=True)
+    vendor_name = Column(String, primary_key=True)
+    position = Column(Integer, nullable=False, default=0)
+    level1_id = Column(String, nullable=True)
+    level1_name = Column(String, nullable=True)
+    level2_id = Column(String, nullable=True)
+    level2_name = Column(String, nullable=True)
+    level3_id = Column(String, nullable=True)
+    level3_name = Column(String, nullable=True)
+    level4_id = Column(String, nullable=True)
+    level4_name = Column(String, nullable=True)
+    level5_id = Column(String, nullable=True)
+    level5_name = Column(String, nullable=True)
+    final_confidence = Column(Float, nullable=True)
+    final_status = Column(String, nullable=False)
+    classification_source = Column(String, nullable=True)
+    classification_notes_or_reason = Column(Text, nullable=True)
+    achieved_level = Column(Integer, nullable=True)
+    cluster_representative = Column(String, nullable=True)
+
+    __table_args__ = (
+        Index('ix_job_result_items_job_position', 'job_id', 'position'),
+        Index('ix_job_result_items_job_status', 'job_id', 'final_status'),
+        Index('ix_job_result_items_job_level', 'job_id', 'achieved_level'),
+        Index('ix_job_result_items_job_source', 'job_id', 'classification_source'),
+    )
@@ -1,7 +1,8 @@
 # <file path='app/models/taxonomy.py'>
 # --- file path='app/models/taxonomy.py' ---
-from pydantic import BaseModel, Field
-from typing import Dict, List, Optional, Any # <<< ADDED Any
+from pydantic import BaseModel, ConfigDict, Field, PrivateAttr
+from types import MappingProxyType
+from typing import Dict, List, Optional, Any, FrozenSet, Mapping, Tuple # <<< ADDED Any
 import re # Added import
 
 # --- ADDED: Import logger ---
@@ -16,6 +17,10 @@ class TaxonomyCategory(BaseModel):
     name: str
     description: Optional[str] = None
 
+class IndexedTaxonomyCategory(TaxonomyCategory):
+    """Read-only category record shared by TaxonomyIndex lookups."""
+    model_config = ConfigDict(frozen=True)
+
 # --- ADDED: Level 5 Model ---
 class TaxonomyLevel5(TaxonomyCategory):
     """Level 5 taxonomy category (most specific - typically 6 digits)."""
@@ -40,6 +45,64 @@ class TaxonomyLevel1(TaxonomyCategory):
     """Level 1 taxonomy category (most general)."""
     children: Dict[str, TaxonomyLevel2] = Field(default_factory=dict)
 
+class TaxonomyIndex:
+    """
+    Immutable flat lookup tables over a Taxonomy, built once (see Taxonomy.build_index).
+    Parent keys are bare category IDs; None is the root (Level 1). IDs are unique across levels (NAICS).
+    """
+    __slots__ = ("nodes", "levels", "parents", "paths", "children", "child_ids", "level_ids")
+
+    def __init__(self, taxonomy: "Taxonomy"):
+        nodes: Dict[str, TaxonomyCategory] = {}
+        levels: Dict[str, int] = {}
+        parents: Dict[str, Optional[str]] = {}
+        paths: Dict[str, Tuple[str, ...]] = {}
+        children: Dict[Optional[str], List[TaxonomyCategory]] = {None: []}
+        level_ids: Dict[int, List[str]] = {level: [] for level in range(1, 6)}
+
+        def _walk(node_map: Dict[str, Any], level: int, parent_id: Optional[str], parent_path: Tuple[str, ...]):
+            for cat_id, node in node_map.items():
+                if cat_id in nodes:
+                    logger.warning(f"TaxonomyIndex: Duplicate category ID '{cat_id}' at level {level}; keeping the first occurrence (level {levels[cat_id]}).")
+                    continue
+                category = IndexedTaxonomyCategory(id=cat_id, name=node.name, description=node.description)
+                nodes[cat_id] = category
+                levels[cat_id] = level
+                parents[cat_id] = parent_id
+                paths[cat_id] = parent_path + (cat_id,)
+                children.setdefault(parent_id, []).append(category)
+                children.setdefault(cat_id, [])
+                level_ids[level].append(cat_id)
+                _walk(getattr(node, 'children', None) or {}, level + 1, cat_id, paths[cat_id])
+
+        _walk(taxonomy.categories, 1, None, ())
+
+        self.nodes: Mapping[str, TaxonomyCategory] = MappingProxyType(nodes)
+        self.levels: Mapping[str, int] = MappingProxyType(levels)
+        self.parents: Mapping[str, Optional[str]] = MappingProxyType(parents)
+        self.paths: Mapping[str, Tuple[str, ...]] = MappingProxyType(paths)
+        self.children: Mapping[Optional[str], Tuple[TaxonomyCategory, ...]] = MappingProxyType({k: tuple(v) for k, v in children.items()})
+        self.child_ids: Mapping[Optional[str], FrozenSet[str]] = MappingProxyType({k: frozenset(c.id for c in v) for k, v in children.items()})
+        self.level_ids: Mapping[int, Tuple[str, ...]] = MappingProxyType({k: tuple(v) for k, v in level_ids.items()})
+        logger.info(f"TaxonomyIndex built with {len(nodes)} categories.",
+                    extra={"level_counts": {level: len(ids) for level, ids in level_ids.items()}})
+
+    def resolve_parent(self, parent_id: Optional[str], child_level: int) -> Optional[str]:
+        """
+        Maps a parent reference (bare ID or dotted path such as 'L1.L2.L3') to the bare ID of a category
+        at level child_level - 1. Returns None if it does not resolve.
+        """
+        if not parent_id:
+            return None
+        parts = parent_id.split('.')
+        bare_id = parts[-1]
+        if self.levels.get(bare_id) != child_level - 1:
+            return None
+        if len(parts) > 1 and self.paths[bare_id][-len(parts):] != tuple(parts):
+            return None # Dotted path does not match the actual ancestry
+        return bare_id
+
+
 class Taxonomy(BaseModel):
     """Complete taxonomy model."""
     name: str
@@ -47,236 +110,73 @@ class Taxonomy(BaseModel):
     description: Optional[str] = None
     categories: Dict[str, TaxonomyLevel1] = Field(default_factory=dict)
 
+    _index: Optional[TaxonomyIndex] = PrivateAttr(default=None)
+
+    def build_index(self) -> TaxonomyIndex:
+        """(Re)builds the lookup index. Call after mutating categories; load_taxonomy calls it once."""
+        self._index = TaxonomyIndex(self)
+        return self._index
+
+    @property
+    def index(self) -> TaxonomyIndex:
+        """Lookup index, built lazily on first use."""
+        index = self._index
+        if index is None:
+            index = self.build_index()
+        return index
+
+    def get_child_categories(self, level: int, parent_id: Optional[str] = None) -> Tuple[TaxonomyCategory, ...]:
+        """Categories at `level` under `parent_id` (ignored for Level 1). Shared, read-only objects."""
+        if level == 1:
+            return self.index.children[None]
+        resolved_parent = self.index.resolve_parent(parent_id, level)
+        if resolved_parent is None:
+            logger.warning(f"get_child_categories: Parent ID '{parent_id}' is not a Level {level - 1} category.")
+            return ()
+        children = self.index.children.get(resolved_parent, ())
+        if not children:
+            logger.warning(f"get_child_categories: Parent category '{parent_id}' has no Level {level} children.")
+        return children
+
+    def get_valid_child_ids(self, level: int, parent_id: Optional[str] = None) -> FrozenSet[str]:
+        """IDs valid at `level` under `parent_id`, for validating LLM output."""
+        if level == 1:
+            return self.index.child_ids[None]
+        resolved_parent = self.index.resolve_parent(parent_id, level)
+        if resolved_parent is None:
+            return frozenset()
+        return self.index.child_ids.get(resolved_parent, frozenset())
+
+    def get_category_name(self, category_id: Optional[str]) -> Optional[str]:
+        """Name of a category given its bare ID or dotted path, or None if unknown."""
+        if not category_id:
+            return None
+        node = self.index.nodes.get(category_id.split('.')[-1])
+        return node.name if node else None
+
+    def get_category_path(self, category_id: str) -> Tuple[str, ...]:
+        """IDs from Level 1 down to `category_id` (inclusive), or () if unknown."""
+        return self.index.paths.get(category_id.split('.')[-1], ())
+
     def get_level1_categories(self) -> List[TaxonomyCategory]:
         """Get all level 1 categories."""
-        logger.debug(f"get_level1_categories: Retrieving {len(self.categories)} L1 categories.")
-        return [
-            TaxonomyCategory(id=cat_id, name=cat.name, description=cat.description)
-            for cat_id, cat in self.categories.items()
-        ]
+        return list(self.get_child_categories(1))
 
     def get_level2_categories(self, parent_id: str) -> List[TaxonomyCategory]:
         """Get level 2 categories for a given parent."""
-        logger.debug(f"get_level2_categories: Attempting to get children for L1 parent '{parent_id}'.")
-        if parent_id not in self.categories:
-            logger.warning(f"get_level2_categories: Parent ID '{parent_id}' not found in L1 categories.")
-            return []
-
-        level1_cat = self.categories[parent_id]
-        if not hasattr(level1_cat, 'children') or not level1_cat.children:
-             logger.warning(f"get_level2_categories: Parent L1 category '{parent_id}' has no children dictionary or it is empty.")
-             return []
-
-        children_count = len(level1_cat.children)
-        logger.debug(f"get_level2_categories: Found {children_count} L2 children for parent '{parent_id}'.")
-        return [
-            TaxonomyCategory(id=cat_id, name=cat.name, description=cat.description)
-            for cat_id, cat in level1_cat.children.items()
-        ]
+        return list(self.get_child_categories(2, parent_id))
 
     def get_level3_categories(self, parent_id: str) -> List[TaxonomyCategory]:
         """Get level 3 categories for a given parent ID (expected format: L1.L2 or just L2 ID)."""
-        logger.debug(f"get_level3_categories: Attempting to get children for L2 parent '{parent_id}'.")
-        level1_id = None
-        level2_id = None
-        if '.' in parent_id:
-            parts = parent_id.split('.')
-            if len(parts) == 2:
-                level1_id, level2_id = parts[0], parts[1]
-            else:
-                 logger.error(f"get_level3_categories: Invalid parent ID format '{parent_id}'. Expected 'L1.L2' or 'L2'.")
-                 return []
-        else:
-            # Assume it's just the L2 ID - need to find its L1 parent
-            level2_id = parent_id
-            for l1_key, l1_node in self.categories.items():
-                if level2_id in getattr(l1_node, 'children', {}):
-                    level1_id = l1_key
-                    break
-            if not level1_id:
-                logger.warning(f"get_level3_categories: Could not find L1 parent for L2 ID '{level2_id}'.")
-                return []
-
-        logger.debug(f"get_level3_categories: Parsed parent ID into L1='{level1_id}', L2='{level2_id}'.")
-
-        if level1_id not in self.categories:
-            logger.warning(f"get_level3_categories: L1 parent ID '{level1_id}' not found.")
-            return []
-
-        level1_cat = self.categories[level1_id]
-        if not hasattr(level1_cat, 'children') or level2_id not in level1_cat.children:
-             logger.warning(f"get_level3_categories: L2 parent ID '{level2_id}' not found under L1 '{level1_id}'.")
-             return []
-
-        level2_cat = level1_cat.children[level2_id]
-        if not hasattr(level2_cat, 'children') or not level2_cat.children:
-             logger.warning(f"get_level3_categories: Parent L2 category '{level2_id}' has no children dictionary or it is empty.")
-             return []
-
-        children_count = len(level2_cat.children)
-        logger.debug(f"get_level3_categories: Found {children_count} L3 children for parent '{parent_id}'.")
-        return [
-            TaxonomyCategory(id=cat_id, name=cat.name, description=cat.description)
-            for cat_id, cat in level2_cat.children.items()
-        ]
+        return list(self.get_child_categories(3, parent_id))
 
     def get_level4_categories(self, parent_id: str) -> List[TaxonomyCategory]:
         """Get level 4 categories for a given parent ID (expected format: L1.L2.L3 or just L3 ID)."""
-        logger.debug(f"get_level4_categories: Attempting to get children for L3 parent '{parent_id}'.")
-        level1_id = None
-        level2_id = None
-        level3_id = None
-        if '.' in parent_id:
-            parts = parent_id.split('.')
-            if len(parts) == 3:
-                level1_id, level2_id, level3_id = parts[0], parts[1], parts[2]
-            else:
-                 logger.error(f"get_level4_categories: Invalid parent ID format '{parent_id}'. Expected 'L1.L2.L3' or 'L3'.")
-                 return []
-        else:
-            # Assume it's just the L3 ID - need to find its L1/L2 parents
-            level3_id = parent_id
-            found = False
-            for l1_key, l1_node in self.categories.items():
-                for l2_key, l2_node in getattr(l1_node, 'children', {}).items():
-                    if level3_id in getattr(l2_node, 'children', {}):
-                        level1_id = l1_key
-                        level2_id = l2_key
-                        found = True
-                        break
-                if found:
-                    break
-            if not found:
-                 logger.warning(f"get_level4_categories: Could not find L1/L2 parents for L3 ID '{level3_id}'.")
-                 return []
-
-        logger.debug(f"get_level4_categories: Parsed parent ID into L1='{level1_id}', L2='{level2_id}', L3='{level3_id}'.")
-
-        if level1_id not in self.categories:
-            logger.warning(f"get_level4_categories: L1 parent ID '{level1_id}' not found.")
-            return []
-
-        level1_cat = self.categories[level1_id]
-        if not hasattr(level1_cat, 'children') or level2_id not in level1_cat.children:
-            logger.warning(f"get_level4_categories: L2 parent ID '{level2_id}' not found under L1 '{level1_id}'.")
-            return []
-
-        level2_cat = level1_cat.children[level2_id]
-        if not hasattr(level2_cat, 'children') or level3_id not in level2_cat.children:
-            logger.warning(f"get_level4_categories: L3 parent ID '{level3_id}' not found under L2 '{level2_id}'.")
-            return []
-
-        level3_cat = level2_cat.children[level3_id]
-        if not hasattr(level3_cat, 'children') or not level3_cat.children:
-             logger.warning(f"get_level4_categories: Parent L3 category '{level3_id}' has no children dictionary or it is empty.")
-             return []
-
-        children_count = len(level3_cat.children)
-        logger.debug(f"get_level4_categories: Found {children_count} L4 children for parent '{parent_id}'.")
-        return [
-            TaxonomyCategory(id=cat_id, name=cat.name, description=cat.description)
-            for cat_id, cat in level3_cat.children.items()
-        ]
-
-    # --- ADDED: get_level5_categories ---
+        return list(self.get_child_categories(4, parent_id))
+
     def get_level5_categories(self, parent_id: str) -> List[TaxonomyCategory]:
-        """Get level 5 categories for a given parent ID (expected format: L1.L2.L3.L4 or just L4 ID)."""
-        logger.debug(f"get_level5_categories: Attempting to get children for L4 parent '{parent_id}'.")
-        level1_id = None
-        level2_id = None
-        level3_id = None
-        level4_id = None
-        if '.' in parent_id:
-            parts = parent_id.split('.')
-            if len(parts) == 4:
-                level1_id, level2_id, level3_id, level4_id = parts[0], parts[1], parts[2], parts[3]
-            elif len(parts) == 3: # Handle case where parent_id is L2.L3.L4
-                l2_id_part, l3_id_part, l4_id_part = parts[0], parts[1], parts[2]
-                found = False
-                for l1k, l1n in self.categories.items():
-                    if l2_id_part in getattr(l1n, 'children', {}):
-                         level1_id = l1k
-                         level2_id = l2_id_part
-                         level3_id = l3_id_part
-                         level4_id = l4_id_part
-                         found = True
-                         break
-                if not found:
-                    logger.error(f"get_level5_categories: Could not find L1 parent for L2.L3.L4 format '{parent_id}'.")
-                    return []
-            elif len(parts) == 2: # Handle case where parent_id is L3.L4
-                l3_id_part, l4_id_part = parts[0], parts[1]
-                found = False
-                for l1k, l1n in self.categories.items():
-                    for l2k, l2n in getattr(l1n, 'children', {}).items():
-                         if l3_id_part in getattr(l2n, 'children', {}):
-                             level1_id = l1k
-                             level2_id = l2k
-                             level3_id = l3_id_part
-                             level4_id = l4_id_part
-                             found = True
-                             break
-                    if found: break
-                if not found:
-                    logger.error(f"get_level5_categories: Could not find L1/L2 parent for L3.L4 format '{parent_id}'.")
-                    return []
-            else:
-                 logger.error(f"get_level5_categories: Invalid parent ID format '{parent_id}'. Expected 'L1.L2.L3.L4' or 'L4'.")
-                 return []
-        else:
-            # Assume it's just the L4 ID - need to find its parents
-            level4_id = parent_id
-            found = False
-            for l1_key, l1_node in self.categories.items():
-                for l2_key, l2_node in getattr(l1_node, 'children', {}).items():
-                    for l3_key, l3_node in getattr(l2_node, 'children', {}).items():
-                        if level4_id in getattr(l3_node, 'children', {}):
-                            level1_id = l1_key
-                            level2_id = l2_key
-                            level3_id = l3_key
-                            found = True
-                            break
-                    if found: break
-                if found: break
-            if not found:
-                 logger.warning(f"get_level5_categories: Could not find L1/L2/L3 parents for L4 ID '{level4_id}'.")
-                 return []
-
-        logger.debug(f"get_level5_categories: Parsed parent ID into L1='{level1_id}', L2='{level2_id}', L3='{level3_id}', L4='{level4_id}'.")
-
-        # Traverse the hierarchy
-        if level1_id not in self.categories:
-            logger.warning(f"get_level5_categories: L1 parent ID '{level1_id}' not found.")
-            return []
-        level1_cat = self.categories[level1_id]
-
-        if not hasattr(level1_cat, 'children') or level2_id not in level1_cat.children:
-            logger.warning(f"get_level5_categories: L2 parent ID '{level2_id}' not found under L1 '{level1_id}'.")
-            return []
-        level2_cat = level1_cat.children[level2_id]
-
-        if not hasattr(level2_cat, 'children') or level3_id not in level2_cat.children:
-            logger.warning(f"get_level5_categories: L3 parent ID '{level3_id}' not found under L2 '{level2_id}'.")
-            return []
-        level3_cat = level2_cat.children[level3_id]
-
-        if not hasattr(level3_cat, 'children') or level4_id not in level3_cat.children:
-            logger.warning(f"get_level5_categories: L4 parent ID '{level4_id}' not found under L3 '{level3_id}'.")
-            return []
-        level4_cat = level3_cat.children[level4_id]
-
-        # Get L5 children
-        if not hasattr(level4_cat, 'children') or not level4_cat.children:
-             logger.warning(f"get_level5_categories: Parent L4 category '{level4_id}' has no children dictionary or it is empty.")
-             return []
-
-        children_count = len(level4_cat.children)
-        logger.debug(f"get_level5_categories: Found {children_count} L5 children for parent '{parent_id}'.")
-        return [
-            TaxonomyCategory(id=cat_id, name=cat.name, description=cat.description)
-            for cat_id, cat in level4_cat.children.items()
-        ]
-    # --- END ADDED ---
+        """Get level 5 categories for a given parent ID (expected format: L1.L2.L3.L4, L2.L3.L4, L3.L4 or just L4 ID)."""
+        return list(self.get_child_categories(5, parent_id))
 
     # --- ADDED: get_level_dict method ---
     def get_level_dict(self, parent_id_path: Optional[str] = None) -> Dict[str, Any]:
@@ -23,9 +23,10 @@ class JobResultItem(BaseModel):
     level5_name: Optional[str] = Field(None, description="Level 5 Category Name")
     final_confidence: Optional[float] = Field(None, ge=0.0, le=1.0, description="Confidence score of the final classification level achieved (0.0 if not possible)")
     final_status: str = Field(..., description="Overall status ('Classified', 'Not Possible', 'Error')")
-    classification_source: Optional[str] = Field(None, description="Source of the final classification ('Initial', 'Search', 'Review')") # Added 'Review'
+    classification_source: Optional[str] = Field(None, description="Source of the final classification ('Initial', 'Embedding', 'Search', 'Review')") # Added 'Review'
     classification_notes_or_reason: Optional[str] = Field(None, description="LLM notes or reason for failure/low confidence")
     achieved_level: Optional[int] = Field(None, ge=0, le=5, description="Deepest level successfully classified (0 if none)")
+    cluster_representative: Optional[str] = Field(None, description="Vendor whose classification was reused for this name (duplicate spelling or fuzzy cluster); None if classified itself")
 
     class Config:
         from_attributes = True # For potential future ORM mapping if results move to separate table
@@ -74,4 +75,7 @@ class JobResultsResponse(BaseModel):
     job_id: str
     job_type: JobType
     results: Union[List[JobResultItem], List[ReviewResultItem]] = Field(..., description="List of detailed results, structure depends on job_type")
+    total: int = Field(0, description="Number of results matching the filters (before skip/limit)")
+    skip: int = Field(0, description="Offset of the first returned result")
+    limit: Optional[int] = Field(None, description="Page size requested (None = all remaining results)")
 # --- END ADDED ---
\ No newline at end of file
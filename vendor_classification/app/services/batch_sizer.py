@@ -0,0 +1,165 @@
+# app/services/batch_sizer.py
+"""
+Adaptive batch sizing for LLM classification.
+
+Vendors are packed into a batch up to a per-model prompt token budget (static prefix for the level/parent
+plus the vendor entries), and up to a vendor count that adapts per (model, level):
+- grows by one after BATCH_SIZE_GROW_AFTER consecutive clean batches that finished within
+  BATCH_TARGET_LATENCY_SECONDS;
+- halves on a failed batch (truncated/unparseable response, timeout, or vendors missing from the response).
+The per-(model, level) sizes are process-wide, so a worker keeps what it learned across jobs.
+A shrink also applies to batches already queued for the level (the dispatcher re-splits them); growth
+applies from the next batches built.
+With ADAPTIVE_BATCH_SIZING off, batches are plain BATCH_SIZE chunks as before.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.logging_config import get_logger
+from models.taxonomy import Taxonomy
+from tasks.classification_prompts import build_vendor_data_xml, get_batch_system_prefix
+
+logger = get_logger("vendor_classification.batch_sizer")
+
+CHARS_PER_TOKEN = 4 # Rough estimate; good enough for packing
+OUTPUT_TOKENS_PER_VENDOR = 120 # Approximate completion tokens per vendor classification entry
+BATCH_MAX_COMPLETION_TOKENS = 2048 # max_tokens sent with classify_batch
+# Prompt token budget per batch, by model prefix (first match wins). BATCH_PROMPT_TOKEN_BUDGET overrides.
+MODEL_PROMPT_TOKEN_BUDGETS: Tuple[Tuple[str, int], ...] = (
+    ("anthropic/", 16000),
+    ("openai/", 16000),
+    ("google/gemini", 16000),
+    ("deepseek/", 12000),
+)
+DEFAULT_PROMPT_TOKEN_BUDGET = 8000
+MISSING_VENDOR_REASON = "Vendor missing from LLM response batch"
+
+# Learned batch size per (model, level), shared by all jobs in this process
+_learned_sizes: Dict[Tuple[str, int], int] = {}
+_learned_sizes_lock = threading.Lock()
+
+
+def estimate_tokens(text: str) -> int:
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+
+def prompt_token_budget(model: str) -> int:
+    if settings.BATCH_PROMPT_TOKEN_BUDGET > 0:
+        return settings.BATCH_PROMPT_TOKEN_BUDGET
+    model_lower = (model or "").lower()
+    for prefix, budget in MODEL_PROMPT_TOKEN_BUDGETS:
+        if model_lower.startswith(prefix):
+            return budget
+    return DEFAULT_PROMPT_TOKEN_BUDGET
+
+
+def batch_failed(batch_results: Dict[str, Dict]) -> bool:
+    """A batch counts as failed if any vendor got an ERROR result or was missing from the LLM response."""
+    for classification in batch_results.values():
+        if classification.get("category_id") == "ERROR":
+            return True
+        if classification.get("classification_not_possible_reason") == MISSING_VENDOR_REASON:
+            return True
+    return False
+
+
+class AdaptiveBatchSizer:
+    """Batch packing and size adaptation for one job (fixed taxonomy and model)."""
+
+    def __init__(self, taxonomy: Taxonomy, model: str):
+        self.taxonomy = taxonomy
+        self.model = model
+        self.enabled = settings.ADAPTIVE_BATCH_SIZING
+        self.initial_size = settings.BATCH_SIZE if settings.BATCH_SIZE > 0 else 5
+        self.min_size = max(1, settings.BATCH_SIZE_MIN)
+        output_cap = max(1, BATCH_MAX_COMPLETION_TOKENS // OUTPUT_TOKENS_PER_VENDOR)
+        self.max_size = max(self.min_size, min(settings.BATCH_SIZE_MAX, output_cap))
+        self.token_budget = prompt_token_budget(model)
+        self._clean_streak: Dict[int, int] = {}
+        self._prefix_tokens: Dict[Tuple[int, Optional[str]], int] = {}
+        self.stats: Dict[str, Any] = {"enabled": self.enabled, "token_budget": self.token_budget, "max_size": self.max_size,
+                                      "batches": 0, "failed_batches": 0, "grown": 0, "shrunk": 0,
+                                      "resplit_batches": 0}
+
+    # --- Sizing ---
+
+    def current_size(self, level: int) -> int:
+        if not self.enabled:
+            return self.initial_size
+        with _learned_sizes_lock:
+            size = _learned_sizes.get((self.model, level), self.initial_size)
+        return max(self.min_size, min(self.max_size, size))
+
+    def _prefix_token_count(self, level: int, parent_category_id: Optional[str]) -> int:
+        key = (level, parent_category_id)
+        tokens = self._prefix_tokens.get(key)
+        if tokens is None:
+            tokens = estimate_tokens(get_batch_system_prefix(self.taxonomy, level, parent_category_id))
+            self._prefix_tokens[key] = tokens
+        return tokens
+
+    def vendor_token_budget(self, level: int, parent_category_id: Optional[str]) -> Optional[int]:
+        """Tokens available for vendor entries in one batch, or None when token packing is off."""
+        if not self.enabled:
+            return None
+        return max(0, self.token_budget - self._prefix_token_count(level, parent_category_id))
+
+    @staticmethod
+    def vendor_tokens(vendor_data: Dict[str, Any]) -> int:
+        """Prompt tokens of one vendor entry, including its own search context (post-search batches)."""
+        return estimate_tokens(build_vendor_data_xml([vendor_data], include_search_context=True))
+
+    def fits(self, level: int, parent_category_id: Optional[str], batch_data: List[Dict[str, Any]], vendor_data: Dict[str, Any]) -> bool:
+        """Whether vendor_data can be added to batch_data without exceeding the size or token limits."""
+        if not batch_data:
+            return True
+        if len(batch_data) >= self.current_size(level):
+            return False
+        budget = self.vendor_token_budget(level, parent_category_id)
+        if budget is None:
+            return True
+        used = sum(self.vendor_tokens(vd) for vd in batch_data)
+        return used + self.vendor_tokens(vendor_data) <= budget
+
+    def batch_limits(self, level: int, parent_category_id: Optional[str] = None) -> Tuple[int, Optional[int]]:
+        """(max vendors per batch, vendor token budget or None) for create_batches."""
+        return self.current_size(level), self.vendor_token_budget(level, parent_category_id)
+
+    # --- Feedback ---
+
+    def record_batch(self, level: int, batch_size: int, batch_results: Dict[str, Dict], duration: float) -> None:
+        """Adjusts the learned size for `level` from one finished batch."""
+        failed = batch_failed(batch_results)
+        self.stats["batches"] += 1
+        if failed:
+            self.stats["failed_batches"] += 1
+        if not self.enabled:
+            return
+
+        current = self.current_size(level)
+        if failed:
+            self._clean_streak[level] = 0
+            new_size = max(self.min_size, min(current, batch_size) // 2)
+            if new_size < current:
+                self.stats["shrunk"] += 1
+                logger.info(f"Adaptive batching: shrinking Level {level} batch size {current} -> {new_size} after a failed batch of {batch_size}.")
+        else:
+            within_latency = settings.BATCH_TARGET_LATENCY_SECONDS <= 0 or duration <= settings.BATCH_TARGET_LATENCY_SECONDS
+            streak = self._clean_streak.get(level, 0)
+            if not within_latency:
+                streak = 0
+            elif batch_size >= current: # Only full batches count; small tail batches say nothing about the limit
+                streak += 1
+            new_size = current
+            if streak >= settings.BATCH_SIZE_GROW_AFTER and current < self.max_size:
+                new_size = current + 1
+                streak = 0
+                self.stats["grown"] += 1
+                logger.debug(f"Adaptive batching: growing Level {level} batch size {current} -> {new_size}.")
+            self._clean_streak[level] = streak
+        with _learned_sizes_lock:
+            _learned_sizes[(self.model, level)] = new_size
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**self.stats, "sizes": {f"level{level}": self.current_size(level) for level in range(1, 6)}}
@@ -0,0 +1,177 @@
+# app/services/classification_memo.py
+"""
+Cross-job vendor classification memo.
+
+Finished per-vendor classification results (all levels, plus the search outcome) are stored under a key
+built from `normalize_vendor_name` and a hash of the vendor's context columns, the taxonomy fingerprint,
+the model and the target level. A repeat vendor in a later upload is filled from the memo and skips the
+LLM and Tavily entirely. Storage reuses the response cache backends (services/llm_cache.py).
+Outcomes that rest on an empty search are served only for SEARCH_NEGATIVE_CACHE_TTL_SECONDS, like the
+search cache's negative entries.
+"""
+import asyncio
+import hashlib
+import json
+import time
+from typing import Any, Dict, List, Optional
+
+from core.config import settings
+from core.logging_config import get_logger
+from models.taxonomy import Taxonomy
+from services.batch_sizer import MISSING_VENDOR_REASON
+from services.llm_cache import get_response_cache
+from utils.taxonomy_loader import register_taxonomy_reload_hook
+from utils.text_processing import normalize_vendor_name
+
+logger = get_logger("vendor_classification.classification_memo")
+
+MEMO_NAMESPACE = "classification_memo"
+# Optional input columns that can change the classification of the same vendor name
+MEMO_CONTEXT_FIELDS = ("example", "vendor_address", "vendor_website", "internal_category", "parent_company", "spend_category")
+
+# Taxonomy content fingerprints, keyed by id() of the Taxonomy object. Cleared when the taxonomy is reloaded.
+_taxonomy_fingerprints: Dict[int, str] = {}
+
+
+def _on_taxonomy_reload(taxonomy: Taxonomy) -> None:
+    _taxonomy_fingerprints.clear()
+    logger.info("Taxonomy reloaded; classification memo fingerprints invalidated.",
+                extra={"taxonomy_version": taxonomy.version})
+
+register_taxonomy_reload_hook(_on_taxonomy_reload)
+
+
+def taxonomy_fingerprint(taxonomy: Taxonomy) -> str:
+    """Content hash of the taxonomy, so a changed taxonomy never serves results built on the old one."""
+    fingerprint = _taxonomy_fingerprints.get(id(taxonomy))
+    if fingerprint is None:
+        content = json.dumps(taxonomy.model_dump(mode='json'), sort_keys=True)
+        fingerprint = hashlib.sha256(content.encode('utf-8')).hexdigest()[:16]
+        _taxonomy_fingerprints[id(taxonomy)] = fingerprint
+    return fingerprint
+
+
+def _is_memoizable(vendor_results: Dict[str, Any], target_level: int) -> bool:
+    """
+    Only definitive outcomes are stored: no ERROR levels, no vendors the LLM dropped from a batch
+    and no failed/timed-out search.
+    """
+    if not vendor_results.get("level1"):
+        return False
+    for level in range(1, target_level + 1):
+        level_data = vendor_results.get(f"level{level}")
+        if not isinstance(level_data, dict):
+            continue
+        if level_data.get("category_id") == "ERROR" or level_data.get("classification_not_possible_reason") == MISSING_VENDOR_REASON:
+            return False
+    search_results = vendor_results.get("search_results")
+    if isinstance(search_results, dict) and search_results.get("error"):
+        return False
+    return True
+
+
+def _is_empty_search_outcome(vendor_results: Dict[str, Any]) -> bool:
+    """True when the vendor went through search and the search returned no content to classify from."""
+    search_results = vendor_results.get("search_results")
+    return isinstance(search_results, dict) and not search_results.get("sources") and not search_results.get("summary")
+
+
+class ClassificationMemo:
+    """Memo lookups/stores for one job (fixed taxonomy, model and target level)."""
+
+    def __init__(self, taxonomy: Taxonomy, model: str, target_level: int):
+        self.cache = get_response_cache(
+            namespace=MEMO_NAMESPACE,
+            ttl_seconds=settings.CLASSIFICATION_MEMO_TTL_SECONDS,
+            enabled=settings.USE_CLASSIFICATION_MEMO
+        )
+        self.target_level = target_level
+        self.key_prefix = f"{taxonomy.name}|{taxonomy.version}|{taxonomy_fingerprint(taxonomy)}|{model}|L{target_level}"
+        self.stats = {"lookups": 0, "hits": 0, "stored": 0}
+
+    def memo_key(self, vendor_data: Dict[str, Any]) -> Optional[str]:
+        """Returns the memo key for a vendor, or None if the name normalizes to nothing."""
+        normalized_name = normalize_vendor_name(vendor_data.get('vendor_name', ''))
+        if not normalized_name:
+            return None
+        context = {field: " ".join(str(vendor_data.get(field) or "").lower().split()) for field in MEMO_CONTEXT_FIELDS}
+        key_source = json.dumps({"prefix": self.key_prefix, "name": normalized_name, "context": context}, sort_keys=True)
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    async def lookup_many(self, unique_vendors_map: Dict[str, Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+        """
+        Looks up every vendor. Returns {vendor_name: results entry} for hits, in the same shape
+        process_vendors writes into the results dictionary.
+        """
+        if not settings.USE_CLASSIFICATION_MEMO:
+            return {}
+        keyed = [(name, self.memo_key(data)) for name, data in unique_vendors_map.items()]
+        keyed = [(name, key) for name, key in keyed if key]
+        entries = await asyncio.gather(*(self.cache.get(key) for _, key in keyed))
+        self.stats["lookups"] += len(keyed)
+
+        hits: Dict[str, Dict[str, Any]] = {}
+        for (vendor_name, _), entry in zip(keyed, entries):
+            if not isinstance(entry, dict) or not isinstance(entry.get("results"), dict):
+                continue
+            if entry.get("empty") and time.time() - entry.get("cached_at", 0) > settings.SEARCH_NEGATIVE_CACHE_TTL_SECONDS:
+                continue # Retry the search once the negative TTL has passed
+            vendor_results = entry["results"]
+            for level in range(1, self.target_level + 1):
+                level_data = vendor_results.get(f"level{level}")
+                if isinstance(level_data, dict):
+                    level_data["vendor_name"] = vendor_name # Stored under the name of the job that produced it
+            vendor_results["memo_hit"] = True
+            hits[vendor_name] = vendor_results
+        self.stats["hits"] += len(hits)
+        logger.info(f"Classification memo lookup: {len(hits)}/{len(keyed)} hits.")
+        return hits
+
+    async def store_many(
+        self,
+        results: Dict[str, Dict],
+        unique_vendors_map: Dict[str, Dict[str, Any]],
+        skip_vendor_names: Optional[List[str]] = None
+    ) -> int:
+        """Stores definitive results for vendors classified in this job. Returns the number stored."""
+        if not settings.USE_CLASSIFICATION_MEMO:
+            return 0
+        skip = set(skip_vendor_names or [])
+        writes = []
+        for vendor_name, vendor_results in results.items():
+            if vendor_name in skip or vendor_name not in unique_vendors_map:
+                continue
+            if not _is_memoizable(vendor_results, self.target_level):
+                continue
+            key = self.memo_key(unique_vendors_map[vendor_name])
+            if not key:
+                continue
+            entry_results = {f"level{level}": vendor_results[f"level{level}"]
+                             for level in range(1, self.target_level + 1) if vendor_results.get(f"level{level}")}
+            for flag in ("search_attempted", "classified_via_search"):
+                if flag in vendor_results:
+                    entry_results[flag] = vendor_results[flag]
+            search_results = vendor_results.get("search_results")
+            if isinstance(search_results, dict):
+                # Keep the search summary and source list, not the full page contents
+                entry_results["search_results"] = {
+                    "search_query": search_results.get("search_query"),
+                    "summary": search_results.get("summary"),
+                    "sources": [{"title": src.get("title", ""), "url": src.get("url", "")} for src in search_results.get("sources", []) or []],
+                    "error": None
+                }
+            writes.append(self.cache.set(key, {
+                "results": entry_results, "empty": _is_empty_search_outcome(vendor_results), "cached_at": time.time()
+            }))
+        if writes:
+            await asyncio.gather(*writes)
+        self.stats["stored"] += len(writes)
+        logger.info(f"Classification memo: stored {len(writes)} vendor results.")
+        return len(writes)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {
+            **self.stats,
+            "hit_rate": round(self.stats["hits"] / self.stats["lookups"], 4) if self.stats["lookups"] else 0.0,
+            "backend": self.cache.backend_name
+        }
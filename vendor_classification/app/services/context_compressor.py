@@ -0,0 +1,153 @@
+# app/services/context_compressor.py
+"""
+CPU-only reduction of Tavily search results before they are embedded in post-search prompts
+(process_search_results for Level 1, and the per-vendor search context of the Level 2+ batches).
+
+The summary and source snippets are split into sentences. Then:
+- navigation text, cookie/legal banners and other boilerplate are dropped (never a sentence that names the vendor);
+- duplicate and near-duplicate sentences are dropped (the same sentence often appears in several sources);
+- the remaining sentences are ranked by overlap with the vendor's name and the industry vocabulary
+  (generic business-activity words plus the vendor's own example / internal / spend category text);
+- the best sentences are kept, within a per-vendor token budget, in their original order and grouped
+  under the source they came from.
+The result has the same shape as the search results (summary, sources[title, url, content]), so the prompt
+builders use it unchanged.
+"""
+import re
+from typing import Any, Dict, FrozenSet, List, Optional, Tuple
+
+from core.logging_config import get_logger
+from services.batch_sizer import estimate_tokens
+from utils.text_processing import INDUSTRY_STOPWORDS, WORD_TOKEN_RE
+
+logger = get_logger("vendor_classification.context_compressor")
+
+MIN_SENTENCE_WORDS = 4
+NEAR_DUPLICATE_JACCARD = 0.8
+MAX_NON_ALPHA_RATIO = 0.4 # Sentences that are mostly digits, symbols and separators (menus, tables, phone lists)
+SUMMARY_SOURCE = -1 # Source index used for summary sentences
+
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])\s+|\s*\n+\s*|\s+[|•·»›]\s+")
+# Whole banner/navigation phrases only: words like "cookies", "menu" or "newsletter" alone are often the business
+_BOILERPLATE_RE = re.compile(
+    r"accept (all )?cookies|(we|this (web)?site) uses? cookies|cookie (policy|settings|preferences|consent)|"
+    r"privacy policy|terms (of|and) (use|service|conditions)|all rights reserved|©|copyright \d{4}|"
+    r"skip to (main )?content|(sign|log) ?(in|up) to (your|write|continue)|subscribe to our newsletter|"
+    r"(enable|requires?) javascript|javascript (is )?(disabled|required)|click here|read more|follow us on|back to top",
+    re.IGNORECASE
+)
+# Words that say what a business does; sentences containing them are more useful for classification
+INDUSTRY_KEYWORDS: FrozenSet[str] = frozenset({
+    "manufacturer", "manufactures", "manufacturing", "produces", "production", "supplier", "supplies",
+    "distributor", "distributes", "distribution", "wholesale", "wholesaler", "retailer", "retail", "store",
+    "provider", "provides", "services", "service", "products", "solutions", "software", "consulting",
+    "contractor", "construction", "engineering", "logistics", "transportation", "freight", "shipping",
+    "healthcare", "medical", "clinic", "hospital", "pharmaceutical", "insurance", "bank", "financial",
+    "restaurant", "food", "catering", "hotel", "staffing", "marketing", "advertising", "legal", "law",
+    "accounting", "maintenance", "repair", "installation", "equipment", "industrial", "chemical",
+    "energy", "utility", "telecommunications", "technology", "publishing", "printing", "education",
+    "training", "rental", "leasing", "real", "estate", "agency", "firm", "specializes", "specializing",
+    "industry", "business", "company", "offers", "sells", "operates",
+})
+
+
+def _tokens(text: str) -> FrozenSet[str]:
+    return frozenset(w for w in WORD_TOKEN_RE.findall((text or "").lower()) if w not in INDUSTRY_STOPWORDS)
+
+
+def _is_boilerplate(sentence: str, sentence_tokens: FrozenSet[str], name_tokens: FrozenSet[str]) -> bool:
+    """
+    Navigation, banners and symbol-heavy lines. A sentence with the vendor's full name is never boilerplate; one
+    with part of it (e.g. "cookies" for "Crumbl Cookies") is only dropped if it matches a banner phrase.
+    """
+    banner = _BOILERPLATE_RE.search(sentence) is not None
+    if name_tokens and name_tokens <= sentence_tokens:
+        return False
+    if sentence_tokens & name_tokens:
+        return banner
+    if banner or len(sentence.split()) < MIN_SENTENCE_WORDS:
+        return True
+    non_alpha = sum(1 for char in sentence if not (char.isalpha() or char.isspace()))
+    return non_alpha / len(sentence) > MAX_NON_ALPHA_RATIO
+
+
+def _split_sentences(text: Optional[str]) -> List[str]:
+    return [sentence.strip() for sentence in _SENTENCE_SPLIT_RE.split(str(text or "")) if sentence and sentence.strip()]
+
+
+def context_tokens(search_context: Dict[str, Any]) -> int:
+    """Estimated tokens of the summary, source titles and source contents."""
+    parts = [str(search_context.get("summary") or "")]
+    for source in search_context.get("sources") or []:
+        if isinstance(source, dict):
+            parts.append(str(source.get("title") or ""))
+            parts.append(str(source.get("content") or ""))
+    return estimate_tokens(" ".join(parts))
+
+
+def compress_search_context(
+    vendor_data: Dict[str, Any],
+    search_results: Dict[str, Any],
+    token_budget: int
+) -> Tuple[Optional[Dict[str, Any]], int, int]:
+    """
+    (compressed {summary, sources}, tokens before, tokens after). The compressed context is None if no
+    sentence survives the filters; the caller then keeps the original search results.
+    """
+    tokens_before = context_tokens(search_results)
+    name_tokens = _tokens(vendor_data.get("vendor_name", ""))
+    hint_tokens = _tokens(" ".join(str(vendor_data.get(field) or "") for field in ("example", "internal_category", "spend_category")))
+    keyword_tokens = INDUSTRY_KEYWORDS | hint_tokens
+
+    sources = [source for source in (search_results.get("sources") or []) if isinstance(source, dict)]
+    texts = [(SUMMARY_SOURCE, search_results.get("summary"))] + [(index, source.get("content")) for index, source in enumerate(sources)]
+
+    # (source index, position, sentence, tokens, score); summary first so its sentences win duplicate ties
+    candidates: List[Tuple[int, int, str, int, float]] = []
+    kept_token_sets: List[FrozenSet[str]] = []
+    seen: set = set()
+    dropped_boilerplate = dropped_duplicates = 0
+    for source_index, text in texts:
+        for position, sentence in enumerate(_split_sentences(text)):
+            sentence_tokens = _tokens(sentence)
+            if _is_boilerplate(sentence, sentence_tokens, name_tokens):
+                dropped_boilerplate += 1
+                continue
+            key = " ".join(sorted(sentence_tokens))
+            if not sentence_tokens or key in seen or any(
+                    len(sentence_tokens & other) / len(sentence_tokens | other) >= NEAR_DUPLICATE_JACCARD for other in kept_token_sets):
+                dropped_duplicates += 1
+                continue
+            seen.add(key)
+            kept_token_sets.append(sentence_tokens)
+            score = (3.0 * len(sentence_tokens & name_tokens) / max(1, len(name_tokens))
+                     + min(3, len(sentence_tokens & keyword_tokens)) / 3.0
+                     + (0.5 if source_index == SUMMARY_SOURCE else 0.0)
+                     + 0.3 / (1 + position))
+            candidates.append((source_index, position, sentence, estimate_tokens(sentence) + 1, score))
+
+    if not candidates:
+        logger.debug("No usable sentences left after compressing search context", extra={"vendor": vendor_data.get("vendor_name")})
+        return None, tokens_before, tokens_before
+
+    selected: List[Tuple[int, int, str, int, float]] = []
+    used_tokens = 0
+    for candidate in sorted(candidates, key=lambda c: -c[4]):
+        if selected and used_tokens + candidate[3] > token_budget:
+            continue
+        selected.append(candidate)
+        used_tokens += candidate[3]
+    selected.sort(key=lambda c: (c[0], c[1]))
+
+    summary = " ".join(c[2] for c in selected if c[0] == SUMMARY_SOURCE) or None
+    compressed_sources = []
+    for index, source in enumerate(sources):
+        content = " ".join(c[2] for c in selected if c[0] == index)
+        if content:
+            compressed_sources.append({"title": source.get("title"), "url": source.get("url"), "content": content})
+    compressed = {"summary": summary, "sources": compressed_sources}
+    tokens_after = context_tokens(compressed)
+    logger.debug("Compressed search context",
+                 extra={"vendor": vendor_data.get("vendor_name"), "tokens_before": tokens_before, "tokens_after": tokens_after,
+                        "sentences_kept": len(selected), "dropped_boilerplate": dropped_boilerplate, "dropped_duplicates": dropped_duplicates})
+    return compressed, tokens_before, tokens_after
@@ -0,0 +1,76 @@
+# app/services/hedging.py
+"""
+Latency tracking for hedged (speculative) LLM requests.
+
+LLMService records the duration of every successful live call per (model, latency key), e.g.
+("openai/gpt-4o", "classify_level3"). Once a key has LLM_HEDGE_MIN_SAMPLES observations, a request that
+runs longer than the LLM_HEDGE_PERCENTILE latency gets a duplicate (on another pool key, or on
+LLM_HEDGE_MODEL); the first valid response wins and the other request is cancelled.
+The tracker is process-wide, so a worker keeps its latency picture across jobs.
+"""
+import math
+import threading
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from core.config import settings
+from core.logging_config import get_logger
+
+logger = get_logger("vendor_classification.hedging")
+
+LATENCY_WINDOW = 200 # Most recent durations kept per (model, latency key)
+
+
+class LatencyTracker:
+    """Rolling window of call durations per (model, latency key)."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.window = window
+        self._samples: Dict[Tuple[str, str], Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, latency_key: str, seconds: float) -> None:
+        with self._lock:
+            samples = self._samples.get((model, latency_key))
+            if samples is None:
+                samples = deque(maxlen=self.window)
+                self._samples[(model, latency_key)] = samples
+            samples.append(seconds)
+
+    def percentile(self, model: str, latency_key: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        """Nearest-rank percentile of the recorded durations, or None with fewer than min_samples."""
+        with self._lock:
+            samples = sorted(self._samples.get((model, latency_key), ()))
+        if not samples or len(samples) < max(1, min_samples):
+            return None
+        rank = max(1, math.ceil(pct / 100.0 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+    def get_stats(self) -> Dict[str, Any]:
+        with self._lock:
+            keys = list(self._samples.keys())
+        stats = {}
+        for model, latency_key in keys:
+            stats[f"{model}|{latency_key}"] = {
+                "samples": len(self._samples[(model, latency_key)]),
+                "p50": self.percentile(model, latency_key, 50),
+                "p95": self.percentile(model, latency_key, 95),
+            }
+        return stats
+
+
+_tracker = LatencyTracker()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    return _tracker
+
+
+def hedge_delay(model: str, latency_key: Optional[str]) -> Optional[float]:
+    """Seconds to wait for the primary request before hedging, or None when hedging does not apply."""
+    if not settings.LLM_HEDGING_ENABLED or not latency_key:
+        return None
+    observed = _tracker.percentile(model, latency_key, settings.LLM_HEDGE_PERCENTILE, settings.LLM_HEDGE_MIN_SAMPLES)
+    if observed is None:
+        return None
+    return max(settings.LLM_HEDGE_MIN_DELAY_SECONDS, observed)
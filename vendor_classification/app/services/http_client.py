@@ -0,0 +1,139 @@
+# app/services/http_client.py
+"""
+Process-wide registry of pooled httpx.AsyncClient instances.
+
+One client is kept per (client name, event loop). Each Celery task runs its own event loop, so the task
+owns the clients it creates and must call `close_http_clients()` before closing that loop.
+Clients use keep-alive, optional HTTP/2, configurable pool limits and a per-host timeout.
+Connection reuse is measured with httpcore trace events.
+"""
+import asyncio
+from typing import Dict, Tuple, Any, Optional
+
+import httpx
+
+from core.config import settings
+from core.logging_config import get_logger
+
+logger = get_logger("vendor_classification.http_client")
+
+OPENROUTER_CLIENT = "openrouter"
+TAVILY_CLIENT = "tavily"
+
+try:
+    import h2  # noqa: F401 # Required by httpx for HTTP/2
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+_clients: Dict[Tuple[str, asyncio.AbstractEventLoop], httpx.AsyncClient] = {}
+_metrics: Dict[Tuple[str, asyncio.AbstractEventLoop], Dict[str, int]] = {}
+
+
+def _client_timeout(name: str) -> httpx.Timeout:
+    """Per-host read timeout, with a shared connect timeout."""
+    if name == OPENROUTER_CLIENT:
+        read_timeout = settings.OPENROUTER_TIMEOUT_SECONDS
+    elif name == TAVILY_CLIENT:
+        read_timeout = settings.TAVILY_TIMEOUT_SECONDS
+    else:
+        read_timeout = settings.HTTP_DEFAULT_TIMEOUT_SECONDS
+    return httpx.Timeout(read_timeout, connect=settings.HTTP_CONNECT_TIMEOUT_SECONDS)
+
+
+def _new_metrics() -> Dict[str, int]:
+    return {"requests": 0, "new_connections": 0, "tls_handshakes": 0, "http2_requests": 0}
+
+
+def _make_trace(metrics: Dict[str, int]):
+    """Builds an httpcore trace callback that counts connection setups."""
+    async def _trace(event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            metrics["new_connections"] += 1
+        elif event_name == "connection.start_tls.complete":
+            metrics["tls_handshakes"] += 1
+        elif event_name == "http2.send_request_headers.started":
+            metrics["http2_requests"] += 1
+    return _trace
+
+
+def get_http_client(name: str) -> httpx.AsyncClient:
+    """
+    Returns the shared client for `name` on the running event loop, creating it on first use.
+    Must be called from within a coroutine.
+    """
+    loop = asyncio.get_running_loop()
+    key = (name, loop)
+    client = _clients.get(key)
+    if client is not None and not client.is_closed:
+        return client
+
+    # Drop clients whose loops were closed without close_http_clients() being awaited
+    for stale_key in [k for k in _clients if k[1].is_closed()]:
+        logger.warning(f"Discarding HTTP client '{stale_key[0]}' left open on a closed event loop.")
+        _clients.pop(stale_key, None)
+        _metrics.pop(stale_key, None)
+
+    use_http2 = settings.HTTP2_ENABLED and HTTP2_AVAILABLE
+    if settings.HTTP2_ENABLED and not HTTP2_AVAILABLE:
+        logger.warning("HTTP2_ENABLED is set but the 'h2' package is not installed. Falling back to HTTP/1.1.")
+
+    metrics = _new_metrics()
+    trace = _make_trace(metrics)
+
+    async def _on_request(request: httpx.Request):
+        metrics["requests"] += 1
+        request.extensions["trace"] = trace
+
+    client = httpx.AsyncClient(
+        http2=use_http2,
+        timeout=_client_timeout(name),
+        limits=httpx.Limits(
+            max_connections=settings.HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=settings.HTTP_KEEPALIVE_EXPIRY_SECONDS
+        ),
+        event_hooks={"request": [_on_request]}
+    )
+    _clients[key] = client
+    _metrics[key] = metrics
+    logger.info(f"Created shared HTTP client '{name}'",
+                extra={"http2": use_http2, "max_connections": settings.HTTP_MAX_CONNECTIONS,
+                       "max_keepalive_connections": settings.HTTP_MAX_KEEPALIVE_CONNECTIONS})
+    return client
+
+
+def get_http_client_metrics(loop: Optional[asyncio.AbstractEventLoop] = None) -> Dict[str, Dict[str, int]]:
+    """
+    Connection reuse metrics per client name for the given (default: running) event loop.
+    `reused_connections` counts requests that did not need a new TCP connection.
+    """
+    if loop is None:
+        loop = asyncio.get_running_loop()
+    snapshot: Dict[str, Dict[str, int]] = {}
+    for (name, client_loop), metrics in _metrics.items():
+        if client_loop is not loop:
+            continue
+        entry = dict(metrics)
+        entry["reused_connections"] = max(0, entry["requests"] - entry["new_connections"])
+        snapshot[name] = entry
+    return snapshot
+
+
+async def close_http_clients() -> Dict[str, Dict[str, int]]:
+    """
+    Closes every shared client owned by the running event loop.
+    Returns their final metrics.
+    """
+    loop = asyncio.get_running_loop()
+    final_metrics = get_http_client_metrics(loop)
+    for key in [k for k in _clients if k[1] is loop]:
+        client = _clients.pop(key)
+        _metrics.pop(key, None)
+        try:
+            await client.aclose()
+        except Exception as close_err:
+            logger.warning(f"Error closing HTTP client '{key[0]}': {close_err}")
+    if final_metrics:
+        logger.info("Closed shared HTTP clients", extra={"http_client_metrics": final_metrics})
+    return final_metrics
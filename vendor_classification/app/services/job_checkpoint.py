@@ -0,0 +1,134 @@
+# app/services/job_checkpoint.py
+"""
+Incremental persistence of a CLASSIFICATION job's progress (job_vendor_results table).
+
+process_vendors keeps its working state in the in-memory results dict. With checkpointing, every finished
+batch also appends its level results (and every finished vendor search its output) to job_vendor_results,
+committed right away. If the worker dies, Celery redelivers the task (acks_late) and the job restores these
+rows: restored levels are not sent to the LLM again and restored searches are not repeated.
+ERROR results are never checkpointed, so they are retried. Rows are deleted when the job completes.
+"""
+from typing import Any, Dict, List
+
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import Session
+
+from core.config import settings
+from core.logging_config import get_logger
+from models.job import JobVendorResult
+
+logger = get_logger("vendor_classification.job_checkpoint")
+
+SEARCH_RESULT_KEY = "search"
+
+
+class JobCheckpoint:
+    """Records and restores one job's per-vendor results. Write failures are logged, never raised."""
+
+    def __init__(self, db: Session, job_id: str):
+        self.db = db
+        self.job_id = job_id
+        self.enabled = settings.JOB_CHECKPOINT_ENABLED
+        self.stats = {"recorded_level_results": 0, "recorded_searches": 0, "restored_level_results": 0,
+                      "restored_searches": 0, "write_errors": 0}
+
+    def _write(self, rows: List[JobVendorResult]) -> bool:
+        if not self.enabled or not rows:
+            return False
+        try:
+            self.db.add_all(rows)
+            self.db.commit()
+            return True
+        except Exception: # SQLAlchemyError, or a result that is not JSON serializable
+            logger.error("Failed to write job checkpoint rows", exc_info=True, extra={"rows": len(rows)})
+            self.db.rollback()
+            self.stats["write_errors"] += 1
+            return False
+
+    def record_level_results(self, level: int, batch_results: Dict[str, Dict[str, Any]]) -> None:
+        """Checkpoints one batch's classifications for `level` (ERROR results are skipped)."""
+        rows = [
+            JobVendorResult(job_id=self.job_id, vendor_name=vendor_name, result_key=f"level{level}", result=classification)
+            for vendor_name, classification in batch_results.items()
+            if isinstance(classification, dict) and classification.get("category_id") != "ERROR"
+        ]
+        if self._write(rows):
+            self.stats["recorded_level_results"] += len(rows)
+
+    def record_search(self, vendor_name: str, search_output: Dict[str, Any]) -> None:
+        """Checkpoints one vendor's search output (search-based Level 1 plus post-search levels; skipped if it carries an error)."""
+        self.record_searches({vendor_name: search_output})
+
+    def record_searches(self, search_outputs: Dict[str, Dict[str, Any]]) -> None:
+        """
+        Checkpoints several vendors' search outputs in one commit (outputs carrying an error are skipped).
+        A vendor's output is re-recorded as its post-search levels complete; the latest row wins on load.
+        """
+        rows = [
+            JobVendorResult(job_id=self.job_id, vendor_name=vendor_name, result_key=SEARCH_RESULT_KEY, result=search_output)
+            for vendor_name, search_output in search_outputs.items()
+            if isinstance(search_output, dict) and not search_output.get("error")
+        ]
+        if self._write(rows):
+            self.stats["recorded_searches"] += len(rows)
+
+    def load(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """{vendor_name: {result_key: result}} from earlier runs of this job; later rows win."""
+        if not self.enabled:
+            return {}
+        try:
+            rows = (self.db.query(JobVendorResult.vendor_name, JobVendorResult.result_key, JobVendorResult.result)
+                    .filter(JobVendorResult.job_id == self.job_id)
+                    .order_by(JobVendorResult.id)
+                    .all())
+        except SQLAlchemyError:
+            logger.error("Failed to load job checkpoint; starting from scratch", exc_info=True)
+            self.db.rollback()
+            return {}
+        restored: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        for vendor_name, result_key, result in rows:
+            restored.setdefault(vendor_name, {})[result_key] = result
+        return restored
+
+    def restore_levels(self, results: Dict[str, Dict], restored: Dict[str, Dict[str, Dict[str, Any]]],
+                       target_level: int) -> int:
+        """
+        Copies restored level results into `results` for the vendors it contains, as a consistent chain:
+        levels 1..N in order, stopping after the first level that was not possible. Returns vendors restored.
+        """
+        vendor_count = 0
+        for vendor_name, vendor_rows in restored.items():
+            if vendor_name not in results:
+                continue
+            restored_any = False
+            for level in range(1, target_level + 1):
+                classification = vendor_rows.get(f"level{level}")
+                if not classification:
+                    break
+                results[vendor_name][f"level{level}"] = classification
+                self.stats["restored_level_results"] += 1
+                restored_any = True
+                if classification.get("classification_not_possible", True):
+                    break
+            vendor_count += int(restored_any)
+        return vendor_count
+
+    def restored_searches(self, restored: Dict[str, Dict[str, Dict[str, Any]]]) -> Dict[str, Dict[str, Any]]:
+        searches = {name: rows[SEARCH_RESULT_KEY] for name, rows in restored.items() if SEARCH_RESULT_KEY in rows}
+        self.stats["restored_searches"] = len(searches)
+        return searches
+
+    def clear(self) -> None:
+        """Deletes this job's checkpoint rows (after the job completed)."""
+        if not self.enabled:
+            return
+        try:
+            deleted = self.db.query(JobVendorResult).filter(JobVendorResult.job_id == self.job_id).delete(synchronize_session=False)
+            self.db.commit()
+            logger.info(f"Cleared {deleted} checkpoint rows for job {self.job_id}")
+        except SQLAlchemyError:
+            logger.error("Failed to clear job checkpoint rows", exc_info=True)
+            self.db.rollback()
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {"enabled": self.enabled, **self.stats}
@@ -0,0 +1,164 @@
+# app/services/key_pool.py
+"""
+Key pool scheduler for providers with several API keys (OpenRouter provisioning keys, Tavily keys).
+
+Instead of sending everything through one key and rotating only after a failure, each call leases the
+healthy key with the most remaining per-minute quota (when a per-key limit is configured), then the
+fewest requests in flight, then the fewest requests in the last minute. Keys that return 401/403/429
+are quarantined for a cool-down period. If every key is quarantined, the one that recovers first is used.
+
+Pools are process-wide (one per provider), so quarantines and counters carry across jobs in a worker.
+Cross-worker cool-downs are shared through the rate limiter (services/rate_limiter.py).
+"""
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from core.config import settings
+from core.logging_config import get_logger
+
+logger = get_logger("vendor_classification.key_pool")
+
+AUTH_ERROR_STATUS_CODES = {401, 403}
+THROTTLE_STATUS_CODES = {429}
+WINDOW_SECONDS = 60.0
+
+
+class _KeyState:
+    __slots__ = ("in_flight", "requests", "successes", "errors", "throttled", "auth_errors",
+                 "quarantined_until", "recent", "last_used")
+
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = 0
+        self.successes = 0
+        self.errors = 0
+        self.throttled = 0
+        self.auth_errors = 0
+        self.quarantined_until = 0.0
+        self.recent: Deque[float] = deque() # Request start times within the last WINDOW_SECONDS
+        self.last_used = 0.0
+
+
+class KeyPool:
+    """Spreads requests across a provider's keys. Keys are referred to by index."""
+
+    def __init__(self, name: str, keys: List[str], per_key_requests_per_minute: int = 0):
+        self.name = name
+        self.keys = list(keys)
+        self.per_key_requests_per_minute = per_key_requests_per_minute
+        self._states = [_KeyState() for _ in self.keys]
+        self._created_at = time.monotonic()
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def _trim(self, state: _KeyState, now: float) -> None:
+        while state.recent and now - state.recent[0] > WINDOW_SECONDS:
+            state.recent.popleft()
+
+    def _remaining_quota(self, state: _KeyState) -> float:
+        if self.per_key_requests_per_minute <= 0:
+            return float("inf")
+        return self.per_key_requests_per_minute - len(state.recent) - state.in_flight
+
+    def acquire(self) -> Optional[int]:
+        """Leases a key for one request and returns its index (None if the pool is empty). Pair with release()."""
+        if not self.keys:
+            return None
+        now = time.monotonic()
+        healthy = []
+        for index, state in enumerate(self._states):
+            self._trim(state, now)
+            if state.quarantined_until <= now:
+                healthy.append(index)
+        if healthy:
+            index = min(healthy, key=lambda i: (-self._remaining_quota(self._states[i]), self._states[i].in_flight,
+                                                len(self._states[i].recent), self._states[i].last_used))
+        else:
+            index = min(range(len(self.keys)), key=lambda i: self._states[i].quarantined_until)
+            logger.warning(f"All {len(self.keys)} {self.name} keys are quarantined; using key {index}, which recovers first.")
+        state = self._states[index]
+        state.in_flight += 1
+        state.requests += 1
+        state.recent.append(now)
+        state.last_used = now
+        return index
+
+    def release(self, index: Optional[int], success: bool = True, status_code: Optional[int] = None,
+                cooldown_seconds: Optional[float] = None) -> None:
+        """
+        Ends a lease. A 401/403 quarantines the key for KEY_POOL_AUTH_COOLDOWN_SECONDS. A 429 quarantines it
+        for `cooldown_seconds` (e.g. Retry-After), or KEY_POOL_THROTTLE_COOLDOWN_SECONDS if not given.
+        """
+        if index is None or not 0 <= index < len(self._states):
+            return
+        state = self._states[index]
+        state.in_flight = max(0, state.in_flight - 1)
+        if success:
+            state.successes += 1
+            return
+        state.errors += 1
+        if status_code in AUTH_ERROR_STATUS_CODES:
+            state.auth_errors += 1
+            self.quarantine(index, settings.KEY_POOL_AUTH_COOLDOWN_SECONDS, reason=f"HTTP {status_code}")
+        elif status_code in THROTTLE_STATUS_CODES:
+            state.throttled += 1
+            self.quarantine(index, cooldown_seconds if cooldown_seconds else settings.KEY_POOL_THROTTLE_COOLDOWN_SECONDS,
+                            reason=f"HTTP {status_code}")
+        elif cooldown_seconds:
+            self.quarantine(index, cooldown_seconds, reason=f"HTTP {status_code}" if status_code else "error")
+
+    def cancel(self, index: Optional[int]) -> None:
+        """Ends a lease whose request was cancelled (e.g. a losing hedged request); counts neither success nor error."""
+        if index is None or not 0 <= index < len(self._states):
+            return
+        state = self._states[index]
+        state.in_flight = max(0, state.in_flight - 1)
+
+    def quarantine(self, index: int, seconds: float, reason: str = "") -> None:
+        if seconds <= 0 or not 0 <= index < len(self._states):
+            return
+        state = self._states[index]
+        until = time.monotonic() + seconds
+        if until > state.quarantined_until:
+            state.quarantined_until = until
+            logger.warning(f"Quarantined {self.name} key {index} for {seconds:.0f}s ({reason}).",
+                           extra={"healthy_keys": self.healthy_count()})
+
+    def healthy_count(self) -> int:
+        now = time.monotonic()
+        return sum(1 for state in self._states if state.quarantined_until <= now)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Per-key counters since the worker started, plus requests/min over the last minute."""
+        now = time.monotonic()
+        per_key = []
+        for index, state in enumerate(self._states):
+            self._trim(state, now)
+            per_key.append({
+                "key_index": index,
+                "requests": state.requests,
+                "successes": state.successes,
+                "errors": state.errors,
+                "throttled": state.throttled,
+                "auth_errors": state.auth_errors,
+                "in_flight": state.in_flight,
+                "requests_last_minute": len(state.recent),
+                "quarantined_for_seconds": round(max(0.0, state.quarantined_until - now), 1)
+            })
+        return {"keys": len(self.keys), "healthy_keys": self.healthy_count(),
+                "uptime_seconds": round(now - self._created_at, 1), "per_key": per_key}
+
+
+_pools: Dict[str, KeyPool] = {}
+
+
+def get_key_pool(name: str, keys: List[str], per_key_requests_per_minute: int = 0) -> KeyPool:
+    """Returns the process-wide pool for `name`, recreating it if the configured keys changed."""
+    pool = _pools.get(name)
+    if pool is None or pool.keys != list(keys):
+        pool = KeyPool(name, keys, per_key_requests_per_minute)
+        _pools[name] = pool
+        logger.info(f"Key pool '{name}' ready with {len(keys)} keys.")
+    return pool
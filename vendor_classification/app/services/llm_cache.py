@@ -0,0 +1,282 @@
+# app/services/llm_cache.py
+"""
+Persistent response cache with pluggable backends.
+
+- "sqlite": local file (WAL mode) shared by all workers on the host. Expired entries are dropped on
+  read, and the least recently used entries are evicted above the size cap.
+- "redis": uses REDIS_URL (the Celery broker). Entries expire by Redis TTL. A sorted set of access
+  times per namespace enforces the size cap.
+
+Caches are namespaced, so the same backend can hold LLM responses and other reusable results.
+Every cache keeps hit/miss/write/eviction counters.
+"""
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from core.config import settings
+from core.logging_config import get_logger
+
+logger = get_logger("vendor_classification.llm_cache")
+
+LLM_RESPONSE_NAMESPACE = "llm_response"
+EVICTION_CHECK_INTERVAL = 100 # Writes between size-cap checks (SQLite backend)
+
+
+class ResponseCache:
+    """Base interface. Subclasses implement _get/_set; counters are kept here."""
+
+    backend_name = "none"
+
+    def __init__(self, namespace: str, ttl_seconds: int, max_entries: int):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.counters = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "expired": 0, "errors": 0}
+
+    async def get(self, key: str) -> Optional[Any]:
+        """Returns the cached value or None. Errors are logged and treated as misses."""
+        try:
+            value = await self._get(key)
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache get failed ({self.backend_name}/{self.namespace}): {e}")
+            value = None
+        self.counters["hits" if value is not None else "misses"] += 1
+        return value
+
+    async def set(self, key: str, value: Any) -> None:
+        """Stores a JSON-serializable value. Errors are logged and ignored."""
+        try:
+            await self._set(key, value)
+            self.counters["writes"] += 1
+        except Exception as e:
+            self.counters["errors"] += 1
+            logger.warning(f"Cache set failed ({self.backend_name}/{self.namespace}): {e}")
+
+    def get_stats(self) -> Dict[str, Any]:
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            "backend": self.backend_name,
+            "namespace": self.namespace,
+            **self.counters,
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0
+        }
+
+    async def close(self) -> None:
+        return None
+
+    async def _get(self, key: str) -> Optional[Any]:
+        return None
+
+    async def _set(self, key: str, value: Any) -> None:
+        return None
+
+
+class NullResponseCache(ResponseCache):
+    """Used when caching is disabled; every lookup is a miss and writes are dropped."""
+
+    async def set(self, key: str, value: Any) -> None:
+        return None
+
+
+class SQLiteResponseCache(ResponseCache):
+    """SQLite-backed cache. One connection per process, serialized by a lock and run off the event loop."""
+
+    backend_name = "sqlite"
+
+    def __init__(self, namespace: str, ttl_seconds: int, max_entries: int, path: str):
+        super().__init__(namespace, ttl_seconds, max_entries)
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._writes_since_eviction_check = EVICTION_CHECK_INTERVAL # Check on first write
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            cache_dir = os.path.dirname(self.path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            conn = sqlite3.connect(self.path, timeout=30.0, check_same_thread=False, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS cache_entries (
+                    namespace TEXT NOT NULL,
+                    cache_key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_access REAL NOT NULL,
+                    PRIMARY KEY (namespace, cache_key)
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_cache_entries_lru ON cache_entries (namespace, last_access)")
+            self._conn = conn
+            logger.info(f"Opened SQLite response cache at {self.path}", extra={"namespace": self.namespace})
+        return self._conn
+
+    def _get_sync(self, key: str) -> Optional[Any]:
+        now = time.time()
+        with self._lock:
+            conn = self._connection()
+            row = conn.execute(
+                "SELECT value, created_at FROM cache_entries WHERE namespace = ? AND cache_key = ?",
+                (self.namespace, key)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds > 0 and now - created_at > self.ttl_seconds:
+                conn.execute("DELETE FROM cache_entries WHERE namespace = ? AND cache_key = ?", (self.namespace, key))
+                self.counters["expired"] += 1
+                return None
+            conn.execute(
+                "UPDATE cache_entries SET last_access = ? WHERE namespace = ? AND cache_key = ?",
+                (now, self.namespace, key)
+            )
+        return json.loads(value)
+
+    def _set_sync(self, key: str, value: Any) -> None:
+        now = time.time()
+        serialized = json.dumps(value, separators=(",", ":"))
+        with self._lock:
+            conn = self._connection()
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_entries (namespace, cache_key, value, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (self.namespace, key, serialized, now, now)
+            )
+            self._writes_since_eviction_check += 1
+            if self._writes_since_eviction_check >= EVICTION_CHECK_INTERVAL:
+                self._writes_since_eviction_check = 0
+                self._evict_locked(conn, now)
+
+    def _evict_locked(self, conn: sqlite3.Connection, now: float) -> None:
+        if self.ttl_seconds > 0:
+            cursor = conn.execute(
+                "DELETE FROM cache_entries WHERE namespace = ? AND created_at < ?",
+                (self.namespace, now - self.ttl_seconds)
+            )
+            self.counters["expired"] += max(cursor.rowcount, 0)
+        if self.max_entries > 0:
+            (entry_count,) = conn.execute("SELECT COUNT(*) FROM cache_entries WHERE namespace = ?", (self.namespace,)).fetchone()
+            excess = entry_count - self.max_entries
+            if excess > 0:
+                conn.execute("""
+                    DELETE FROM cache_entries WHERE rowid IN (
+                        SELECT rowid FROM cache_entries WHERE namespace = ? ORDER BY last_access ASC LIMIT ?
+                    )
+                """, (self.namespace, excess))
+                self.counters["evictions"] += excess
+                logger.info(f"Evicted {excess} least recently used entries from SQLite cache", extra={"namespace": self.namespace})
+
+    async def _get(self, key: str) -> Optional[Any]:
+        return await asyncio.to_thread(self._get_sync, key)
+
+    async def _set(self, key: str, value: Any) -> None:
+        await asyncio.to_thread(self._set_sync, key, value)
+
+    async def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class RedisResponseCache(ResponseCache):
+    """Redis-backed cache. Redis clients are bound to an event loop, so one is kept per loop."""
+
+    backend_name = "redis"
+
+    def __init__(self, namespace: str, ttl_seconds: int, max_entries: int, redis_url: str):
+        super().__init__(namespace, ttl_seconds, max_entries)
+        self.redis_url = redis_url
+        self._clients: Dict[asyncio.AbstractEventLoop, Any] = {}
+        self._lru_key = f"vc:cache:{namespace}:lru"
+
+    def _client(self):
+        import redis.asyncio as redis_asyncio # Imported lazily; redis is only needed for this backend
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            client = redis_asyncio.from_url(self.redis_url, decode_responses=True)
+            self._clients[loop] = client
+        return client
+
+    def _entry_key(self, key: str) -> str:
+        return f"vc:cache:{self.namespace}:{key}"
+
+    async def _get(self, key: str) -> Optional[Any]:
+        client = self._client()
+        value = await client.get(self._entry_key(key))
+        if value is None:
+            return None
+        await client.zadd(self._lru_key, {key: time.time()})
+        return json.loads(value)
+
+    async def _set(self, key: str, value: Any) -> None:
+        client = self._client()
+        serialized = json.dumps(value, separators=(",", ":"))
+        async with client.pipeline(transaction=False) as pipe:
+            pipe.set(self._entry_key(key), serialized, ex=self.ttl_seconds if self.ttl_seconds > 0 else None)
+            pipe.zadd(self._lru_key, {key: time.time()})
+            pipe.zcard(self._lru_key)
+            results = await pipe.execute()
+        entry_count = results[-1]
+        if self.max_entries > 0 and entry_count > self.max_entries:
+            evicted = await client.zpopmin(self._lru_key, entry_count - self.max_entries)
+            if evicted:
+                await client.delete(*[self._entry_key(member) for member, _ in evicted])
+                self.counters["evictions"] += len(evicted)
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.close()
+
+
+_caches: Dict[Tuple[str, str], ResponseCache] = {}
+
+
+def get_response_cache(namespace: str = LLM_RESPONSE_NAMESPACE,
+                       ttl_seconds: Optional[int] = None,
+                       enabled: Optional[bool] = None) -> ResponseCache:
+    """
+    Returns the process-wide cache for `namespace` using the configured backend (LLM_CACHE_BACKEND).
+    `enabled` defaults to USE_LLM_CACHE; `ttl_seconds` defaults to LLM_CACHE_TTL_SECONDS.
+    """
+    enabled = settings.USE_LLM_CACHE if enabled is None else enabled
+    backend = (settings.LLM_CACHE_BACKEND or "sqlite").lower() if enabled else "none"
+    cache_id = (backend, namespace)
+    cache = _caches.get(cache_id)
+    if cache is not None:
+        return cache
+
+    ttl = settings.LLM_CACHE_TTL_SECONDS if ttl_seconds is None else ttl_seconds
+    if backend == "redis":
+        cache = RedisResponseCache(namespace, ttl, settings.LLM_CACHE_MAX_ENTRIES, settings.REDIS_URL)
+    elif backend == "sqlite":
+        cache = SQLiteResponseCache(namespace, ttl, settings.LLM_CACHE_MAX_ENTRIES, settings.LLM_CACHE_PATH)
+    else:
+        if enabled:
+            logger.warning(f"Unknown LLM_CACHE_BACKEND '{backend}'. Caching disabled.")
+        cache = NullResponseCache(namespace, ttl, 0)
+    _caches[cache_id] = cache
+    logger.info("Response cache ready", extra={"backend": cache.backend_name, "namespace": namespace, "ttl_seconds": ttl,
+                                               "max_entries": settings.LLM_CACHE_MAX_ENTRIES})
+    return cache
+
+
+async def close_response_caches() -> None:
+    """Releases per-loop backend resources (Redis connections). Call before closing a task's event loop."""
+    for cache in _caches.values():
+        if isinstance(cache, RedisResponseCache):
+            try:
+                await cache.close()
+            except Exception as e:
+                logger.warning(f"Error closing response cache '{cache.namespace}': {e}")
@@ -1,11 +1,11 @@
 # app/services/llm_service.py
+import asyncio
 import httpx
 import json
 import re
-import os
 import hashlib
 # --- ADDED Tuple ---
-from typing import List, Dict, Any, Optional, Set, Tuple
+from typing import Callable, List, Dict, Any, Optional, Set, Tuple
 # --- END ADDED ---
 import logging
 import time
@@ -18,79 +18,87 @@ from models.taxonomy import Taxonomy
 from core.logging_config import get_logger
 from core.log_context import set_log_context, get_correlation_id
 from utils.log_utils import LogTimer, log_function_call
-from tasks.classification_prompts import generate_batch_prompt, generate_search_prompt
+from services.http_client import get_http_client, OPENROUTER_CLIENT
+from services.llm_cache import get_response_cache
+from services.batch_sizer import BATCH_MAX_COMPLETION_TOKENS
+from services.rate_limiter import get_rate_limiter, retry_after_seconds, wait_for_shared_budget, OPENROUTER_PROVIDER
+from services.key_pool import get_key_pool
+from services.hedging import get_latency_tracker, hedge_delay
+from services.llm_stream import StreamedCompletion, read_completion_stream
+from services.structured_output import (ResponseSpec, batch_response_spec, direct_path_response_spec, mark_unsupported,
+                                        parse_json, request_options, search_response_spec)
+from tasks.classification_prompts import generate_batch_prompt_messages, generate_direct_path_prompt_messages, generate_search_prompt
 
 # Configure logger
 logger = get_logger("vendor_classification.llm_service")
 llm_trace_logger = logging.getLogger("llm_api_trace")
 
-logger.debug("Successfully imported generate_batch_prompt and generate_search_prompt from tasks.classification_prompts.")
+logger.debug("Successfully imported generate_batch_prompt_messages and generate_search_prompt from tasks.classification_prompts.")
 
 # --- Cache Configuration ---
-CACHE_DIR = "data/cache"
-CACHE_FILE_PATH = os.path.join(CACHE_DIR, "openrouter_dev_cache.json")
-logger.info(f"Checking for cache file existence at: {CACHE_FILE_PATH} (Absolute: {os.path.abspath(CACHE_FILE_PATH)})")
-CACHE_ENABLED = settings.USE_LLM_CACHE and os.path.exists(CACHE_FILE_PATH) # Enable only if setting is true AND file exists
-
-if CACHE_ENABLED:
-    logger.warning(f"--- OpenRouter DEV CACHE ACTIVE --- API calls will be cached in {CACHE_FILE_PATH}")
-elif settings.USE_LLM_CACHE and not os.path.exists(CACHE_FILE_PATH):
-     logger.warning(f"--- OpenRouter DEV CACHE INACTIVE --- USE_LLM_CACHE is true, but cache file not found at {CACHE_FILE_PATH}. Live API calls will be made. Cache file will be created on first save.")
-     # Ensure directory exists if we intend to create the file later
-     try:
-        os.makedirs(CACHE_DIR, exist_ok=True)
-        logger.info(f"Ensured cache directory '{CACHE_DIR}' exists.")
-     except Exception as e:
-        logger.error(f"Failed to create cache directory '{CACHE_DIR}': {e}")
-        # Decide if this is fatal or just disable caching
-        # settings.USE_LLM_CACHE = False # Disable caching if dir creation fails
-        # logger.warning("Disabling cache due to directory creation failure.")
+# Responses are cached in a persistent, evicting store (services/llm_cache.py) when USE_LLM_CACHE is true.
+if settings.USE_LLM_CACHE:
+    logger.warning(f"--- OpenRouter RESPONSE CACHE ACTIVE --- Backend: {settings.LLM_CACHE_BACKEND}, TTL: {settings.LLM_CACHE_TTL_SECONDS}s, Max entries: {settings.LLM_CACHE_MAX_ENTRIES}")
 else:
-    logger.info(f"--- OpenRouter DEV CACHE INACTIVE --- USE_LLM_CACHE is false. Live API calls will be made.")
+    logger.info(f"--- OpenRouter RESPONSE CACHE INACTIVE --- USE_LLM_CACHE is false. Live API calls will be made.")
 
 
-# --- Cache Helper Functions (Unchanged from previous version) ---
-def _load_cache() -> Dict[str, Any]:
-    """Loads the cache from the JSON file."""
-    if not settings.USE_LLM_CACHE: # Check setting first
-        return {}
-    if not os.path.exists(CACHE_FILE_PATH):
-         logger.info(f"Cache file {CACHE_FILE_PATH} not found. Starting with empty cache.")
-         return {}
-    try:
-        with open(CACHE_FILE_PATH, 'r') as f:
-            cache_data = json.load(f)
-            logger.debug(f"Loaded cache with {len(cache_data)} entries from {CACHE_FILE_PATH}")
-            return cache_data
-    except json.JSONDecodeError:
-        logger.error(f"Error decoding JSON from cache file {CACHE_FILE_PATH}. Returning empty cache.", exc_info=True)
-        return {}
-    except Exception as e:
-        logger.error(f"Error loading cache file {CACHE_FILE_PATH}: {e}", exc_info=True)
-        return {}
+# --- Provider prompt caching ---
+# OpenRouter passes `cache_control` breakpoints through to providers that need them explicitly.
+# Other providers (OpenAI, DeepSeek, ...) cache a repeated prefix automatically, so the system
+# message is sent as plain text for them.
+CACHE_CONTROL_MODEL_PREFIXES = ("anthropic/", "google/gemini")
+
+
+def _supports_cache_control(model: str) -> bool:
+    return settings.LLM_PROMPT_CACHE_HINTS and (model or "").lower().startswith(CACHE_CONTROL_MODEL_PREFIXES)
+
+
+def _build_prefixed_messages(model: str, system_prefix: str, user_message: str) -> List[Dict[str, Any]]:
+    """System message with the byte-stable prefix (cache breakpoint where supported), then the per-call user message."""
+    if _supports_cache_control(model):
+        system_content: Any = [{"type": "text", "text": system_prefix, "cache_control": {"type": "ephemeral"}}]
+    else:
+        system_content = system_prefix
+    return [{"role": "system", "content": system_content}, {"role": "user", "content": user_message}]
+
+
+def _message_text(content: Any) -> Any:
+    """Flattens multi-part message content to its text, so cache hints do not change the response cache key."""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content
+
+
+def _extract_usage(usage: Dict[str, Any]) -> Dict[str, int]:
+    """Token usage for one call, including prompt tokens served from the provider's prompt cache."""
+    prompt_details = usage.get("prompt_tokens_details") or {}
+    cached_tokens = prompt_details.get("cached_tokens") if isinstance(prompt_details, dict) else None
+    if cached_tokens is None:
+        cached_tokens = usage.get("cache_read_input_tokens", 0) # Anthropic-style field, if passed through
+    return {
+        "prompt_tokens": usage.get("prompt_tokens", 0) or 0,
+        "completion_tokens": usage.get("completion_tokens", 0) or 0,
+        "total_tokens": usage.get("total_tokens", 0) or 0,
+        "cached_tokens": cached_tokens or 0
+    }
 
-def _save_cache(cache_data: Dict[str, Any]):
-    """Saves the cache data to the JSON file."""
-    if not settings.USE_LLM_CACHE: # Only save if cache is enabled
-        return
-    try:
-        # Ensure the cache directory exists
-        os.makedirs(os.path.dirname(CACHE_FILE_PATH), exist_ok=True)
-        with open(CACHE_FILE_PATH, 'w') as f:
-            json.dump(cache_data, f, indent=2)
-        logger.debug(f"Saved cache with {len(cache_data)} entries to {CACHE_FILE_PATH}")
-    except IOError as e:
-        logger.error(f"Error writing cache file {CACHE_FILE_PATH}: {e}", exc_info=True)
-    except Exception as e:
-        logger.error(f"Unexpected error saving cache file {CACHE_FILE_PATH}: {e}", exc_info=True)
 
-def _generate_cache_key(payload: Dict[str, Any]) -> str:
-    """Generates a consistent cache key based on the request payload."""
+def _generate_cache_key(payload: Dict[str, Any], volatile_ids: Optional[List[str]] = None) -> str:
+    """
+    Generates a consistent cache key based on the request payload.
+    `volatile_ids` (e.g. the per-call batch_id/attempt_id embedded in the prompt) are masked so that
+    identical requests map to the same key across calls.
+    """
+    messages = [_message_text(msg.get("content", "")) for msg in payload.get("messages", []) if isinstance(msg, dict)]
+    for volatile_id in volatile_ids or []:
+        if volatile_id:
+            messages = [content.replace(volatile_id, "<id>") if isinstance(content, str) else content for content in messages]
     # Ensure messages are included correctly for cache key generation
     key_data = {
         "model": payload.get("model"),
         # --- Fixed: Use actual message content for key ---
-        "messages": [msg.get("content", "") for msg in payload.get("messages", []) if isinstance(msg, dict)],
+        "messages": messages,
         # --- End Fixed ---
         "temperature": payload.get("temperature"),
         "max_tokens": payload.get("max_tokens"),
@@ -148,9 +156,35 @@ def _extract_json_from_response(response_content: str) -> Optional[Dict[str, Any
         return None
 # --- END HELPER ---
 
+def _record_retry(retry_state) -> None:
+    """tenacity before_sleep hook: counts retried LLM calls on the service instance (first positional argument)."""
+    service = retry_state.args[0] if retry_state.args else None
+    response_stats = getattr(service, "response_stats", None)
+    if isinstance(response_stats, dict):
+        call_name = getattr(retry_state.fn, "__name__", "unknown")
+        response_stats["retries"] += 1
+        response_stats["retries_by_call"][call_name] = response_stats["retries_by_call"].get(call_name, 0) + 1
+
 # --- Status codes remain the same ---
 GENERATED_KEY_INVALID_STATUS_CODES = {401, 403, 429}
 PROVISIONING_RELATED_ERROR_CODES = {500, 502, 503, 504}
+# Error bodies meaning the json_schema response format itself was refused (400), or that no provider for the
+# model accepts the request parameters (404). Any other 400/404 is a normal error and is not a schema fallback.
+SCHEMA_UNSUPPORTED_RE = re.compile(
+    r"(?:response_format|json_schema|structured output).{0,80}?(?:not supported|unsupported|does not support)"
+    r"|(?:not supported|unsupported|does not support).{0,80}?(?:response_format|json_schema|structured output)",
+    re.IGNORECASE | re.DOTALL)
+NO_PROVIDER_SUPPORT_RE = re.compile(r"no (?:providers?|endpoints)\b.{0,80}?(?:support|handle the requested parameters)",
+                                    re.IGNORECASE | re.DOTALL)
+
+
+def is_schema_rejection(status_code: int, response_text: str) -> bool:
+    """True if an OpenRouter error response says the json_schema response format cannot be used for the model."""
+    if status_code == 400:
+        return bool(SCHEMA_UNSUPPORTED_RE.search(response_text or ""))
+    if status_code == 404:
+        return bool(NO_PROVIDER_SUPPORT_RE.search(response_text or ""))
+    return False
 
 class LLMService:
     """Service for interacting with OpenRouter API, using Provisioning Keys."""
@@ -161,10 +195,23 @@ class LLMService:
         self.provisioning_keys = config.MANUAL_OPENROUTER_PROVISIONING_KEYS
         self.api_base = settings.OPENROUTER_API_BASE
         self.model = settings.OPENROUTER_MODEL
-        self.current_provisioning_key_index = 0
-        self.active_generated_key: Optional[str] = None
-        self.active_generated_key_hash: Optional[str] = None
-        self.cache = _load_cache()
+        # Requests are spread across all provisioning keys; each has its own generated key
+        self.key_pool = get_key_pool(OPENROUTER_PROVIDER, self.provisioning_keys, settings.OPENROUTER_KEY_REQUESTS_PER_MINUTE)
+        self.generated_keys: Dict[int, Tuple[str, Optional[str]]] = {} # provisioning key index -> (generated key, key hash)
+        self.response_cache = get_response_cache()
+        self.cache_stats = {"hits": 0, "misses": 0, "writes": 0} # Per-service (per-job) counters
+        self.rate_limiter = get_rate_limiter()
+        self.rate_limit_stats = {"waits": 0, "wait_seconds": 0.0, "throttled_responses": 0}
+        self.latency_tracker = get_latency_tracker()
+        # Hedged requests (per job). extra_* counts tokens of completed requests whose response was not used.
+        self.hedge_stats = {"enabled": settings.LLM_HEDGING_ENABLED, "eligible_calls": 0, "hedged_calls": 0, "hedge_wins": 0,
+                            "primary_wins": 0, "skipped_budget": 0, "cancelled_requests": 0,
+                            "extra_prompt_tokens": 0, "extra_completion_tokens": 0, "extra_total_tokens": 0}
+        # Response formats and parsing outcomes of live calls (per job), see services/structured_output.py
+        self.response_stats = {"json_schema_requests": 0, "json_object_requests": 0, "schema_unsupported_fallbacks": 0,
+                               "parsed_clean": 0, "parsed_after_extraction": 0, "parse_failures": 0,
+                               "schema_invalid_responses": 0, "schema_invalid_items": 0, "retries": 0, "retries_by_call": {},
+                               "streamed_requests": 0, "streamed_items": 0, "partial_streams": 0}
 
         if not self.provisioning_keys:
             logger.critical("OpenRouter Provisioning Key list is empty! LLM calls WILL fail.")
@@ -174,46 +221,19 @@ class LLMService:
                         "model": self.model,
                         "provisioning_key_count": len(self.provisioning_keys),
                         "cache_enabled": settings.USE_LLM_CACHE,
-                        "initial_cache_size": len(self.cache)})
-
-    def _get_current_provisioning_key(self) -> Optional[str]:
-        """Gets the current provisioning key based on the index."""
-        if not self.provisioning_keys:
-            return None
-        if self.current_provisioning_key_index >= len(self.provisioning_keys):
-            logger.warning(f"Provisioning key index {self.current_provisioning_key_index} out of bounds ({len(self.provisioning_keys)} keys). Resetting to 0.")
-            self.current_provisioning_key_index = 0
-        # --- FIX: Ensure index is valid before accessing ---
-        if 0 <= self.current_provisioning_key_index < len(self.provisioning_keys):
-            return self.provisioning_keys[self.current_provisioning_key_index]
-        else:
-            logger.error(f"Invalid provisioning key index {self.current_provisioning_key_index} after bounds check.")
-            return None
-        # --- END FIX ---
-
-
-    def _rotate_provisioning_key(self):
-        """Rotates to the next provisioning key in the list."""
-        if not self.provisioning_keys or len(self.provisioning_keys) <= 1:
-            logger.warning("Cannot rotate Provisioning key: list is empty or has only one key.")
-            return False # Indicate rotation didn't happen
-
-        old_index = self.current_provisioning_key_index
-        self.current_provisioning_key_index = (self.current_provisioning_key_index + 1) % len(self.provisioning_keys)
-        logger.warning(f"Rotated OpenRouter Provisioning Key from index {old_index} to {self.current_provisioning_key_index} due to key generation failure.")
-        return True # Indicate rotation happened
+                        "cache_backend": self.response_cache.backend_name})
 
     @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=1, max=5)) # Retry generation few times
-    async def _generate_api_key(self) -> bool:
+    async def _generate_api_key(self, provisioning_key_index: int) -> bool:
         """
-        Generates a new API key using the current provisioning key.
-        Rotates provisioning key on failure.
+        Generates a new API key using the given provisioning key.
+        Quarantines the provisioning key in the key pool on auth/server errors.
         Returns True if successful, False otherwise.
         """
-        provisioning_key = self._get_current_provisioning_key()
-        if not provisioning_key:
-            logger.error("Cannot generate API key: No provisioning key available.")
+        if not 0 <= provisioning_key_index < len(self.provisioning_keys):
+            logger.error(f"Cannot generate API key: invalid provisioning key index {provisioning_key_index}.")
             return False
+        provisioning_key = self.provisioning_keys[provisioning_key_index]
 
         generation_url = f"{self.api_base}/keys" # Use the correct endpoint from docs
         headers = {
@@ -235,80 +255,94 @@ class LLMService:
                  logger.warning(f"Invalid GENERATED_KEY_CREDIT_LIMIT format: '{settings.GENERATED_KEY_CREDIT_LIMIT}'. Ignoring limit.")
 
 
-        logger.info(f"Attempting to generate new OpenRouter API key using provisioning key index {self.current_provisioning_key_index}")
-        llm_trace_logger.info(f"LLM_TRACE: Generating new API key. URL: {generation_url}, ProvKeyIndex: {self.current_provisioning_key_index}", extra={'correlation_id': get_correlation_id()})
+        logger.info(f"Attempting to generate new OpenRouter API key using provisioning key index {provisioning_key_index}")
+        llm_trace_logger.info(f"LLM_TRACE: Generating new API key. URL: {generation_url}, ProvKeyIndex: {provisioning_key_index}", extra={'correlation_id': get_correlation_id()})
         llm_trace_logger.debug(f"LLM_TRACE: Key Generation Payload: {json.dumps(payload)}", extra={'correlation_id': get_correlation_id()})
 
         try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(generation_url, json=payload, headers=headers, timeout=30.0)
-                llm_trace_logger.debug(f"LLM_TRACE: Key Generation Raw Response (Status: {response.status_code}):\n{response.text}", extra={'correlation_id': get_correlation_id()})
-                response.raise_for_status() # Raises HTTPStatusError for 4xx/5xx
-
-                response_data = response.json()
-                new_key = response_data.get("key")
-                response_data_inner = response_data.get("data", {}) # Get inner dict, default {}
-                key_hash = response_data_inner.get("hash") if isinstance(response_data_inner, dict) else None
-
-                if not new_key:
-                    logger.error("Key generation response did not contain a 'key' field.", extra={"response": response_data})
-                    raise ValueError("Invalid response format from key generation API")
-                if not key_hash:
-                    logger.warning("Key generation response did not contain a 'hash' field within 'data'.", extra={"response": response_data})
-
-                self.active_generated_key = new_key
-                self.active_generated_key_hash = key_hash # Store the hash (could be None)
-
-                key_hash_prefix = f"{key_hash[:8]}..." if key_hash else "N/A" # Use N/A if hash is None
-                logger.info(f"Successfully generated new OpenRouter API key (hash: {key_hash_prefix}) using provisioning key index {self.current_provisioning_key_index}")
-                llm_trace_logger.info(f"LLM_TRACE: Successfully generated key {key_hash_prefix}", extra={'correlation_id': get_correlation_id()})
-                return True # Success
+            client = get_http_client(OPENROUTER_CLIENT) # Shared pooled client (keep-alive)
+            response = await client.post(generation_url, json=payload, headers=headers, timeout=30.0)
+            llm_trace_logger.debug(f"LLM_TRACE: Key Generation Raw Response (Status: {response.status_code}):\n{response.text}", extra={'correlation_id': get_correlation_id()})
+            response.raise_for_status() # Raises HTTPStatusError for 4xx/5xx
+
+            response_data = response.json()
+            new_key = response_data.get("key")
+            response_data_inner = response_data.get("data", {}) # Get inner dict, default {}
+            key_hash = response_data_inner.get("hash") if isinstance(response_data_inner, dict) else None
+
+            if not new_key:
+                logger.error("Key generation response did not contain a 'key' field.", extra={"response": response_data})
+                raise ValueError("Invalid response format from key generation API")
+            if not key_hash:
+                logger.warning("Key generation response did not contain a 'hash' field within 'data'.", extra={"response": response_data})
+
+            self.generated_keys[provisioning_key_index] = (new_key, key_hash) # Hash could be None
+
+            key_hash_prefix = f"{key_hash[:8]}..." if key_hash else "N/A" # Use N/A if hash is None
+            logger.info(f"Successfully generated new OpenRouter API key (hash: {key_hash_prefix}) using provisioning key index {provisioning_key_index}")
+            llm_trace_logger.info(f"LLM_TRACE: Successfully generated key {key_hash_prefix}", extra={'correlation_id': get_correlation_id()})
+            return True # Success
 
         except httpx.HTTPStatusError as e:
             status_code = e.response.status_code
             response_text = e.response.text[:500]
             logger.error(f"HTTP error during API key generation", exc_info=False,
-                        extra={ "status_code": status_code, "response_text": response_text, "provisioning_key_index": self.current_provisioning_key_index })
+                        extra={ "status_code": status_code, "response_text": response_text, "provisioning_key_index": provisioning_key_index })
             llm_trace_logger.error(f"LLM_TRACE: Key Generation HTTP Error: Status={status_code}, Response='{response_text}'", exc_info=True, extra={'correlation_id': get_correlation_id()})
-            if status_code in {401, 403} or status_code in PROVISIONING_RELATED_ERROR_CODES:
-                rotated = self._rotate_provisioning_key()
-                if not rotated and len(self.provisioning_keys) <= 1:
-                     logger.critical("Single provisioning key failed, cannot rotate. Key generation will likely keep failing.")
-                     return False # Stop retrying if rotation isn't possible/doesn't help
-                raise TryAgain # Tell tenacity to retry after rotating
+            if status_code in {401, 403, 429}:
+                # The caller leases another provisioning key; this one sits out its cool-down
+                cooldown = (settings.KEY_POOL_AUTH_COOLDOWN_SECONDS if status_code in {401, 403}
+                            else retry_after_seconds(e.response, settings.KEY_POOL_THROTTLE_COOLDOWN_SECONDS))
+                self.key_pool.quarantine(provisioning_key_index, cooldown, reason=f"key generation HTTP {status_code}")
+                return False
+            elif status_code in PROVISIONING_RELATED_ERROR_CODES:
+                raise TryAgain # Transient server error: retry the same provisioning key
             else:
                  logger.error("Key generation failed with unrecoverable client error.")
                  return False
 
         except (httpx.RequestError, json.JSONDecodeError, ValueError, Exception) as e:
-            key_hash_prefix = f"{self.active_generated_key_hash[:8]}..." if self.active_generated_key_hash else "N/A"
             logger.error(f"Error during API key generation: {e}", exc_info=True,
-                         extra={"provisioning_key_index": self.current_provisioning_key_index, "key_hash_used": key_hash_prefix})
-            llm_trace_logger.error(f"LLM_TRACE: Key Generation Error: {e}", exc_info=True, extra={'correlation_id': get_correlation_id(), "key_hash_used": key_hash_prefix})
-            rotated = self._rotate_provisioning_key()
-            if not rotated and len(self.provisioning_keys) <= 1:
-                 logger.critical("Single provisioning key failed on error, cannot rotate.")
-                 return False
-            raise TryAgain # Retry after rotation
+                         extra={"provisioning_key_index": provisioning_key_index})
+            llm_trace_logger.error(f"LLM_TRACE: Key Generation Error: {e}", exc_info=True, extra={'correlation_id': get_correlation_id(), "provisioning_key_index": provisioning_key_index})
+            raise TryAgain # Retry the same provisioning key
 
         return False # Should not be reached if retry logic works, but acts as default failure
 
-    async def _get_active_key_or_generate(self) -> Optional[str]:
-        """Gets the currently active generated key, or generates a new one if needed."""
-        if self.active_generated_key:
-            return self.active_generated_key
+    async def _lease_generated_key(self) -> Optional[Tuple[int, str, Optional[str]]]:
+        """
+        Leases a provisioning key from the key pool and returns (provisioning key index, generated key, key hash),
+        generating the key on first use. Tries each provisioning key at most once. The caller must release
+        the index back to self.key_pool.
+        """
+        for _ in range(max(1, len(self.key_pool))):
+            provisioning_key_index = self.key_pool.acquire()
+            if provisioning_key_index is None:
+                return None
+            if provisioning_key_index in self.generated_keys:
+                generated_key, key_hash = self.generated_keys[provisioning_key_index]
+                return provisioning_key_index, generated_key, key_hash
+
+            logger.info(f"No generated key yet for provisioning key index {provisioning_key_index}. Attempting to generate one.")
+            try:
+                success = await self._generate_api_key(provisioning_key_index)
+            except RetryError:
+                success = False
+            if success:
+                generated_key, key_hash = self.generated_keys[provisioning_key_index]
+                return provisioning_key_index, generated_key, key_hash
+            self.key_pool.release(provisioning_key_index, success=False)
+        logger.error("Failed to generate an API key with any provisioning key.")
+        return None
 
-        logger.info("No active generated key found. Attempting to generate a new one.")
-        success = await self._generate_api_key()
-        if success:
-            return self.active_generated_key
-        else:
-            logger.error("Failed to generate a new API key after multiple attempts.")
-            return None
+    async def _save_to_cache(self, cache_key: str, api_result: Dict[str, Any]):
+        """Stores a successful result+usage entry in the response cache."""
+        await self.response_cache.set(cache_key, api_result)
+        self.cache_stats["writes"] += 1
 
     # --- Main API Call Methods ---
 
-    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_exponential(multiplier=1, min=settings.RETRY_DELAY, max=10))
+    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_for_shared_budget(OPENROUTER_PROVIDER, wait_exponential(multiplier=1, min=settings.RETRY_DELAY, max=10)), before_sleep=_record_retry)
     @log_function_call(logger, include_args=False)
     async def classify_batch(
         self,
@@ -316,14 +350,18 @@ class LLMService:
         level: int,
         taxonomy: Taxonomy,
         parent_category_id: Optional[str] = None,
-        search_context: Optional[Dict[str, Any]] = None
+        search_context: Optional[Dict[str, Any]] = None,
+        model: Optional[str] = None, # Overrides self.model (e.g. model cascade)
+        on_item: Optional[Callable[[Dict[str, Any]], None]] = None
     ) -> Dict[str, Any]:
         """
         Send a batch of vendors to LLM for classification, using generated keys.
-        Handles prompt generation internally.
+        Handles prompt generation internally. With LLM_STREAMING_ENABLED the response is streamed and each
+        classification is passed to `on_item` as soon as it is complete; if the stream breaks off, the result
+        holds the classifications received so far and is marked "partial".
         """
-        batch_names = [vd.get('vendor_name', f'Unknown_{i}') for i, vd in enumerate(batch_data)]
-        context_type = "Search Context" if search_context else "Initial Data"
+        model = model or self.model
+        context_type = "Search Context" if search_context or any(vd.get('search_context') for vd in batch_data) else "Initial Data"
         logger.info(f"Classifying vendor batch using {context_type}",
                 extra={ "batch_size": len(batch_data), "level": level, "parent_category_id": parent_category_id, "has_search_context": bool(search_context) })
         set_log_context({"vendor_count": len(batch_data), "taxonomy_level": level, "context_type": context_type})
@@ -332,46 +370,105 @@ class LLMService:
         llm_trace_logger.debug(f"LLM_TRACE: Starting classify_batch (Batch ID: {batch_id}, Level: {level})", extra={'correlation_id': correlation_id})
 
         # --- Prompt Generation ---
+        # Static instructions + category options form a byte-stable system prefix; the vendor data comes last.
         with LogTimer(logger, "Prompt creation", include_in_stats=True):
-            prompt = generate_batch_prompt(batch_data, level, taxonomy, parent_category_id, batch_id, search_context)
-            prompt_length = len(prompt)
-            logger.debug(f"Classification prompt created", extra={"prompt_length": prompt_length})
-            llm_trace_logger.debug(f"LLM_TRACE: Generated Prompt (Batch ID: {batch_id}):\n-------\n{prompt}\n-------", extra={'correlation_id': correlation_id})
+            system_prefix, user_message = generate_batch_prompt_messages(batch_data, level, taxonomy, parent_category_id, batch_id, search_context)
+            prompt_length = len(system_prefix) + len(user_message)
+            logger.debug(f"Classification prompt created", extra={"prompt_length": prompt_length, "prefix_length": len(system_prefix)})
+            llm_trace_logger.debug(f"LLM_TRACE: Generated Prompt (Batch ID: {batch_id}):\n-------\n{system_prefix}\n{user_message}\n-------", extra={'correlation_id': correlation_id})
 
         # --- Payload ---
+        # Strict JSON schema (category enum for this level/parent) where the model supports it, else json_object
+        response_spec = batch_response_spec(taxonomy, level, parent_category_id)
         payload = {
-            "model": self.model, "messages": [{"role": "user", "content": prompt}],
-            "temperature": 0.1, "max_tokens": 2048, "top_p": 0.9,
+            "model": model, "messages": _build_prefixed_messages(model, system_prefix, user_message),
+            "temperature": 0.1, "max_tokens": BATCH_MAX_COMPLETION_TOKENS, "top_p": 0.9,
             "frequency_penalty": 0, "presence_penalty": 0,
-            "response_format": {"type": "json_object"}
+            **request_options(model, response_spec),
+            "usage": {"include": True} # OpenRouter usage accounting (reports cached prompt tokens)
         }
+        if settings.LLM_STREAMING_ENABLED:
+            payload["stream"] = True # Not part of the cache key: streamed and buffered responses are interchangeable
 
         # --- Call generic LLM method ---
         # This method handles API key, call, error handling, stats, parsing
+        cache_key = _generate_cache_key(payload, volatile_ids=[batch_id])
         parsed_result, usage_data = await self._call_llm_endpoint(
             payload=payload,
             job_id=batch_id, # Use batch_id for tracing this specific call
-            call_description=f"Level {level} batch classification"
+            call_description=f"Level {level} batch classification",
+            cache_key=cache_key,
+            latency_key=f"classify_level{level}",
+            response_spec=response_spec,
+            on_item=on_item
         )
 
         # --- Return structure expected by caller ---
         api_result = {
             "result": parsed_result, # The parsed JSON from LLM
-            "usage": usage_data # The usage stats collected by _call_llm_endpoint
+            "usage": usage_data, # The usage stats collected by _call_llm_endpoint
+            "model": model
         }
 
-        # --- SAVE TO CACHE (if successful) ---
-        if settings.USE_LLM_CACHE and parsed_result is not None:
-            cache_key = _generate_cache_key(payload) # Generate key based on payload
+        # --- SAVE TO CACHE (if successful and complete) ---
+        if settings.USE_LLM_CACHE and parsed_result is not None and not parsed_result.get("partial"):
             logger.info(f"--- SAVING TO CACHE --- Storing successful response for batch {batch_id[:8]} (Key: {cache_key[:8]}...)")
-            self.cache[cache_key] = api_result # Store the combined result+usage
-            _save_cache(self.cache)
+            await self._save_to_cache(cache_key, api_result) # Store the combined result+usage
         # --- END SAVE TO CACHE ---
 
         return api_result
 
 
-    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_exponential(multiplier=1, min=settings.RETRY_DELAY, max=10))
+    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_for_shared_budget(OPENROUTER_PROVIDER, wait_exponential(multiplier=1, min=settings.RETRY_DELAY, max=10)), before_sleep=_record_retry)
+    @log_function_call(logger, include_args=False)
+    async def classify_direct_path(
+        self,
+        batch_data: List[Dict[str, Any]],
+        candidates: Dict[str, List[Tuple[str, ...]]],
+        taxonomy: Taxonomy,
+        target_level: int,
+        model: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        Asks for the full Level 1..target_level path of each vendor in one call, choosing among the vendor's
+        candidate paths ({vendor_name: [path, ...]}). Same return structure as classify_batch.
+        """
+        model = model or self.model
+        logger.info("Classifying vendor batch directly to a full path",
+                    extra={"batch_size": len(batch_data), "target_level": target_level})
+        set_log_context({"vendor_count": len(batch_data), "taxonomy_level": target_level, "context_type": "Direct Path"})
+        batch_id = str(uuid.uuid4())
+        correlation_id = get_correlation_id()
+
+        with LogTimer(logger, "Direct path prompt creation", include_in_stats=True):
+            system_prefix, user_message = generate_direct_path_prompt_messages(batch_data, candidates, taxonomy, target_level, batch_id)
+            llm_trace_logger.debug(f"LLM_TRACE: Generated Direct Path Prompt (Batch ID: {batch_id}):\n-------\n{system_prefix}\n{user_message}\n-------", extra={'correlation_id': correlation_id})
+
+        response_spec = direct_path_response_spec(target_level, [".".join(path) for paths in candidates.values() for path in paths])
+        payload = {
+            "model": model, "messages": _build_prefixed_messages(model, system_prefix, user_message),
+            "temperature": 0.1, "max_tokens": BATCH_MAX_COMPLETION_TOKENS, "top_p": 0.9,
+            "frequency_penalty": 0, "presence_penalty": 0,
+            **request_options(model, response_spec),
+            "usage": {"include": True}
+        }
+
+        cache_key = _generate_cache_key(payload, volatile_ids=[batch_id])
+        parsed_result, usage_data = await self._call_llm_endpoint(
+            payload=payload,
+            job_id=batch_id,
+            call_description=f"Direct path (Level {target_level}) batch classification",
+            cache_key=cache_key,
+            latency_key=f"direct_path_level{target_level}",
+            response_spec=response_spec
+        )
+        api_result = {"result": parsed_result, "usage": usage_data, "model": model}
+        if settings.USE_LLM_CACHE and parsed_result is not None:
+            await self._save_to_cache(cache_key, api_result)
+        return api_result
+
+
+    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_for_shared_budget(OPENROUTER_PROVIDER, wait_exponential(multiplier=1, min=settings.RETRY_DELAY, max=10)), before_sleep=_record_retry)
     @log_function_call(logger, include_args=False)
     async def process_search_results(
         self,
@@ -399,39 +496,43 @@ class LLMService:
             llm_trace_logger.debug(f"LLM_TRACE: Generated Search Prompt (Attempt ID: {attempt_id}):\n-------\n{prompt}\n-------", extra={'correlation_id': correlation_id})
 
         # --- Payload ---
+        response_spec = search_response_spec(taxonomy)
         payload = {
             "model": self.model, "messages": [{"role": "user", "content": prompt}],
             "temperature": 0.1, "max_tokens": 1024, "top_p": 0.9,
             "frequency_penalty": 0, "presence_penalty": 0,
-            "response_format": {"type": "json_object"}
+            **request_options(self.model, response_spec)
         }
 
         # --- Call generic LLM method ---
+        cache_key = _generate_cache_key(payload, volatile_ids=[attempt_id])
         parsed_result, usage_data = await self._call_llm_endpoint(
             payload=payload,
             job_id=attempt_id, # Use attempt_id for tracing
-            call_description=f"Search results processing for {vendor_name}"
+            call_description=f"Search results processing for {vendor_name}",
+            cache_key=cache_key,
+            latency_key="search_results",
+            response_spec=response_spec
         )
 
         # --- Return structure expected by caller ---
         api_result = {
             "result": parsed_result,
-            "usage": usage_data
+            "usage": usage_data,
+            "model": self.model
         }
 
         # --- SAVE TO CACHE (if successful) ---
         if settings.USE_LLM_CACHE and parsed_result is not None:
-            cache_key = _generate_cache_key(payload)
             logger.info(f"--- SAVING TO CACHE --- Storing successful response for search results {attempt_id[:8]} (Key: {cache_key[:8]}...)")
-            self.cache[cache_key] = api_result
-            _save_cache(self.cache)
+            await self._save_to_cache(cache_key, api_result)
         # --- END SAVE TO CACHE ---
 
         return api_result
 
 
     # --- NEW METHOD: Handles generic prompt call ---
-    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_exponential(multiplier=1, min=settings.RETRY_DELAY, max=10))
+    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_for_shared_budget(OPENROUTER_PROVIDER, wait_exponential(multiplier=1, min=settings.RETRY_DELAY, max=10)), before_sleep=_record_retry)
     @log_function_call(logger, include_args=False)
     async def call_llm_with_prompt(
         self,
@@ -492,6 +593,12 @@ class LLMService:
             stats_dict["openrouter_prompt_tokens"] = stats_dict.get("openrouter_prompt_tokens", 0) + usage_data.get("prompt_tokens", 0)
             stats_dict["openrouter_completion_tokens"] = stats_dict.get("openrouter_completion_tokens", 0) + usage_data.get("completion_tokens", 0)
             stats_dict["openrouter_total_tokens"] = stats_dict.get("openrouter_total_tokens", 0) + usage_data.get("total_tokens", 0)
+            stats_dict["openrouter_cached_tokens"] = stats_dict.get("openrouter_cached_tokens", 0) + usage_data.get("cached_tokens", 0)
+            by_model = stats_dict.setdefault("by_model", {}).setdefault(self.model, {
+                "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0})
+            by_model["calls"] += 1
+            for field in ("prompt_tokens", "completion_tokens", "total_tokens", "cached_tokens"):
+                by_model[field] += usage_data.get(field, 0)
             # Note: Cost calculation should happen *after* all calls, using the final accumulated stats.
         else:
             logger.warning("Stats dictionary was not provided or invalid type, cannot update usage.", extra={"job_id": job_id})
@@ -506,7 +613,11 @@ class LLMService:
         self,
         payload: Dict[str, Any],
         job_id: str, # Identifier for logging/tracing this specific call
-        call_description: str = "LLM API call"
+        call_description: str = "LLM API call",
+        cache_key: Optional[str] = None, # Precomputed key (with volatile IDs masked); derived from payload if omitted
+        latency_key: Optional[str] = None, # Latency class for hedging (e.g. "classify_level2"); None disables hedging
+        response_spec: Optional[ResponseSpec] = None, # Validates the parsed response (see services/structured_output.py)
+        on_item: Optional[Callable[[Dict[str, Any]], None]] = None # Streamed requests: called per completed classification
     ) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
         """
         Internal helper to handle the actual API call, caching, key management,
@@ -516,36 +627,192 @@ class LLMService:
             payload: The complete request payload for the API.
             job_id: Identifier for logging/tracing.
             call_description: Short description for logs.
+            cache_key: Response cache key; defaults to _generate_cache_key(payload).
+            latency_key: Latency class. Durations are tracked per (model, latency_key), and with
+                         LLM_HEDGING_ENABLED a slow request is hedged (see _call_llm_hedged).
+            response_spec: Expected response shape. Items that do not match it are dropped; a response
+                           that does not match at all counts as unparseable.
 
         Returns:
             A tuple containing:
             - The parsed JSON dictionary response (or None on error/parse failure).
             - A dictionary with usage stats for *this specific call*
-              (prompt_tokens, completion_tokens, total_tokens).
+              (prompt_tokens, completion_tokens, total_tokens, cached_tokens).
         """
         correlation_id = get_correlation_id() or job_id
-        default_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0}
+        default_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
 
         # --- CACHE CHECK ---
-        cache_key = _generate_cache_key(payload)
-        if settings.USE_LLM_CACHE and cache_key in self.cache:
-            logger.warning(f"--- CACHE HIT --- Returning cached response for {call_description} ({job_id})")
+        cache_key = cache_key or _generate_cache_key(payload)
+        cached_response = await self.response_cache.get(cache_key) if settings.USE_LLM_CACHE else None
+        if isinstance(cached_response, dict):
+            self.cache_stats["hits"] += 1
+            logger.info(f"--- CACHE HIT --- Returning cached response for {call_description} ({job_id})")
             llm_trace_logger.info(f"LLM_TRACE: Cache Hit ({call_description}, Job ID: {job_id}, Key: {cache_key[:8]}...)", extra={'correlation_id': correlation_id})
-            cached_response = self.cache[cache_key]
             # Ensure cache structure matches expected return format
             parsed_result = cached_response.get("result")
             usage_data = cached_response.get("usage", default_usage)
             return parsed_result, usage_data
+        if settings.USE_LLM_CACHE:
+            self.cache_stats["misses"] += 1
         # --- END CACHE CHECK ---
 
         logger.info(f"--- CACHE MISS --- Preparing LIVE API call for {call_description} ({job_id})")
 
-        # --- Get or Generate API Key ---
-        current_api_key = await self._get_active_key_or_generate()
-        if not current_api_key:
+        delay = hedge_delay(payload.get("model", self.model), latency_key)
+        if delay is not None:
+            return await self._call_llm_hedged(payload, job_id, call_description, latency_key, delay, response_spec, on_item)
+        return await self._call_llm_live(payload, job_id, call_description, latency_key, response_spec=response_spec, on_item=on_item)
+
+    async def _call_llm_hedged(
+        self,
+        payload: Dict[str, Any],
+        job_id: str,
+        call_description: str,
+        latency_key: str,
+        delay: float,
+        response_spec: Optional[ResponseSpec] = None,
+        on_item: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+        """
+        Sends the request and, if no response has arrived `delay` seconds after it went out, sends a duplicate
+        (to another pool key, or to LLM_HEDGE_MODEL). The first valid response wins and the other request is
+        cancelled. Errors are re-raised for tenacity only if neither request produced a response.
+        """
+        self.hedge_stats["eligible_calls"] += 1
+        sent = asyncio.Event()
+        tasks: Dict[asyncio.Task, str] = {}
+        primary = asyncio.ensure_future(self._call_llm_live(payload, job_id, call_description, latency_key, sent_event=sent, response_spec=response_spec, on_item=on_item))
+        tasks[primary] = "primary"
+        try:
+            # The hedge timer starts once the primary is on the wire, not while it waits for rate-limit budget
+            sent_waiter = asyncio.ensure_future(sent.wait())
+            await asyncio.wait({primary, sent_waiter}, return_when=asyncio.FIRST_COMPLETED)
+            sent_waiter.cancel()
+            if not primary.done():
+                await asyncio.wait({primary}, timeout=delay)
+            if primary.done():
+                return primary.result()
+
+            max_hedged = settings.LLM_HEDGE_MAX_FRACTION * self.hedge_stats["eligible_calls"]
+            if self.hedge_stats["hedged_calls"] + 1 > max(1.0, max_hedged):
+                self.hedge_stats["skipped_budget"] += 1
+                return await primary
+
+            hedge_payload = payload
+            if settings.LLM_HEDGE_MODEL:
+                hedge_payload = {key: value for key, value in payload.items() if key != "provider"}
+                hedge_payload.update(model=settings.LLM_HEDGE_MODEL, **request_options(settings.LLM_HEDGE_MODEL, response_spec))
+            logger.info(f"Hedging {call_description}: no response after {delay:.1f}s",
+                        extra={"job_id": job_id, "latency_key": latency_key, "hedge_model": hedge_payload.get("model")})
+            self.hedge_stats["hedged_calls"] += 1
+            hedge = asyncio.ensure_future(self._call_llm_live(hedge_payload, job_id, f"{call_description} (hedge)", latency_key, response_spec=response_spec, on_item=on_item))
+            tasks[hedge] = "hedge"
+
+            pending = set(tasks)
+            fallback: Optional[Tuple[Optional[Dict[str, Any]], Dict[str, int]]] = None
+            first_error: Optional[BaseException] = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is not None:
+                        first_error = first_error or task.exception()
+                        continue
+                    parsed_result, usage_data = task.result()
+                    if parsed_result is None:
+                        # Unparseable response: keep it as a last resort, count its tokens as extra spend
+                        if fallback is not None:
+                            self._record_extra_hedge_usage(fallback[1])
+                        fallback = (parsed_result, usage_data)
+                        continue
+                    self.hedge_stats[f"{tasks[task]}_wins"] += 1
+                    if fallback is not None:
+                        self._record_extra_hedge_usage(fallback[1])
+                    return parsed_result, usage_data
+            if fallback is not None:
+                return fallback
+            raise first_error
+        finally:
+            losers = [task for task in tasks if not task.done()]
+            for task in losers:
+                task.cancel()
+                self.hedge_stats["cancelled_requests"] += 1
+            if losers:
+                await asyncio.gather(*losers, return_exceptions=True)
+
+    def _record_extra_hedge_usage(self, usage_data: Dict[str, int]) -> None:
+        for field in ("prompt_tokens", "completion_tokens", "total_tokens"):
+            self.hedge_stats[f"extra_{field}"] += usage_data.get(field, 0)
+
+    def get_hedge_stats(self) -> Dict[str, Any]:
+        return {**self.hedge_stats, "latency": self.latency_tracker.get_stats()}
+
+    def _parse_response(self, raw_content: Optional[str], response_spec: Optional[ResponseSpec]) -> Optional[Dict[str, Any]]:
+        """
+        Parses a response body: pydantic-core JSON parsing first (always enough for json_schema responses), then
+        the lenient fence/brace extraction. The result is validated against response_spec when given.
+        """
+        parsed = parse_json(raw_content)
+        if parsed is not None:
+            self.response_stats["parsed_clean"] += 1
+        else:
+            parsed = _extract_json_from_response(raw_content)
+            if parsed is None:
+                self.response_stats["parse_failures"] += 1
+                return None
+            self.response_stats["parsed_after_extraction"] += 1
+        if response_spec is None:
+            return parsed
+        validated, invalid_items = response_spec.validate(parsed)
+        self.response_stats["schema_invalid_items"] += invalid_items
+        if validated is None:
+            self.response_stats["schema_invalid_responses"] += 1
+            logger.error(f"LLM response does not match the {response_spec.name} schema", extra={"response_preview": str(parsed)[:500]})
+        return validated
+
+    def _item_validator(self, response_spec: Optional[ResponseSpec]) -> Optional[Callable[[Any], Optional[Dict[str, Any]]]]:
+        """Validates single streamed classifications[] elements against response_spec's item model."""
+        if response_spec is None or response_spec.list_field is None:
+            return None
+
+        def _validate(item: Any) -> Optional[Dict[str, Any]]:
+            validated, invalid = response_spec.validate({response_spec.list_field: [item]})
+            self.response_stats["schema_invalid_items"] += invalid
+            return validated[response_spec.list_field][0] if validated and validated[response_spec.list_field] else None
+        return _validate
+
+    def get_response_stats(self) -> Dict[str, Any]:
+        """Response format and parsing counters, with the share of parsed responses that were unusable."""
+        stats = dict(self.response_stats, retries_by_call=dict(self.response_stats["retries_by_call"]))
+        responses = stats["parsed_clean"] + stats["parsed_after_extraction"] + stats["parse_failures"]
+        unusable = stats["parse_failures"] + stats["schema_invalid_responses"]
+        stats["parse_failure_rate"] = round(unusable / responses, 4) if responses else 0.0
+        return stats
+
+    async def _call_llm_live(
+        self,
+        payload: Dict[str, Any],
+        job_id: str,
+        call_description: str,
+        latency_key: Optional[str] = None,
+        sent_event: Optional[asyncio.Event] = None, # Set just before the HTTP request is sent (hedge timer)
+        response_spec: Optional[ResponseSpec] = None,
+        on_item: Optional[Callable[[Dict[str, Any]], None]] = None
+    ) -> Tuple[Optional[Dict[str, Any]], Dict[str, int]]:
+        """Makes one live API call (no cache lookup). Returns (parsed result or None, usage); raises for tenacity."""
+        correlation_id = get_correlation_id() or job_id
+        default_usage = {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0}
+
+        # --- Lease a key from the pool (generating its API key if needed) ---
+        lease = await self._lease_generated_key()
+        if not lease:
             logger.error(f"Cannot make live API call for {call_description}: Failed to obtain a generated API key.", extra={"job_id": job_id})
             llm_trace_logger.error(f"LLM_TRACE: LLM API Error ({call_description}, Job ID: {job_id}): Failed to obtain generated key.", extra={'correlation_id': correlation_id})
             return None, default_usage # Return None for result, zero usage
+        provisioning_key_index, current_api_key, current_key_hash = lease
+        provisioning_key = self.provisioning_keys[provisioning_key_index] # Rate-limit identity (generated keys change)
+        key_hash_prefix = current_key_hash[:8] if current_key_hash else "N/A"
+        lease_success = False; lease_status_code = None; lease_cooldown = None; lease_cancelled = False
 
         headers = {
             "Authorization": f"Bearer {current_api_key}",
@@ -557,7 +824,6 @@ class LLMService:
         # Log Request Details (Trace Log)
         try:
             log_headers = {k: v for k, v in headers.items() if k.lower() != 'authorization'}
-            key_hash_prefix = self.active_generated_key_hash[:8] if self.active_generated_key_hash else "UNKNOWN"
             log_headers['Authorization'] = f'Bearer [REDACTED_GENERATED_KEY_{key_hash_prefix}]'
             llm_trace_logger.debug(f"LLM_TRACE: LLM Request Headers ({call_description}, Job ID: {job_id}):\n{json.dumps(log_headers, indent=2)}", extra={'correlation_id': correlation_id})
             llm_trace_logger.debug(f"LLM_TRACE: LLM Request Payload ({call_description}, Job ID: {job_id}):\n{json.dumps(payload, indent=2)}", extra={'correlation_id': correlation_id})
@@ -566,20 +832,49 @@ class LLMService:
 
         response_data = None; raw_content = None; response = None; status_code = None; api_duration = 0.0
         parsed_result = None
+        completion: Optional[StreamedCompletion] = None # Set for streamed requests
         usage_data = default_usage.copy()
 
+        # Prompt tokens are estimated (~4 chars/token) and max_tokens is reserved; reconciled with `usage` below
+        reserved_tokens = sum(len(str(_message_text(msg.get("content", "")))) for msg in payload.get("messages", [])) // 4 + int(payload.get("max_tokens") or 0)
         try:
-            key_hash_prefix = self.active_generated_key_hash[:8] if self.active_generated_key_hash else 'N/A'
-            logger.debug(f"Sending request to OpenRouter API for {call_description} using generated key (hash: {key_hash_prefix})", extra={"job_id": job_id})
+            wait_seconds = await self.rate_limiter.acquire(OPENROUTER_PROVIDER, provisioning_key, tokens=reserved_tokens)
+            if wait_seconds > 0:
+                self.rate_limit_stats["waits"] += 1
+                self.rate_limit_stats["wait_seconds"] = round(self.rate_limit_stats["wait_seconds"] + wait_seconds, 3)
+                logger.debug(f"Waited {wait_seconds:.2f}s for OpenRouter rate-limit budget", extra={"job_id": job_id})
+
+            logger.debug(f"Sending request to OpenRouter API for {call_description} using generated key (hash: {key_hash_prefix}, provisioning key index {provisioning_key_index})", extra={"job_id": job_id})
+            if sent_event is not None:
+                sent_event.set()
+            uses_schema = (payload.get("response_format") or {}).get("type") == "json_schema"
+            self.response_stats["json_schema_requests" if uses_schema else "json_object_requests"] += 1
             start_time = time.time()
-            async with httpx.AsyncClient() as client:
-                response = await client.post(f"{self.api_base}/chat/completions", json=payload, headers=headers, timeout=90.0) # Adjust timeout if needed
+            client = get_http_client(OPENROUTER_CLIENT) # Shared pooled client (keep-alive)
+            if payload.get("stream"):
+                # The read timeout applies per chunk, so a long but steadily streaming completion does not time out
+                self.response_stats["streamed_requests"] += 1
+                async with client.stream("POST", f"{self.api_base}/chat/completions", json=payload, headers=headers) as response:
+                    if response.status_code < 400:
+                        completion = await read_completion_stream(response, on_item, self._item_validator(response_spec))
+                        raw_content = completion.content
+                        self.response_stats["streamed_items"] += len(completion.items)
+                    else:
+                        await response.aread()
+                        raw_content = response.text
+            else:
+                response = await client.post(f"{self.api_base}/chat/completions", json=payload, headers=headers) # Timeout from OPENROUTER_TIMEOUT_SECONDS
                 raw_content = response.text
-                status_code = response.status_code
-                api_duration = time.time() - start_time
-                llm_trace_logger.debug(f"LLM_TRACE: LLM Raw Response ({call_description}, Job ID: {job_id}, Status: {status_code}, Duration: {api_duration:.3f}s):\n-------\n{raw_content or '[No Content Received]'}\n-------", extra={'correlation_id': correlation_id})
-                response.raise_for_status()
-                response_data = response.json()
+            status_code = response.status_code
+            api_duration = time.time() - start_time
+            llm_trace_logger.debug(f"LLM_TRACE: LLM Raw Response ({call_description}, Job ID: {job_id}, Status: {status_code}, Duration: {api_duration:.3f}s):\n-------\n{raw_content or '[No Content Received]'}\n-------", extra={'correlation_id': correlation_id})
+            response.raise_for_status()
+            lease_success = True # Any 2xx counts for the key, even if the content fails to parse
+            if latency_key:
+                self.latency_tracker.record(payload.get("model", self.model), latency_key, api_duration)
+            response_data = completion.as_response_data() if completion is not None else response.json()
+            if completion is not None and completion.error is not None and not completion.items:
+                raise completion.error # Nothing usable arrived: retry the whole batch
 
             # --- Successful response processing ---
             if response_data and response_data.get("choices") and isinstance(response_data["choices"], list) and len(response_data["choices"]) > 0:
@@ -592,16 +887,24 @@ class LLMService:
 
             # Extract usage for this call
             usage = response_data.get("usage", {}) if response_data else {}
-            usage_data["prompt_tokens"] = usage.get("prompt_tokens", 0)
-            usage_data["completion_tokens"] = usage.get("completion_tokens", 0)
-            usage_data["total_tokens"] = usage.get("total_tokens", 0)
+            usage_data.update(_extract_usage(usage or {}))
+            if usage_data["total_tokens"]:
+                await self.rate_limiter.adjust_tokens(OPENROUTER_PROVIDER, provisioning_key, usage_data["total_tokens"] - reserved_tokens)
 
             logger.info(f"OpenRouter API response received successfully for {call_description}",
-                    extra={ "duration": api_duration, "job_id": job_id, "status_code": status_code, "key_hash_used": key_hash_prefix, **usage_data })
+                    extra={ "duration": api_duration, "job_id": job_id, "status_code": status_code, "key_hash_used": key_hash_prefix,
+                            "provisioning_key_index": provisioning_key_index, **usage_data })
 
             # Parse the JSON content
             with LogTimer(logger, "JSON parsing and extraction", include_in_stats=True):
-                parsed_result = _extract_json_from_response(raw_content) # Use internal helper
+                if completion is None or completion.error is None:
+                    parsed_result = self._parse_response(raw_content, response_spec)
+                if parsed_result is None and completion is not None and completion.items:
+                    # Stream broke off (or ended truncated): keep the classifications that arrived complete
+                    self.response_stats["partial_streams"] += 1
+                    logger.warning(f"Using {len(completion.items)} classifications from an incomplete stream for {call_description}",
+                                   extra={"job_id": job_id, "finish_reason": completion.finish_reason, "error": str(completion.error)[:200] if completion.error else None})
+                    parsed_result = completion.partial_result()
 
             if parsed_result is None:
                 llm_trace_logger.error(f"LLM_TRACE: LLM JSON Parse Error ({call_description}, Job ID: {job_id}). Raw content logged above.", extra={'correlation_id': correlation_id})
@@ -618,28 +921,38 @@ class LLMService:
         except httpx.HTTPStatusError as e:
             response_text = raw_content or (e.response.text[:500] if hasattr(e.response, 'text') else "[No Response Body]")
             status_code = e.response.status_code
-            key_hash_used_prefix = self.active_generated_key_hash[:8] if self.active_generated_key_hash else 'N/A'
+            key_hash_used_prefix = key_hash_prefix
+            lease_status_code = status_code
             logger.error(f"HTTP error during {call_description}", exc_info=False,
                         extra={ "status_code": status_code, "response_text": response_text, "job_id": job_id, "key_hash_used": key_hash_used_prefix })
             llm_trace_logger.error(f"LLM_TRACE: LLM API HTTP Error ({call_description}, Job ID: {job_id}): Status={status_code}, Response='{response_text}', KeyHash={key_hash_used_prefix}", exc_info=True, extra={'correlation_id': correlation_id})
 
+            if status_code == 429:
+                # Shared cooldown for all workers using this provisioning key (its generated keys share its limits).
+                # The key pool quarantines it locally, so the retry goes through another key.
+                self.rate_limit_stats["throttled_responses"] += 1
+                await self.rate_limiter.block(OPENROUTER_PROVIDER, provisioning_key, retry_after_seconds(e.response, settings.RATE_LIMIT_DEFAULT_COOLDOWN_SECONDS))
+                lease_cooldown = retry_after_seconds(e.response, settings.KEY_POOL_THROTTLE_COOLDOWN_SECONDS)
+
+            if ((payload.get("response_format") or {}).get("type") == "json_schema"
+                    and is_schema_rejection(status_code, e.response.text if hasattr(e.response, 'text') else response_text)):
+                # No provider for this model accepts the schema: the retry rebuilds the payload with json_object
+                mark_unsupported(payload.get("model", self.model))
+                self.response_stats["schema_unsupported_fallbacks"] += 1
+
             if status_code in GENERATED_KEY_INVALID_STATUS_CODES:
                 logger.warning(f"Generated key (hash: {key_hash_used_prefix}) may be invalid due to status {status_code}. Discarding and forcing regeneration on retry.", extra={"job_id": job_id})
-                self.active_generated_key = None
-                self.active_generated_key_hash = None
+                self.generated_keys.pop(provisioning_key_index, None)
             elif status_code in PROVISIONING_RELATED_ERROR_CODES:
                  logger.warning(f"Server error {status_code} encountered for {call_description}. This might indicate an OpenRouter issue.", extra={"job_id": job_id})
 
             raise # Re-raise for tenacity to handle retry
 
         except httpx.RequestError as e:
-            key_hash_used_prefix = self.active_generated_key_hash[:8] if self.active_generated_key_hash else 'N/A'
+            key_hash_used_prefix = key_hash_prefix
             logger.error(f"Network error during {call_description}", exc_info=False,
                         extra={ "error_details": str(e), "job_id": job_id, "key_hash_used": key_hash_used_prefix })
             llm_trace_logger.error(f"LLM_TRACE: LLM API Network Error ({call_description}, Job ID: {job_id}): {e}, KeyHash={key_hash_used_prefix}", exc_info=True, extra={'correlation_id': correlation_id})
-            # Optionally discard key here too
-            # self.active_generated_key = None
-            # self.active_generated_key_hash = None
             raise # Re-raise for tenacity
 
         except ValueError as ve: # Catch the specific error raised on JSON parse failure
@@ -648,13 +961,23 @@ class LLMService:
             # Don't discard key for parsing error. Return None for result.
             return None, usage_data # Return None for parsed_result, but include any usage stats obtained
 
+        except asyncio.CancelledError:
+            lease_cancelled = True # Losing hedged request (or job timeout)
+            raise
+
         except Exception as e:
-            key_hash_used_prefix = self.active_generated_key_hash[:8] if self.active_generated_key_hash else 'N/A'
+            key_hash_used_prefix = key_hash_prefix
             error_context = { "job_id": job_id, "error": str(e), "model": self.model, "key_hash_used": key_hash_used_prefix }
             logger.error(f"Unexpected error during {call_description}", exc_info=True, extra=error_context)
             llm_trace_logger.error(f"LLM_TRACE: LLM Unexpected Error ({call_description}, Job ID: {job_id}): {e}, KeyHash={key_hash_used_prefix}", exc_info=True, extra={'correlation_id': correlation_id})
             raise # Re-raise for tenacity
 
+        finally:
+            if lease_cancelled:
+                self.key_pool.cancel(provisioning_key_index)
+            else:
+                self.key_pool.release(provisioning_key_index, success=lease_success, status_code=lease_status_code, cooldown_seconds=lease_cooldown)
+
         # Should only be reached if Tenacity gives up after retries
         logger.error(f"LLM call failed after multiple retries for {call_description}", extra={"job_id": job_id})
         return None, default_usage # Return None, zero usage if all retries fail
@@ -0,0 +1,187 @@
+# app/services/llm_stream.py
+"""
+Streaming (SSE) support for batch classification calls.
+
+With LLM_STREAMING_ENABLED, classify_batch requests `stream: true`. OpenRouter then sends the completion as
+server-sent events ("data: {chunk}" lines, ": comment" keep-alives, "data: [DONE]"). The text deltas are fed to an
+IncrementalArrayParser, which hands every element of the response's "classifications" array to the caller as
+soon as its closing brace arrives. A batch that times out or loses its connection half way therefore keeps the
+vendors that were already answered (see classification_logic._run_level_batch).
+"""
+import json
+import re
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+
+from core.logging_config import get_logger
+from services.structured_output import parse_json
+
+logger = get_logger("vendor_classification.llm_stream")
+
+SSE_DATA_PREFIX = "data:"
+SSE_DONE = "[DONE]"
+
+
+class StreamError(Exception):
+    """An error event sent by the provider inside a 200 stream."""
+
+
+class StreamedCompletion:
+    """What was received from one streamed completion, including when the stream broke off."""
+
+    def __init__(self):
+        self.parts: List[str] = []
+        self.items: List[Dict[str, Any]] = [] # Completed (and validated) classifications[] elements
+        self.invalid_items = 0
+        self.usage: Dict[str, Any] = {}
+        self.finish_reason: Optional[str] = None
+        self.error: Optional[Exception] = None # Set if the stream ended with a network or provider error
+
+    @property
+    def content(self) -> str:
+        return "".join(self.parts)
+
+    def as_response_data(self) -> Dict[str, Any]:
+        """The equivalent non-streamed response body."""
+        return {"choices": [{"message": {"content": self.content}, "finish_reason": self.finish_reason}], "usage": self.usage}
+
+    def partial_result(self) -> Dict[str, Any]:
+        return {"classifications": list(self.items), "partial": True}
+
+
+async def read_completion_stream(
+    response: httpx.Response,
+    on_item: Optional[Callable[[Dict[str, Any]], None]] = None,
+    validate_item: Optional[Callable[[Any], Optional[Dict[str, Any]]]] = None
+) -> StreamedCompletion:
+    """
+    Reads an SSE chat completion. Every completed classifications[] element is validated (validate_item returns
+    None to drop it) and handed to on_item immediately. Network and provider errors end the read and are
+    recorded on the result instead of raised, so the caller can keep what arrived; cancellation propagates.
+    """
+    completion = StreamedCompletion()
+    parser = IncrementalArrayParser()
+    try:
+        async for line in response.aiter_lines():
+            chunk = parse_sse_line(line)
+            if chunk is None:
+                continue
+            if isinstance(chunk.get("usage"), dict):
+                completion.usage = chunk["usage"]
+            choices = chunk.get("choices") or []
+            if choices and isinstance(choices[0], dict) and choices[0].get("finish_reason"):
+                completion.finish_reason = choices[0]["finish_reason"]
+            text = chunk_text(chunk)
+            if not text:
+                continue
+            completion.parts.append(text)
+            for item in parser.feed(text):
+                if validate_item is not None:
+                    item = validate_item(item)
+                    if item is None:
+                        completion.invalid_items += 1
+                        continue
+                completion.items.append(item)
+                if on_item is not None:
+                    on_item(item)
+    except (httpx.HTTPError, StreamError) as stream_error:
+        logger.warning("LLM response stream ended early", extra={"error": str(stream_error)[:200], "items_received": len(completion.items)})
+        completion.error = stream_error
+    return completion
+
+
+class IncrementalArrayParser:
+    """
+    Extracts the complete elements of the array under `array_field` from JSON text that arrives in pieces.
+    Tolerant of text or code fences around the object; elements are parsed one by one as they close.
+    """
+
+    def __init__(self, array_field: str = "classifications"):
+        self._array_re = re.compile(r'"' + re.escape(array_field) + r'"\s*:\s*\[')
+        self.text = ""
+        self._pos = 0 # Next character to scan
+        self._in_array = False
+        self._done = False
+        self._depth = 0 # Brace/bracket depth inside the array
+        self._in_string = False
+        self._escape = False
+        self._item_start: Optional[int] = None
+
+    def feed(self, chunk: str) -> List[Any]:
+        """Appends a chunk of response text and returns the array elements completed by it."""
+        self.text += chunk
+        if self._done:
+            return []
+        if not self._in_array:
+            match = self._array_re.search(self.text)
+            if not match:
+                return []
+            self._in_array = True
+            self._pos = match.end()
+        items: List[Any] = []
+        text = self.text
+        for index in range(self._pos, len(text)):
+            char = text[index]
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                continue
+            if char == '"':
+                self._in_string = True
+            elif char in "{[":
+                if self._depth == 0:
+                    self._item_start = index
+                self._depth += 1
+            elif char in "}]":
+                if self._depth == 0: # The array itself closed
+                    self._done = True
+                    self._pos = index + 1
+                    return items
+                self._depth -= 1
+                if self._depth == 0 and self._item_start is not None:
+                    item = parse_json(text[self._item_start:index + 1])
+                    if item is not None:
+                        items.append(item)
+                    else:
+                        logger.warning("Skipping streamed array element that is not valid JSON",
+                                       extra={"element_preview": text[self._item_start:index + 1][:200]})
+                    self._item_start = None
+        self._pos = len(text)
+        return items
+
+
+def parse_sse_line(line: str) -> Optional[Dict[str, Any]]:
+    """
+    Decodes one SSE line into its JSON chunk. Returns None for keep-alive comments, blank lines, other fields
+    and the final [DONE] marker. Raises StreamError for an error chunk.
+    """
+    line = line.strip()
+    if not line.startswith(SSE_DATA_PREFIX):
+        return None
+    data = line[len(SSE_DATA_PREFIX):].strip()
+    if not data or data == SSE_DONE:
+        return None
+    try:
+        chunk = json.loads(data)
+    except json.JSONDecodeError:
+        logger.warning("Ignoring undecodable SSE data line", extra={"line_preview": data[:200]})
+        return None
+    if isinstance(chunk, dict) and chunk.get("error"):
+        raise StreamError(str(chunk["error"])[:500])
+    return chunk if isinstance(chunk, dict) else None
+
+
+def chunk_text(chunk: Dict[str, Any]) -> str:
+    """Text delta of a streamed chat completion chunk ('' if none)."""
+    choices = chunk.get("choices") or []
+    if not choices or not isinstance(choices[0], dict):
+        return ""
+    delta = choices[0].get("delta") or {}
+    if not isinstance(delta, dict):
+        return ""
+    return delta.get("content") or ""
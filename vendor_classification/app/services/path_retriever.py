@@ -0,0 +1,75 @@
+# app/services/path_retriever.py
+"""
+Candidate retrieval for direct-path classification (tasks/classification_logic.classify_direct_paths).
+
+Indexes every category at one taxonomy level (normally Level 5) with the same hashed TF-IDF features as the
+pre-classifier. Each document is the category's name and description plus its ancestors' names, so
+"Software Publishers" is also found through "Information" / "Publishing Industries". For each vendor, the
+top-k most similar categories are returned as full paths. The LLM then picks one of them (or none) in a single
+call instead of walking the levels one request at a time.
+"""
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.logging_config import get_logger
+from models.taxonomy import Taxonomy
+from services.preclassifier import VENDOR_CHUNK_SIZE, _hash_counts, _l2_normalize, vendor_text
+
+logger = get_logger("vendor_classification.path_retriever")
+
+
+class TfidfPathRetriever:
+    """TF-IDF index over the categories of one level; returns the top-k candidate paths per vendor."""
+
+    def __init__(self, taxonomy: Taxonomy, level: int):
+        index = taxonomy.index
+        self.taxonomy = taxonomy
+        self.level = level
+        self.category_ids = list(index.level_ids.get(level, ()))
+        self.paths: List[Tuple[str, ...]] = [index.paths[category_id] for category_id in self.category_ids]
+        documents = []
+        for category_id, path in zip(self.category_ids, self.paths):
+            category = index.nodes[category_id]
+            ancestor_names = " ".join(index.nodes[ancestor_id].name for ancestor_id in path[:-1])
+            documents.append(f"{category.name} {category.description or ''} {ancestor_names}")
+        counts = _hash_counts(documents)
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1.0 + len(documents)) / (1.0 + document_frequency)) + 1.0).astype(np.float32)
+        self.matrix = _l2_normalize(np.log1p(counts) * self.idf)
+        logger.info(f"Path retriever indexed {len(self.category_ids)} Level {level} categories.")
+
+    def candidates(
+        self,
+        vendors: List[Dict[str, Any]],
+        top_k: int,
+        required_prefixes: Optional[Dict[str, Tuple[str, ...]]] = None
+    ) -> Dict[str, List[Tuple[str, ...]]]:
+        """
+        {vendor_name: up to top_k category paths, most similar first}. Vendors with no similar category get [].
+        required_prefixes ({vendor_name: (L1 id, L2 id, ...)}) restricts a vendor's candidates to paths that
+        start with its already assigned levels (e.g. the pre-classifier's Level 1-2).
+        """
+        required_prefixes = required_prefixes or {}
+        top_k = max(1, top_k)
+        found: Dict[str, List[Tuple[str, ...]]] = {}
+        if not self.category_ids:
+            return {vd.get("vendor_name"): [] for vd in vendors if vd.get("vendor_name")}
+        for start in range(0, len(vendors), VENDOR_CHUNK_SIZE):
+            chunk = vendors[start:start + VENDOR_CHUNK_SIZE]
+            counts = _hash_counts(vendor_text(vd) for vd in chunk)
+            similarities = _l2_normalize(np.log1p(counts) * self.idf) @ self.matrix.T
+            for row, vendor_data in enumerate(chunk):
+                vendor_name = vendor_data.get("vendor_name")
+                if not vendor_name:
+                    continue
+                scores = similarities[row]
+                prefix = required_prefixes.get(vendor_name)
+                if prefix:
+                    mask = np.fromiter((path[:len(prefix)] == prefix for path in self.paths), dtype=bool, count=len(self.paths))
+                    scores = np.where(mask, scores, -1.0)
+                k = min(top_k, len(scores))
+                best = np.argpartition(-scores, k - 1)[:k]
+                best = best[np.argsort(-scores[best])]
+                found[vendor_name] = [self.paths[i] for i in best if scores[i] > 0]
+        return found
@@ -0,0 +1,165 @@
+# app/services/preclassifier.py
+"""
+CPU-only pre-classification for Levels 1-2 (TF-IDF + cosine similarity, NumPy only).
+
+Each vendor's text (name, example goods/services, internal/spend category) is compared with:
+- the Level 1 and Level 2 category names and descriptions from the Taxonomy index, and
+- previously confirmed classifications (vendors whose result came from a merged review), if given.
+A vendor is assigned a category when its best similarity is at least PRECLASSIFIER_SIMILARITY_THRESHOLD
+and beats the best competing category by PRECLASSIFIER_MIN_MARGIN. Level 2 is only tried under an assigned
+Level 1. Everything else is left for the LLM.
+
+Features are word unigrams plus character trigrams, hashed into HASH_DIMENSIONS buckets, so memory stays
+bounded without a vocabulary or sparse-matrix dependency.
+"""
+import zlib
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from core.config import settings
+from core.logging_config import get_logger
+from models.taxonomy import Taxonomy
+from utils.text_processing import INDUSTRY_STOPWORDS, WORD_TOKEN_RE
+
+logger = get_logger("vendor_classification.preclassifier")
+
+HASH_DIMENSIONS = 2 ** 13
+VENDOR_CHUNK_SIZE = 512 # Vendors scored per matrix product (bounds peak memory)
+MAX_PRECLASSIFY_LEVEL = 2
+CLASSIFICATION_SOURCE = "Embedding"
+
+# (text, level1 id, level2 id or None)
+LabeledDocument = Tuple[str, str, Optional[str]]
+
+
+def _features(text: str) -> List[str]:
+    words = [w for w in WORD_TOKEN_RE.findall((text or "").lower()) if w not in INDUSTRY_STOPWORDS]
+    features = [f"w:{w}" for w in words]
+    for word in words:
+        padded = f" {word} "
+        features.extend(f"c:{padded[i:i + 3]}" for i in range(len(padded) - 2))
+    return features
+
+
+def _hash_counts(texts: Iterable[str]) -> np.ndarray:
+    texts = list(texts)
+    matrix = np.zeros((len(texts), HASH_DIMENSIONS), dtype=np.float32)
+    for row, text in enumerate(texts):
+        for feature in _features(text):
+            matrix[row, zlib.crc32(feature.encode("utf-8")) % HASH_DIMENSIONS] += 1.0
+    return matrix
+
+
+def _l2_normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def vendor_text(vendor_data: Dict[str, Any]) -> str:
+    """Text used for a vendor: the same descriptive fields the batch prompt sends (minus address/website)."""
+    fields = ("vendor_name", "example", "internal_category", "spend_category")
+    return " ".join(str(vendor_data.get(field)) for field in fields if vendor_data.get(field))
+
+
+class TfidfPreClassifier:
+    """TF-IDF index over Level 1-2 category documents and confirmed vendor classifications."""
+
+    def __init__(self, taxonomy: Taxonomy, confirmed: Optional[List[LabeledDocument]] = None):
+        index = taxonomy.index
+        documents: List[LabeledDocument] = []
+        for level1_id in index.level_ids[1]:
+            category = index.nodes[level1_id]
+            documents.append((f"{category.name} {category.description or ''}", level1_id, None))
+        for level2_id in index.level_ids[2]:
+            category = index.nodes[level2_id]
+            documents.append((f"{category.name} {category.description or ''}", index.parents[level2_id], level2_id))
+        category_documents = len(documents)
+        for text, level1_id, level2_id in confirmed or []:
+            if index.levels.get(level1_id) != 1:
+                continue
+            if level2_id is not None and index.parents.get(level2_id) != level1_id:
+                level2_id = None # Keep the Level 1 evidence even if the Level 2 ID is stale
+            documents.append((text, level1_id, level2_id))
+
+        self.taxonomy = taxonomy
+        self.level1_labels = np.array([doc[1] for doc in documents], dtype=object)
+        self.level2_labels = np.array([doc[2] or "" for doc in documents], dtype=object)
+        counts = _hash_counts(doc[0] for doc in documents)
+        document_frequency = np.count_nonzero(counts, axis=0)
+        self.idf = (np.log((1.0 + len(documents)) / (1.0 + document_frequency)) + 1.0).astype(np.float32)
+        self.matrix = _l2_normalize(np.log1p(counts) * self.idf)
+        self.stats = {"category_documents": category_documents, "confirmed_documents": len(documents) - category_documents}
+
+    def _vectorize(self, texts: List[str]) -> np.ndarray:
+        return _l2_normalize(np.log1p(_hash_counts(texts)) * self.idf)
+
+    @staticmethod
+    def _best_label(similarities: np.ndarray, labels: np.ndarray, mask: Optional[np.ndarray] = None) -> Tuple[Optional[str], float, float]:
+        """(label with the highest similarity, its similarity, margin over the best different label)."""
+        if mask is not None:
+            similarities = np.where(mask, similarities, -1.0)
+        order = np.argsort(similarities)[::-1]
+        if len(order) == 0 or similarities[order[0]] <= 0:
+            return None, 0.0, 0.0
+        best = labels[order[0]]
+        best_score = float(similarities[order[0]])
+        runner_up = 0.0
+        for position in order[1:]:
+            score = float(similarities[position])
+            if score < 0:
+                break
+            if labels[position] != best:
+                runner_up = max(0.0, score)
+                break
+        return best, best_score, best_score - runner_up
+
+    def classify(self, vendors: List[Dict[str, Any]], max_level: int = MAX_PRECLASSIFY_LEVEL) -> Dict[str, Dict[int, Dict[str, Any]]]:
+        """
+        Returns {vendor_name: {level: classification}} for the vendors that clear the threshold.
+        Classifications use the same fields as process_batch results, with classification_source="Embedding".
+        """
+        threshold = settings.PRECLASSIFIER_SIMILARITY_THRESHOLD
+        min_margin = settings.PRECLASSIFIER_MIN_MARGIN
+        max_level = max(1, min(max_level, MAX_PRECLASSIFY_LEVEL))
+        assigned: Dict[str, Dict[int, Dict[str, Any]]] = {}
+        for start in range(0, len(vendors), VENDOR_CHUNK_SIZE):
+            chunk = vendors[start:start + VENDOR_CHUNK_SIZE]
+            similarities = self._vectorize([vendor_text(vd) for vd in chunk]) @ self.matrix.T
+            for row, vendor_data in enumerate(chunk):
+                vendor_name = vendor_data.get("vendor_name")
+                level1_id, score, margin = self._best_label(similarities[row], self.level1_labels)
+                if not vendor_name or level1_id is None or score < threshold or margin < min_margin:
+                    continue
+                levels = {1: self._result(vendor_name, level1_id, score, margin)}
+                if max_level >= 2:
+                    mask = (self.level1_labels == level1_id) & (self.level2_labels != "")
+                    level2_id, score2, margin2 = self._best_label(similarities[row], self.level2_labels, mask)
+                    if level2_id and score2 >= threshold and margin2 >= min_margin:
+                        levels[2] = self._result(vendor_name, level2_id, score2, margin2)
+                assigned[vendor_name] = levels
+        return assigned
+
+    def _result(self, vendor_name: str, category_id: str, score: float, margin: float) -> Dict[str, Any]:
+        return {
+            "category_id": category_id,
+            "category_name": self.taxonomy.get_category_name(category_id) or "N/A",
+            "confidence": round(min(score, 1.0), 3),
+            "classification_not_possible": False,
+            "classification_not_possible_reason": None,
+            "notes": f"Pre-classified by TF-IDF similarity {score:.2f} (margin {margin:.2f})",
+            "vendor_name": vendor_name,
+            "classification_source": CLASSIFICATION_SOURCE
+        }
+
+
+def confirmed_documents_from_results(detailed_results: Iterable[Dict[str, Any]]) -> List[LabeledDocument]:
+    """Labeled documents from stored JobResultItem dicts whose final result was confirmed by a review."""
+    documents: List[LabeledDocument] = []
+    for item in detailed_results or []:
+        if not isinstance(item, dict) or item.get("classification_source") != "Review":
+            continue
+        if item.get("vendor_name") and item.get("level1_id"):
+            documents.append((item["vendor_name"], item["level1_id"], item.get("level2_id")))
+    return documents
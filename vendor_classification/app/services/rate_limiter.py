@@ -0,0 +1,330 @@
+# app/services/rate_limiter.py
+"""
+Distributed token-bucket rate limiting for outbound API calls (OpenRouter, Tavily).
+
+Every call acquires from up to four buckets before it is sent:
+- requests/min for the provider (all keys) and for the API key in use;
+- tokens/min for the provider and for the key (OpenRouter only; estimated up front, reconciled with `usage`).
+A limit of 0 disables that bucket; all limits default to 0 and RATE_LIMIT_BACKEND to "none", so nothing is
+throttled until they are set from the account's actual limits (see core/config.py). With RATE_LIMIT_BACKEND="redis"
+the buckets live in Redis (REDIS_URL), so all Celery workers share one budget; each acquire is a single atomic
+Lua script. "local" keeps per-process buckets, and "none" disables limiting. If Redis is unreachable, the limiter falls back to
+local buckets and tries Redis again after REDIS_RETRY_INTERVAL_SECONDS; fallbacks are counted in get_stats().
+
+A 429 from a provider puts the key (or the whole provider) into a shared cooldown. Retries then wait on
+the shared budget in `acquire` instead of sleeping on their own.
+"""
+import asyncio
+import hashlib
+import random
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from core.config import settings
+from core.logging_config import get_logger
+
+logger = get_logger("vendor_classification.rate_limiter")
+
+OPENROUTER_PROVIDER = "openrouter"
+TAVILY_PROVIDER = "tavily"
+BUCKET_TTL_MS = 120000 # Idle buckets expire (they would be full again by then)
+MAX_SINGLE_WAIT_SECONDS = 5.0 # Re-check the buckets at least this often while waiting
+REDIS_RETRY_INTERVAL_SECONDS = 30.0 # After a Redis error, use local buckets for this long before trying Redis again
+
+# Atomic multi-bucket acquire. KEYS: provider cooldown key, key cooldown key, then bucket keys.
+# ARGV: for each bucket: capacity, refill per ms, cost. Returns 0 if granted, else milliseconds to wait.
+_ACQUIRE_SCRIPT = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) * 1000 + math.floor(tonumber(now_parts[2]) / 1000)
+local blocked_ms = math.max(redis.call('PTTL', KEYS[1]), redis.call('PTTL', KEYS[2]))
+if blocked_ms > 0 then return blocked_ms end
+local levels = {}
+local max_wait = 0
+for i = 3, #KEYS do
+  local base = (i - 3) * 3
+  local capacity = tonumber(ARGV[base + 1])
+  local rate = tonumber(ARGV[base + 2])
+  local cost = tonumber(ARGV[base + 3])
+  local data = redis.call('HMGET', KEYS[i], 'level', 'ts')
+  local level = tonumber(data[1]) or capacity
+  local ts = tonumber(data[2]) or now
+  level = math.min(capacity, level + math.max(0, now - ts) * rate)
+  levels[i] = level
+  local needed = math.min(cost, capacity)
+  if level < needed then
+    local wait = math.ceil((needed - level) / rate)
+    if wait > max_wait then max_wait = wait end
+  end
+end
+if max_wait > 0 then return max_wait end
+for i = 3, #KEYS do
+  local cost = tonumber(ARGV[(i - 3) * 3 + 3])
+  redis.call('HSET', KEYS[i], 'level', levels[i] - cost, 'ts', now)
+  redis.call('PEXPIRE', KEYS[i], %d)
+end
+return 0
+""" % BUCKET_TTL_MS
+
+
+def key_fingerprint(api_key: Optional[str]) -> str:
+    """Stable, non-reversible bucket id for an API key (raw keys are never written to Redis or logs)."""
+    if not api_key:
+        return "default"
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def _provider_limits(provider: str) -> Dict[str, int]:
+    if provider == OPENROUTER_PROVIDER:
+        return {
+            "requests": settings.OPENROUTER_REQUESTS_PER_MINUTE,
+            "key_requests": settings.OPENROUTER_KEY_REQUESTS_PER_MINUTE,
+            "tokens": settings.OPENROUTER_TOKENS_PER_MINUTE,
+            "key_tokens": settings.OPENROUTER_KEY_TOKENS_PER_MINUTE
+        }
+    if provider == TAVILY_PROVIDER:
+        return {
+            "requests": settings.TAVILY_REQUESTS_PER_MINUTE,
+            "key_requests": settings.TAVILY_KEY_REQUESTS_PER_MINUTE,
+            "tokens": 0,
+            "key_tokens": 0
+        }
+    return {"requests": 0, "key_requests": 0, "tokens": 0, "key_tokens": 0}
+
+
+class RateLimiter:
+    """Process-wide limiter. Redis clients are bound to an event loop, so one is kept per loop."""
+
+    def __init__(self, backend: str):
+        self.backend = backend
+        self._redis_clients: Dict[asyncio.AbstractEventLoop, Tuple[Any, Any]] = {}
+        self._local_buckets: Dict[str, Tuple[float, float]] = {} # bucket key -> (level, last refill time)
+        self._local_blocked_until: Dict[str, float] = {}
+        self._redis_retry_at = 0.0 # monotonic time before which Redis is skipped after an error
+        self.stats = {"redis_errors": 0, "local_fallback_acquires": 0}
+
+    # --- Bucket layout ---
+
+    @staticmethod
+    def _block_key(provider: str, key_id: Optional[str]) -> str:
+        return f"vc:ratelimit:{provider}:{key_id or '*'}:blocked"
+
+    def _buckets(self, provider: str, key_id: str, tokens: int) -> List[Tuple[str, float, float, float]]:
+        """(bucket key, capacity, refill per ms, cost) for every enabled bucket of this call."""
+        limits = _provider_limits(provider)
+        buckets = []
+        for name, scope, cost in (("requests", "*", 1), ("key_requests", key_id, 1),
+                                  ("tokens", "*", tokens), ("key_tokens", key_id, tokens)):
+            per_minute = limits[name]
+            if per_minute <= 0 or cost <= 0:
+                continue
+            bucket_kind = "tokens" if "tokens" in name else "requests"
+            buckets.append((f"vc:ratelimit:{provider}:{scope}:{bucket_kind}", float(per_minute), per_minute / 60000.0, float(cost)))
+        return buckets
+
+    # --- Backends ---
+
+    def _redis(self):
+        import redis.asyncio as redis_asyncio # Imported lazily; redis is only needed for this backend
+        loop = asyncio.get_running_loop()
+        entry = self._redis_clients.get(loop)
+        if entry is None:
+            client = redis_asyncio.from_url(settings.REDIS_URL, decode_responses=True)
+            entry = (client, client.register_script(_ACQUIRE_SCRIPT))
+            self._redis_clients[loop] = entry
+        return entry
+
+    async def _try_acquire_redis(self, provider: str, key_id: str, buckets) -> float:
+        _, script = self._redis()
+        block_keys = [self._block_key(provider, None), self._block_key(provider, key_id)]
+        args: List[float] = []
+        for _, capacity, rate, cost in buckets:
+            args.extend((capacity, rate, cost))
+        wait_ms = await script(keys=block_keys + [bucket[0] for bucket in buckets], args=args)
+        return int(wait_ms) / 1000.0
+
+    def _try_acquire_local(self, provider: str, key_id: str, buckets) -> float:
+        now = time.monotonic()
+        blocked_until = max(self._local_blocked_until.get(self._block_key(provider, None), 0.0),
+                            self._local_blocked_until.get(self._block_key(provider, key_id), 0.0))
+        if blocked_until > now:
+            return blocked_until - now
+        levels = []
+        max_wait = 0.0
+        for bucket_key, capacity, rate, cost in buckets:
+            level, last = self._local_buckets.get(bucket_key, (capacity, now))
+            level = min(capacity, level + (now - last) * 1000.0 * rate)
+            levels.append(level)
+            needed = min(cost, capacity)
+            if level < needed:
+                max_wait = max(max_wait, (needed - level) / rate / 1000.0)
+        if max_wait > 0:
+            return max_wait
+        for (bucket_key, _, _, cost), level in zip(buckets, levels):
+            self._local_buckets[bucket_key] = (level - cost, now)
+        return 0.0
+
+    def _use_redis(self) -> bool:
+        return self.backend == "redis" and time.monotonic() >= self._redis_retry_at
+
+    def _redis_error(self, action: str, error: Exception) -> None:
+        """Switches to local buckets for REDIS_RETRY_INTERVAL_SECONDS after a Redis error."""
+        self.stats["redis_errors"] += 1
+        self._redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL_SECONDS
+        logger.warning(f"Redis rate limiter failed to {action} ({error}). Using per-process buckets for {REDIS_RETRY_INTERVAL_SECONDS:.0f}s.")
+
+    async def _try_acquire(self, provider: str, key_id: str, buckets) -> float:
+        if self._use_redis():
+            try:
+                return await self._try_acquire_redis(provider, key_id, buckets)
+            except Exception as e:
+                self._redis_error("acquire", e)
+        if self.backend == "redis":
+            self.stats["local_fallback_acquires"] += 1
+        return self._try_acquire_local(provider, key_id, buckets)
+
+    # --- Public API ---
+
+    async def acquire(self, provider: str, api_key: Optional[str] = None, tokens: int = 0) -> float:
+        """
+        Waits until the provider/key budgets allow one request (and `tokens` tokens).
+        Returns the seconds spent waiting. Gives up waiting after RATE_LIMIT_MAX_WAIT_SECONDS.
+        """
+        if self.backend == "none":
+            return 0.0
+        key_id = key_fingerprint(api_key)
+        buckets = self._buckets(provider, key_id, tokens)
+        started = time.monotonic()
+        while True:
+            wait_seconds = await self._try_acquire(provider, key_id, buckets)
+            if wait_seconds <= 0:
+                return time.monotonic() - started
+            waited = time.monotonic() - started
+            if waited + wait_seconds > settings.RATE_LIMIT_MAX_WAIT_SECONDS:
+                logger.warning(f"Rate limit wait for {provider} exceeded {settings.RATE_LIMIT_MAX_WAIT_SECONDS}s. Proceeding without a budget.",
+                               extra={"key_id": key_id, "waited_seconds": round(waited, 3)})
+                return waited
+            # Jitter spreads out workers that were released at the same time
+            await asyncio.sleep(min(wait_seconds, MAX_SINGLE_WAIT_SECONDS) * random.uniform(1.0, 1.2))
+
+    async def adjust_tokens(self, provider: str, api_key: Optional[str], delta_tokens: int) -> None:
+        """Charges (positive) or refunds (negative) tokens after the real usage is known."""
+        if self.backend == "none" or not delta_tokens:
+            return
+        key_id = key_fingerprint(api_key)
+        token_buckets = [bucket for bucket in self._buckets(provider, key_id, 1) if bucket[0].endswith(":tokens")]
+        if not token_buckets:
+            return
+        if self._use_redis():
+            try:
+                client, _ = self._redis()
+                async with client.pipeline(transaction=False) as pipe:
+                    for bucket_key, _, _, _ in token_buckets:
+                        pipe.hincrbyfloat(bucket_key, "level", -delta_tokens)
+                        pipe.pexpire(bucket_key, BUCKET_TTL_MS)
+                    await pipe.execute()
+                return
+            except Exception as e:
+                self._redis_error("reconcile token budget", e)
+                return
+        now = time.monotonic()
+        for bucket_key, capacity, _, _ in token_buckets:
+            level, last = self._local_buckets.get(bucket_key, (capacity, now))
+            self._local_buckets[bucket_key] = (level - delta_tokens, last)
+
+    async def block(self, provider: str, api_key: Optional[str], seconds: float, provider_wide: bool = False) -> None:
+        """Puts a key (or the whole provider) into a shared cooldown, e.g. after a 429."""
+        if self.backend == "none" or seconds <= 0:
+            return
+        block_key = self._block_key(provider, None if provider_wide else key_fingerprint(api_key))
+        logger.warning(f"Rate limited by {provider}; pausing {'all keys' if provider_wide else 'key'} for {seconds:.1f}s.")
+        if self._use_redis():
+            try:
+                client, _ = self._redis()
+                # Never shorten an existing cooldown
+                current_ms = await client.pttl(block_key)
+                if current_ms is None or current_ms < seconds * 1000:
+                    await client.set(block_key, "1", px=int(seconds * 1000))
+                return
+            except Exception as e:
+                self._redis_error("record cooldown", e)
+        self._local_blocked_until[block_key] = max(self._local_blocked_until.get(block_key, 0.0), time.monotonic() + seconds)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Backend state for job stats. Counters are per process (the limiter outlives jobs)."""
+        return {
+            "backend": self.backend,
+            "redis_available": self._use_redis() if self.backend == "redis" else None,
+            **self.stats
+        }
+
+    async def close(self) -> None:
+        loop = asyncio.get_running_loop()
+        entry = self._redis_clients.pop(loop, None)
+        if entry is not None:
+            await entry[0].close()
+
+
+_limiter: Optional[RateLimiter] = None
+
+
+def get_rate_limiter() -> RateLimiter:
+    """Returns the process-wide limiter for RATE_LIMIT_BACKEND ('redis', 'local' or 'none')."""
+    global _limiter
+    if _limiter is None:
+        backend = (settings.RATE_LIMIT_BACKEND or "none").lower()
+        if backend not in ("redis", "local", "none"):
+            logger.warning(f"Unknown RATE_LIMIT_BACKEND '{backend}'. Rate limiting disabled.")
+            backend = "none"
+        _limiter = RateLimiter(backend)
+        logger.info("Rate limiter ready", extra={"backend": backend})
+    return _limiter
+
+
+def retry_after_seconds(response: Any, default: float) -> float:
+    """Seconds from a Retry-After header (delta-seconds form), else `default`."""
+    try:
+        value = response.headers.get("retry-after") if response is not None else None
+        return max(0.0, float(value)) if value else default
+    except (TypeError, ValueError):
+        return default
+
+
+def provider_limits_configured(provider: str) -> bool:
+    """Whether any request/token bucket is set for the provider."""
+    return any(limit > 0 for limit in _provider_limits(provider).values())
+
+
+def _is_throttled_response(exception: Optional[BaseException]) -> bool:
+    response = getattr(exception, "response", None)
+    return getattr(response, "status_code", None) == 429
+
+
+class wait_for_shared_budget:
+    """
+    tenacity wait strategy. A retry only waits a short jitter when the limiter will do the waiting: the
+    attempt was throttled (429, so the next acquire waits out the shared cooldown) or the provider has a
+    bucket configured. 5xx, network errors and timeouts without a bucket keep the `fallback` backoff
+    (the previous exponential backoff), as does every retry with RATE_LIMIT_BACKEND="none".
+    """
+
+    def __init__(self, provider: str, fallback):
+        self.provider = provider
+        self.fallback = fallback
+
+    def __call__(self, retry_state) -> float:
+        if get_rate_limiter().backend == "none":
+            return self.fallback(retry_state)
+        outcome = retry_state.outcome
+        throttled = outcome is not None and outcome.failed and _is_throttled_response(outcome.exception())
+        if throttled or provider_limits_configured(self.provider):
+            return random.uniform(0.1, 0.5)
+        return self.fallback(retry_state)
+
+
+async def close_rate_limiter() -> None:
+    """Releases the limiter's Redis connection for the running loop. Call before closing a task's event loop."""
+    if _limiter is not None:
+        try:
+            await _limiter.close()
+        except Exception as e:
+            logger.warning(f"Error closing rate limiter: {e}")
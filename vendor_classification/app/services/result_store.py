@@ -0,0 +1,178 @@
+# app/services/result_store.py
+"""
+Storage for CLASSIFICATION job results in the job_result_items table (models.job.JobResultRecord).
+
+Results are written with bulk INSERT/UPDATE statements and read back page by page, filtered and sorted in
+the database, so request memory and latency do not grow with the job. Jobs completed before the table
+existed still have their results in Job.detailed_results; the read helpers fall back to that list.
+REVIEW jobs keep using Job.detailed_results (one small ReviewResultItem list per review).
+"""
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from sqlalchemy import delete, func, insert, or_, update
+from sqlalchemy.orm import Session
+
+from core.logging_config import get_logger
+from models.job import Job, JobResultRecord
+from schemas.job import JobResultItem
+
+logger = get_logger("vendor_classification.result_store")
+
+RESULT_FIELDS = list(JobResultItem.model_fields.keys())
+SORTABLE_FIELDS = {"position", *RESULT_FIELDS}
+WRITE_CHUNK_SIZE = 5000
+LOOKUP_CHUNK_SIZE = 1000
+
+
+def _row(job_id: str, position: int, item: Dict[str, Any]) -> Dict[str, Any]:
+    row = {field: item.get(field) for field in RESULT_FIELDS}
+    row["job_id"] = job_id
+    row["position"] = position
+    return row
+
+
+def _item(record: JobResultRecord) -> Dict[str, Any]:
+    return {field: getattr(record, field) for field in RESULT_FIELDS}
+
+
+def _chunks(rows: List[Dict[str, Any]], size: int) -> Iterator[List[Dict[str, Any]]]:
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def save_job_results(db: Session, job_id: str, items: List[Dict[str, Any]]) -> int:
+    """Replaces the job's stored results with `items` (JobResultItem dicts, in order). Does not commit."""
+    db.execute(delete(JobResultRecord).where(JobResultRecord.job_id == job_id))
+    rows = [_row(job_id, position, item) for position, item in enumerate(items)]
+    for chunk in _chunks(rows, WRITE_CHUNK_SIZE):
+        db.execute(insert(JobResultRecord), chunk)
+    logger.info(f"Stored {len(rows)} result rows for job {job_id}")
+    return len(rows)
+
+
+def update_job_results(db: Session, job_id: str, items: Iterable[Dict[str, Any]]) -> int:
+    """Overwrites the stored results of the given vendors (bulk UPDATE by primary key). Does not commit."""
+    rows = []
+    for item in items:
+        row = {field: item.get(field) for field in RESULT_FIELDS}
+        row["job_id"] = job_id
+        rows.append(row)
+    for chunk in _chunks(rows, WRITE_CHUNK_SIZE):
+        db.execute(update(JobResultRecord), chunk)
+    return len(rows)
+
+
+def has_stored_results(db: Session, job_id: str) -> bool:
+    return db.query(JobResultRecord.job_id).filter(JobResultRecord.job_id == job_id).first() is not None
+
+
+def get_job_results(db: Session, job: Job, vendor_names: Optional[Iterable[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Result dicts for `job`, in input order: all of them, or only those of `vendor_names` (looked up in
+    chunks through the primary key). Falls back to Job.detailed_results for jobs stored before the table.
+    """
+    if vendor_names is None:
+        items = list(iter_job_results(db, job.id))
+    else:
+        names = list(dict.fromkeys(vendor_names))
+        items = []
+        for start in range(0, len(names), LOOKUP_CHUNK_SIZE):
+            records = (db.query(JobResultRecord)
+                       .filter(JobResultRecord.job_id == job.id, JobResultRecord.vendor_name.in_(names[start:start + LOOKUP_CHUNK_SIZE]))
+                       .all())
+            items.extend((record.position, _item(record)) for record in records)
+        items = [item for _, item in sorted(items, key=lambda pair: pair[0])]
+    if items or not job.detailed_results:
+        return items
+    wanted = None if vendor_names is None else set(vendor_names)
+    return [item for item in job.detailed_results if wanted is None or item.get("vendor_name") in wanted]
+
+
+def get_results_by_source(db: Session, job_ids: List[str], classification_source: str) -> Dict[str, List[Dict[str, Any]]]:
+    """{job_id: [result dicts]} of the given jobs' results with this classification_source (uses the source index)."""
+    grouped: Dict[str, List[Dict[str, Any]]] = {}
+    if not job_ids:
+        return grouped
+    records = (db.query(JobResultRecord)
+               .filter(JobResultRecord.job_id.in_(job_ids), JobResultRecord.classification_source == classification_source)
+               .order_by(JobResultRecord.job_id, JobResultRecord.position)
+               .all())
+    for record in records:
+        grouped.setdefault(record.job_id, []).append(_item(record))
+    return grouped
+
+
+def iter_job_results(db: Session, job_id: str, chunk_size: int = WRITE_CHUNK_SIZE) -> Iterator[Dict[str, Any]]:
+    """Streams a job's stored results in input order without loading them all at once."""
+    query = (db.query(JobResultRecord)
+             .filter(JobResultRecord.job_id == job_id)
+             .order_by(JobResultRecord.position)
+             .yield_per(chunk_size))
+    for record in query:
+        yield _item(record)
+
+
+def query_job_results(
+    db: Session,
+    job: Job,
+    skip: int = 0,
+    limit: Optional[int] = None,
+    final_status: Optional[str] = None,
+    classification_source: Optional[str] = None,
+    achieved_level: Optional[int] = None,
+    search: Optional[str] = None,
+    sort_by: str = "position",
+    sort_desc: bool = False
+) -> Tuple[int, List[Dict[str, Any]]]:
+    """
+    One page of a job's results, filtered and sorted by the database. Returns (total matching, items).
+    `search` is a case-insensitive substring match on the vendor name and the category names.
+    Legacy jobs (results only in Job.detailed_results) are filtered and paged in memory.
+    """
+    if sort_by not in SORTABLE_FIELDS:
+        raise ValueError(f"Cannot sort by '{sort_by}'. Sortable fields: {', '.join(sorted(SORTABLE_FIELDS))}")
+
+    if not has_stored_results(db, job.id) and job.detailed_results:
+        return _query_legacy_results(job.detailed_results, skip, limit, final_status, classification_source,
+                                     achieved_level, search, sort_by, sort_desc)
+
+    query = db.query(JobResultRecord).filter(JobResultRecord.job_id == job.id)
+    if final_status:
+        query = query.filter(JobResultRecord.final_status == final_status)
+    if classification_source:
+        query = query.filter(JobResultRecord.classification_source == classification_source)
+    if achieved_level is not None:
+        query = query.filter(JobResultRecord.achieved_level == achieved_level)
+    if search:
+        pattern = f"%{search.lower()}%"
+        query = query.filter(or_(func.lower(JobResultRecord.vendor_name).like(pattern),
+                                 *(func.lower(getattr(JobResultRecord, f"level{level}_name")).like(pattern) for level in range(1, 6))))
+    total = query.count()
+    sort_column = getattr(JobResultRecord, sort_by)
+    query = query.order_by(sort_column.desc() if sort_desc else sort_column.asc(), JobResultRecord.position)
+    if skip:
+        query = query.offset(skip)
+    if limit is not None:
+        query = query.limit(limit)
+    return total, [_item(record) for record in query.all()]
+
+
+def _query_legacy_results(items: List[Dict[str, Any]], skip: int, limit: Optional[int], final_status: Optional[str],
+                          classification_source: Optional[str], achieved_level: Optional[int], search: Optional[str],
+                          sort_by: str, sort_desc: bool) -> Tuple[int, List[Dict[str, Any]]]:
+    search = search.lower() if search else None
+    matches = [
+        item for item in items
+        if (not final_status or item.get("final_status") == final_status)
+        and (not classification_source or item.get("classification_source") == classification_source)
+        and (achieved_level is None or item.get("achieved_level") == achieved_level)
+        and (not search or any(search in str(item.get(field) or "").lower()
+                               for field in ["vendor_name"] + [f"level{level}_name" for level in range(1, 6)]))
+    ]
+    if sort_by != "position":
+        matches.sort(key=lambda item: (item.get(sort_by) is None, item.get(sort_by) if item.get(sort_by) is not None else 0),
+                     reverse=sort_desc)
+    elif sort_desc:
+        matches.reverse()
+    end = None if limit is None else skip + limit
+    return len(matches), matches[skip:end]
@@ -1,8 +1,10 @@
 # app/services/search_service.py
 
+import asyncio
+import hashlib
 import httpx
 import logging
-from typing import Dict, Any, List, Optional # Added Optional
+from typing import Dict, Any, Tuple
 from tenacity import retry, stop_after_attempt, wait_exponential, RetryError
 import time
 import uuid
@@ -12,6 +14,10 @@ from core.config import settings
 from core.logging_config import get_logger
 from core.log_context import set_log_context, get_correlation_id
 from utils.log_utils import LogTimer, log_function_call
+from services.http_client import get_http_client, TAVILY_CLIENT
+from services.llm_cache import get_response_cache
+from services.rate_limiter import get_rate_limiter, retry_after_seconds, wait_for_shared_budget, TAVILY_PROVIDER
+from services.key_pool import get_key_pool
 
 llm_trace_logger = logging.getLogger("llm_api_trace")
 logger = get_logger("vendor_classification.search_service")
@@ -19,16 +25,46 @@ logger = get_logger("vendor_classification.search_service")
 # --- Status codes that trigger key rotation ---
 # UPDATED: Added 432 (Tavily specific usage limit code) to the set
 TAVILY_ROTATION_STATUS_CODES = {400, 401, 403, 429, 432, 500, 502, 503, 504}
+TAVILY_AUTH_STATUS_CODES = {401, 403, 432} # 432: plan/credit limit exceeded
+
+# --- Search result cache ---
+# Results are cached across jobs by sanitized query (services/llm_cache.py backend). Empty results are
+# cached too, but only for SEARCH_NEGATIVE_CACHE_TTL_SECONDS. Errors are never cached.
+SEARCH_CACHE_NAMESPACE = "tavily_search"
+SEARCH_DEPTH = "advanced"
+SEARCH_MAX_RESULTS = 5
+
+
+def build_search_query(vendor_name: str) -> str:
+    """Sanitized Tavily query for a vendor (control characters and excess whitespace removed)."""
+    sanitized_vendor_name = ' '.join(str(vendor_name).split())
+    return f"{sanitized_vendor_name} company business type industry"
+
+
+def search_cache_key(search_query: str) -> str:
+    """Case-insensitive key for a query, including the request parameters that shape the results."""
+    key_source = f"{search_query.lower()}|{SEARCH_DEPTH}|{SEARCH_MAX_RESULTS}"
+    return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
 
 class SearchService:
-    """Service for interacting with Tavily Search API, with key rotation."""
+    """Service for interacting with Tavily Search API, spreading requests across a key pool."""
 
     def __init__(self):
         """Initialize the search service."""
-        logger.info("Initializing Tavily Search service with key rotation")
+        logger.info("Initializing Tavily Search service with key pool")
         self.api_keys = config.MANUAL_TAVILY_API_KEYS
         self.base_url = "https://api.tavily.com"
-        self.current_key_index = 0
+        self.key_pool = get_key_pool(TAVILY_PROVIDER, self.api_keys, settings.TAVILY_KEY_REQUESTS_PER_MINUTE)
+        self.search_cache = get_response_cache(
+            namespace=SEARCH_CACHE_NAMESPACE,
+            ttl_seconds=settings.SEARCH_CACHE_TTL_SECONDS,
+            enabled=settings.USE_SEARCH_CACHE
+        )
+        # Searches in flight in this service (one job), keyed by cache key, so duplicates share one request
+        self._in_flight: Dict[str, asyncio.Future] = {}
+        self.cache_stats = {"hits": 0, "negative_hits": 0, "misses": 0, "writes": 0, "coalesced": 0, "live_calls": 0}
+        self.rate_limiter = get_rate_limiter()
+        self.rate_limit_stats = {"waits": 0, "wait_seconds": 0.0, "throttled_responses": 0}
 
         if not self.api_keys:
             logger.error("Tavily API key list is empty! Search calls will fail.")
@@ -40,49 +76,84 @@ class SearchService:
                           "key_count": len(self.api_keys),
                           "rotation_codes": sorted(list(TAVILY_ROTATION_STATUS_CODES))}) # Log rotation codes sorted
 
-    def _get_current_key(self) -> Optional[str]:
-        """Gets the current API key based on the index."""
-        if not self.api_keys:
-            logger.warning("Attempted to get Tavily key, but key list is empty.")
-            return None
-        # Ensure index is always valid, even if list shrinks dynamically (though unlikely here)
-        if self.current_key_index >= len(self.api_keys):
-            logger.warning(f"Tavily key index {self.current_key_index} out of bounds ({len(self.api_keys)} keys). Resetting to 0.")
-            self.current_key_index = 0
-        return self.api_keys[self.current_key_index]
-
-    def _rotate_key(self):
-        """Rotates to the next API key in the list."""
-        if not self.api_keys or len(self.api_keys) <= 1:
-            logger.warning("Cannot rotate Tavily key: list is empty or has only one key.")
-            return # No rotation possible
-
-        old_index = self.current_key_index
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-        logger.warning(f"Rotated Tavily API key from index {old_index} to {self.current_key_index} due to API error.")
+    async def search_vendor(self, vendor_name: str) -> Dict[str, Any]:
+        """
+        Search for information about a vendor.
+        Served from the search cache when possible; concurrent searches for the same query share a
+        single request. The returned dict has a 'search_cache' field: 'hit', 'negative_hit',
+        'coalesced' or 'miss' (a live Tavily call was made).
+        """
+        search_query = build_search_query(vendor_name)
+        cache_key = search_cache_key(search_query)
+
+        in_flight = self._in_flight.get(cache_key)
+        if in_flight is not None:
+            self.cache_stats["coalesced"] += 1
+            logger.debug("Joining in-flight search for identical query", extra={"vendor": vendor_name})
+            shared_result = await asyncio.shield(in_flight)
+            return {**shared_result, "vendor": vendor_name, "search_cache": "coalesced"}
+
+        # Registered before the cache lookup, so a duplicate arriving meanwhile joins this search
+        future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self._in_flight[cache_key] = future
+        try:
+            result, search_cache_status = await self._cached_or_live_search(vendor_name, search_query, cache_key)
+            future.set_result(result)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception() # Mark retrieved; waiters (if any) re-raise it themselves
+            raise
+        finally:
+            self._in_flight.pop(cache_key, None)
+        return {**result, "vendor": vendor_name, "search_cache": search_cache_status}
+
+    async def _cached_or_live_search(self, vendor_name: str, search_query: str, cache_key: str) -> Tuple[Dict[str, Any], str]:
+        """Returns (result, cache status) from the search cache, or from a live Tavily call that is then cached."""
+        cached_entry = await self.search_cache.get(cache_key) if settings.USE_SEARCH_CACHE else None
+        if isinstance(cached_entry, dict) and isinstance(cached_entry.get("result"), dict):
+            is_empty = cached_entry.get("empty", False)
+            if not is_empty or time.time() - cached_entry.get("cached_at", 0) <= settings.SEARCH_NEGATIVE_CACHE_TTL_SECONDS:
+                self.cache_stats["negative_hits" if is_empty else "hits"] += 1
+                logger.info("Search cache hit", extra={"vendor": vendor_name, "empty_result": is_empty})
+                return cached_entry["result"], "negative_hit" if is_empty else "hit"
+        if settings.USE_SEARCH_CACHE:
+            self.cache_stats["misses"] += 1
+
+        self.cache_stats["live_calls"] += 1
+        result = await self._search_vendor_live(vendor_name, search_query)
+        if settings.USE_SEARCH_CACHE and not result.get("error"):
+            is_empty = not result.get("sources") and not result.get("summary")
+            await self.search_cache.set(cache_key, {"result": result, "empty": is_empty, "cached_at": time.time()})
+            self.cache_stats["writes"] += 1
+        return result, "miss"
+
+    def get_rate_limit_stats(self) -> Dict[str, Any]:
+        return dict(self.rate_limit_stats)
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        return {"backend": self.search_cache.backend_name, **self.cache_stats}
 
     # Increased retries slightly for search as it might be less critical than LLM? Or keep same.
-    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_exponential(multiplier=1, min=1, max=10))
+    @retry(stop=stop_after_attempt(settings.MAX_RETRIES), wait=wait_for_shared_budget(TAVILY_PROVIDER, wait_exponential(multiplier=1, min=1, max=10)))
     @log_function_call(logger)
-    async def search_vendor(self, vendor_name: str) -> Dict[str, Any]:
+    async def _search_vendor_live(self, vendor_name: str, search_query: str) -> Dict[str, Any]:
         """
-        Search for information about a vendor, with key rotation on failure.
+        Search Tavily for information about a vendor, using the key leased from the key pool.
+        Keys that fail with a rotation status code are quarantined, so the retry goes through another key.
         """
         logger.info(f"Searching for vendor information",
                    extra={"vendor": vendor_name})
         set_log_context({"vendor": vendor_name})
-        # Basic query sanitization attempt (remove potential control characters, excessive whitespace)
-        sanitized_vendor_name = ' '.join(str(vendor_name).split())
-        search_query = f"{sanitized_vendor_name} company business type industry"
-        if vendor_name != sanitized_vendor_name:
-             logger.debug(f"Sanitized vendor name for search query", extra={"original": vendor_name, "sanitized": sanitized_vendor_name})
 
         logger.debug(f"Generated search query",
                    extra={"search_query": search_query})
 
-        # --- Get current key ---
-        current_api_key = self._get_current_key()
-        if not current_api_key:
+        # --- Lease a key from the pool ---
+        key_index = self.key_pool.acquire()
+        if key_index is None:
              logger.error("Cannot perform Tavily search: No API key available.")
              # Return error structure consistent with API failures
              return {
@@ -92,23 +163,25 @@ class SearchService:
                 "sources": [],
                 "summary": None # Ensure summary is None on error
              }
-        # --- End get current key ---
+        current_api_key = self.api_keys[key_index]
+        # --- End lease key ---
 
         correlation_id = get_correlation_id()
         search_attempt_id = str(uuid.uuid4())
         llm_trace_logger.debug(f"LLM_TRACE: Starting Tavily Search (Attempt ID: {search_attempt_id}, Vendor: {vendor_name})", extra={'correlation_id': correlation_id})
 
         response = None; raw_content = None; response_data = None; status_code = None
+        lease_success = False; lease_cooldown = None
         try:
-            logger.debug(f"Sending request to Tavily API using key index {self.current_key_index}")
+            logger.debug(f"Sending request to Tavily API using key index {key_index}")
 
             # --- Log Request Payload (already present) ---
             payload_for_log = { # Redact key for logging
-                "api_key": f"[REDACTED_KEY_INDEX_{self.current_key_index}]",
+                "api_key": f"[REDACTED_KEY_INDEX_{key_index}]",
                 "query": search_query,
-                "search_depth": "advanced",
+                "search_depth": SEARCH_DEPTH,
                 "include_answer": True,
-                "max_results": 5
+                "max_results": SEARCH_MAX_RESULTS
             }
             headers = {"Content-Type": "application/json"}
 
@@ -123,23 +196,28 @@ class SearchService:
             actual_payload = payload_for_log.copy()
             actual_payload["api_key"] = current_api_key # Use the actual key for the request
 
-            async with httpx.AsyncClient() as client:
-                with LogTimer(logger, "Tavily API request", include_in_stats=True):
-                    start_time = time.time()
-                    response = await client.post(
-                        f"{self.base_url}/search",
-                        json=actual_payload,
-                        headers=headers,
-                        timeout=30.0
-                    )
-                    # --- Log Raw Response (already present) ---
-                    api_duration = time.time() - start_time
-                    raw_content = response.text
-                    status_code = response.status_code
-                    llm_trace_logger.debug(f"LLM_TRACE: Tavily Raw Response (Attempt ID: {search_attempt_id}, Status: {status_code}, Duration: {api_duration:.3f}s):\n-------\n{raw_content or '[No Content Received]'}\n-------", extra={'correlation_id': correlation_id})
-                    # --- End Log Raw Response ---
-                    response.raise_for_status() # Raise HTTPStatusError for 4xx/5xx AFTER logging
-                    response_data = response.json()
+            wait_seconds = await self.rate_limiter.acquire(TAVILY_PROVIDER, current_api_key)
+            if wait_seconds > 0:
+                self.rate_limit_stats["waits"] += 1
+                self.rate_limit_stats["wait_seconds"] = round(self.rate_limit_stats["wait_seconds"] + wait_seconds, 3)
+
+            client = get_http_client(TAVILY_CLIENT) # Shared pooled client (keep-alive)
+            with LogTimer(logger, "Tavily API request", include_in_stats=True):
+                start_time = time.time()
+                response = await client.post(
+                    f"{self.base_url}/search",
+                    json=actual_payload,
+                    headers=headers # Timeout from TAVILY_TIMEOUT_SECONDS
+                )
+                # --- Log Raw Response (already present) ---
+                api_duration = time.time() - start_time
+                raw_content = response.text
+                status_code = response.status_code
+                llm_trace_logger.debug(f"LLM_TRACE: Tavily Raw Response (Attempt ID: {search_attempt_id}, Status: {status_code}, Duration: {api_duration:.3f}s):\n-------\n{raw_content or '[No Content Received]'}\n-------", extra={'correlation_id': correlation_id})
+                # --- End Log Raw Response ---
+                response.raise_for_status() # Raise HTTPStatusError for 4xx/5xx AFTER logging
+                lease_success = True
+                response_data = response.json()
 
             processed_results = {
                 "vendor": vendor_name, # Return original name
@@ -155,53 +233,58 @@ class SearchService:
                 "summary": response_data.get("answer", ""),
                 "error": None
             }
-            logger.info(f"Tavily search successful", extra={"vendor": vendor_name, "results_found": len(processed_results["sources"]), "key_index_used": self.current_key_index})
+            logger.info(f"Tavily search successful", extra={"vendor": vendor_name, "results_found": len(processed_results["sources"]), "key_index_used": key_index})
             return processed_results
 
         except httpx.HTTPStatusError as e:
              response_text = raw_content or (e.response.text[:500] if hasattr(e.response, 'text') else "[No Response Body]")
              status_code = e.response.status_code
              logger.error(f"Tavily API HTTP error for vendor '{vendor_name}'", exc_info=False, # exc_info=False for less noise, trace log has it
-                         extra={"status_code": status_code, "response": response_text, "key_index_used": self.current_key_index, "attempt_id": search_attempt_id})
+                         extra={"status_code": status_code, "response": response_text, "key_index_used": key_index, "attempt_id": search_attempt_id})
              # Log HTTP Error (already present)
              llm_trace_logger.error(f"LLM_TRACE: Tavily API HTTP Error (Attempt ID: {search_attempt_id}): Status={status_code}, Response='{response_text}'", exc_info=True, extra={'correlation_id': correlation_id})
 
-             # --- Key Rotation Logic (already present) ---
-             if status_code in TAVILY_ROTATION_STATUS_CODES:
-                 self._rotate_key() # Rotate if the status code matches
+             if status_code == 429:
+                 # Shared cooldown for this key across workers; the key pool sends the retry through another key
+                 self.rate_limit_stats["throttled_responses"] += 1
+                 await self.rate_limiter.block(TAVILY_PROVIDER, current_api_key, retry_after_seconds(e.response, settings.RATE_LIMIT_DEFAULT_COOLDOWN_SECONDS))
+                 lease_cooldown = retry_after_seconds(e.response, settings.KEY_POOL_THROTTLE_COOLDOWN_SECONDS)
+             elif status_code in TAVILY_AUTH_STATUS_CODES:
+                 # Invalid key or exhausted plan: keep this key out of rotation for the auth cool-down
+                 lease_cooldown = settings.KEY_POOL_AUTH_COOLDOWN_SECONDS
+             elif status_code in TAVILY_ROTATION_STATUS_CODES:
+                 lease_cooldown = settings.RATE_LIMIT_DEFAULT_COOLDOWN_SECONDS # Short sit-out; retry through another key
              else:
-                 logger.warning(f"HTTP Status Code {status_code} not in TAVILY_ROTATION_STATUS_CODES. Key will not be rotated for this error.", extra={"vendor": vendor_name})
-             # --- END Key Rotation Logic ---
+                 logger.warning(f"HTTP Status Code {status_code} not in TAVILY_ROTATION_STATUS_CODES. Key will not be quarantined for this error.", extra={"vendor": vendor_name})
 
-             # Re-raise *after* potential rotation for tenacity to handle retry
              raise # Re-raise for tenacity
 
         except httpx.RequestError as e:
              # Network errors (connection, timeout etc.)
              logger.error(f"Tavily API request error for vendor '{vendor_name}'", exc_info=False, # exc_info=False for less noise, trace log has it
-                          extra={"error_details": str(e), "key_index_used": self.current_key_index, "attempt_id": search_attempt_id})
+                          extra={"error_details": str(e), "key_index_used": key_index, "attempt_id": search_attempt_id})
              # Log Network Error (already present)
              llm_trace_logger.error(f"LLM_TRACE: Tavily API Network Error (Attempt ID: {search_attempt_id}): {e}", exc_info=True, extra={'correlation_id': correlation_id})
-             # Optionally rotate on specific network errors? Less common for key issues.
-             # self._rotate_key()
              raise # Re-raise for tenacity
 
         except json.JSONDecodeError as e:
              # Handle cases where Tavily returns non-JSON response with 200 OK (unlikely but possible)
              logger.error(f"Failed to decode JSON response from Tavily for vendor '{vendor_name}'", exc_info=False,
-                          extra={"response_preview": raw_content[:500] if raw_content else "N/A", "key_index_used": self.current_key_index, "attempt_id": search_attempt_id})
+                          extra={"response_preview": raw_content[:500] if raw_content else "N/A", "key_index_used": key_index, "attempt_id": search_attempt_id})
              # Log JSON Decode Error (already present)
              llm_trace_logger.error(f"LLM_TRACE: Tavily JSON Decode Error (Attempt ID: {search_attempt_id}): {e}. Raw Content: {raw_content or 'N/A'}", exc_info=True, extra={'correlation_id': correlation_id})
-             # Don't rotate key for JSON errors. Re-raise for tenacity.
+             # Don't quarantine the key for JSON errors. Re-raise for tenacity.
              # Treat as a failure like other exceptions.
              raise ValueError(f"Tavily response was not valid JSON: {str(e)}") from e
 
         except Exception as e:
             # Catch any other unexpected errors during the process
             logger.error(f"Unexpected error during Tavily search for vendor '{vendor_name}'", exc_info=True, # Include stack trace for unexpected
-                         extra={"key_index_used": self.current_key_index, "attempt_id": search_attempt_id})
+                         extra={"key_index_used": key_index, "attempt_id": search_attempt_id})
             # Log Unexpected Error (already present)
             llm_trace_logger.error(f"LLM_TRACE: Tavily Unexpected Error (Attempt ID: {search_attempt_id}): {e}", exc_info=True, extra={'correlation_id': correlation_id})
-            # Optionally rotate on unexpected errors? Could hide other issues.
-            # self._rotate_key()
-            raise # Re-raise for tenacity
\ No newline at end of file
+            raise # Re-raise for tenacity
+
+        finally:
+            self.key_pool.release(key_index, success=lease_success, status_code=status_code if not lease_success else None,
+                                  cooldown_seconds=lease_cooldown)
\ No newline at end of file
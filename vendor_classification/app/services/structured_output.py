@@ -0,0 +1,207 @@
+# app/services/structured_output.py
+"""
+Structured (JSON schema) output for LLM classification calls.
+
+For models whose providers enforce `response_format: {"type": "json_schema"}` (STRUCTURED_OUTPUT_MODEL_PREFIXES,
+or every model with LLM_STRUCTURED_OUTPUT='always'), requests carry a strict schema. Its category_id field is an
+enum of the IDs valid for that (level, parent), plus "N/A", so the model cannot return malformed JSON or an
+unknown category. Other models keep `{"type": "json_object"}`.
+
+Every response, whatever its format, is parsed with pydantic-core's JSON parser and checked against a
+ResponseSpec. Entries that do not match the item model are dropped (and counted). The caller then treats those
+vendors as missing from the response instead of failing the whole batch.
+"""
+import threading
+from typing import Any, Dict, List, Optional, Sequence, Tuple, Type
+
+from pydantic import BaseModel, Field, ValidationError
+from pydantic_core import from_json
+
+from core.config import settings
+from core.logging_config import get_logger
+from models.taxonomy import Taxonomy
+from utils.taxonomy_loader import register_taxonomy_reload_hook
+
+logger = get_logger("vendor_classification.structured_output")
+
+# Model prefixes whose OpenRouter providers support strict json_schema response formats
+STRUCTURED_OUTPUT_MODEL_PREFIXES = ("openai/", "google/gemini", "mistralai/")
+NOT_POSSIBLE_ID = "N/A"
+
+# Models that rejected a json_schema request in this process; they fall back to json_object
+_unsupported_models: set = set()
+_unsupported_models_lock = threading.Lock()
+
+
+class ClassificationItem(BaseModel):
+    """One vendor entry of a batch (or search) classification response."""
+    vendor_name: str
+    category_id: str = NOT_POSSIBLE_ID
+    category_name: Optional[str] = NOT_POSSIBLE_ID
+    confidence: float = Field(0.0, ge=0.0, le=1.0)
+    classification_not_possible: bool = False
+    classification_not_possible_reason: Optional[str] = None
+    notes: Optional[str] = None
+
+
+class DirectPathItem(BaseModel):
+    """One vendor entry of a direct-path response."""
+    vendor_name: str
+    category_path: str = NOT_POSSIBLE_ID
+    confidence: float = Field(0.0, ge=0.0, le=1.0)
+    classification_not_possible: bool = False
+    classification_not_possible_reason: Optional[str] = None
+    notes: Optional[str] = None
+
+
+class ResponseSpec:
+    """
+    Expected shape of one kind of response: a JSON schema for the request, and an item model to validate the
+    parsed result with. list_field names the list of items ("classifications"); None means the response
+    object is itself a single item (search results prompt).
+    """
+    __slots__ = ("name", "schema", "item_model", "list_field")
+
+    def __init__(self, name: str, schema: Dict[str, Any], item_model: Type[BaseModel], list_field: Optional[str] = "classifications"):
+        self.name = name
+        self.schema = schema
+        self.item_model = item_model
+        self.list_field = list_field
+
+    def response_format(self) -> Dict[str, Any]:
+        return {"type": "json_schema", "json_schema": {"name": self.name, "strict": True, "schema": self.schema}}
+
+    def validate(self, data: Any) -> Tuple[Optional[Dict[str, Any]], int]:
+        """
+        (validated data, number of invalid items dropped). Returns (None, 0) if the response as a whole does not
+        have the expected shape. Fields outside the item model are kept untouched at the top level.
+        """
+        if not isinstance(data, dict):
+            return None, 0
+        if self.list_field is None:
+            try:
+                return {**data, **self.item_model.model_validate(data).model_dump()}, 0
+            except ValidationError:
+                return None, 0
+        items = data.get(self.list_field)
+        if not isinstance(items, list):
+            return None, 0
+        valid_items: List[Dict[str, Any]] = []
+        invalid = 0
+        for item in items:
+            try:
+                valid_items.append(self.item_model.model_validate(item).model_dump())
+            except ValidationError as validation_error:
+                invalid += 1
+                logger.warning(f"Dropping {self.name} response item that does not match the schema",
+                               extra={"errors": validation_error.errors(include_url=False)[:3], "item_preview": str(item)[:200]})
+        return {**data, self.list_field: valid_items}, invalid
+
+
+def parse_json(content: Optional[str]) -> Optional[Any]:
+    """Fast path: the whole content is JSON (always the case with json_schema). None if it is not."""
+    if not content:
+        return None
+    try:
+        return from_json(content)
+    except ValueError:
+        return None
+
+
+def uses_json_schema(model: str) -> bool:
+    mode = (settings.LLM_STRUCTURED_OUTPUT or "auto").lower()
+    if mode == "off" or model in _unsupported_models:
+        return False
+    return mode == "always" or (model or "").lower().startswith(STRUCTURED_OUTPUT_MODEL_PREFIXES)
+
+
+def mark_unsupported(model: str) -> None:
+    """Remembers that `model` rejected json_schema requests, so later calls in this process use json_object."""
+    with _unsupported_models_lock:
+        if model not in _unsupported_models:
+            _unsupported_models.add(model)
+            logger.warning(f"Model '{model}' rejected a json_schema response format; using json_object for it from now on.")
+
+
+def request_options(model: str, spec: Optional[ResponseSpec]) -> Dict[str, Any]:
+    """Payload entries selecting the response format (json_schema for supporting models, json_object otherwise)."""
+    if spec is None or not uses_json_schema(model):
+        return {"response_format": {"type": "json_object"}}
+    # Only route to providers that honour response_format, instead of one silently ignoring the schema
+    return {"response_format": spec.response_format(), "provider": {"require_parameters": True}}
+
+
+def _nullable(json_type: str) -> Dict[str, Any]:
+    return {"type": [json_type, "null"]}
+
+
+def _object(properties: Dict[str, Any]) -> Dict[str, Any]:
+    # Strict mode: every property required, no others allowed
+    return {"type": "object", "properties": properties, "required": list(properties), "additionalProperties": False}
+
+
+def _classification_item_schema(category_ids: Sequence[str]) -> Dict[str, Any]:
+    return _object({
+        "vendor_name": {"type": "string"},
+        "category_id": {"type": "string", "enum": [*category_ids, NOT_POSSIBLE_ID]},
+        "category_name": {"type": "string"},
+        "confidence": {"type": "number"},
+        "classification_not_possible": {"type": "boolean"},
+        "classification_not_possible_reason": _nullable("string"),
+        "notes": _nullable("string"),
+    })
+
+
+# (taxonomy name, version, level, parent) -> spec; cleared when the taxonomy is reloaded
+_batch_spec_cache: Dict[Tuple[str, str, int, Optional[str]], ResponseSpec] = {}
+
+
+def clear_response_spec_cache(taxonomy: Optional[Taxonomy] = None) -> None:
+    _batch_spec_cache.clear()
+
+register_taxonomy_reload_hook(clear_response_spec_cache)
+
+
+def batch_response_spec(taxonomy: Taxonomy, level: int, parent_category_id: Optional[str]) -> ResponseSpec:
+    """Spec for a Level `level` batch under `parent_category_id`, with the valid child IDs as the category enum."""
+    cache_key = (taxonomy.name, taxonomy.version, level, parent_category_id)
+    spec = _batch_spec_cache.get(cache_key)
+    if spec is None:
+        category_ids = sorted(taxonomy.get_valid_child_ids(level, parent_category_id))
+        schema = _object({
+            "level": {"type": "integer"},
+            "batch_id": {"type": "string"},
+            "parent_category_id": _nullable("string"),
+            "classifications": {"type": "array", "items": _classification_item_schema(category_ids)},
+        })
+        spec = _batch_spec_cache[cache_key] = ResponseSpec(f"level{level}_classification", schema, ClassificationItem)
+    return spec
+
+
+def search_response_spec(taxonomy: Taxonomy) -> ResponseSpec:
+    """Spec for the single-vendor Level 1 search results prompt."""
+    cache_key = (taxonomy.name, taxonomy.version, 0, None)
+    spec = _batch_spec_cache.get(cache_key)
+    if spec is None:
+        schema = _classification_item_schema(sorted(taxonomy.get_valid_child_ids(1)))
+        schema["properties"] = {"attempt_id": {"type": "string"}, **schema["properties"]}
+        schema["required"] = list(schema["properties"])
+        spec = _batch_spec_cache[cache_key] = ResponseSpec("search_level1_classification", schema, ClassificationItem, list_field=None)
+    return spec
+
+
+def direct_path_response_spec(target_level: int, candidate_paths: Sequence[str]) -> ResponseSpec:
+    """Spec for a direct-path batch; category_path is limited to the batch's candidate paths (dotted IDs)."""
+    schema = _object({
+        "level": {"type": "integer"},
+        "batch_id": {"type": "string"},
+        "classifications": {"type": "array", "items": _object({
+            "vendor_name": {"type": "string"},
+            "category_path": {"type": "string", "enum": [*sorted(set(candidate_paths)), NOT_POSSIBLE_ID]},
+            "confidence": {"type": "number"},
+            "classification_not_possible": {"type": "boolean"},
+            "classification_not_possible_reason": _nullable("string"),
+            "notes": _nullable("string"),
+        })},
+    })
+    return ResponseSpec(f"level{target_level}_direct_path", schema, DirectPathItem)
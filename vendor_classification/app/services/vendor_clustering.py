@@ -0,0 +1,201 @@
+# app/services/vendor_clustering.py
+"""
+Fuzzy duplicate clustering of vendor names before classification.
+
+Exact spelling variants ("Acme Inc" / "ACME, Inc.") are already merged on normalized_key
+(utils.text_processing.vendor_name_keys). This stage catches the near-duplicates that survive it,
+e.g. "Microsoft" / "Micro Soft" / "Microsfot", or "Deloitte Touche" / "Touche Deloitte":
+
+1. Every key is reduced to its token-sorted, space-free form ("touche deloitte" -> "deloittetouche",
+   "micro soft" -> "microsoft").
+2. Blocking: keys that share that form, its first PREFIX_BLOCK_LENGTH characters, or a MinHash band over
+   character trigrams become candidates for each other. Only candidates are compared, and blocks larger than
+   VENDOR_CLUSTERING_MAX_BLOCK_SIZE (generic prefixes/trigrams) are dropped, so the cost stays near-linear.
+3. Leader clustering: vendors are visited in input order; a vendor joins the most similar earlier
+   representative, or becomes a representative. Similarity is Jaro-Winkler over the tokens the two names
+   do NOT share (space-free), so a common word cannot carry a match ("Acme Services" / "Acme Solutions"
+   compares "services" with "solutions"); it must be >= VENDOR_CLUSTERING_THRESHOLD. Same token sets match
+   exactly, a name that only adds words ("Siemens" / "Siemens Energy") never matches, and keys whose numbers
+   differ ("Store 12" / "Store 13") never join.
+   Below MIN_EDIT_KEY_LENGTH characters, the differing part must also look like a typo (a doubled letter or
+   two swapped neighbours: "Deloite", "Microsfot"). Any other one-letter change there is how distinct names
+   differ ("Johnson" / "Johnston", "Anderson" / "Andersen", "Electric" / "Electronics").
+
+Only representatives are sent to the LLM; the task copies their results to the other members.
+"""
+import re
+import zlib
+from typing import Dict, FrozenSet, List, Optional, Set, Tuple
+
+import numpy as np
+
+from core.config import settings
+from core.logging_config import get_logger
+
+logger = get_logger("vendor_classification.vendor_clustering")
+
+MINHASH_BANDS = 8
+MINHASH_ROWS = 2 # Hashes per band; 8 x 2 catches most pairs with trigram Jaccard >= 0.5
+MIN_KEY_LENGTH = 5 # Shorter keys are too ambiguous to merge fuzzily
+MIN_EDIT_KEY_LENGTH = 12 # Shorter differing parts only merge on typo-like differences (see _is_typo_variant)
+PREFIX_BLOCK_LENGTH = 5
+_MERSENNE_PRIME = (1 << 61) - 1
+_DIGITS_RE = re.compile(r"\d+")
+_REPEATED_CHAR_RE = re.compile(r"(.)\1+")
+_FILLER_TOKENS = frozenset({"the", "and"}) # "The Home Depot" / "Home Depot"
+
+_rng = np.random.default_rng(20240601)
+_HASH_A = _rng.integers(1, 1 << 31, size=MINHASH_BANDS * MINHASH_ROWS, dtype=np.uint64)
+_HASH_B = _rng.integers(0, 1 << 31, size=MINHASH_BANDS * MINHASH_ROWS, dtype=np.uint64)
+
+
+def token_sort_key(key: str) -> str:
+    """Tokens sorted and joined without spaces, so word order and split words do not matter."""
+    return "".join(sorted((key or "").split()))
+
+
+def _could_reach(len_a: int, len_b: int, threshold: float) -> bool:
+    """Cheap length bound: Jaro <= (2 + shorter/longer) / 3, and the Winkler boost is at most 0.4 * (1 - Jaro)."""
+    ratio = min(len_a, len_b) / max(len_a, len_b)
+    jaro_bound = (2 + ratio) / 3
+    return jaro_bound + 0.4 * (1 - jaro_bound) >= threshold
+
+
+def _is_typo_variant(a: str, b: str) -> bool:
+    """True if a and b differ only by doubled letters, or by one swap of adjacent characters."""
+    a, b = _REPEATED_CHAR_RE.sub(r"\1", a), _REPEATED_CHAR_RE.sub(r"\1", b)
+    if a == b:
+        return True
+    if len(a) != len(b):
+        return False
+    differing = [i for i, (x, y) in enumerate(zip(a, b)) if x != y]
+    return len(differing) == 2 and differing[1] == differing[0] + 1 and a[differing[0]] == b[differing[1]] and a[differing[1]] == b[differing[0]]
+
+
+def name_similarity(tokens_a: FrozenSet[str], tokens_b: FrozenSet[str], threshold: float = 0.0) -> float:
+    """Jaro-Winkler over the non-shared tokens (see module docstring); 0.0 when the length bound rules it out."""
+    if tokens_a == tokens_b:
+        return 1.0
+    common = tokens_a & tokens_b
+    rest_a, rest_b = token_sort_key(" ".join(tokens_a - common)), token_sort_key(" ".join(tokens_b - common))
+    if rest_a == rest_b:
+        return 1.0 # Same letters, different split ("micro soft" / "microsoft")
+    if min(len(rest_a), len(rest_b)) < MIN_KEY_LENGTH or not _could_reach(len(rest_a), len(rest_b), threshold):
+        return 0.0
+    if min(len(rest_a), len(rest_b)) < MIN_EDIT_KEY_LENGTH and not _is_typo_variant(rest_a, rest_b):
+        return 0.0
+    return jaro_winkler(rest_a, rest_b)
+
+
+def jaro_winkler(a: str, b: str, prefix_scale: float = 0.1) -> float:
+    """Jaro-Winkler similarity in [0, 1] (common prefix of up to 4 characters boosted)."""
+    if a == b:
+        return 1.0
+    len_a, len_b = len(a), len(b)
+    if not len_a or not len_b:
+        return 0.0
+    window = max(0, max(len_a, len_b) // 2 - 1)
+    matched_b = [False] * len_b
+    matches_a = []
+    for i, char in enumerate(a):
+        for j in range(max(0, i - window), min(len_b, i + window + 1)):
+            if not matched_b[j] and b[j] == char:
+                matched_b[j] = True
+                matches_a.append(char)
+                break
+    matches = len(matches_a)
+    if not matches:
+        return 0.0
+    matches_b = [b[j] for j in range(len_b) if matched_b[j]]
+    transpositions = sum(1 for x, y in zip(matches_a, matches_b) if x != y) / 2
+    jaro = (matches / len_a + matches / len_b + (matches - transpositions) / matches) / 3
+    prefix = 0
+    for x, y in zip(a[:4], b[:4]):
+        if x != y:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1 - jaro)
+
+
+def _minhash_bands(text: str) -> List[Tuple[int, int]]:
+    padded = f" {text} "
+    shingles = {padded[i:i + 3] for i in range(len(padded) - 2)}
+    hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles), dtype=np.uint64, count=len(shingles))
+    signature = ((hashes[:, None] * _HASH_A + _HASH_B) % _MERSENNE_PRIME).min(axis=0)
+    return [(band, hash(tuple(signature[band * MINHASH_ROWS:(band + 1) * MINHASH_ROWS].tolist())))
+            for band in range(MINHASH_BANDS)]
+
+
+def cluster_vendor_names(vendor_keys: Dict[str, str], threshold: Optional[float] = None,
+                         max_block_size: Optional[int] = None) -> Tuple[Dict[str, str], Dict[str, int]]:
+    """
+    Clusters near-duplicate vendor names.
+
+    Args:
+        vendor_keys: {vendor_name: normalized_key}, in input order (one entry per already-deduplicated vendor)
+        threshold: Jaro-Winkler threshold (defaults to VENDOR_CLUSTERING_THRESHOLD)
+        max_block_size: blocks with more members are ignored (defaults to VENDOR_CLUSTERING_MAX_BLOCK_SIZE)
+
+    Returns:
+        ({member_name: representative_name} for every vendor that joined another vendor's cluster, stats)
+    """
+    threshold = settings.VENDOR_CLUSTERING_THRESHOLD if threshold is None else threshold
+    max_block_size = settings.VENDOR_CLUSTERING_MAX_BLOCK_SIZE if max_block_size is None else max_block_size
+
+    blocks: Dict[Tuple, List[int]] = {}
+    representatives: List[Tuple[str, str, FrozenSet[str], Tuple[str, ...]]] = [] # (name, token-sorted key, tokens, numbers)
+    members: Dict[str, str] = {}
+    comparisons = 0
+    oversized_blocks: Set[Tuple] = set()
+
+    for name, key in vendor_keys.items():
+        tokens = frozenset((key or name.lower()).split())
+        tokens = tokens - _FILLER_TOKENS or tokens
+        sorted_key = token_sort_key(" ".join(tokens))
+        numbers = tuple(sorted(_DIGITS_RE.findall(sorted_key)))
+        block_keys: List[Tuple] = [("tokens", sorted_key)]
+        if len(sorted_key) >= MIN_KEY_LENGTH:
+            block_keys.append(("prefix", sorted_key[:PREFIX_BLOCK_LENGTH]))
+            block_keys.extend(_minhash_bands(sorted_key))
+
+        candidates: Set[int] = set()
+        for block_key in block_keys:
+            block = blocks.get(block_key)
+            if block:
+                candidates.update(block)
+
+        best_index, best_score = None, threshold
+        for index in candidates:
+            rep_name, rep_key, rep_tokens, rep_numbers = representatives[index]
+            if rep_numbers != numbers:
+                continue
+            if rep_key == sorted_key:
+                best_index, best_score = index, 1.0
+                break
+            comparisons += 1
+            score = name_similarity(rep_tokens, tokens, best_score)
+            if score >= best_score:
+                best_index, best_score = index, score
+
+        if best_index is not None:
+            members[name] = representatives[best_index][0]
+            continue
+        representatives.append((name, sorted_key, tokens, numbers))
+        for block_key in block_keys:
+            if block_key in oversized_blocks:
+                continue
+            block = blocks.setdefault(block_key, [])
+            block.append(len(representatives) - 1)
+            if len(block) > max_block_size:
+                oversized_blocks.add(block_key)
+                del blocks[block_key]
+
+    stats = {
+        "vendors": len(vendor_keys),
+        "representatives": len(representatives),
+        "members_merged": len(members),
+        "comparisons": comparisons,
+        "oversized_blocks_skipped": len(oversized_blocks),
+    }
+    logger.info("Fuzzy vendor clustering finished", extra=stats)
+    return members, stats
@@ -63,6 +63,13 @@ try:
         enable_utc=True,
         task_track_started=True,
         task_send_sent_event=True,
+        # Ack only after the task finishes, so a job whose worker dies is redelivered and resumes from its
+        # checkpoint (services/job_checkpoint.py) instead of being lost.
+        task_acks_late=True,
+        task_reject_on_worker_lost=True,
+        worker_prefetch_multiplier=1,
+        broker_transport_options={"visibility_timeout": settings.CELERY_VISIBILITY_TIMEOUT_SECONDS},
+        result_backend_transport_options={"visibility_timeout": settings.CELERY_VISIBILITY_TIMEOUT_SECONDS},
     )
     logger.info("Celery configuration updated")
 
@@ -1,8 +1,10 @@
 # <file path='app/tasks/classification_logic.py'>
 import asyncio
+import heapq
+import itertools
 import time
 from datetime import datetime
-from typing import List, Dict, Any, Optional, Set
+from typing import List, Dict, Any, Optional, Set, FrozenSet, Tuple, Callable
 from sqlalchemy.orm import Session
 from sqlalchemy.exc import SQLAlchemyError
 
@@ -13,22 +15,37 @@ from core.log_context import set_log_context
 # Import log helpers from utils
 from utils.log_utils import LogTimer, log_function_call, log_duration
 
-from models.job import Job, JobStatus, ProcessingStage
+from models.job import Job, JobStatus, ProcessingStage, JobType
 from models.taxonomy import Taxonomy
 from services.llm_service import LLMService
 from services.search_service import SearchService
+from services.batch_sizer import AdaptiveBatchSizer, MISSING_VENDOR_REASON
+from services.preclassifier import TfidfPreClassifier, confirmed_documents_from_results
+from services.path_retriever import TfidfPathRetriever
+from services.context_compressor import compress_search_context
+from services.job_checkpoint import JobCheckpoint
+from services.result_store import get_results_by_source
 
 logger = get_logger("vendor_classification.classification_logic")
 
 # --- Constants ---
 MAX_CONCURRENT_SEARCHES = 10 # Limit concurrent search/LLM processing for unknown vendors
 BATCH_PROCESSING_TIMEOUT = 300.0 # Max time (seconds) per classification batch
-SEARCH_CLASSIFY_TIMEOUT = 600.0 # Max time (seconds) per vendor search + recursive classification
+SEARCH_CLASSIFY_TIMEOUT = 600.0 # Max time (seconds) per vendor search + Level 1 classification from the search results
 
 # --- Helper Functions (Moved from classification_tasks.py) ---
 
-def create_batches(items: List[Any], batch_size: int) -> List[List[Any]]:
-    """Create batches from a list of items."""
+def create_batches(
+    items: List[Any],
+    batch_size: int,
+    max_tokens: Optional[int] = None,
+    token_estimator: Optional[Callable[[Any], int]] = None
+) -> List[List[Any]]:
+    """
+    Create batches from a list of items.
+    If max_tokens and token_estimator are given, a batch is also closed before its estimated tokens would
+    exceed max_tokens (a single oversized item still gets its own batch).
+    """
     if not items: return []
     if not isinstance(items, list):
         logger.warning(f"create_batches expected a list, got {type(items)}. Returning empty list.")
@@ -36,7 +53,22 @@ def create_batches(items: List[Any], batch_size: int) -> List[List[Any]]:
     if batch_size <= 0:
         logger.warning(f"Invalid batch_size {batch_size}, using default from settings.")
         batch_size = settings.BATCH_SIZE
-    return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    if max_tokens is None or token_estimator is None:
+        return [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+
+    batches: List[List[Any]] = []
+    current_batch: List[Any] = []
+    current_tokens = 0
+    for item in items:
+        item_tokens = token_estimator(item)
+        if current_batch and (len(current_batch) >= batch_size or current_tokens + item_tokens > max_tokens):
+            batches.append(current_batch)
+            current_batch, current_tokens = [], 0
+        current_batch.append(item)
+        current_tokens += item_tokens
+    if current_batch:
+        batches.append(current_batch)
+    return batches
 
 def group_by_parent_category(
     results: Dict[str, Dict],
@@ -90,6 +122,40 @@ def group_by_parent_category(
 
 # --- Core Processing Logic (Moved from classification_tasks.py) ---
 
+def record_api_usage(stats: Dict[str, Any], usage: Dict[str, Any], model: str) -> None:
+    """Adds one LLM call's usage to stats["api_usage"], both in total and under api_usage["by_model"][model]."""
+    api_usage = stats["api_usage"]
+    by_model = api_usage.setdefault("by_model", {}).setdefault(model, {
+        "calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0, "cached_tokens": 0})
+    api_usage["openrouter_calls"] += 1
+    by_model["calls"] += 1
+    for field in ("prompt_tokens", "completion_tokens", "total_tokens", "cached_tokens"):
+        api_usage[f"openrouter_{field}"] += usage.get(field, 0)
+        by_model[field] += usage.get(field, 0)
+
+
+def cascade_models(llm_service: LLMService) -> Tuple[Optional[str], str]:
+    """(fast first-pass model or None when the cascade is off, strong model used for escalation)."""
+    strong_model = settings.LLM_CASCADE_STRONG_MODEL or llm_service.model
+    fast_model = settings.LLM_CASCADE_FAST_MODEL
+    if not settings.LLM_CASCADE_ENABLED or not fast_model or fast_model == strong_model:
+        return None, strong_model
+    return fast_model, strong_model
+
+
+def needs_escalation(result: Optional[Dict[str, Any]]) -> bool:
+    """Whether a first-pass (fast model) result should be re-run on the strong model."""
+    if not result:
+        return True
+    if result.get("classification_not_possible") or result.get("category_id") in ("ERROR", "N/A", None, ""):
+        return True # Also covers invalid category IDs and vendors missing from the response (set not possible in validation)
+    try:
+        confidence = float(result.get("confidence") or 0.0)
+    except (TypeError, ValueError):
+        confidence = 0.0
+    return confidence < settings.LLM_CASCADE_CONFIDENCE_THRESHOLD
+
+
 @log_function_call(logger, include_args=False) # Keep args=False
 async def process_batch(
     batch_data: List[Dict[str, Any]], # Pass list of dicts including optional fields
@@ -98,51 +164,61 @@ async def process_batch(
     taxonomy: Taxonomy,
     llm_service: LLMService,
     stats: Dict[str, Any],
-    search_context: Optional[Dict[str, Any]] = None # ADDED: Optional search context
+    search_context: Optional[Dict[str, Any]] = None, # ADDED: Optional search context
+    on_item: Optional[Callable[[Dict[str, Any]], None]] = None # Streaming: receives each raw classification as it arrives
 ) -> Dict[str, Dict]:
     """
     Process a batch of vendors for a specific classification level (1-5), including taxonomy validation.
-    Optionally uses search context for post-search classification attempts.
-    Updates stats dictionary in place. Passes full vendor data and context to LLM.
-    Returns results for the batch.
+    With LLM_CASCADE_ENABLED, the batch first runs on LLM_CASCADE_FAST_MODEL and only vendors that need
+    escalation (low confidence, not possible, invalid category, missing, error) are re-run as one batch on
+    the strong model. Updates stats dictionary in place. Returns results for the batch.
     """
-    results = {}
-    if not batch_data:
-        logger.warning(f"process_batch called with empty batch_data for Level {level}, Parent '{parent_category_id}'.")
+    fast_model, strong_model = cascade_models(llm_service)
+    if not fast_model:
+        return await _classify_batch_with_model(batch_data, level, parent_category_id, taxonomy, llm_service, stats, search_context,
+                                                on_item=on_item)
+
+    cascade_stats = stats.setdefault("cascade", {"fast_model": fast_model, "strong_model": strong_model,
+                                                 "first_pass_vendors": 0, "escalated_vendors": 0, "escalated_batches": 0})
+    results = await _classify_batch_with_model(batch_data, level, parent_category_id, taxonomy, llm_service, stats,
+                                               search_context, model=fast_model, on_item=on_item)
+    cascade_stats["first_pass_vendors"] += len(batch_data)
+
+    escalate = [vd for vd in batch_data if needs_escalation(results.get(vd.get("vendor_name")))]
+    if not escalate:
         return results
+    logger.info(f"process_batch: Escalating {len(escalate)}/{len(batch_data)} Level {level} vendors from '{fast_model}' to '{strong_model}'.",
+                extra={"parent_category_id": parent_category_id})
+    cascade_stats["escalated_vendors"] += len(escalate)
+    cascade_stats["escalated_batches"] += 1
+    escalated_results = await _classify_batch_with_model(escalate, level, parent_category_id, taxonomy, llm_service, stats,
+                                                         search_context, model=strong_model, on_item=on_item)
+    for vendor_name, escalated in escalated_results.items():
+        # Keep the fast result if the strong model call failed outright and the fast model had an answer
+        if escalated.get("category_id") == "ERROR" and results.get(vendor_name, {}).get("category_id") not in (None, "ERROR"):
+            continue
+        results[vendor_name] = escalated
+    return results
 
-    batch_names = [vd.get('vendor_name', f'Unknown_{i}') for i, vd in enumerate(batch_data)] # For logging
-    context_type = "Search Context" if search_context else "Initial Data"
-    classification_source = "Search" if search_context else "Initial" # Determine source
 
-    logger.info(f"process_batch: Starting Level {level} batch using {context_type}.",
-                extra={"batch_size": len(batch_data), "parent_category_id": parent_category_id, "first_vendor": batch_names[0] if batch_names else 'N/A'})
+def _classification_source(batch_data: List[Dict[str, Any]], search_context: Optional[Dict[str, Any]] = None) -> str:
+    """'Search' for post-search batches (one shared search context or a "search_context" on each vendor), else 'Initial'."""
+    return "Search" if search_context or any(vd.get('search_context') for vd in batch_data) else "Initial"
 
-    # --- Get valid category IDs for this level/parent (Updated for L5) ---
-    valid_category_ids: Set[str] = set()
+
+def _lookup_valid_category_ids(taxonomy: Taxonomy, level: int, parent_category_id: Optional[str]) -> Tuple[FrozenSet[str], bool]:
+    """(valid category IDs for this level/parent, lookup error flag) used to validate LLM answers."""
+    valid_category_ids: FrozenSet[str] = frozenset()
     category_id_lookup_error = False
     try:
         logger.debug(f"process_batch: Retrieving valid category IDs for Level {level}, Parent '{parent_category_id}'.")
-        categories = []
-        if level == 1:
-            categories = taxonomy.get_level1_categories()
-        elif parent_category_id:
-            if level == 2:
-                categories = taxonomy.get_level2_categories(parent_category_id)
-            elif level == 3:
-                categories = taxonomy.get_level3_categories(parent_category_id)
-            elif level == 4:
-                categories = taxonomy.get_level4_categories(parent_category_id)
-            elif level == 5:
-                categories = taxonomy.get_level5_categories(parent_category_id)
-            else:
-                    logger.error(f"process_batch: Invalid level {level} requested.")
-                    categories = [] # Should not happen
-        else: # level > 1 and no parent_category_id
-                logger.error(f"process_batch: Parent category ID is required for Level {level} but was not provided.")
-                categories = []
-
-        valid_category_ids = {cat.id for cat in categories}
+        if level < 1 or level > 5:
+            logger.error(f"process_batch: Invalid level {level} requested.")
+        elif level > 1 and not parent_category_id:
+            logger.error(f"process_batch: Parent category ID is required for Level {level} but was not provided.")
+        else:
+            # Precomputed frozenset from the taxonomy index (O(1) lookup)
+            valid_category_ids = taxonomy.get_valid_child_ids(level, parent_category_id)
 
         if not valid_category_ids:
                 if level > 1 and parent_category_id:
@@ -150,15 +226,132 @@ async def process_batch(
                 elif level == 1:
                     logger.error("process_batch: No Level 1 categories found in taxonomy!")
                     category_id_lookup_error = True
-        # else: # Reduced verbosity
-                # logger.debug(f"process_batch: Found {len(valid_category_ids)} valid IDs for Level {level}, Parent '{parent_category_id}'. Example: {list(valid_category_ids)[:5]}")
 
     except Exception as tax_err:
         logger.error(f"process_batch: Error getting valid categories from taxonomy", exc_info=True,
                         extra={"level": level, "parent_category_id": parent_category_id})
-        valid_category_ids = set()
+        valid_category_ids = frozenset()
         category_id_lookup_error = True
 
+    return valid_category_ids, category_id_lookup_error
+
+
+def _validate_classification(
+    classification: Any,
+    level: int,
+    parent_category_id: Optional[str],
+    valid_category_ids: FrozenSet[str],
+    category_id_lookup_error: bool,
+    classification_source: str,
+    stats: Dict[str, Any]
+) -> Optional[Dict[str, Any]]:
+    """
+    Taxonomy validation and consistency checks for one classification returned by the LLM.
+    Returns the vendor's result entry, or None if the item is unusable (not a dict, no vendor_name).
+    """
+    if not isinstance(classification, dict):
+        logger.warning("Invalid classification item format received from LLM (not a dict)", extra={"item": classification})
+        return None
+
+    vendor_name = classification.get("vendor_name")
+    if not vendor_name:
+        logger.warning("Classification received without vendor_name", extra={"classification": classification})
+        return None
+
+    target_vendor_name = vendor_name
+
+    category_id = classification.get("category_id", "N/A")
+    category_name = classification.get("category_name", "N/A")
+    confidence = classification.get("confidence", 0.0)
+    classification_not_possible = classification.get("classification_not_possible", False)
+    reason = classification.get("classification_not_possible_reason")
+    notes = classification.get("notes")
+    is_valid_category = True
+
+    # --- TAXONOMY VALIDATION ---
+    if not classification_not_possible and not category_id_lookup_error and valid_category_ids:
+        if category_id not in valid_category_ids:
+            is_valid_category = False
+            logger.warning(f"Invalid category ID '{category_id}' returned by LLM for vendor '{target_vendor_name}' at level {level}, parent '{parent_category_id}'.",
+                            extra={"valid_ids_count": len(valid_category_ids)})
+            classification_not_possible = True
+            reason = f"Invalid category ID '{category_id}' returned by LLM (Valid examples: {sorted(valid_category_ids)[:3]})"
+            confidence = 0.0
+            category_id = "N/A"
+            category_name = "N/A"
+            stats["invalid_category_errors"] = stats.get("invalid_category_errors", 0) + 1
+        # else: # Reduced verbosity
+                # logger.debug(f"Category ID '{category_id}' for '{target_vendor_name}' is valid for Level {level}, Parent '{parent_category_id}'.")
+    elif not classification_not_possible and category_id_lookup_error:
+            logger.warning(f"Cannot validate category ID '{category_id}' for '{target_vendor_name}' due to earlier taxonomy lookup error.")
+    elif not classification_not_possible and not valid_category_ids and level > 1:
+            logger.warning(f"Cannot validate category ID '{category_id}' for '{target_vendor_name}' because no valid child categories were found for parent '{parent_category_id}'.")
+            is_valid_category = False
+            classification_not_possible = True
+            reason = f"LLM returned category '{category_id}' but no valid children found for parent '{parent_category_id}'."
+            confidence = 0.0
+            category_id = "N/A"; category_name = "N/A"
+            stats["invalid_category_errors"] = stats.get("invalid_category_errors", 0) + 1
+    # --- End TAXONOMY VALIDATION ---
+
+    # --- Consistency Checks ---
+    if classification_not_possible and confidence > 0.0:
+        logger.warning("Correcting confidence to 0.0 for classification_not_possible=true", extra={"vendor": target_vendor_name})
+        confidence = 0.0
+    if not classification_not_possible and is_valid_category and (category_id == "N/A" or not category_id):
+            logger.warning("Classification marked possible by LLM but category ID is 'N/A' or empty", extra={"vendor": target_vendor_name, "classification": classification})
+            classification_not_possible = True
+            reason = reason or "Missing category ID despite LLM success claim"
+            confidence = 0.0
+            category_id = "N/A"
+            category_name = "N/A"
+    # --- End Consistency Checks ---
+
+    return {
+        "category_id": category_id,
+        "category_name": category_name,
+        "confidence": confidence,
+        "classification_not_possible": classification_not_possible,
+        "classification_not_possible_reason": reason,
+        "notes": notes,
+        "vendor_name": target_vendor_name,
+        # --- UPDATED: Use classification_source ---
+        "classification_source": classification_source
+        # --- END UPDATED ---
+    }
+
+
+async def _classify_batch_with_model(
+    batch_data: List[Dict[str, Any]],
+    level: int,
+    parent_category_id: Optional[str],
+    taxonomy: Taxonomy,
+    llm_service: LLMService,
+    stats: Dict[str, Any],
+    search_context: Optional[Dict[str, Any]] = None,
+    model: Optional[str] = None, # None = llm_service.model
+    on_item: Optional[Callable[[Dict[str, Any]], None]] = None
+) -> Dict[str, Dict]:
+    """
+    One LLM call for a batch on `model`, followed by taxonomy validation and consistency checks.
+    Optionally uses search context for post-search classification attempts.
+    Updates stats dictionary in place. Passes full vendor data and context to LLM.
+    Returns results for the batch.
+    """
+    results = {}
+    if not batch_data:
+        logger.warning(f"process_batch called with empty batch_data for Level {level}, Parent '{parent_category_id}'.")
+        return results
+
+    batch_names = [vd.get('vendor_name', f'Unknown_{i}') for i, vd in enumerate(batch_data)] # For logging
+    classification_source = _classification_source(batch_data, search_context) # Determine source
+    context_type = "Search Context" if classification_source == "Search" else "Initial Data"
+
+    logger.info(f"process_batch: Starting Level {level} batch using {context_type}.",
+                extra={"batch_size": len(batch_data), "parent_category_id": parent_category_id, "first_vendor": batch_names[0] if batch_names else 'N/A'})
+
+    valid_category_ids, category_id_lookup_error = _lookup_valid_category_ids(taxonomy, level, parent_category_id)
+
     # --- Call LLM ---
     llm_response_data = None
     try:
@@ -170,16 +363,14 @@ async def process_batch(
                 level=level,
                 taxonomy=taxonomy,
                 parent_category_id=parent_category_id,
-                search_context=search_context
+                search_context=search_context,
+                model=model,
+                on_item=on_item
             )
         logger.info(f"process_batch: LLM call completed for Level {level}, Parent '{parent_category_id or 'None'}'.")
 
         if llm_response_data and isinstance(llm_response_data.get("usage"), dict):
-            usage = llm_response_data["usage"]
-            stats["api_usage"]["openrouter_calls"] += 1
-            stats["api_usage"]["openrouter_prompt_tokens"] += usage.get("prompt_tokens", 0)
-            stats["api_usage"]["openrouter_completion_tokens"] += usage.get("completion_tokens", 0)
-            stats["api_usage"]["openrouter_total_tokens"] += usage.get("total_tokens", 0)
+            record_api_usage(stats, llm_response_data["usage"], llm_response_data.get("model") or model or llm_service.model)
             # logger.debug(f"process_batch: LLM API usage updated", extra=usage) # Reduced verbosity
         else:
             logger.warning("process_batch: LLM response missing or has invalid usage data.")
@@ -205,74 +396,12 @@ async def process_batch(
                 logger.warning("Invalid classification item format received from LLM (not a dict)", extra={"item": classification})
                 continue
 
-            vendor_name = classification.get("vendor_name")
-            if not vendor_name:
-                logger.warning("Classification received without vendor_name", extra={"classification": classification})
+            result = _validate_classification(classification, level, parent_category_id, valid_category_ids,
+                                              category_id_lookup_error, classification_source, stats)
+            if result is None:
                 continue
-
-            target_vendor_name = vendor_name
-            processed_vendors_in_response.add(target_vendor_name)
-
-            category_id = classification.get("category_id", "N/A")
-            category_name = classification.get("category_name", "N/A")
-            confidence = classification.get("confidence", 0.0)
-            classification_not_possible = classification.get("classification_not_possible", False)
-            reason = classification.get("classification_not_possible_reason")
-            notes = classification.get("notes")
-            is_valid_category = True
-
-            # --- TAXONOMY VALIDATION ---
-            if not classification_not_possible and not category_id_lookup_error and valid_category_ids:
-                if category_id not in valid_category_ids:
-                    is_valid_category = False
-                    logger.warning(f"Invalid category ID '{category_id}' returned by LLM for vendor '{target_vendor_name}' at level {level}, parent '{parent_category_id}'.",
-                                    extra={"valid_ids_count": len(valid_category_ids)})
-                    classification_not_possible = True
-                    reason = f"Invalid category ID '{category_id}' returned by LLM (Valid examples: {list(valid_category_ids)[:3]})"
-                    confidence = 0.0
-                    category_id = "N/A"
-                    category_name = "N/A"
-                    stats["invalid_category_errors"] = stats.get("invalid_category_errors", 0) + 1
-                # else: # Reduced verbosity
-                        # logger.debug(f"Category ID '{category_id}' for '{target_vendor_name}' is valid for Level {level}, Parent '{parent_category_id}'.")
-            elif not classification_not_possible and category_id_lookup_error:
-                    logger.warning(f"Cannot validate category ID '{category_id}' for '{target_vendor_name}' due to earlier taxonomy lookup error.")
-            elif not classification_not_possible and not valid_category_ids and level > 1:
-                    logger.warning(f"Cannot validate category ID '{category_id}' for '{target_vendor_name}' because no valid child categories were found for parent '{parent_category_id}'.")
-                    is_valid_category = False
-                    classification_not_possible = True
-                    reason = f"LLM returned category '{category_id}' but no valid children found for parent '{parent_category_id}'."
-                    confidence = 0.0
-                    category_id = "N/A"; category_name = "N/A"
-                    stats["invalid_category_errors"] = stats.get("invalid_category_errors", 0) + 1
-            # --- End TAXONOMY VALIDATION ---
-
-            # --- Consistency Checks ---
-            if classification_not_possible and confidence > 0.0:
-                logger.warning("Correcting confidence to 0.0 for classification_not_possible=true", extra={"vendor": target_vendor_name})
-                confidence = 0.0
-            if not classification_not_possible and is_valid_category and (category_id == "N/A" or not category_id):
-                    logger.warning("Classification marked possible by LLM but category ID is 'N/A' or empty", extra={"vendor": target_vendor_name, "classification": classification})
-                    classification_not_possible = True
-                    reason = reason or "Missing category ID despite LLM success claim"
-                    confidence = 0.0
-                    category_id = "N/A"
-                    category_name = "N/A"
-            # --- End Consistency Checks ---
-
-            results[target_vendor_name] = {
-                "category_id": category_id,
-                "category_name": category_name,
-                "confidence": confidence,
-                "classification_not_possible": classification_not_possible,
-                "classification_not_possible_reason": reason,
-                "notes": notes,
-                "vendor_name": target_vendor_name,
-                # --- UPDATED: Use classification_source ---
-                "classification_source": classification_source
-                # --- END UPDATED ---
-            }
-            # logger.debug(f"process_batch: Processed result for '{target_vendor_name}' at Level {level}. Possible: {not classification_not_possible}, ID: {category_id}") # Reduced verbosity
+            processed_vendors_in_response.add(result["vendor_name"])
+            results[result["vendor_name"]] = result
 
         # Handle missing vendors from batch
         missing_vendors = set(batch_names) - processed_vendors_in_response
@@ -282,7 +411,7 @@ async def process_batch(
                 results[vendor_name] = {
                     "category_id": "N/A", "category_name": "N/A", "confidence": 0.0,
                     "classification_not_possible": True,
-                    "classification_not_possible_reason": "Vendor missing from LLM response batch",
+                    "classification_not_possible_reason": MISSING_VENDOR_REASON,
                     "notes": None,
                     "vendor_name": vendor_name,
                     # --- UPDATED: Use classification_source ---
@@ -311,27 +440,51 @@ async def process_batch(
     return results
 
 
+def _compress_search_results(vendor_data: Dict[str, Any], search_result_data: Dict[str, Any], stats: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    With SEARCH_CONTEXT_COMPRESSION_ENABLED, stores the compressed context (services/context_compressor.py) and
+    the vendor's context tokens before/after on search_result_data, adds them to stats["search_context_tokens"],
+    and returns the context to embed in prompts (the raw search results if compression is off or kept nothing).
+    """
+    if not settings.SEARCH_CONTEXT_COMPRESSION_ENABLED:
+        return search_result_data
+    try:
+        compressed, tokens_before, tokens_after = compress_search_context(vendor_data, search_result_data, settings.SEARCH_CONTEXT_TOKEN_BUDGET)
+    except Exception:
+        logger.error("Search context compression failed; using the raw search results", exc_info=True,
+                     extra={"vendor": vendor_data.get('vendor_name')})
+        return search_result_data
+    search_result_data["compressed_context"] = compressed
+    search_result_data["context_tokens"] = {"before": tokens_before, "after": tokens_after}
+    token_stats = stats.setdefault("search_context_tokens", {"vendors": 0, "before": 0, "after": 0, "uncompressed_vendors": 0})
+    token_stats["vendors"] += 1
+    token_stats["before"] += tokens_before
+    token_stats["after"] += tokens_after
+    if compressed is None:
+        token_stats["uncompressed_vendors"] += 1
+        return search_result_data
+    return compressed
+
+
 @log_function_call(logger, include_args=False)
-async def search_and_classify_recursively(
+async def search_and_classify_level1(
     vendor_data: Dict[str, Any],
     taxonomy: Taxonomy,
     llm_service: LLMService,
     search_service: SearchService,
     stats: Dict[str, Any],
-    semaphore: asyncio.Semaphore,
-    target_level: int # <<< ADDED target_level
+    semaphore: asyncio.Semaphore
 ) -> Dict[str, Any]:
     """
-    Performs Tavily search, attempts L1 classification, and then recursively
-    attempts L2 up to target_level classification using the search context.
+    Performs Tavily search and attempts L1 classification from the search results.
     Controlled by semaphore.
-    Returns the search_result_data dictionary, potentially augmented with
-    classification results (keyed as classification_l1, classification_l2, etc.).
+    Returns the search_result_data dictionary with the L1 result under classification_l1. Levels 2 and up
+    are classified afterwards for all searched vendors together (classify_search_levels).
     """
     vendor_name = vendor_data.get('vendor_name', 'UnknownVendor')
-    logger.debug(f"search_and_classify_recursively: Waiting to acquire semaphore for vendor '{vendor_name}'.")
+    logger.debug(f"search_and_classify_level1: Waiting to acquire semaphore for vendor '{vendor_name}'.")
     async with semaphore: # Limit concurrency
-        logger.info(f"search_and_classify_recursively: Acquired semaphore. Starting for vendor '{vendor_name}' up to Level {target_level}.")
+        logger.info(f"search_and_classify_level1: Acquired semaphore. Starting for vendor '{vendor_name}'.")
         search_result_data = {
             "vendor": vendor_name,
             "search_query": f"{vendor_name} company business type industry",
@@ -348,17 +501,18 @@ async def search_and_classify_recursively(
 
         # --- 1. Perform Tavily Search ---
         try:
-            logger.debug(f"search_and_classify_recursively: Calling search_service.search_vendor for '{vendor_name}'.")
+            logger.debug(f"search_and_classify_level1: Calling search_service.search_vendor for '{vendor_name}'.")
             with LogTimer(logger, f"Tavily search for '{vendor_name}'", include_in_stats=True):
                 tavily_response = await search_service.search_vendor(vendor_name)
-            logger.debug(f"search_and_classify_recursively: search_service.search_vendor returned for '{vendor_name}'.")
+            logger.debug(f"search_and_classify_level1: search_service.search_vendor returned for '{vendor_name}'.")
 
-            stats["api_usage"]["tavily_search_calls"] += 1
+            if tavily_response.get("search_cache", "miss") == "miss": # Cache hits and coalesced searches cost nothing
+                stats["api_usage"]["tavily_search_calls"] += 1
             search_result_data.update(tavily_response) # Update with actual search results or error
 
             source_count = len(search_result_data.get("sources", []))
             if search_result_data.get("error"):
-                logger.warning(f"search_and_classify_recursively: Search failed", extra={"vendor": vendor_name, "error": search_result_data["error"]})
+                logger.warning(f"search_and_classify_level1: Search failed", extra={"vendor": vendor_name, "error": search_result_data["error"]})
                 search_result_data["classification_l1"] = {
                         "classification_not_possible": True,
                         "classification_not_possible_reason": f"Search error: {str(search_result_data['error'])[:100]}",
@@ -367,13 +521,13 @@ async def search_and_classify_recursively(
                         "classification_source": "Search"
                         # --- END UPDATED ---
                 }
-                logger.debug(f"search_and_classify_recursively: Releasing semaphore early due to search error for '{vendor_name}'.")
+                logger.debug(f"search_and_classify_level1: Releasing semaphore early due to search error for '{vendor_name}'.")
                 return search_result_data # Stop if search failed
             else:
-                logger.info(f"search_and_classify_recursively: Search completed", extra={"vendor": vendor_name, "source_count": source_count, "summary_present": bool(search_result_data.get('summary'))})
+                logger.info(f"search_and_classify_level1: Search completed", extra={"vendor": vendor_name, "source_count": source_count, "summary_present": bool(search_result_data.get('summary'))})
 
         except Exception as search_exc:
-            logger.error(f"search_and_classify_recursively: Unexpected error during Tavily search for {vendor_name}", exc_info=True)
+            logger.error(f"search_and_classify_level1: Unexpected error during Tavily search for {vendor_name}", exc_info=True)
             search_result_data["error"] = f"Unexpected search error: {str(search_exc)}"
             search_result_data["classification_l1"] = {
                     "classification_not_possible": True,
@@ -383,13 +537,13 @@ async def search_and_classify_recursively(
                     "classification_source": "Search"
                     # --- END UPDATED ---
                 }
-            logger.debug(f"search_and_classify_recursively: Releasing semaphore early due to search exception for '{vendor_name}'.")
+            logger.debug(f"search_and_classify_level1: Releasing semaphore early due to search exception for '{vendor_name}'.")
             return search_result_data # Stop if search failed
 
         # --- 2. Attempt L1 Classification using Search Results ---
         search_content_available = search_result_data.get("sources") or search_result_data.get("summary")
         if not search_content_available:
-            logger.warning(f"search_and_classify_recursively: No usable search results found for vendor, cannot classify", extra={"vendor": vendor_name})
+            logger.warning(f"search_and_classify_level1: No usable search results found for vendor, cannot classify", extra={"vendor": vendor_name})
             search_result_data["classification_l1"] = {
                     "classification_not_possible": True,
                     "classification_not_possible_reason": "No search results content found",
@@ -398,28 +552,27 @@ async def search_and_classify_recursively(
                     "classification_source": "Search"
                     # --- END UPDATED ---
             }
-            logger.debug(f"search_and_classify_recursively: Releasing semaphore early due to no search content for '{vendor_name}'.")
+            logger.debug(f"search_and_classify_level1: Releasing semaphore early due to no search content for '{vendor_name}'.")
             return search_result_data # Stop if no content
 
+        # Prompts get the deduplicated, ranked sentences; the raw search results are kept for the output
+        prompt_search_context = _compress_search_results(vendor_data, search_result_data, stats)
+
         valid_l1_category_ids: Set[str] = set(taxonomy.categories.keys())
         llm_response_l1 = None
         try:
-            logger.debug(f"search_and_classify_recursively: Calling llm_service.process_search_results (L1) for '{vendor_name}'.")
+            logger.debug(f"search_and_classify_level1: Calling llm_service.process_search_results (L1) for '{vendor_name}'.")
             with LogTimer(logger, f"LLM L1 classification from search for '{vendor_name}'", include_in_stats=True):
                 # This specific function is designed only for L1 from search results
-                llm_response_l1 = await llm_service.process_search_results(vendor_data, search_result_data, taxonomy)
-            logger.debug(f"search_and_classify_recursively: llm_service.process_search_results (L1) returned for '{vendor_name}'.")
+                llm_response_l1 = await llm_service.process_search_results(vendor_data, prompt_search_context, taxonomy)
+            logger.debug(f"search_and_classify_level1: llm_service.process_search_results (L1) returned for '{vendor_name}'.")
 
             if llm_response_l1 is None:
-                    logger.error("search_and_classify_recursively: Received None response from llm_service.process_search_results. Cannot process L1.")
+                    logger.error("search_and_classify_level1: Received None response from llm_service.process_search_results. Cannot process L1.")
                     raise ValueError("LLM service (process_search_results) returned None.")
 
             if isinstance(llm_response_l1.get("usage"), dict):
-                usage = llm_response_l1["usage"]
-                stats["api_usage"]["openrouter_calls"] += 1
-                stats["api_usage"]["openrouter_prompt_tokens"] += usage.get("prompt_tokens", 0)
-                stats["api_usage"]["openrouter_completion_tokens"] += usage.get("completion_tokens", 0)
-                stats["api_usage"]["openrouter_total_tokens"] += usage.get("total_tokens", 0)
+                record_api_usage(stats, llm_response_l1["usage"], llm_response_l1.get("model") or llm_service.model)
 
             l1_classification = llm_response_l1.get("result", {})
             if "vendor_name" not in l1_classification: l1_classification["vendor_name"] = vendor_name
@@ -453,7 +606,7 @@ async def search_and_classify_recursively(
             search_result_data["classification_l1"] = l1_classification # Store validated L1 result
 
         except Exception as llm_err:
-                logger.error(f"search_and_classify_recursively: Error during LLM L1 processing for {vendor_name}", exc_info=True)
+                logger.error(f"search_and_classify_level1: Error during LLM L1 processing for {vendor_name}", exc_info=True)
                 search_result_data["error"] = search_result_data.get("error") or f"LLM L1 processing error: {str(llm_err)}"
                 search_result_data["classification_l1"] = {
                     "classification_not_possible": True,
@@ -463,102 +616,569 @@ async def search_and_classify_recursively(
                     "classification_source": "Search"
                     # --- END UPDATED ---
                 }
-                logger.debug(f"search_and_classify_recursively: Releasing semaphore early due to L1 LLM exception for '{vendor_name}'.")
+                logger.debug(f"search_and_classify_level1: Releasing semaphore early due to L1 LLM exception for '{vendor_name}'.")
                 return search_result_data # Stop if L1 classification failed
 
-        # --- 3. Recursive Classification L2 up to target_level using Search Context ---
-        current_parent_id = search_result_data["classification_l1"].get("category_id")
-        classification_possible = not search_result_data["classification_l1"].get("classification_not_possible", True)
+        logger.info(f"search_and_classify_level1: Finished for vendor", extra={"vendor": vendor_name})
+        logger.debug(f"search_and_classify_level1: Releasing semaphore for vendor '{vendor_name}'.")
+        return search_result_data
+
 
-        # --- UPDATED: Loop up to target_level ---
-        if classification_possible and current_parent_id and current_parent_id != "N/A" and target_level > 1:
-            logger.info(f"search_and_classify_recursively: L1 successful ({current_parent_id}), proceeding to L2-{target_level} for {vendor_name} using search context.")
-            for level in range(2, target_level + 1):
+async def classify_search_levels(
+    search_outputs: Dict[str, Dict[str, Any]],
+    unique_vendors_map: Dict[str, Dict[str, Any]],
+    taxonomy: Taxonomy,
+    llm_service: LLMService,
+    stats: Dict[str, Any],
+    target_level: int,
+    checkpoint: Optional[JobCheckpoint] = None,
+    batch_sizer: Optional[AdaptiveBatchSizer] = None
+) -> None:
+    """
+    Post-search classification of Levels 2 to target_level for every vendor whose search-based Level 1
+    succeeded ({vendor_name: search_and_classify_level1 output}). Runs level by level like the initial
+    barrier walk: vendors are grouped by their previous search-based category and sent in multi-vendor
+    batches, each vendor carrying its own search results as context. Classification stops for a vendor at
+    the first level that is not possible. Results are stored in search_outputs[name]["classification_l{level}"].
+    Levels an output already holds (restored from a checkpoint) are not classified again; with a checkpoint,
+    the updated outputs of every finished batch are recorded. With batch_sizer, batches are packed by estimated
+    prompt tokens (search context included) and their outcomes feed the size adaptation.
+    """
+    # The search-based results in the shape group_by_parent_category expects
+    search_results_by_level: Dict[str, Dict[str, Any]] = {}
+    for vendor_name, search_output in search_outputs.items():
+        if search_output.get("error") or not isinstance(search_output.get("classification_l1"), dict):
+            continue
+        search_results_by_level[vendor_name] = {"level1": search_output["classification_l1"]}
+    vendors_for_level = list(search_results_by_level)
+    search_batch_stats = stats.setdefault("search_level_batches", {})
+
+    for level in range(2, target_level + 1):
+        if not vendors_for_level:
+            break
+        level_key = f"classification_l{level}"
+        vendors_for_next_level: List[str] = []
+        # ERROR results (batch timeout or failure) are classified again, like unrestored levels
+        restored_names = [name for name in vendors_for_level
+                          if isinstance(search_outputs[name].get(level_key), dict) and search_outputs[name][level_key].get("category_id") != "ERROR"]
+        for vendor_name in restored_names:
+            search_results_by_level[vendor_name][f"level{level}"] = search_outputs[vendor_name][level_key]
+            if not search_outputs[vendor_name][level_key].get("classification_not_possible", True):
+                vendors_for_next_level.append(vendor_name)
+        restored_set = set(restored_names)
+        grouped_vendors_names = group_by_parent_category(search_results_by_level, level - 1,
+                                                         [name for name in vendors_for_level if name not in restored_set])
+        level_batches: List[Tuple[Optional[str], List[Dict[str, Any]]]] = []
+        for parent_category_id, group_vendor_names in grouped_vendors_names.items():
+            group_vendor_data = [
+                {**unique_vendors_map.get(name, {'vendor_name': name}),
+                 "search_context": search_outputs[name].get("compressed_context") or
+                                   {"summary": search_outputs[name].get("summary"), "sources": search_outputs[name].get("sources")}}
+                for name in group_vendor_names
+            ]
+            if batch_sizer is not None:
+                group_batch_size, group_max_tokens = batch_sizer.batch_limits(level, parent_category_id)
+                group_batches = create_batches(group_vendor_data, batch_size=group_batch_size, max_tokens=group_max_tokens,
+                                               token_estimator=batch_sizer.vendor_tokens)
+            else:
+                group_batches = create_batches(group_vendor_data, batch_size=settings.BATCH_SIZE)
+            level_batches.extend((parent_category_id, batch_data) for batch_data in group_batches)
+        if not level_batches:
+            vendors_for_level = vendors_for_next_level
+            continue
+        logger.info(f"Post-search Level {level}: {sum(len(batch) for _, batch in level_batches)} vendors in {len(level_batches)} batches "
+                    f"across {len(grouped_vendors_names)} parent categories.")
+        search_batch_stats[f"level{level}"] = {"vendors": sum(len(batch) for _, batch in level_batches), "batches": len(level_batches)}
+
+        def _apply_search_batch_results(parent_category_id: Optional[str], batch_data: List[Dict[str, Any]], batch_results: Dict[str, Dict]):
+            for vendor_data in batch_data:
+                vendor_name = vendor_data.get('vendor_name')
+                level_result = batch_results.get(vendor_name) or {
+                    "classification_not_possible": True,
+                    "classification_not_possible_reason": f"Missing result from L{level} post-search batch",
+                    "confidence": 0.0, "vendor_name": vendor_name, "notes": f"L{level} Error",
+                }
+                level_result["classification_source"] = "Search"
+                search_outputs[vendor_name][level_key] = level_result
+                search_results_by_level[vendor_name][f"level{level}"] = level_result
+                if level_result.get("classification_not_possible", True):
+                    logger.info(f"Post-search classification stopped at Level {level} for {vendor_name}. Reason: {level_result.get('classification_not_possible_reason')}")
+                else:
+                    vendors_for_next_level.append(vendor_name)
+            if checkpoint is not None:
+                checkpoint.record_searches({vd.get('vendor_name'): search_outputs[vd.get('vendor_name')] for vd in batch_data})
+
+        await dispatch_level_batches(
+            level_batches=level_batches,
+            level=level,
+            taxonomy=taxonomy,
+            llm_service=llm_service,
+            stats=stats,
+            on_batch_complete=_apply_search_batch_results,
+            batch_sizer=batch_sizer
+        )
+        vendors_for_level = vendors_for_next_level
+
+
+def _batch_error_results(
+    batch_data: List[Dict[str, Any]],
+    reason: str,
+    classification_source: str = "Initial"
+) -> Dict[str, Dict]:
+    """Builds ERROR classification entries for every vendor in a batch that could not be processed."""
+    error_results: Dict[str, Dict] = {}
+    for vendor_entry in batch_data:
+        vendor_name = vendor_entry.get('vendor_name')
+        if not vendor_name:
+            continue
+        error_results[vendor_name] = {
+            "category_id": "ERROR", "category_name": "ERROR", "confidence": 0.0,
+            "classification_not_possible": True,
+            "classification_not_possible_reason": reason,
+            "vendor_name": vendor_name,
+            "classification_source": classification_source
+        }
+    return error_results
+
+
+def _assigned_depth(results: Dict[str, Dict], vendor_name: str) -> int:
+    """
+    Deepest level N such that levels 1..N already hold successful results before the LLM levels run
+    (assigned by the pre-classifier or the direct path, or restored from a job checkpoint); 0 if none.
+    """
+    depth = 0
+    vendor_results = results.get(vendor_name, {})
+    while True:
+        level_result = vendor_results.get(f"level{depth + 1}")
+        if not isinstance(level_result, dict) or level_result.get("classification_not_possible", True):
+            return depth
+        depth += 1
+
+
+def _store_level_results(
+    results: Dict[str, Dict],
+    level: int,
+    batch_results: Dict[str, Dict],
+    classification_source: str = "Initial"
+) -> Tuple[int, List[str]]:
+    """
+    Writes one batch's classifications into results under 'level{level}'.
+    Returns (number of results stored, names of vendors successfully classified at this level).
+    """
+    level_key = f"level{level}"
+    stored_count = 0
+    successful_names: List[str] = []
+    for vendor_name, classification in batch_results.items():
+        if vendor_name not in results:
+            logger.warning(f"Vendor '{vendor_name}' from batch result not found in main results dictionary.", extra={"level": level})
+            continue
+        if classification.get("category_id") == "ERROR" and level_key in results[vendor_name]:
+            continue # Defensive: never overwrite an existing result with a batch-level error
+        # --- UPDATED: Ensure source is set (process_batch should do this) ---
+        classification["classification_source"] = classification_source
         # --- END UPDATED ---
-                logger.debug(f"Attempting post-search Level {level} for {vendor_name}, parent {current_parent_id}")
-                try:
-                    logger.debug(f"search_and_classify_recursively: Calling process_batch (Level {level}) for '{vendor_name}' with search context.")
-                    # Use process_batch for consistency in validation and structure
-                    # Note: process_batch itself doesn't have an external timeout,
-                    # but the overall search_and_classify_recursively task does (added in process_vendors)
-                    batch_result_dict = await process_batch(
-                        batch_data=[vendor_data], # Batch of one
-                        level=level,
-                        parent_category_id=current_parent_id,
-                        taxonomy=taxonomy,
-                        llm_service=llm_service,
-                        stats=stats,
-                        search_context=search_result_data # Pass the full search results as context
-                    )
-                    logger.debug(f"search_and_classify_recursively: process_batch (Level {level}) returned for '{vendor_name}'.")
+        results[vendor_name][level_key] = classification
+        stored_count += 1
+        if not classification.get("classification_not_possible", True):
+            successful_names.append(vendor_name)
+    return stored_count, successful_names
 
-                    level_result = batch_result_dict.get(vendor_name)
-                    if level_result:
-                        # --- UPDATED: Ensure source is marked (process_batch should already do this) ---
-                        level_result["classification_source"] = "Search"
-                        # --- END UPDATED ---
-                        search_result_data[f"classification_l{level}"] = level_result # Store result
-                        if level_result.get("classification_not_possible", True):
-                            logger.info(f"Post-search classification stopped at Level {level} for {vendor_name}. Reason: {level_result.get('classification_not_possible_reason')}")
-                            break # Stop recursion if classification fails
-                        else:
-                            current_parent_id = level_result.get("category_id") # Update parent for next level
-                            if not current_parent_id or current_parent_id == "N/A":
-                                logger.warning(f"Post-search Level {level} successful but returned invalid parent_id '{current_parent_id}' for {vendor_name}. Stopping recursion.")
-                                break
-                    else:
-                        logger.error(f"Post-search Level {level} batch processing did not return result for {vendor_name}. Stopping recursion.")
-                        search_result_data[f"classification_l{level}"] = {
-                                "classification_not_possible": True,
-                                "classification_not_possible_reason": f"Missing result from L{level} post-search batch",
-                                "confidence": 0.0, "vendor_name": vendor_name, "notes": f"L{level} Error",
-                                # --- UPDATED: Add source ---
-                                "classification_source": "Search"
-                                # --- END UPDATED ---
-                        }
-                        break
-
-                except Exception as recursive_err:
-                    logger.error(f"search_and_classify_recursively: Error during post-search Level {level} for {vendor_name}", exc_info=True)
-                    search_result_data[f"classification_l{level}"] = {
-                            "classification_not_possible": True,
-                            "classification_not_possible_reason": f"L{level} processing error: {str(recursive_err)[:100]}",
-                            "confidence": 0.0, "vendor_name": vendor_name, "notes": f"L{level} Error",
-                            # --- UPDATED: Add source ---
-                            "classification_source": "Search"
-                            # --- END UPDATED ---
-                    }
-                    break # Stop recursion on error
-        else:
-            logger.info(f"search_and_classify_recursively: L1 classification failed or not possible for {vendor_name}, or target level is 1. Skipping L2-{target_level}.")
 
-        logger.info(f"search_and_classify_recursively: Finished for vendor", extra={"vendor": vendor_name})
-        logger.debug(f"search_and_classify_recursively: Releasing semaphore for vendor '{vendor_name}'.")
-        return search_result_data
+def _salvage_streamed_results(
+    received: Dict[str, Dict[str, Any]],
+    batch_names: List[str],
+    level: int,
+    parent_category_id: Optional[str],
+    taxonomy: Taxonomy,
+    stats: Dict[str, Any],
+    classification_source: str = "Initial"
+) -> Dict[str, Dict]:
+    """Validates the classifications a streamed batch delivered before it timed out."""
+    wanted = set(batch_names)
+    valid_category_ids, category_id_lookup_error = _lookup_valid_category_ids(taxonomy, level, parent_category_id)
+    salvaged: Dict[str, Dict] = {}
+    for vendor_name, classification in received.items():
+        if vendor_name not in wanted:
+            continue
+        result = _validate_classification(classification, level, parent_category_id, valid_category_ids,
+                                          category_id_lookup_error, classification_source, stats)
+        if result is not None:
+            salvaged[vendor_name] = result
+    stats.setdefault("streaming", {"salvaged_vendors": 0, "retried_vendors": 0, "retry_batches": 0})["salvaged_vendors"] += len(salvaged)
+    return salvaged
 
 
-@log_function_call(logger, include_args=False) # Keep args=False
-async def process_vendors(
-    unique_vendors_map: Dict[str, Dict[str, Any]], # Pass map containing full vendor data
+def _needs_stream_retry(result: Optional[Dict[str, Any]]) -> bool:
+    """Vendor got no answer from a partially successful streamed batch (timed out before it, or left out)."""
+    if not result:
+        return True
+    return result.get("category_id") == "ERROR" or result.get("classification_not_possible_reason") == MISSING_VENDOR_REASON
+
+
+async def _run_level_batch(
+    batch_data: List[Dict[str, Any]],
+    level: int,
+    parent_category_id: Optional[str],
+    taxonomy: Taxonomy,
+    llm_service: LLMService,
+    stats: Dict[str, Any],
+    batch_sizer: Optional[AdaptiveBatchSizer] = None
+) -> Dict[str, Dict]:
+    """
+    Runs a single classification batch (initial, or post-search with per-vendor search context) with
+    BATCH_PROCESSING_TIMEOUT applied.
+    Never raises: timeouts and unexpected errors are converted into ERROR results for the batch.
+    The outcome and latency are reported to batch_sizer, if given.
+
+    With LLM_STREAMING_ENABLED, classifications received before a timeout are kept, and if part of the batch
+    was answered, only the vendors without an answer are sent again (once).
+    """
+    batch_names = [vd.get('vendor_name') for vd in batch_data]
+    classification_source = _classification_source(batch_data)
+    batch_start_time = time.monotonic()
+    streaming = settings.LLM_STREAMING_ENABLED
+    received: Dict[str, Dict[str, Any]] = {} # vendor_name -> latest streamed classification
+
+    def _on_item(classification: Dict[str, Any]) -> None:
+        if isinstance(classification, dict) and classification.get("vendor_name"):
+            received[classification["vendor_name"]] = classification
+
+    try:
+        logger.debug(f"Calling process_batch with timeout {BATCH_PROCESSING_TIMEOUT}s")
+        batch_results = await asyncio.wait_for(
+            process_batch(batch_data, level, parent_category_id, taxonomy, llm_service, stats, search_context=None,
+                          on_item=_on_item if streaming else None),
+            timeout=BATCH_PROCESSING_TIMEOUT
+        )
+    except asyncio.TimeoutError:
+        logger.error(f"Timeout processing Level {level} batch for parent '{parent_category_id or 'None'}' after {BATCH_PROCESSING_TIMEOUT}s.",
+                     extra={"batch_vendors": batch_names, "streamed_results": len(received)})
+        batch_results = _batch_error_results(batch_data, f"Batch processing timed out after {BATCH_PROCESSING_TIMEOUT}s", classification_source)
+        if received:
+            batch_results.update(_salvage_streamed_results(received, batch_names, level, parent_category_id, taxonomy, stats,
+                                                           classification_source))
+    except Exception as batch_error:
+        logger.error(f"Error during initial batch processing logic (Level {level}, parent '{parent_category_id or 'None'}')", exc_info=True,
+                     extra={"batch_vendors": batch_names, "error": str(batch_error)})
+        batch_results = _batch_error_results(batch_data, f"Batch processing logic error: {str(batch_error)[:100]}", classification_source)
+    if batch_sizer is not None:
+        batch_sizer.record_batch(level, len(batch_data), batch_results, time.monotonic() - batch_start_time)
+
+    if streaming:
+        retry_batch = [vd for vd in batch_data if _needs_stream_retry(batch_results.get(vd.get('vendor_name')))]
+        if retry_batch and len(retry_batch) < len(batch_data):
+            logger.info(f"Retrying {len(retry_batch)}/{len(batch_data)} unanswered vendors of a partially streamed Level {level} batch.",
+                        extra={"parent_category_id": parent_category_id})
+            streaming_stats = stats.setdefault("streaming", {"salvaged_vendors": 0, "retried_vendors": 0, "retry_batches": 0})
+            streaming_stats["retried_vendors"] += len(retry_batch)
+            streaming_stats["retry_batches"] += 1
+            try:
+                retry_results = await asyncio.wait_for(
+                    process_batch(retry_batch, level, parent_category_id, taxonomy, llm_service, stats, search_context=None),
+                    timeout=BATCH_PROCESSING_TIMEOUT
+                )
+                batch_results.update({name: result for name, result in retry_results.items() if name in batch_results})
+            except Exception as retry_error: # Includes the timeout: the vendors keep their first-attempt results
+                logger.error(f"Retry of unanswered Level {level} vendors failed", extra={"error": str(retry_error)[:200] or type(retry_error).__name__})
+    return batch_results
+
+
+async def dispatch_level_batches(
+    level_batches: List[Tuple[Optional[str], List[Dict[str, Any]]]],
+    level: int,
+    taxonomy: Taxonomy,
+    llm_service: LLMService,
+    stats: Dict[str, Any],
+    on_batch_complete: Callable[[Optional[str], List[Dict[str, Any]], Dict[str, Dict]], None],
+    max_in_flight: Optional[int] = None,
+    batch_sizer: Optional[AdaptiveBatchSizer] = None
+) -> None:
+    """
+    Bounded-concurrency dispatcher for all batches of one classification level (across all parent groups).
+
+    A fixed pool of `max_in_flight` workers pulls (parent_category_id, batch_data) items in order and
+    runs them through process_batch. `on_batch_complete` is a synchronous callback invoked on the event
+    loop for every finished batch, so result/stat/progress writes never interleave. Each vendor belongs
+    to exactly one batch per level, so the final state does not depend on completion order.
+
+    Batches are built before dispatch with the batch_sizer limits of that moment. If the sizer shrinks the
+    level while batches are queued, a worker splits an oversized batch when it picks it up and re-queues the
+    remainder. Growth only applies to batches built later (the next level, or the next job).
+    """
+    if not level_batches:
+        return
+    level_batches = list(level_batches) # Work queue; re-split batches are inserted into it
+    max_in_flight = max_in_flight or settings.MAX_CONCURRENT_BATCHES
+    if max_in_flight <= 0:
+        logger.warning(f"Invalid MAX_CONCURRENT_BATCHES {max_in_flight}, falling back to sequential dispatch.")
+        max_in_flight = 1
+    worker_count = min(max_in_flight, len(level_batches))
+    next_batch_index = 0
+
+    async def _worker(worker_id: int):
+        nonlocal next_batch_index
+        while next_batch_index < len(level_batches):
+            batch_index = next_batch_index
+            next_batch_index += 1
+            parent_category_id, batch_data = level_batches[batch_index]
+            if batch_sizer is not None:
+                current_size = batch_sizer.current_size(level)
+                if len(batch_data) > current_size:
+                    batch_data, remainder = batch_data[:current_size], batch_data[current_size:]
+                    level_batches.insert(next_batch_index, (parent_category_id, remainder))
+                    batch_sizer.stats["resplit_batches"] += 1
+                    logger.info(f"Level {level}: batch size shrank to {current_size}; re-queued {len(remainder)} vendors of a queued batch.",
+                                extra={"parent_category_id": parent_category_id})
+            logger.info(f"Processing Level {level} batch {batch_index + 1}/{len(level_batches)} for parent '{parent_category_id or 'None'}'",
+                        extra={"batch_size": len(batch_data), "first_vendor": batch_data[0].get('vendor_name') if batch_data else 'N/A', "worker_id": worker_id})
+            batch_results = await _run_level_batch(batch_data, level, parent_category_id, taxonomy, llm_service, stats, batch_sizer)
+            try:
+                on_batch_complete(parent_category_id, batch_data, batch_results)
+            except Exception:
+                logger.error(f"Error applying Level {level} batch results for parent '{parent_category_id or 'None'}'", exc_info=True)
+
+    logger.info(f"Level {level}: Dispatching {len(level_batches)} batches with {worker_count} concurrent workers (limit {max_in_flight}).")
+    dispatch_start_time = time.monotonic()
+    await asyncio.gather(*(_worker(i) for i in range(worker_count)))
+    logger.info(f"Level {level}: All {len(level_batches)} batches completed in {time.monotonic() - dispatch_start_time:.3f}s.")
+
+
+def load_confirmed_documents(db: Session, job: Job) -> List[Tuple[str, str, Optional[str]]]:
+    """
+    Confirmed (review-merged) vendor classifications from the user's most recent completed classification
+    jobs, newest first, one per vendor name, capped at PRECLASSIFIER_MAX_EXEMPLARS.
+    """
+    if settings.PRECLASSIFIER_EXEMPLAR_JOBS <= 0:
+        return []
+    try:
+        previous_jobs = (
+            db.query(Job)
+            .filter(Job.created_by == job.created_by, Job.id != job.id,
+                    Job.job_type == JobType.CLASSIFICATION.value, Job.status == JobStatus.COMPLETED.value)
+            .order_by(Job.completed_at.desc())
+            .limit(settings.PRECLASSIFIER_EXEMPLAR_JOBS)
+            .all()
+        )
+    except SQLAlchemyError:
+        logger.error("Failed to load previous jobs for pre-classifier exemplars", exc_info=True)
+        db.rollback()
+        return []
+    try:
+        # Review-confirmed rows only, through the (job_id, classification_source) index
+        confirmed_by_job = get_results_by_source(db, [previous_job.id for previous_job in previous_jobs], "Review")
+    except SQLAlchemyError:
+        logger.error("Failed to load review-confirmed results for pre-classifier exemplars", exc_info=True)
+        db.rollback()
+        return []
+    documents: List[Tuple[str, str, Optional[str]]] = []
+    seen_names: Set[str] = set()
+    for previous_job in previous_jobs:
+        # Jobs completed before job_result_items keep their results in detailed_results
+        job_results = confirmed_by_job.get(previous_job.id) or previous_job.detailed_results or []
+        for document in confirmed_documents_from_results(job_results):
+            if document[0] in seen_names:
+                continue
+            seen_names.add(document[0])
+            documents.append(document)
+            if len(documents) >= settings.PRECLASSIFIER_MAX_EXEMPLARS:
+                return documents
+    return documents
+
+
+def preclassify_vendors(
+    unique_vendors_map: Dict[str, Dict[str, Any]],
     taxonomy: Taxonomy,
     results: Dict[str, Dict],
     stats: Dict[str, Any],
     job: Job,
     db: Session,
+    target_level: int
+) -> int:
+    """
+    Assigns Level 1 (and Level 2) directly for vendors the TF-IDF pre-classifier is confident about,
+    tagged classification_source="Embedding". The LLM levels skip those assignments. Returns the number of
+    vendors pre-classified. Failures are logged and leave every vendor to the LLM.
+    """
+    with LogTimer(logger, "TF-IDF pre-classification", include_in_stats=True):
+        try:
+            confirmed = load_confirmed_documents(db, job)
+            preclassifier = TfidfPreClassifier(taxonomy, confirmed)
+            assigned = preclassifier.classify(list(unique_vendors_map.values()), max_level=min(target_level, settings.PRECLASSIFIER_MAX_LEVEL))
+        except Exception as pre_err:
+            logger.error("Pre-classification failed; all vendors go to the LLM", exc_info=True, extra={"error": str(pre_err)})
+            stats["preclassifier"] = {"error": str(pre_err)[:200]}
+            return 0
+
+    level_counts = {1: 0, 2: 0}
+    for vendor_name, levels in assigned.items():
+        if vendor_name not in results or "level1" in results[vendor_name]:
+            continue # Unknown, or already restored from a checkpoint
+        for level, classification in levels.items():
+            results[vendor_name][f"level{level}"] = classification
+            level_counts[level] = level_counts.get(level, 0) + 1
+    stats["preclassifier"] = {**preclassifier.stats, "vendors": len(unique_vendors_map),
+                              "assigned_level1": level_counts[1], "assigned_level2": level_counts[2],
+                              "threshold": settings.PRECLASSIFIER_SIMILARITY_THRESHOLD}
+    logger.info(f"Pre-classifier assigned {level_counts[1]}/{len(unique_vendors_map)} vendors at Level 1 and {level_counts[2]} at Level 2.",
+                extra=stats["preclassifier"])
+    return level_counts[1]
+
+
+def validate_direct_path(
+    classification: Dict[str, Any],
+    taxonomy: Taxonomy,
+    target_level: int,
+    required_prefix: Tuple[str, ...] = ()
+) -> Tuple[Optional[Tuple[str, ...]], str]:
+    """
+    Checks one direct-path answer against the taxonomy. Returns (path, "accepted") or (None, reason) with reason
+    "not_possible", "invalid_path" (unknown ID, wrong depth, broken ancestry, or contradicts the already assigned
+    levels) or "low_confidence" (below DIRECT_PATH_MIN_CONFIDENCE).
+    """
+    if classification.get("classification_not_possible"):
+        return None, "not_possible"
+    parts = tuple(part.strip() for part in str(classification.get("category_path") or "").split(".") if part.strip())
+    path = taxonomy.get_category_path(parts[-1]) if parts else ()
+    # A bare leaf ID or a partial path is fine as long as it matches the leaf's real ancestry
+    if len(path) != target_level or path[-len(parts):] != parts or path[:len(required_prefix)] != required_prefix:
+        return None, "invalid_path"
+    try:
+        confidence = float(classification.get("confidence") or 0.0)
+    except (TypeError, ValueError):
+        confidence = 0.0
+    if confidence < settings.DIRECT_PATH_MIN_CONFIDENCE:
+        return None, "low_confidence"
+    return path, "accepted"
+
+
+@log_function_call(logger, include_args=False)
+async def classify_direct_paths(
+    unique_vendors_map: Dict[str, Dict[str, Any]],
+    taxonomy: Taxonomy,
+    results: Dict[str, Dict],
+    stats: Dict[str, Any],
     llm_service: LLMService,
-    search_service: SearchService,
-    target_level: int # <<< ADDED target_level
-):
+    target_level: int,
+    checkpoint: Optional[JobCheckpoint] = None
+) -> int:
     """
-    Main orchestration function for processing vendors through the classification workflow (up to target_level),
-    including recursive search for unknowns (up to target_level). Updates results and stats dictionaries in place.
+    Direct-path pass before the level walk: for every vendor not yet classified to target_level, the path
+    retriever picks the DIRECT_PATH_TOP_K most similar target-level categories and one LLM call per batch
+    chooses the full Level 1..target_level path among them. Paths that validate (validate_direct_path) are
+    written to `results` as levels 1..target_level with classification_source="Initial", so the level walk
+    skips those vendors; everyone else falls back to it unchanged. Returns the number of vendors accepted.
     """
-    unique_vendor_names = list(unique_vendors_map.keys()) # Get names from map
-    total_unique_vendors = len(unique_vendor_names)
-    processed_count = 0 # Count unique vendors processed in batches
+    direct_stats = {"top_k": settings.DIRECT_PATH_TOP_K, "min_confidence": settings.DIRECT_PATH_MIN_CONFIDENCE,
+                    "vendors_attempted": 0, "no_candidates": 0, "batches": 0, "batch_errors": 0, "accepted": 0,
+                    "not_possible": 0, "invalid_path": 0, "low_confidence": 0, "missing": 0, "outside_candidates": 0}
+    stats["direct_path"] = direct_stats
+    if target_level < 2:
+        return 0 # Level 1 alone is a single call anyway
+
+    vendors: List[Dict[str, Any]] = []
+    prefixes: Dict[str, Tuple[str, ...]] = {}
+    for vendor_name, vendor_data in unique_vendors_map.items():
+        depth = _assigned_depth(results, vendor_name)
+        if depth >= target_level or f"level{depth + 1}" in results.get(vendor_name, {}):
+            continue # Done, or stopped by an earlier result (pre-classifier or checkpoint)
+        vendors.append(vendor_data)
+        if depth:
+            prefixes[vendor_name] = tuple(results[vendor_name][f"level{level}"]["category_id"] for level in range(1, depth + 1))
+    if not vendors:
+        return 0
+
+    with LogTimer(logger, "Direct path candidate retrieval", include_in_stats=True):
+        try:
+            candidates = TfidfPathRetriever(taxonomy, target_level).candidates(vendors, settings.DIRECT_PATH_TOP_K, prefixes)
+        except Exception as retrieval_err:
+            logger.error("Direct path candidate retrieval failed; all vendors walk the levels", exc_info=True)
+            direct_stats["error"] = str(retrieval_err)[:200]
+            return 0
+    with_candidates = [vd for vd in vendors if candidates.get(vd.get("vendor_name"))]
+    direct_stats["no_candidates"] = len(vendors) - len(with_candidates)
+    direct_stats["vendors_attempted"] = len(with_candidates)
+    batches = create_batches(with_candidates, batch_size=max(1, settings.DIRECT_PATH_BATCH_SIZE))
+    direct_stats["batches"] = len(batches)
+    semaphore = asyncio.Semaphore(max(1, settings.MAX_CONCURRENT_BATCHES))
+    logger.info(f"Direct path: {len(with_candidates)} vendors in {len(batches)} batches (Level {target_level}, top {settings.DIRECT_PATH_TOP_K} candidates).")
+
+    def _apply(batch_data: List[Dict[str, Any]], llm_result: Dict[str, Any]) -> None:
+        answers = {c.get("vendor_name"): c for c in llm_result.get("classifications") or [] if isinstance(c, dict)}
+        level_results: Dict[int, Dict[str, Dict]] = {}
+        for vendor_data in batch_data:
+            vendor_name = vendor_data["vendor_name"]
+            classification = answers.get(vendor_name)
+            if classification is None:
+                direct_stats["missing"] += 1
+                continue
+            prefix = prefixes.get(vendor_name, ())
+            path, outcome = validate_direct_path(classification, taxonomy, target_level, prefix)
+            direct_stats[outcome] += 1
+            if path is None:
+                continue
+            if path not in candidates.get(vendor_name, []):
+                direct_stats["outside_candidates"] += 1
+            confidence = round(float(classification.get("confidence") or 0.0), 3)
+            for level in range(len(prefix) + 1, target_level + 1):
+                level_result = {
+                    "category_id": path[level - 1],
+                    "category_name": taxonomy.get_category_name(path[level - 1]) or "N/A",
+                    "confidence": confidence,
+                    "classification_not_possible": False,
+                    "classification_not_possible_reason": None,
+                    "notes": classification.get("notes") if level == target_level else "Assigned by direct path classification",
+                    "vendor_name": vendor_name,
+                    "classification_source": "Initial"
+                }
+                results[vendor_name][f"level{level}"] = level_result
+                level_results.setdefault(level, {})[vendor_name] = level_result
+        if checkpoint is not None:
+            for level, batch_results in level_results.items():
+                checkpoint.record_level_results(level, batch_results)
+
+    async def _run(batch_data: List[Dict[str, Any]]) -> None:
+        batch_candidates = {vd["vendor_name"]: candidates[vd["vendor_name"]] for vd in batch_data}
+        async with semaphore:
+            try:
+                response = await asyncio.wait_for(
+                    llm_service.classify_direct_path(batch_data, batch_candidates, taxonomy, target_level),
+                    timeout=BATCH_PROCESSING_TIMEOUT
+                )
+            except Exception as batch_err: # Includes timeouts and exhausted retries: the vendors just walk the levels
+                logger.warning(f"Direct path batch failed; {len(batch_data)} vendors fall back to the level walk",
+                               extra={"error": str(batch_err)[:200]})
+                direct_stats["batch_errors"] += 1
+                return
+        if isinstance(response.get("usage"), dict):
+            record_api_usage(stats, response["usage"], response.get("model") or llm_service.model)
+        _apply(batch_data, response.get("result") or {})
+
+    with LogTimer(logger, f"Direct path classification (Level {target_level})", include_in_stats=True):
+        await asyncio.gather(*(_run(batch_data) for batch_data in batches))
+    logger.info(f"Direct path accepted {direct_stats['accepted']}/{len(with_candidates)} vendors; the rest walk the levels.",
+                extra=direct_stats)
+    return direct_stats["accepted"]
 
-    logger.info(f"Starting classification loop for {total_unique_vendors} unique vendors up to target Level {target_level}.")
 
+@log_function_call(logger, include_args=False)
+async def classify_levels_barrier(
+    unique_vendors_map: Dict[str, Dict[str, Any]],
+    taxonomy: Taxonomy,
+    results: Dict[str, Dict],
+    stats: Dict[str, Any],
+    job: Job,
+    db: Session,
+    llm_service: LLMService,
+    target_level: int,
+    batch_sizer: Optional[AdaptiveBatchSizer] = None,
+    checkpoint: Optional[JobCheckpoint] = None
+) -> Tuple[int, int]:
+    """
+    Level-by-level initial classification (Levels 1 to target_level). Every batch of a level must finish
+    before the survivors are regrouped by parent and the next level starts.
+    Updates results in place. Returns (initial_l4_success_count, initial_l5_success_count).
+    """
+    unique_vendor_names = list(unique_vendors_map.keys())
     # --- Initial Hierarchical Classification (Levels 1 to target_level) ---
     vendors_to_process_next_level_names = set(unique_vendor_names) # Start with all unique vendor names for Level 1
     initial_l4_success_count = 0 # Track L4 for stats
@@ -573,6 +1193,19 @@ async def process_vendors(
 
         current_vendors_for_this_level = list(vendors_to_process_next_level_names) # Copy names for processing this level
         vendors_successfully_classified_in_level_names = set() # Track vendors that pass this level
+        # Vendors that already have a result at this level (pre-classifier or checkpoint) skip the LLM:
+        # successful ones go straight to the next level, the others stop here.
+        preassigned_names = [name for name in current_vendors_for_this_level if f"level{level}" in results.get(name, {})]
+        if preassigned_names:
+            preassigned_successes = [name for name in preassigned_names if _assigned_depth(results, name) >= level]
+            vendors_successfully_classified_in_level_names.update(preassigned_successes)
+            if level == 4:
+                initial_l4_success_count += len(preassigned_successes)
+            if level == 5:
+                initial_l5_success_count += len(preassigned_successes)
+            skip = set(preassigned_names)
+            current_vendors_for_this_level = [name for name in current_vendors_for_this_level if name not in skip]
+            logger.info(f"Level {level}: {len(preassigned_names)} vendors already have a result (pre-classified or restored); skipping LLM for them.")
 
         stage_enum_name = f"CLASSIFICATION_L{level}"
         if hasattr(ProcessingStage, stage_enum_name):
@@ -607,111 +1240,57 @@ async def process_vendors(
 
         processed_in_level_count = 0
         batch_counter_for_level = 0
-        total_batches_for_level = sum( (len(names) + settings.BATCH_SIZE - 1) // settings.BATCH_SIZE for names in grouped_vendors_names.values() )
-        logger.info(f"Level {level}: Total batches to process: {total_batches_for_level}")
-
+        level_batches: List[Tuple[Optional[str], List[Dict[str, Any]]]] = []
         for parent_category_id, group_vendor_names in grouped_vendors_names.items():
             if not group_vendor_names:
                 logger.debug(f"Skipping empty group for parent '{parent_category_id}' at Level {level}.")
                 continue
-
-            logger.info(f"Processing Level {level} group",
-                        extra={"parent_category_id": parent_category_id, "vendor_count": len(group_vendor_names)})
-
             group_vendor_data = [unique_vendors_map[name] for name in group_vendor_names if name in unique_vendors_map]
-            level_batches_data = create_batches(group_vendor_data, batch_size=settings.BATCH_SIZE)
-            logger.debug(f"Created {len(level_batches_data)} batches for group '{parent_category_id}' at Level {level}.")
-
-            for i, batch_data in enumerate(level_batches_data):
-                batch_counter_for_level += 1
-                batch_names = [vd['vendor_name'] for vd in batch_data] # Get names for logging
-                logger.info(f"Processing Level {level} batch {i+1}/{len(level_batches_data)} for parent '{parent_category_id or 'None'}'",
-                            extra={"batch_size": len(batch_data), "first_vendor": batch_names[0] if batch_names else 'N/A', "batch_num": batch_counter_for_level, "total_batches": total_batches_for_level})
-                try:
-                    # --- MODIFICATION: Added asyncio.wait_for ---
-                    logger.debug(f"Calling process_batch with timeout {BATCH_PROCESSING_TIMEOUT}s")
-                    batch_results = await asyncio.wait_for(
-                        process_batch(batch_data, level, parent_category_id, taxonomy, llm_service, stats, search_context=None),
-                        timeout=BATCH_PROCESSING_TIMEOUT
-                    )
-                    # --- END MODIFICATION ---
-                    logger.debug(f"Level {level} batch {i+1} results received. Count: {len(batch_results)}.")
+            if batch_sizer is not None:
+                group_batch_size, group_max_tokens = batch_sizer.batch_limits(level, parent_category_id)
+                group_batches = create_batches(group_vendor_data, batch_size=group_batch_size, max_tokens=group_max_tokens,
+                                               token_estimator=batch_sizer.vendor_tokens)
+            else:
+                group_batches = create_batches(group_vendor_data, batch_size=settings.BATCH_SIZE)
+            logger.debug(f"Created {len(group_batches)} batches for group '{parent_category_id}' ({len(group_vendor_names)} vendors) at Level {level}.")
+            level_batches.extend((parent_category_id, batch_data) for batch_data in group_batches)
+        total_batches_for_level = len(level_batches)
+        logger.info(f"Level {level}: Total batches to process: {total_batches_for_level}")
 
-                    for vendor_name, classification in batch_results.items():
-                        if vendor_name in results:
-                            # --- UPDATED: Ensure source is set (process_batch should do this) ---
-                            classification["classification_source"] = "Initial"
-                            # --- END UPDATED ---
-                            results[vendor_name][f"level{level}"] = classification
-                            processed_in_level_count += 1
-
-                            if not classification.get("classification_not_possible", True):
-                                vendors_successfully_classified_in_level_names.add(vendor_name)
-                                # logger.debug(f"Vendor '{vendor_name}' successfully classified at Level {level} (ID: {classification.get('category_id')}). Added for L{level+1}.") # Reduced verbosity
-                                # Update stats based on the actual level completed
-                                if level == 4:
-                                    initial_l4_success_count += 1
-                                    # logger.debug(f"Incremented initial_l4_success_count for {vendor_name}. Current L4 count: {initial_l4_success_count}") # Reduced verbosity
-                                if level == 5:
-                                    initial_l5_success_count += 1
-                                    # logger.debug(f"Incremented initial_l5_success_count for {vendor_name}. Current L5 count: {initial_l5_success_count}") # Reduced verbosity
-                            # else: # Reduced verbosity
-                                # logger.debug(f"Vendor '{vendor_name}' not successfully classified at Level {level}. Reason: {classification.get('classification_not_possible_reason', 'Unknown')}. Will not proceed.")
-                        else:
-                                logger.warning(f"Vendor '{vendor_name}' from batch result not found in main results dictionary.", extra={"level": level})
-
-                # --- MODIFICATION: Catch asyncio.TimeoutError specifically ---
-                except asyncio.TimeoutError:
-                    logger.error(f"Timeout processing Level {level} batch {i+1} for parent '{parent_category_id or 'None'}' after {BATCH_PROCESSING_TIMEOUT}s.",
-                                 extra={"batch_vendors": batch_names})
-                    # Mark all vendors in this batch as failed due to timeout
-                    for vendor_name in batch_names:
-                        if vendor_name in results:
-                            # Only add error if not already processed (shouldn't happen with timeout, but defensive)
-                            if f"level{level}" not in results[vendor_name]:
-                                results[vendor_name][f"level{level}"] = {
-                                    "category_id": "ERROR", "category_name": "ERROR", "confidence": 0.0,
-                                    "classification_not_possible": True,
-                                    "classification_not_possible_reason": f"Batch processing timed out after {BATCH_PROCESSING_TIMEOUT}s",
-                                    "vendor_name": vendor_name,
-                                    # --- UPDATED: Add source ---
-                                    "classification_source": "Initial"
-                                    # --- END UPDATED ---
-                                }
-                                processed_in_level_count += 1 # Count as processed (though failed)
-                        else:
-                            logger.warning(f"Vendor '{vendor_name}' from timed-out batch not found in main results dictionary.", extra={"level": level})
-                # --- END MODIFICATION ---
-
-                except Exception as batch_error:
-                    logger.error(f"Error during initial batch processing logic (Level {level}, parent '{parent_category_id or 'None'}')", exc_info=True,
-                                    extra={"batch_vendors": batch_names, "error": str(batch_error)})
-                    for vendor_name in batch_names:
-                            if vendor_name in results:
-                                if f"level{level}" not in results[vendor_name]:
-                                    results[vendor_name][f"level{level}"] = {
-                                        "category_id": "ERROR", "category_name": "ERROR", "confidence": 0.0,
-                                        "classification_not_possible": True,
-                                        "classification_not_possible_reason": f"Batch processing logic error: {str(batch_error)[:100]}",
-                                        "vendor_name": vendor_name,
-                                        # --- UPDATED: Add source ---
-                                        "classification_source": "Initial"
-                                        # --- END UPDATED ---
-                                    }
-                                    processed_in_level_count += 1
-                            else:
-                                logger.warning(f"Vendor '{vendor_name}' from failed batch not found in main results dictionary.", extra={"level": level})
-
-
-                # Update progress within the level (based on batches completed)
-                level_progress_fraction = batch_counter_for_level / total_batches_for_level if total_batches_for_level > 0 else 1
-                job.progress = min(0.8, 0.1 + ((level - 1) * progress_per_level) + (progress_per_level * level_progress_fraction))
-                try:
-                    # logger.info(f"[process_vendors] Committing progress update after batch {batch_counter_for_level}/{total_batches_for_level} (Level {level}): {job.progress:.3f}") # Reduced verbosity
-                    db.commit()
-                except Exception as db_err:
-                        logger.error("Failed to commit progress update during batch processing", exc_info=True)
-                        db.rollback()
+        def _apply_batch_results(parent_category_id: Optional[str], batch_data: List[Dict[str, Any]], batch_results: Dict[str, Dict]):
+            nonlocal processed_in_level_count, batch_counter_for_level, initial_l4_success_count, initial_l5_success_count
+            batch_counter_for_level += 1
+            logger.debug(f"Level {level} batch {batch_counter_for_level}/{total_batches_for_level} results received. Count: {len(batch_results)}.")
+
+            stored_count, successful_names = _store_level_results(results, level, batch_results, classification_source="Initial")
+            if checkpoint is not None:
+                checkpoint.record_level_results(level, batch_results)
+            processed_in_level_count += stored_count
+            vendors_successfully_classified_in_level_names.update(successful_names)
+            # Update stats based on the actual level completed
+            if level == 4:
+                initial_l4_success_count += len(successful_names)
+            if level == 5:
+                initial_l5_success_count += len(successful_names)
+
+            # Update progress within the level (based on batches completed)
+            level_progress_fraction = batch_counter_for_level / total_batches_for_level if total_batches_for_level > 0 else 1
+            job.progress = min(0.8, 0.1 + ((level - 1) * progress_per_level) + (progress_per_level * level_progress_fraction))
+            try:
+                db.commit()
+            except Exception:
+                logger.error("Failed to commit progress update during batch processing", exc_info=True)
+                db.rollback()
+
+        await dispatch_level_batches(
+            level_batches=level_batches,
+            level=level,
+            taxonomy=taxonomy,
+            llm_service=llm_service,
+            stats=stats,
+            on_batch_complete=_apply_batch_results,
+            batch_sizer=batch_sizer
+        )
 
         logger.info(f"===== Initial Level {level} Classification Completed =====")
         logger.info(f"  Processed {processed_in_level_count} vendor results at Level {level}.")
@@ -719,7 +1298,243 @@ async def process_vendors(
         # logger.debug(f"Vendors proceeding to Level {level+1}: {list(vendors_successfully_classified_in_level_names)[:10]}...") # Reduced verbosity
         vendors_to_process_next_level_names = vendors_successfully_classified_in_level_names
 
-    # --- End of Initial Level Loop ---
+    return initial_l4_success_count, initial_l5_success_count
+
+
+@log_function_call(logger, include_args=False)
+async def classify_levels_pipelined(
+    unique_vendors_map: Dict[str, Dict[str, Any]],
+    taxonomy: Taxonomy,
+    results: Dict[str, Dict],
+    stats: Dict[str, Any],
+    job: Job,
+    db: Session,
+    llm_service: LLMService,
+    target_level: int,
+    batch_sizer: Optional[AdaptiveBatchSizer] = None,
+    checkpoint: Optional[JobCheckpoint] = None
+) -> Tuple[int, int]:
+    """
+    Pipelined initial classification (Levels 1 to target_level) without a per-level barrier.
+    Each vendor advances as soon as its own batch returns. Vendors that share a parent are micro-batched
+    into the next level once a batch is full (BATCH_SIZE, or the adaptive size/token budget when a
+    batch_sizer is given), once the oldest has waited
+    PIPELINE_MICRO_BATCH_TIMEOUT seconds, or once nothing else is in flight. Deeper-level batches are
+    dispatched ahead of shallower ones, and at most MAX_CONCURRENT_BATCHES batches run at a time.
+    Updates results in place. Returns (initial_l4_success_count, initial_l5_success_count).
+    """
+    batch_size = settings.BATCH_SIZE if settings.BATCH_SIZE > 0 else 5
+    max_in_flight = settings.MAX_CONCURRENT_BATCHES if settings.MAX_CONCURRENT_BATCHES > 0 else 1
+    flush_timeout = max(0.0, settings.PIPELINE_MICRO_BATCH_TIMEOUT)
+    total_vendors = len(unique_vendors_map)
+    initial_l4_success_count = 0
+    initial_l5_success_count = 0
+    finished_vendor_count = 0
+    pipeline_stats = {"batches_dispatched": 0, "full_flushes": 0, "timeout_flushes": 0, "idle_flushes": 0}
+
+    # Ready batches are ordered deepest level first, then FIFO: (-level, seq, level, parent_id, batch_data)
+    ready_heap: List[Tuple[int, int, int, Optional[str], List[Dict[str, Any]]]] = []
+    ready_sequence = itertools.count()
+    # Partially filled micro-batches per (level, parent_category_id), plus when each was opened
+    buffers: Dict[Tuple[int, Optional[str]], List[Dict[str, Any]]] = {}
+    buffer_opened_at: Dict[Tuple[int, Optional[str]], float] = {}
+    in_flight: Dict[asyncio.Task, Tuple[int, Optional[str], List[Dict[str, Any]]]] = {}
+
+    def _enqueue_batch(level: int, parent_category_id: Optional[str], batch_data: List[Dict[str, Any]]):
+        heapq.heappush(ready_heap, (-level, next(ready_sequence), level, parent_category_id, batch_data))
+
+    def _flush_buffer(key: Tuple[int, Optional[str]]):
+        buffer_opened_at.pop(key, None)
+        batch_data = buffers.pop(key, None)
+        if batch_data:
+            _enqueue_batch(key[0], key[1], batch_data)
+
+    def _buffer_vendor(level: int, parent_category_id: str, vendor_data: Dict[str, Any]):
+        key = (level, parent_category_id)
+        if batch_sizer is not None and key in buffers and not batch_sizer.fits(level, parent_category_id, buffers[key], vendor_data):
+            pipeline_stats["full_flushes"] += 1
+            _flush_buffer(key)
+        if key not in buffers:
+            buffers[key] = []
+            buffer_opened_at[key] = time.monotonic()
+        buffers[key].append(vendor_data)
+        full_size = batch_sizer.current_size(level) if batch_sizer is not None else batch_size
+        if len(buffers[key]) >= full_size:
+            pipeline_stats["full_flushes"] += 1
+            _flush_buffer(key)
+
+    def _lowest_active_level() -> int:
+        levels = [entry[0] for entry in in_flight.values()] + [entry[2] for entry in ready_heap] + [key[0] for key in buffers]
+        return min(levels) if levels else target_level
+
+    # Pre-classified and restored vendors enter the pipeline below their deepest assigned level;
+    # a vendor whose next level already holds a (not possible) result is finished.
+    level1_vendor_data: List[Dict[str, Any]] = []
+    for vendor_name, vendor_data in unique_vendors_map.items():
+        depth = _assigned_depth(results, vendor_name)
+        if depth >= 4:
+            initial_l4_success_count += 1
+        if depth >= 5:
+            initial_l5_success_count += 1
+        if depth >= target_level or f"level{depth + 1}" in results.get(vendor_name, {}):
+            finished_vendor_count += 1
+        elif depth == 0:
+            level1_vendor_data.append(vendor_data)
+        else:
+            _buffer_vendor(depth + 1, results[vendor_name][f"level{depth}"]["category_id"], vendor_data)
+
+    if batch_sizer is not None:
+        l1_batch_size, l1_max_tokens = batch_sizer.batch_limits(1)
+        initial_batches = create_batches(level1_vendor_data, batch_size=l1_batch_size, max_tokens=l1_max_tokens,
+                                         token_estimator=batch_sizer.vendor_tokens)
+    else:
+        initial_batches = create_batches(level1_vendor_data, batch_size=batch_size)
+    for batch_data in initial_batches:
+        _enqueue_batch(1, None, batch_data)
+
+    job.current_stage = ProcessingStage.CLASSIFICATION_L1.value
+    job.progress = 0.1
+    logger.info(f"[classify_levels_pipelined] Committing status update before pipelined classification: {job.status}, {job.current_stage}, {job.progress:.3f}")
+    try:
+        db.commit()
+    except Exception:
+        logger.error("Failed to commit status update before pipelined classification", exc_info=True)
+        db.rollback()
+
+    logger.info(f"===== Starting Pipelined Initial Classification (Up to Level {target_level}) =====",
+                extra={"vendors_to_process": total_vendors, "initial_batches": len(ready_heap), "max_in_flight": max_in_flight,
+                       "micro_batch_timeout": flush_timeout})
+    pipeline_start_time = time.monotonic()
+
+    try:
+        while ready_heap or in_flight or buffers:
+            while ready_heap and len(in_flight) < max_in_flight:
+                _, _, level, parent_category_id, batch_data = heapq.heappop(ready_heap)
+                task = asyncio.create_task(_run_level_batch(batch_data, level, parent_category_id, taxonomy, llm_service, stats, batch_sizer))
+                in_flight[task] = (level, parent_category_id, batch_data)
+                pipeline_stats["batches_dispatched"] += 1
+
+            if not in_flight:
+                # Nothing running and nothing ready: send partial micro-batches now instead of waiting out the timeout.
+                for key in sorted(buffers, key=lambda k: -k[0]):
+                    pipeline_stats["idle_flushes"] += 1
+                    _flush_buffer(key)
+                continue
+
+            wait_timeout = None
+            if buffer_opened_at:
+                wait_timeout = max(0.0, min(buffer_opened_at.values()) + flush_timeout - time.monotonic())
+            done, _ = await asyncio.wait(in_flight.keys(), timeout=wait_timeout, return_when=asyncio.FIRST_COMPLETED)
+
+            for task in done:
+                level, parent_category_id, batch_data = in_flight.pop(task)
+                try:
+                    batch_results = task.result()
+                except Exception as task_error: # _run_level_batch does not raise; defensive only
+                    logger.error(f"Unexpected error retrieving Level {level} batch result for parent '{parent_category_id or 'None'}'", exc_info=True)
+                    batch_results = _batch_error_results(batch_data, f"Batch processing logic error: {str(task_error)[:100]}")
+
+                _, successful_names = _store_level_results(results, level, batch_results, classification_source="Initial")
+                if checkpoint is not None:
+                    checkpoint.record_level_results(level, batch_results)
+                if level == 4:
+                    initial_l4_success_count += len(successful_names)
+                if level == 5:
+                    initial_l5_success_count += len(successful_names)
+
+                successful_set = set(successful_names)
+                for vendor_data in batch_data:
+                    vendor_name = vendor_data.get('vendor_name')
+                    category_id = results.get(vendor_name, {}).get(f"level{level}", {}).get("category_id") if vendor_name in successful_set else None
+                    if level < target_level and category_id and category_id not in ["N/A", "ERROR"]:
+                        _buffer_vendor(level + 1, category_id, vendor_data)
+                    else:
+                        finished_vendor_count += 1 # Reached target level or stopped (search phase picks it up)
+
+            now = time.monotonic()
+            for key, opened_at in list(buffer_opened_at.items()):
+                if now - opened_at >= flush_timeout:
+                    pipeline_stats["timeout_flushes"] += 1
+                    _flush_buffer(key)
+
+            if done:
+                stage_enum_name = f"CLASSIFICATION_L{_lowest_active_level()}"
+                if hasattr(ProcessingStage, stage_enum_name):
+                    job.current_stage = getattr(ProcessingStage, stage_enum_name).value
+                job.progress = min(0.8, 0.1 + 0.7 * (finished_vendor_count / total_vendors if total_vendors > 0 else 1))
+                try:
+                    db.commit()
+                except Exception:
+                    logger.error("Failed to commit progress update during pipelined classification", exc_info=True)
+                    db.rollback()
+    finally:
+        for task in in_flight:
+            task.cancel()
+
+    stats["classification_pipeline"] = pipeline_stats
+    logger.info(f"===== Finished Pipelined Initial Classification in {time.monotonic() - pipeline_start_time:.3f}s =====",
+                extra={"finished_vendors": finished_vendor_count, **pipeline_stats})
+    return initial_l4_success_count, initial_l5_success_count
+
+@log_function_call(logger, include_args=False) # Keep args=False
+async def process_vendors(
+    unique_vendors_map: Dict[str, Dict[str, Any]], # Pass map containing full vendor data
+    taxonomy: Taxonomy,
+    results: Dict[str, Dict],
+    stats: Dict[str, Any],
+    job: Job,
+    db: Session,
+    llm_service: LLMService,
+    search_service: SearchService,
+    target_level: int, # <<< ADDED target_level
+    checkpoint: Optional[JobCheckpoint] = None,
+    restored_searches: Optional[Dict[str, Dict[str, Any]]] = None
+):
+    """
+    Main orchestration function for processing vendors through the classification workflow (up to target_level),
+    including recursive search for unknowns (up to target_level). Updates results and stats dictionaries in place.
+    With a checkpoint, finished batches and searches are persisted as they complete; level results already in
+    `results` (restored by the caller) are not re-classified and `restored_searches` ({vendor_name: output})
+    are reused instead of searching again.
+    """
+    restored_searches = restored_searches or {}
+    unique_vendor_names = list(unique_vendors_map.keys()) # Get names from map
+    total_unique_vendors = len(unique_vendor_names)
+    processed_count = 0 # Count unique vendors processed in batches
+
+    logger.info(f"Starting classification loop for {total_unique_vendors} unique vendors up to target Level {target_level}.")
+
+    # --- Pre-classification (TF-IDF similarity, Levels 1-2) ---
+    if settings.PRECLASSIFIER_ENABLED:
+        preclassify_vendors(unique_vendors_map, taxonomy, results, stats, job, db, target_level)
+
+    # --- Direct-path classification (all levels in one call; failures fall through to the level walk) ---
+    if settings.DIRECT_PATH_ENABLED:
+        job.current_stage = ProcessingStage.CLASSIFICATION_L1.value
+        try:
+            db.commit()
+        except Exception:
+            logger.error("Failed to commit status update before direct path classification", exc_info=True)
+            db.rollback()
+        await classify_direct_paths(unique_vendors_map, taxonomy, results, stats, llm_service, target_level, checkpoint)
+
+    # --- Initial Hierarchical Classification (Levels 1 to target_level) ---
+    pipeline_mode = (settings.CLASSIFICATION_PIPELINE_MODE or "barrier").lower()
+    stats["classification_pipeline_mode"] = pipeline_mode
+    batch_sizer = AdaptiveBatchSizer(taxonomy, llm_service.model)
+    if pipeline_mode == "pipelined":
+        initial_l4_success_count, initial_l5_success_count = await classify_levels_pipelined(
+            unique_vendors_map, taxonomy, results, stats, job, db, llm_service, target_level, batch_sizer, checkpoint
+        )
+    else:
+        if pipeline_mode != "barrier":
+            logger.warning(f"Unknown CLASSIFICATION_PIPELINE_MODE '{pipeline_mode}'. Falling back to 'barrier'.")
+        initial_l4_success_count, initial_l5_success_count = await classify_levels_barrier(
+            unique_vendors_map, taxonomy, results, stats, job, db, llm_service, target_level, batch_sizer, checkpoint
+        )
+    stats["adaptive_batching"] = batch_sizer.get_stats()
+
+    # --- End of Initial Classification ---
     logger.info(f"===== Finished Initial Hierarchical Classification Loop (Up to Level {target_level}) =====")
 
     # --- Identify vendors needing search (those not successfully classified at target_level) ---
@@ -776,17 +1591,21 @@ async def process_vendors(
             # Define the coroutine to run with a timeout
             async def timed_search_classify_task(vd):
                 vn = vd.get('vendor_name', 'UnknownVendor') # Get name early for logging
+                if vn in restored_searches:
+                    logger.debug(f"Reusing checkpointed search result for '{vn}'")
+                    return restored_searches[vn]
                 try:
-                    logger.debug(f"Calling search_and_classify_recursively for '{vn}' with timeout {SEARCH_CLASSIFY_TIMEOUT}s")
-                    return await asyncio.wait_for(
-                        search_and_classify_recursively(
-                            vd, taxonomy, llm_service, search_service, stats, search_semaphore, target_level
-                        ),
+                    logger.debug(f"Calling search_and_classify_level1 for '{vn}' with timeout {SEARCH_CLASSIFY_TIMEOUT}s")
+                    search_output = await asyncio.wait_for(
+                        search_and_classify_level1(vd, taxonomy, llm_service, search_service, stats, search_semaphore),
                         timeout=SEARCH_CLASSIFY_TIMEOUT
                     )
+                    if checkpoint is not None:
+                        checkpoint.record_search(vn, search_output) # Search + L1 survive a worker restart
+                    return search_output
                 except asyncio.TimeoutError:
-                    logger.error(f"Timeout (> {SEARCH_CLASSIFY_TIMEOUT}s) during search_and_classify_recursively for vendor: {vn}")
-                    # Return an error structure consistent with other failures in search_and_classify_recursively
+                    logger.error(f"Timeout (> {SEARCH_CLASSIFY_TIMEOUT}s) during search_and_classify_level1 for vendor: {vn}")
+                    # Return an error structure consistent with other failures in search_and_classify_level1
                     return {
                         "vendor": vn, "search_query": f"{vn} company business type industry", "sources": [], "summary": None,
                         "error": f"Task timed out after {SEARCH_CLASSIFY_TIMEOUT} seconds.",
@@ -802,7 +1621,7 @@ async def process_vendors(
                     }
                 except Exception as task_exc:
                     # Catch other exceptions within the task execution itself
-                    logger.error(f"Exception during search_and_classify_recursively task for vendor {vn}", exc_info=task_exc)
+                    logger.error(f"Exception during search_and_classify_level1 task for vendor {vn}", exc_info=task_exc)
                     return {
                          "vendor": vn, "search_query": f"{vn} company business type industry", "sources": [], "summary": None,
                          "error": f"Task execution error: {str(task_exc)}",
@@ -830,6 +1649,19 @@ async def process_vendors(
         gather_duration = time.monotonic() - gather_start_time
         logger.info(f"Search & recursive classification tasks completed (asyncio.gather finished). Duration: {gather_duration:.3f}s")
 
+        # --- Levels 2..target_level from search context, batched across vendors that share a parent ---
+        # Restored searches take part too: levels they already hold are kept, missing ones are classified
+        search_outputs = {
+            vendor_data.get('vendor_name'): search_output
+            for vendor_data, search_output in zip(unknown_vendors_data_to_search, search_and_recursive_results)
+            if isinstance(search_output, dict)
+        }
+        if target_level > 1 and search_outputs:
+            with LogTimer(logger, f"Post-search classification L2-L{target_level}", include_in_stats=True):
+                await classify_search_levels(search_outputs, unique_vendors_map, taxonomy, llm_service, stats, target_level,
+                                             checkpoint, batch_sizer)
+            stats["adaptive_batching"] = batch_sizer.get_stats() # Now including the post-search batches
+
         job.progress = 0.95 # Indicate search phase is done, before result processing/generation
         logger.info(f"[process_vendors] Committing progress update after search gather: {job.progress:.3f}")
         try:
@@ -3,191 +3,158 @@
 # app/prompts/classification_prompts.py
 import json
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Sequence, Tuple
 
 from models.taxonomy import Taxonomy, TaxonomyCategory
+from utils.taxonomy_loader import register_taxonomy_reload_hook
 
 # Configure logger for this module
 logger = logging.getLogger("vendor_classification.prompts")
 
-def generate_batch_prompt(
-    vendors_data: List[Dict[str, Any]],
-    level: int,
-    taxonomy: Taxonomy,
-    parent_category_id: Optional[str] = None,
-    batch_id: str = "unknown-batch",
-    search_context: Optional[Dict[str, Any]] = None
-) -> str:
-    """
-    Create an appropriate prompt for the current classification level (1-5),
-    optionally including search context for post-search classification.
-    """
-    context_type = "Search Context" if search_context else "Initial Data"
-    logger.debug(f"generate_batch_prompt: Generating prompt for Level {level} using {context_type}",
-                extra={ "vendor_count": len(vendors_data), "parent_category_id": parent_category_id, "batch_id": batch_id, "has_search_context": bool(search_context) })
+# --- Prompt fragment cache: pre-rendered <category_options> blocks ---
+# Key: (taxonomy name, taxonomy version, level, parent_category_id) -> (xml, parent name, lookup successful)
+_category_block_cache: Dict[Tuple[str, str, int, Optional[str]], Tuple[str, str, bool]] = {}
+# Same key -> full static system prefix for batch prompts (see get_batch_system_prefix)
+_system_prefix_cache: Dict[Tuple[str, str, int, Optional[str]], str] = {}
 
-    # --- Build Vendor Data Section ---
-    vendor_data_xml = "<vendor_data>\n"
-    for i, vendor_entry in enumerate(vendors_data):
-        vendor_name = vendor_entry.get('vendor_name', f'UnknownVendor_{i}')
-        example = vendor_entry.get('example')
-        address = vendor_entry.get('vendor_address')
-        website = vendor_entry.get('vendor_website')
-        internal_cat = vendor_entry.get('internal_category')
-        parent_co = vendor_entry.get('parent_company')
-        spend_cat = vendor_entry.get('spend_category')
 
-        vendor_data_xml += f"  <vendor index=\"{i+1}\">\n"
-        vendor_data_xml += f"    <name>{vendor_name}</name>\n"
-        if example: vendor_data_xml += f"    <example_goods_services>{str(example)[:200]}</example_goods_services>\n"
-        if address: vendor_data_xml += f"    <address>{str(address)[:200]}</address>\n"
-        if website: vendor_data_xml += f"    <website>{str(website)[:100]}</website>\n"
-        if internal_cat: vendor_data_xml += f"    <internal_category>{str(internal_cat)[:100]}</internal_category>\n"
-        if parent_co: vendor_data_xml += f"    <parent_company>{str(parent_co)[:100]}</parent_company>\n"
-        if spend_cat: vendor_data_xml += f"    <spend_category>{str(spend_cat)[:100]}</spend_category>\n"
-        vendor_data_xml += f"  </vendor>\n"
-    vendor_data_xml += "</vendor_data>"
+def clear_prompt_fragment_cache(taxonomy: Optional[Taxonomy] = None) -> None:
+    """Drops all pre-rendered category blocks (registered as a taxonomy reload hook)."""
+    _category_block_cache.clear()
+    _system_prefix_cache.clear()
+    logger.info("Prompt fragment cache cleared.")
+
+register_taxonomy_reload_hook(clear_prompt_fragment_cache)
 
-    # --- Build Search Context Section ---
-    search_context_xml = ""
-    if search_context and level > 1: # Only include search context for L2+ post-search attempts
-        logger.debug(f"Including search context in prompt for Level {level}", extra={"batch_id": batch_id})
-        search_context_xml += "<search_context>\n"
-        summary = search_context.get("summary")
-        sources = search_context.get("sources")
-        if summary:
-            search_context_xml += f"  <summary>{str(summary)[:1000]}</summary>\n" # Limit length
-        if sources and isinstance(sources, list):
-            search_context_xml += "  <sources>\n"
-            for j, source in enumerate(sources[:3]): # Limit to top 3 sources for brevity
-                title = source.get('title', 'N/A')
-                url = source.get('url', 'N/A')
-                content_preview = str(source.get('content', ''))[:500] # Limit length
-                search_context_xml += f"    <source index=\"{j+1}\">\n"
-                search_context_xml += f"      <title>{title}</title>\n"
-                search_context_xml += f"      <url>{url}</url>\n"
-                search_context_xml += f"      <content_snippet>{content_preview}...</content_snippet>\n"
-                search_context_xml += f"    </source>\n"
-            search_context_xml += "  </sources>\n"
-        else:
-             search_context_xml += "  <message>No relevant search results sources were provided.</message>\n"
-        search_context_xml += "</search_context>\n"
 
-    # --- Get Category Options ---
-    categories: List[TaxonomyCategory] = []
+def _render_category_options(taxonomy: Taxonomy, level: int, parent_category_id: Optional[str]) -> Tuple[str, str, bool]:
+    """Looks up the categories for (level, parent) and renders the <category_options> block."""
+    categories: Sequence[TaxonomyCategory] = ()
     parent_category_name = "N/A"
     category_lookup_successful = True
-    try:
-        logger.debug(f"generate_batch_prompt: Retrieving categories via taxonomy methods for Level {level}, Parent: {parent_category_id}")
-        parent_obj = None
-        if level == 1:
-            categories = taxonomy.get_level1_categories()
-        elif parent_category_id:
-            # --- UPDATED: Use taxonomy methods consistently ---
-            if level == 2:
-                categories = taxonomy.get_level2_categories(parent_category_id)
-                parent_obj = taxonomy.categories.get(parent_category_id)
-            elif level == 3:
-                categories = taxonomy.get_level3_categories(parent_category_id)
-                # Need to find the L2 object to get its name
-                l1_id, l2_id = parent_category_id.split('.') if '.' in parent_category_id else (None, parent_category_id)
-                if not l1_id:
-                    for l1k, l1n in taxonomy.categories.items():
-                        if l2_id in getattr(l1n, 'children', {}): l1_id = l1k; break
-                if l1_id: parent_obj = taxonomy.categories.get(l1_id, {}).children.get(l2_id)
-            elif level == 4:
-                categories = taxonomy.get_level4_categories(parent_category_id)
-                # Need to find the L3 object to get its name
-                # Handle different possible parent_id formats (L1.L2.L3, L2.L3, L3)
-                parts = parent_category_id.split('.')
-                l1_id, l2_id, l3_id = None, None, None
-                if len(parts) == 3: l1_id, l2_id, l3_id = parts[0], parts[1], parts[2]
-                elif len(parts) == 2: # L2.L3 format
-                    l2_p, l3_p = parts[0], parts[1]
-                    for l1k, l1n in taxonomy.categories.items():
-                         if l2_p in getattr(l1n, 'children', {}): l1_id = l1k; l2_id = l2_p; l3_id = l3_p; break
-                elif len(parts) == 1: # L3 format
-                    l3_p = parts[0]
-                    for l1k, l1n in taxonomy.categories.items():
-                        for l2k, l2n in getattr(l1n, 'children', {}).items():
-                            if l3_p in getattr(l2n, 'children', {}): l1_id = l1k; l2_id = l2k; l3_id = l3_p; break
-                        if l1_id: break
-                if l1_id and l2_id and l3_id:
-                    parent_obj = taxonomy.categories.get(l1_id, {}).children.get(l2_id, {}).children.get(l3_id)
-            elif level == 5:
-                categories = taxonomy.get_level5_categories(parent_category_id)
-                # Need to find the L4 object to get its name
-                # Handle different possible parent_id formats (L1.L2.L3.L4, L2.L3.L4, L3.L4, L4)
-                parts = parent_category_id.split('.')
-                l1_id, l2_id, l3_id, l4_id = None, None, None, None
-                if len(parts) == 4: l1_id, l2_id, l3_id, l4_id = parts[0], parts[1], parts[2], parts[3]
-                elif len(parts) == 3: # L2.L3.L4 format
-                    l2_p, l3_p, l4_p = parts[0], parts[1], parts[2]
-                    for l1k, l1n in taxonomy.categories.items():
-                        if l2_p in getattr(l1n, 'children', {}): l1_id = l1k; l2_id = l2_p; l3_id = l3_p; l4_id = l4_p; break
-                elif len(parts) == 2: # L3.L4 format
-                    l3_p, l4_p = parts[0], parts[1]
-                    for l1k, l1n in taxonomy.categories.items():
-                        for l2k, l2n in getattr(l1n, 'children', {}).items():
-                             if l3_p in getattr(l2n, 'children', {}): l1_id = l1k; l2_id = l2k; l3_id = l3_p; l4_id = l4_p; break
-                        if l1_id: break
-                elif len(parts) == 1: # L4 format
-                    l4_p = parts[0]
-                    for l1k, l1n in taxonomy.categories.items():
-                        for l2k, l2n in getattr(l1n, 'children', {}).items():
-                            for l3k, l3n in getattr(l2n, 'children', {}).items():
-                                if l4_p in getattr(l3n, 'children', {}): l1_id = l1k; l2_id = l2k; l3_id = l3k; l4_id = l4_p; break
-                            if l1_id: break
-                        if l1_id: break
-                if l1_id and l2_id and l3_id and l4_id:
-                    parent_obj = taxonomy.categories.get(l1_id, {}).children.get(l2_id, {}).children.get(l3_id, {}).children.get(l4_id)
-            # --- END UPDATED ---
-
-            if parent_obj: parent_category_name = parent_obj.name
-        else: # level > 1 and no parent_category_id
-            logger.error(f"Parent category ID is required for level {level} prompt generation but was not provided.")
-            category_lookup_successful = False
-
-        if not categories and level > 1 and parent_category_id:
-             logger.warning(f"No subcategories found for Level {level}, Parent '{parent_category_id}'.")
-             # Don't mark as failure if parent exists but has no children (valid scenario)
-             # category_lookup_successful = False # Removed this line
-        elif not categories and level == 1:
-             logger.error(f"No Level 1 categories found in taxonomy!")
-             category_lookup_successful = False
-
-        logger.debug(f"generate_batch_prompt: Retrieved {len(categories)} categories for Level {level}, Parent '{parent_category_id}' ('{parent_category_name}').")
-
-    except Exception as e:
-        logger.error(f"Error retrieving categories for prompt (Level {level}, Parent: {parent_category_id})", exc_info=True)
+    logger.debug(f"generate_batch_prompt: Retrieving categories via taxonomy index for Level {level}, Parent: {parent_category_id}")
+    if level == 1:
+        categories = taxonomy.get_child_categories(1)
+    elif parent_category_id:
+        # Index lookups; parent_category_id may be a bare ID or a dotted path
+        categories = taxonomy.get_child_categories(level, parent_category_id)
+        parent_category_name = taxonomy.get_category_name(parent_category_id) or "N/A"
+    else: # level > 1 and no parent_category_id
+        logger.error(f"Parent category ID is required for level {level} prompt generation but was not provided.")
         category_lookup_successful = False
 
-    # --- Build Category Options Section ---
-    category_options_xml = "<category_options>\n"
+    if not categories and level > 1 and parent_category_id:
+         logger.warning(f"No subcategories found for Level {level}, Parent '{parent_category_id}'.")
+         # Don't mark as failure if parent exists but has no children (valid scenario)
+    elif not categories and level == 1:
+         logger.error(f"No Level 1 categories found in taxonomy!")
+         category_lookup_successful = False
+
+    logger.debug(f"generate_batch_prompt: Retrieved {len(categories)} categories for Level {level}, Parent '{parent_category_id}' ('{parent_category_name}').")
+
+    parts = ["<category_options>\n"]
     if category_lookup_successful:
-        category_options_xml += f"  <level>{level}</level>\n"
+        parts.append(f"  <level>{level}</level>\n")
         if level > 1 and parent_category_id:
-            category_options_xml += f"  <parent_id>{parent_category_id}</parent_id>\n"
-            category_options_xml += f"  <parent_name>{parent_category_name}</parent_name>\n"
-        category_options_xml += "  <categories>\n"
+            parts.append(f"  <parent_id>{parent_category_id}</parent_id>\n")
+            parts.append(f"  <parent_name>{parent_category_name}</parent_name>\n")
+        parts.append("  <categories>\n")
         if categories: # Check if categories list is not empty
-            for cat in categories:
-                category_options_xml += f"    <category id=\"{cat.id}\" name=\"{cat.name}\"/>\n"
+            parts.extend(f"    <category id=\"{cat.id}\" name=\"{cat.name}\"/>\n" for cat in categories)
         else:
-             category_options_xml += f"    <message>No subcategories available for this level and parent.</message>\n"
-        category_options_xml += "  </categories>\n"
+            parts.append(f"    <message>No subcategories available for this level and parent.</message>\n")
+        parts.append("  </categories>\n")
     else:
-        category_options_xml += f"  <error>Could not retrieve valid categories for Level {level}, Parent '{parent_category_id}'. Classification is not possible.</error>\n"
-    category_options_xml += "</category_options>"
+        parts.append(f"  <error>Could not retrieve valid categories for Level {level}, Parent '{parent_category_id}'. Classification is not possible.</error>\n")
+    parts.append("</category_options>")
+    return "".join(parts), parent_category_name, category_lookup_successful
 
-    # --- Define Output Format Section ---
-    output_format_xml = f"""<output_format>
+
+def get_category_options_block(taxonomy: Taxonomy, level: int, parent_category_id: Optional[str]) -> Tuple[str, str, bool]:
+    """
+    Returns (category_options_xml, parent_category_name, category_lookup_successful) for (level, parent),
+    rendering it once per taxonomy version. Lookup errors are not cached.
+    """
+    cache_key = (taxonomy.name, taxonomy.version, level, parent_category_id)
+    cached_block = _category_block_cache.get(cache_key)
+    if cached_block is not None:
+        return cached_block
+    try:
+        block = _render_category_options(taxonomy, level, parent_category_id)
+    except Exception as e:
+        logger.error(f"Error retrieving categories for prompt (Level {level}, Parent: {parent_category_id})", exc_info=True)
+        return (f"<category_options>\n  <error>Could not retrieve valid categories for Level {level}, Parent '{parent_category_id}'. Classification is not possible.</error>\n</category_options>",
+                "N/A", False)
+    _category_block_cache[cache_key] = block
+    return block
+
+
+def build_vendor_data_xml(vendors_data: List[Dict[str, Any]], include_search_context: bool = False) -> str:
+    """
+    Renders the <vendor_data> section for a batch. With include_search_context, a vendor entry that carries
+    its own "search_context" (post-search batches) gets it rendered inside its <vendor> element.
+    """
+    parts = ["<vendor_data>\n"]
+    for i, vendor_entry in enumerate(vendors_data):
+        vendor_name = vendor_entry.get('vendor_name', f'UnknownVendor_{i}')
+        example = vendor_entry.get('example')
+        address = vendor_entry.get('vendor_address')
+        website = vendor_entry.get('vendor_website')
+        internal_cat = vendor_entry.get('internal_category')
+        parent_co = vendor_entry.get('parent_company')
+        spend_cat = vendor_entry.get('spend_category')
+
+        parts.append(f"  <vendor index=\"{i+1}\">\n")
+        parts.append(f"    <name>{vendor_name}</name>\n")
+        if example: parts.append(f"    <example_goods_services>{str(example)[:200]}</example_goods_services>\n")
+        if address: parts.append(f"    <address>{str(address)[:200]}</address>\n")
+        if website: parts.append(f"    <website>{str(website)[:100]}</website>\n")
+        if internal_cat: parts.append(f"    <internal_category>{str(internal_cat)[:100]}</internal_category>\n")
+        if parent_co: parts.append(f"    <parent_company>{str(parent_co)[:100]}</parent_company>\n")
+        if spend_cat: parts.append(f"    <spend_category>{str(spend_cat)[:100]}</spend_category>\n")
+        if include_search_context and vendor_entry.get('search_context'):
+            parts.append(_build_search_context_xml(vendor_entry['search_context'], indent="    "))
+        parts.append(f"  </vendor>\n")
+    parts.append("</vendor_data>")
+    return "".join(parts)
+
+
+def _build_search_context_xml(search_context: Dict[str, Any], indent: str = "") -> str:
+    """Renders the <search_context> section for post-search classification."""
+    parts = ["<search_context>\n"]
+    summary = search_context.get("summary")
+    sources = search_context.get("sources")
+    if summary:
+        parts.append(f"  <summary>{str(summary)[:1000]}</summary>\n") # Limit length
+    if sources and isinstance(sources, list):
+        parts.append("  <sources>\n")
+        for j, source in enumerate(sources[:3]): # Limit to top 3 sources for brevity
+            title = source.get('title', 'N/A')
+            url = source.get('url', 'N/A')
+            content_preview = str(source.get('content', ''))[:500] # Limit length
+            parts.append(f"    <source index=\"{j+1}\">\n")
+            parts.append(f"      <title>{title}</title>\n")
+            parts.append(f"      <url>{url}</url>\n")
+            parts.append(f"      <content_snippet>{content_preview}...</content_snippet>\n")
+            parts.append(f"    </source>\n")
+        parts.append("  </sources>\n")
+    else:
+        parts.append("  <message>No relevant search results sources were provided.</message>\n")
+    parts.append("</search_context>\n")
+    if indent:
+        return "".join(indent + line for line in "".join(parts).splitlines(keepends=True))
+    return "".join(parts)
+
+
+def _build_output_format_xml(level: int, parent_category_id: Optional[str]) -> str:
+    """The <output_format> section. The batch_id is copied from the user message, so this stays byte-stable."""
+    return f"""<output_format>
 Respond *only* with a valid JSON object matching this exact schema. Do not include any text before or after the JSON object.
 
 json
 {{
   "level": {level},
-  "batch_id": "{batch_id}",
+  "batch_id": "string", // Exact value of <batch_id> from the vendor message
   "parent_category_id": {json.dumps(parent_category_id)},
   "classifications": [
     {{
@@ -205,40 +172,15 @@ json
 
 </output_format>"""
 
-    # --- Assemble Final Prompt ---
-    prompt_base = f"""
-<role>You are a precise vendor classification expert using the NAICS taxonomy.</role>
-
-<task>Classify each vendor provided in `<vendor_data>` into **ONE** appropriate NAICS category from the `<category_options>` for Level {level}. {f"Consider that these vendors belong to the parent category '{parent_category_id}: {parent_category_name}'. " if level > 1 and parent_category_id and parent_category_name != 'N/A' else ""}</task>"""
 
-    if search_context_xml:
-        prompt_base += f"""
-<search_context_instruction>You have been provided with additional context from a web search in `<search_context>`. Use this information, along with the original `<vendor_data>`, to make the most accurate classification decision for Level {level}.</search_context_instruction>"""
-
-    prompt_base += f"""
-<instructions>
-1.  Analyze each vendor's details in `<vendor_data>` {f"and the supplementary information in `<search_context>`" if search_context_xml else ""}.
-2.  Compare the vendor's likely primary business activity against the available categories in `<category_options>`.
-3.  Assign the **single most specific and appropriate** category ID and name from the list.
-4.  Provide a confidence score (0.0 to 1.0).
-5.  **CRITICAL:** If the vendor's primary activity is genuinely ambiguous, cannot be determined from the provided information, or does not fit well into *any* of the specific categories listed in `<category_options>`, **DO NOT GUESS**. Instead: Set `classification_not_possible` to `true`, `confidence` to `0.0`, provide a brief `classification_not_possible_reason`, and set `category_id`/`category_name` to "N/A".
-6.  If classification *is* possible (`classification_not_possible: false`), ensure `confidence` > 0.0 and `category_id`/`category_name` are populated correctly from `<category_options>`.
-7.  Provide brief optional `notes` for reasoning, especially if confidence is low or classification was not possible.
-8.  Ensure the `batch_id` in the final JSON output matches the `batch_id` specified in `<output_format>`.
-9.  Ensure the output contains an entry for **every** vendor listed in `<vendor_data>`.
-10. Respond *only* with the valid JSON object as specified in `<output_format>`.
-</instructions>
-
-{vendor_data_xml}
-{search_context_xml if search_context_xml else ""}
-{category_options_xml}
-{output_format_xml}
-"""
-    prompt = prompt_base
+def _render_batch_system_prefix(taxonomy: Taxonomy, level: int, parent_category_id: Optional[str]) -> str:
+    """Renders the static part of a batch prompt: role, task, instructions, category options and output format."""
+    category_options_xml, parent_category_name, category_lookup_successful = get_category_options_block(taxonomy, level, parent_category_id)
+    output_format_xml = _build_output_format_xml(level, parent_category_id)
 
     # Handle case where category lookup failed (e.g., bad parent ID for L2+)
     if not category_lookup_successful and level > 1:
-         prompt = f"""
+        return f"""
 <role>You are a precise vendor classification expert using the NAICS taxonomy.</role>
 <task>Acknowledge that classification is not possible for the vendors in `<vendor_data>` at Level {level} because the necessary subcategories could not be provided (likely due to an invalid or non-existent parent category ID: {parent_category_id}).</task>
 <instructions>
@@ -247,16 +189,15 @@ json
 3. Set `confidence` to `0.0`.
 4. Set `category_id` and `category_name` to "N/A".
 5. Set `classification_not_possible_reason` to "No subcategories defined or retrievable for parent {parent_category_id} at Level {level}".
-6. Ensure the `batch_id` in the final JSON output matches the `batch_id` specified in `<output_format>`.
+6. Ensure the `batch_id` in the final JSON output matches the `<batch_id>` given with the vendor data.
 7. Respond *only* with the valid JSON object as specified in `<output_format>`.
 </instructions>
-{vendor_data_xml}
 {category_options_xml}
 {output_format_xml}
 """
     # Handle case where L1 lookup failed (taxonomy load issue)
-    elif not category_lookup_successful and level == 1:
-         prompt = f"""
+    if not category_lookup_successful and level == 1:
+        return f"""
 <role>You are a precise vendor classification expert using the NAICS taxonomy.</role>
 <task>Acknowledge that classification is not possible for the vendors in `<vendor_data>` at Level 1 because the top-level categories could not be loaded or provided.</task>
 <instructions>
@@ -265,16 +206,190 @@ json
 3. Set `confidence` to `0.0`.
 4. Set `category_id` and `category_name` to "N/A".
 5. Set `classification_not_possible_reason` to "Level 1 categories could not be loaded or retrieved.".
-6. Ensure the `batch_id` in the final JSON output matches the `batch_id` specified in `<output_format>`.
+6. Ensure the `batch_id` in the final JSON output matches the `<batch_id>` given with the vendor data.
 7. Respond *only* with the valid JSON object as specified in `<output_format>`.
 </instructions>
-{vendor_data_xml}
 {category_options_xml}
 {output_format_xml}
 """
 
+    return f"""
+<role>You are a precise vendor classification expert using the NAICS taxonomy.</role>
 
-    return prompt
+<task>Classify each vendor provided in `<vendor_data>` into **ONE** appropriate NAICS category from the `<category_options>` for Level {level}. {f"Consider that these vendors belong to the parent category '{parent_category_id}: {parent_category_name}'. " if level > 1 and parent_category_id and parent_category_name != 'N/A' else ""}</task>
+
+<instructions>
+1.  Analyze each vendor's details in `<vendor_data>`, and the supplementary information in `<search_context>` when it is provided.
+2.  Compare the vendor's likely primary business activity against the available categories in `<category_options>`.
+3.  Assign the **single most specific and appropriate** category ID and name from the list.
+4.  Provide a confidence score (0.0 to 1.0).
+5.  **CRITICAL:** If the vendor's primary activity is genuinely ambiguous, cannot be determined from the provided information, or does not fit well into *any* of the specific categories listed in `<category_options>`, **DO NOT GUESS**. Instead: Set `classification_not_possible` to `true`, `confidence` to `0.0`, provide a brief `classification_not_possible_reason`, and set `category_id`/`category_name` to "N/A".
+6.  If classification *is* possible (`classification_not_possible: false`), ensure `confidence` > 0.0 and `category_id`/`category_name` are populated correctly from `<category_options>`.
+7.  Provide brief optional `notes` for reasoning, especially if confidence is low or classification was not possible.
+8.  Ensure the `batch_id` in the final JSON output matches the `<batch_id>` given with the vendor data.
+9.  Ensure the output contains an entry for **every** vendor listed in `<vendor_data>`.
+10. Respond *only* with the valid JSON object as specified in `<output_format>`.
+</instructions>
+
+{category_options_xml}
+{output_format_xml}
+"""
+
+
+def get_batch_system_prefix(taxonomy: Taxonomy, level: int, parent_category_id: Optional[str]) -> str:
+    """
+    Returns the static prompt prefix for (level, parent). It contains nothing batch-specific, so it is
+    byte-identical for every batch under the same parent and can be served from the provider's prompt cache.
+    Memoized per taxonomy version, like the category blocks.
+    """
+    cache_key = (taxonomy.name, taxonomy.version, level, parent_category_id)
+    prefix = _system_prefix_cache.get(cache_key)
+    if prefix is None:
+        prefix = _render_batch_system_prefix(taxonomy, level, parent_category_id)
+        if cache_key in _category_block_cache: # Only cache prefixes built on a successful category lookup
+            _system_prefix_cache[cache_key] = prefix
+    return prefix
+
+
+def build_batch_user_message(
+    vendors_data: List[Dict[str, Any]],
+    level: int,
+    batch_id: str = "unknown-batch",
+    search_context: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Renders the per-batch part of the prompt: batch id, vendor data and (L2+) search context, either one
+    `search_context` for the whole batch or a "search_context" entry on each vendor.
+    """
+    per_vendor_context = level > 1 and any(vd.get('search_context') for vd in vendors_data)
+    parts = [f"<batch_id>{batch_id}</batch_id>\n", build_vendor_data_xml(vendors_data, include_search_context=per_vendor_context), "\n"]
+    if per_vendor_context:
+        parts.append(f"""<search_context_instruction>Vendors in `<vendor_data>` may include a `<search_context>` with additional information from a web search about that vendor. Use each vendor's own search context, along with its other data, to make the most accurate classification decision for Level {level}.</search_context_instruction>
+""")
+    elif search_context and level > 1: # Only include search context for L2+ post-search attempts
+        logger.debug(f"Including search context in prompt for Level {level}", extra={"batch_id": batch_id})
+        parts.append(f"""<search_context_instruction>You have been provided with additional context from a web search in `<search_context>`. Use this information, along with the original `<vendor_data>`, to make the most accurate classification decision for Level {level}.</search_context_instruction>
+""")
+        parts.append(_build_search_context_xml(search_context))
+    return "".join(parts)
+
+
+def generate_batch_prompt_messages(
+    vendors_data: List[Dict[str, Any]],
+    level: int,
+    taxonomy: Taxonomy,
+    parent_category_id: Optional[str] = None,
+    batch_id: str = "unknown-batch",
+    search_context: Optional[Dict[str, Any]] = None
+) -> Tuple[str, str]:
+    """
+    Create the prompt for the current classification level (1-5) as (system_prefix, user_message).
+    The system prefix holds the static instructions, category options and output schema; the vendor
+    data (and optional search context) comes last in the user message.
+    """
+    context_type = "Search Context" if search_context else "Initial Data"
+    logger.debug(f"generate_batch_prompt: Generating prompt for Level {level} using {context_type}",
+                extra={ "vendor_count": len(vendors_data), "parent_category_id": parent_category_id, "batch_id": batch_id, "has_search_context": bool(search_context) })
+    system_prefix = get_batch_system_prefix(taxonomy, level, parent_category_id)
+    user_message = build_batch_user_message(vendors_data, level, batch_id, search_context)
+    return system_prefix, user_message
+
+
+def generate_batch_prompt(
+    vendors_data: List[Dict[str, Any]],
+    level: int,
+    taxonomy: Taxonomy,
+    parent_category_id: Optional[str] = None,
+    batch_id: str = "unknown-batch",
+    search_context: Optional[Dict[str, Any]] = None
+) -> str:
+    """
+    Create an appropriate prompt for the current classification level (1-5) as a single string,
+    optionally including search context for post-search classification.
+    """
+    system_prefix, user_message = generate_batch_prompt_messages(vendors_data, level, taxonomy, parent_category_id, batch_id, search_context)
+    return f"{system_prefix}\n{user_message}"
+
+
+# --- Direct-path classification (all levels in one call, see classification_logic.classify_direct_paths) ---
+
+def get_direct_path_system_prefix(target_level: int) -> str:
+    """Static instructions and output format for direct-path batches (identical for every batch of a level)."""
+    path_example = ".".join(f"L{level}" for level in range(1, target_level + 1))
+    return f"""
+<role>You are a precise vendor classification expert using the NAICS taxonomy.</role>
+
+<task>Classify each vendor in `<vendor_data>` directly to a **Level {target_level}** NAICS category by choosing **ONE** of that vendor's candidate paths in `<candidate_paths>`.</task>
+
+<instructions>
+1.  Analyze each vendor's details in `<vendor_data>` and determine its primary business activity.
+2.  Each vendor has its own list of candidate paths (`{path_example}`, from the most general to the most specific level). Choose the single path whose Level {target_level} category best describes the vendor's primary activity.
+3.  Copy the chosen `id` attribute exactly into `category_path`. Never build a path yourself and never use a candidate listed for another vendor.
+4.  Provide a confidence score (0.0 to 1.0) for the whole path.
+5.  **CRITICAL:** If no candidate fits well, or the vendor's activity cannot be determined from the information given, **DO NOT GUESS**. Set `classification_not_possible` to `true`, `confidence` to `0.0`, `category_path` to "N/A" and give a brief `classification_not_possible_reason`. Such vendors are classified level by level afterwards.
+6.  Ensure the `batch_id` in the final JSON output matches the `<batch_id>` given with the vendor data.
+7.  Ensure the output contains an entry for **every** vendor listed in `<vendor_data>`.
+8.  Respond *only* with the valid JSON object as specified in `<output_format>`.
+</instructions>
+
+<output_format>
+Respond *only* with a valid JSON object matching this exact schema. Do not include any text before or after the JSON object.
+
+json
+{{
+  "level": {target_level},
+  "batch_id": "string", // Exact value of <batch_id> from the vendor message
+  "classifications": [
+    {{
+      "vendor_name": "string", // Exact vendor name from input <vendor_data>
+      "category_path": "string", // id of the chosen candidate path, or "N/A" if not possible
+      "confidence": "float", // 0.0 to 1.0. MUST be 0.0 if classification_not_possible is true.
+      "classification_not_possible": "boolean",
+      "classification_not_possible_reason": "string | null",
+      "notes": "string | null" // Optional brief justification
+    }}
+    // ... one entry for EACH vendor in <vendor_data>
+  ]
+}}
+
+</output_format>
+"""
+
+
+def build_direct_path_user_message(
+    vendors_data: List[Dict[str, Any]],
+    candidates: Dict[str, List[Tuple[str, ...]]],
+    taxonomy: Taxonomy,
+    batch_id: str = "unknown-batch"
+) -> str:
+    """Renders batch id, vendor data and each vendor's candidate paths (id = dotted path, text = the level names)."""
+    parts = [f"<batch_id>{batch_id}</batch_id>\n", build_vendor_data_xml(vendors_data), "\n<candidate_paths>\n"]
+    nodes = taxonomy.index.nodes
+    for i, vendor_entry in enumerate(vendors_data):
+        vendor_name = vendor_entry.get('vendor_name', f'UnknownVendor_{i}')
+        parts.append(f"  <vendor index=\"{i+1}\" name=\"{vendor_name}\">\n")
+        for path in candidates.get(vendor_name, []):
+            names: List[str] = []
+            for category_id in path:
+                if not names or names[-1] != nodes[category_id].name: # NAICS often repeats a name down the levels
+                    names.append(nodes[category_id].name)
+            parts.append(f"    <path id=\"{'.'.join(path)}\">{' > '.join(names)}</path>\n")
+        parts.append("  </vendor>\n")
+    parts.append("</candidate_paths>")
+    return "".join(parts)
+
+
+def generate_direct_path_prompt_messages(
+    vendors_data: List[Dict[str, Any]],
+    candidates: Dict[str, List[Tuple[str, ...]]],
+    taxonomy: Taxonomy,
+    target_level: int,
+    batch_id: str = "unknown-batch"
+) -> Tuple[str, str]:
+    """Direct-path prompt as (system_prefix, user_message), like generate_batch_prompt_messages."""
+    logger.debug(f"generate_direct_path_prompt: Generating prompt for Level {target_level}",
+                 extra={"vendor_count": len(vendors_data), "batch_id": batch_id})
+    return get_direct_path_system_prefix(target_level), build_direct_path_user_message(vendors_data, candidates, taxonomy, batch_id)
 
 
 def generate_search_prompt(
@@ -386,4 +501,102 @@ json
 
 {output_format_xml}
 """
-    return prompt
\ No newline at end of file
+    return prompt
+
+if __name__ == "__main__":
+    # Micro-benchmark: prompt-build time per batch for the full NAICS taxonomy.
+    # - "Uncached": this module with the prompt fragment cache cleared before every call. It already uses the
+    #   TaxonomyIndex lookups and the list-join builders, so Uncached vs Cached measures the fragment cache alone.
+    # - "Baseline" (with --baseline REV): generate_batch_prompt and the Taxonomy model as of git revision REV,
+    #   loaded with `git show`, i.e. the rendering path before these changes.
+    # Usage (from app/): python -m tasks.classification_prompts [path/to/naics_taxonomy.json] [--baseline REV]
+    import importlib.util
+    import os
+    import subprocess
+    import sys
+    import tempfile
+    import time
+
+    def _load_module_at_revision(revision: str, repo_path: str, module_name: str):
+        source = subprocess.run(["git", "show", f"{revision}:./{repo_path}"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                check=True, capture_output=True, text=True).stdout
+        with tempfile.NamedTemporaryFile("w", suffix=".py", delete=False) as module_file:
+            module_file.write(source)
+        spec = importlib.util.spec_from_file_location(module_name, module_file.name)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        os.unlink(module_file.name)
+        return module
+
+    bench_args = sys.argv[1:]
+    baseline_revision = None
+    if "--baseline" in bench_args:
+        flag_index = bench_args.index("--baseline")
+        baseline_revision = bench_args[flag_index + 1]
+        del bench_args[flag_index:flag_index + 2]
+    taxonomy_path = bench_args[0] if bench_args else os.path.join(os.path.dirname(__file__), '../../data/taxonomy/naics_taxonomy.json')
+    with open(taxonomy_path, "r") as f:
+        taxonomy_data = json.load(f)
+    bench_taxonomy = Taxonomy(**taxonomy_data)
+    bench_taxonomy.build_index()
+    logger.setLevel(logging.WARNING)
+
+    baseline_generate = baseline_taxonomy = None
+    if baseline_revision:
+        baseline_models = _load_module_at_revision(baseline_revision, "../models/taxonomy.py", "baseline_taxonomy_model")
+        baseline_prompts = _load_module_at_revision(baseline_revision, "classification_prompts.py", "baseline_classification_prompts")
+        baseline_taxonomy = baseline_models.Taxonomy(**taxonomy_data)
+        baseline_generate = baseline_prompts.generate_batch_prompt
+        for logger_name in ("vendor_classification.taxonomy_model", "vendor_classification.prompts"):
+            logging.getLogger(logger_name).setLevel(logging.WARNING)
+
+    bench_vendors = [
+        {"vendor_name": f"Vendor {i}", "example": "Office supplies and printer toner", "vendor_address": "1 Main St, Springfield",
+         "vendor_website": "example.com", "internal_category": "Facilities", "spend_category": "Indirect"}
+        for i in range(5)
+    ]
+
+    def _time_calls(build, repeats: int, parents: List[Optional[str]]) -> float:
+        start = time.perf_counter()
+        for _ in range(repeats):
+            for parent in parents:
+                build(parent)
+        return time.perf_counter() - start
+
+    def _uncached(level: int):
+        def build(parent):
+            clear_prompt_fragment_cache()
+            generate_batch_prompt(bench_vendors, level, bench_taxonomy, parent, "bench-batch")
+        return build
+
+    print(f"Taxonomy: {bench_taxonomy.name} {bench_taxonomy.version} ({len(bench_taxonomy.index.nodes)} categories)")
+    print(f"Baseline: {'generate_batch_prompt at ' + baseline_revision if baseline_revision else 'not measured (pass --baseline REV)'}")
+    print(f"{'Level':<6}{'Parents':>9}{'Baseline us/batch':>19}{'Uncached us/batch':>19}{'Cached us/batch':>17}"
+          f"{'vs baseline':>13}{'vs uncached':>13}")
+    totals = {"baseline": 0.0, "uncached": 0.0, "cached": 0.0}
+    total_calls = 0
+    for bench_level in range(1, 6):
+        parents = [None] if bench_level == 1 else list(bench_taxonomy.index.level_ids[bench_level - 1])
+        repeats = max(1, 200 // len(parents))
+        level_times = {"baseline": 0.0}
+        if baseline_generate is not None:
+            level_times["baseline"] = _time_calls(
+                lambda parent: baseline_generate(bench_vendors, bench_level, baseline_taxonomy, parent, "bench-batch"), repeats, parents)
+        level_times["uncached"] = _time_calls(_uncached(bench_level), repeats, parents)
+        for parent in parents: # Prime
+            generate_batch_prompt(bench_vendors, bench_level, bench_taxonomy, parent, "bench-batch")
+        level_times["cached"] = _time_calls(
+            lambda parent: generate_batch_prompt(bench_vendors, bench_level, bench_taxonomy, parent, "bench-batch"), repeats, parents)
+
+        calls = repeats * len(parents)
+        total_calls += calls
+        for column, seconds in level_times.items():
+            totals[column] += seconds
+        baseline_cell = f"{level_times['baseline'] / calls * 1e6:>19.1f}" if baseline_generate else f"{'-':>19}"
+        vs_baseline = f"{level_times['baseline'] / level_times['cached']:>12.1f}x" if baseline_generate else f"{'-':>13}"
+        print(f"L{bench_level:<5}{len(parents):>9}{baseline_cell}{level_times['uncached'] / calls * 1e6:>19.1f}"
+              f"{level_times['cached'] / calls * 1e6:>17.1f}{vs_baseline}{level_times['uncached'] / level_times['cached']:>12.1f}x")
+    baseline_cell = f"{totals['baseline'] / total_calls * 1e6:>19.1f}" if baseline_generate else f"{'-':>19}"
+    vs_baseline = f"{totals['baseline'] / totals['cached']:>12.1f}x" if baseline_generate else f"{'-':>13}"
+    print(f"{'All':<6}{'':>9}{baseline_cell}{totals['uncached'] / total_calls * 1e6:>19.1f}"
+          f"{totals['cached'] / total_calls * 1e6:>17.1f}{vs_baseline}{totals['uncached'] / totals['cached']:>12.1f}x")
@@ -21,6 +21,13 @@ from models.job import Job, JobStatus, ProcessingStage, JobType # <<< ADDED JobT
 from services.file_service import read_vendor_file, normalize_vendor_data, generate_output_file
 from services.llm_service import LLMService
 from services.search_service import SearchService
+from services.http_client import close_http_clients, get_http_client_metrics
+from services.llm_cache import close_response_caches
+from services.rate_limiter import close_rate_limiter
+from services.classification_memo import ClassificationMemo
+from services.vendor_clustering import cluster_vendor_names
+from services.job_checkpoint import JobCheckpoint
+from services.result_store import save_job_results
 from utils.taxonomy_loader import load_taxonomy
 
 # Import the refactored logic
@@ -38,6 +45,33 @@ logger.debug("Successfully imported Dict and Any from typing for classification
 # --- END ADDED ---
 
 
+async def _close_loop_resources() -> None:
+    """Closes the HTTP clients, response caches and rate limiter bound to the running loop. Each close runs even if another fails."""
+    outcomes = await asyncio.gather(close_http_clients(), close_response_caches(), close_rate_limiter(), return_exceptions=True)
+    for resource, outcome in zip(("HTTP clients", "response caches", "rate limiter"), outcomes):
+        if isinstance(outcome, Exception):
+            logger.warning(f"Failed to close shared {resource}: {outcome}")
+
+
+def _copy_results_to_aliases(results_dict: Dict[str, Dict], vendor_aliases: Dict[str, List[str]]) -> None:
+    """
+    Gives every alias of a vendor (same normalized_key, or same fuzzy cluster) a copy of the canonical vendor's
+    results, so each spelling in the input file still gets its own output row. The copy records the
+    canonical name as 'cluster_representative'.
+    """
+    for canonical_name, aliases in vendor_aliases.items():
+        vendor_results = results_dict.get(canonical_name)
+        if vendor_results is None:
+            continue
+        for alias in aliases:
+            alias_results: Dict[str, Any] = {"cluster_representative": canonical_name}
+            for key, value in vendor_results.items():
+                if isinstance(value, dict) and "vendor_name" in value:
+                    value = {**value, "vendor_name": alias}
+                alias_results[key] = value
+            results_dict[alias] = alias_results
+
+
 # --- UPDATED: Helper function to process results for DB storage ---
 def _prepare_detailed_results_for_storage(
     results_dict: Dict[str, Dict],
@@ -115,6 +149,7 @@ def _prepare_detailed_results_for_storage(
 
         # Set the final determined source
         flat_result["classification_source"] = final_source
+        flat_result["cluster_representative"] = vendor_results.get("cluster_representative")
 
         # Handle potential ERROR states explicitly (e.g., if L1 failed with ERROR)
         l1_data = vendor_results.get("level1")
@@ -204,6 +239,11 @@ def process_vendor_file(self, job_id: str, file_path: str, target_level: int):
                 logger.warning(f"Task received target_level {target_level} but job record has {job.target_level}. Using task value: {target_level}.")
                 # Optionally update job record here if desired, or just proceed with task value
 
+            # A redelivered task (acks_late) for a job that already finished has nothing left to do
+            if job.status == JobStatus.COMPLETED.value:
+                logger.warning("Job is already completed; ignoring redelivered task.", extra={"job_id": job_id})
+                return
+
             # Ensure job type is CLASSIFICATION
             if job.job_type != JobType.CLASSIFICATION.value:
                  logger.error(f"process_vendor_file task called for a non-CLASSIFICATION job.", extra={"job_id": job_id, "job_type": job.job_type})
@@ -267,6 +307,7 @@ def process_vendor_file(self, job_id: str, file_path: str, target_level: int):
             db.close()
             logger.debug(f"Main database session closed for task.")
         if loop and not loop.is_closed():
+            loop.run_until_complete(_close_loop_resources()) # Shared HTTP clients/caches are owned by this loop
             loop.close()
             logger.debug(f"Event loop closed for task.")
         clear_all_context()
@@ -316,6 +357,8 @@ async def _process_vendor_file_async(job_id: str, file_path: str, db: Session, t
             "openrouter_prompt_tokens": 0,
             "openrouter_completion_tokens": 0,
             "openrouter_total_tokens": 0,
+            "openrouter_cached_tokens": 0, # Prompt tokens served from the provider prompt cache
+            "by_model": {}, # Per-model split of the openrouter_* counters (model cascade)
             "tavily_search_calls": 0,
             "cost_estimate_usd": 0.0
         }
@@ -363,15 +406,33 @@ async def _process_vendor_file_async(job_id: str, file_path: str, db: Session, t
         # --- MODIFIED: Type hints added ---
         unique_vendors_map: Dict[str, Dict[str, Any]] = {}
         # --- END MODIFIED ---
+        # Deduplicate on normalized_key ("Acme Inc" / "ACME, Inc."): the first spelling is classified,
+        # the other spellings are kept as aliases and receive its results before storage.
+        canonical_names: Dict[str, str] = {}
+        vendor_aliases: Dict[str, List[str]] = {}
         for entry in normalized_vendors_data:
             name = entry.get('vendor_name')
-            if name and name not in unique_vendors_map:
-                unique_vendors_map[name] = entry
+            if not name:
+                continue
+            canonical_name = canonical_names.setdefault(entry.get('normalized_key') or name, name)
+            if canonical_name == name:
+                unique_vendors_map.setdefault(name, entry)
+            elif name not in vendor_aliases.setdefault(canonical_name, []):
+                vendor_aliases[canonical_name].append(name)
+        if settings.VENDOR_CLUSTERING_ENABLED:
+            with log_duration(logger, "Fuzzy vendor clustering"):
+                cluster_members, stats["vendor_clustering"] = cluster_vendor_names(
+                    {name: entry.get('normalized_key') or name for name, entry in unique_vendors_map.items()})
+            for member_name, representative_name in cluster_members.items():
+                unique_vendors_map.pop(member_name, None)
+                vendor_aliases.setdefault(representative_name, []).extend([member_name] + vendor_aliases.pop(member_name, []))
+        alias_count = sum(len(aliases) for aliases in vendor_aliases.values())
         logger.info(f"Unique vendors identified",
-                    extra={"unique_count": len(unique_vendors_map)})
+                    extra={"unique_count": len(unique_vendors_map), "name_variants_merged": alias_count})
 
         stats["total_vendors"] = len(normalized_vendors_data)
         stats["unique_vendors"] = len(unique_vendors_map)
+        stats["name_variants_merged"] = alias_count
 
         logger.info(f"Loading taxonomy")
         with log_duration(logger, "Loading taxonomy"):
@@ -382,23 +443,65 @@ async def _process_vendor_file_async(job_id: str, file_path: str, db: Session, t
         # Initialize the results dict structure before passing to process_vendors
         results_dict = {vendor_name: {} for vendor_name in unique_vendors_map.keys()}
 
-        logger.info(f"Starting vendor classification process by calling classification_logic.process_vendors up to Level {target_level}")
-        # --- Call the refactored logic, passing target_level ---
-        # process_vendors will populate the results_dict in place
-        await process_vendors(
-            unique_vendors_map=unique_vendors_map,
-            taxonomy=taxonomy,
-            results=results_dict, # Pass the dict to be populated
-            stats=stats,
-            job=job,
-            db=db,
-            llm_service=llm_service,
-            search_service=search_service,
-            target_level=target_level # Pass the target level
-        )
-        # --- End call to refactored logic ---
+        # --- Cross-job classification memo: reuse results for vendors seen in earlier jobs ---
+        memo = ClassificationMemo(taxonomy, llm_service.model, target_level)
+        memo_hits: Dict[str, Dict] = {}
+        try:
+            memo_hits = await memo.lookup_many(unique_vendors_map)
+        except Exception as memo_err:
+            logger.error("Classification memo lookup failed. Classifying all vendors.", exc_info=True, extra={"error": str(memo_err)})
+        results_dict.update(memo_hits)
+        vendors_to_classify_map = {name: data for name, data in unique_vendors_map.items() if name not in memo_hits}
+        for vendor_results in memo_hits.values():
+            for level, stat_key in ((4, "successfully_classified_l4"), (5, "successfully_classified_l5")):
+                level_data = vendor_results.get(f"level{level}")
+                if level <= target_level and level_data and not level_data.get("classification_not_possible", True):
+                    stats[stat_key] += 1
+        # --- End memo lookup ---
+
+        # --- Resume: restore results checkpointed by an earlier, interrupted run of this job ---
+        checkpoint = JobCheckpoint(db, job.id)
+        restored_checkpoint = checkpoint.load()
+        restored_searches: Dict[str, Dict[str, Any]] = {}
+        if restored_checkpoint:
+            restored_vendor_count = checkpoint.restore_levels(
+                {name: results_dict[name] for name in vendors_to_classify_map}, restored_checkpoint, target_level)
+            restored_searches = checkpoint.restored_searches(restored_checkpoint)
+            logger.info(f"Resuming job from checkpoint: {restored_vendor_count} vendors with restored level results, "
+                        f"{len(restored_searches)} restored searches.")
+        # --- End resume ---
+
+        logger.info(f"Starting vendor classification process by calling classification_logic.process_vendors up to Level {target_level}",
+                    extra={"vendors_to_classify": len(vendors_to_classify_map), "memo_hits": len(memo_hits)})
+        if vendors_to_classify_map:
+            memo_l4_count, memo_l5_count = stats["successfully_classified_l4"], stats["successfully_classified_l5"]
+            # --- Call the refactored logic, passing target_level ---
+            # process_vendors will populate the results_dict in place
+            await process_vendors(
+                unique_vendors_map=vendors_to_classify_map,
+                taxonomy=taxonomy,
+                results=results_dict, # Pass the dict to be populated
+                stats=stats,
+                job=job,
+                db=db,
+                llm_service=llm_service,
+                search_service=search_service,
+                target_level=target_level, # Pass the target level
+                checkpoint=checkpoint,
+                restored_searches=restored_searches
+            )
+            # --- End call to refactored logic ---
+            stats["successfully_classified_l4"] += memo_l4_count # process_vendors sets these for the vendors it classified
+            stats["successfully_classified_l5"] += memo_l5_count
         logger.info(f"Vendor classification process completed (returned from classification_logic.process_vendors)")
 
+        try:
+            await memo.store_many(results_dict, unique_vendors_map, skip_vendor_names=list(memo_hits.keys()))
+        except Exception as memo_err:
+            logger.error("Failed to store results in classification memo", exc_info=True, extra={"error": str(memo_err)})
+        stats["classification_memo"] = memo.get_stats()
+        _copy_results_to_aliases(results_dict, vendor_aliases)
+
         logger.info("Starting result generation phase.")
 
         job.current_stage = ProcessingStage.RESULT_GENERATION.value
@@ -461,17 +564,29 @@ async def _process_vendor_file_async(job_id: str, file_path: str, db: Session, t
                             (stats["api_usage"]["openrouter_completion_tokens"] / 1000) * cost_output_per_1k
         estimated_cost += (stats["api_usage"]["tavily_search_calls"] / 1000) * 4.0
         stats["api_usage"]["cost_estimate_usd"] = round(estimated_cost, 4)
+        stats["http_connections"] = get_http_client_metrics() # Connection reuse for this job's loop
+        stats["llm_cache"] = {"backend": llm_service.response_cache.backend_name, **llm_service.cache_stats}
+        stats["search_cache"] = search_service.get_cache_stats()
+        stats["rate_limiting"] = {"openrouter": dict(llm_service.rate_limit_stats), "tavily": search_service.get_rate_limit_stats(),
+                                  "limiter": llm_service.rate_limiter.get_stats()}
+        stats["key_pools"] = {"openrouter": llm_service.key_pool.get_stats(), "tavily": search_service.key_pool.get_stats()}
+        stats["hedging"] = llm_service.get_hedge_stats()
+        stats["llm_responses"] = llm_service.get_response_stats()
+        stats["checkpoint"] = checkpoint.get_stats()
         # --- End Finalize stats ---
 
         # --- Final Commit Block ---
         try:
             logger.info("Attempting final job completion update in database.")
             # --- UPDATED: Pass the processed detailed_results_for_db to the complete method ---
-            job.complete(output_file_name, stats, detailed_results_for_db)
+            if detailed_results_for_db is not None:
+                save_job_results(db, job.id, detailed_results_for_db) # Same transaction as the completion below
+            job.complete(output_file_name, stats) # Results live in job_result_items, not Job.detailed_results
             # --- END UPDATED ---
             job.progress = 1.0 # Ensure progress is 1.0 on completion
             logger.info(f"[_process_vendor_file_async] Committing final job completion status.")
             db.commit()
+            checkpoint.clear()
             logger.info(f"Job completed successfully",
                         extra={
                             "processing_duration": processing_duration,
@@ -641,6 +756,7 @@ def reclassify_flagged_vendors_task(self, review_job_id: str):
             db.close()
             logger.debug(f"Main database session closed for reclassification task.")
         if loop and not loop.is_closed():
+            loop.run_until_complete(_close_loop_resources()) # Shared HTTP clients/caches are owned by this loop
             loop.close()
             logger.debug(f"Event loop closed for reclassification task.")
         clear_all_context()
@@ -697,6 +813,12 @@ async def _process_reclassification_async(review_job_id: str, db: Session):
 
         logger.info(f"Reclassification logic completed. Processed {final_stats.get('total_items_processed', 0)} items.")
         review_job.progress = 0.95 # Mark logic as complete
+        final_stats["http_connections"] = get_http_client_metrics() # Connection reuse for this job's loop
+        final_stats["llm_cache"] = {"backend": llm_service.response_cache.backend_name, **llm_service.cache_stats}
+        final_stats["rate_limiting"] = {"openrouter": dict(llm_service.rate_limit_stats), "limiter": llm_service.rate_limiter.get_stats()}
+        final_stats["key_pools"] = {"openrouter": llm_service.key_pool.get_stats()}
+        final_stats["hedging"] = llm_service.get_hedge_stats()
+        final_stats["llm_responses"] = llm_service.get_response_stats()
 
         # --- Final Commit Block (Only if no error from logic) ---
         try:
@@ -13,6 +13,7 @@ from utils.log_utils import LogTimer, log_duration # Assuming logging utils migh
 from utils.taxonomy_loader import load_taxonomy, Taxonomy # Assuming taxonomy is needed
 from models.job import Job, JobStatus, ProcessingStage, JobType # Assuming Job model is needed
 from services.llm_service import LLMService # Assuming LLM service is needed
+from services.result_store import get_job_results, has_stored_results
 from schemas.review import ReclassifyRequestItem, ReviewResultItem # Assuming review schemas are needed
 from schemas.job import JobResultItem # Assuming job result schema is needed for structure
 from pydantic import ValidationError # Import ValidationError for specific catching
@@ -54,6 +55,8 @@ async def process_reclassification(
             "openrouter_prompt_tokens": 0,
             "openrouter_completion_tokens": 0,
             "openrouter_total_tokens": 0,
+            "openrouter_cached_tokens": 0, # Prompt tokens served from the provider prompt cache
+            "by_model": {}, # Per-model split of the openrouter_* counters (model cascade)
             "tavily_search_calls": 0, # Should remain 0
             "cost_estimate_usd": 0.0
         },
@@ -105,7 +108,9 @@ async def process_reclassification(
              logger.error(err_msg)
              final_stats["error_message"] = err_msg
              return [], final_stats
-        if not parent_job.detailed_results:
+        # Only the flagged vendors' rows are loaded (primary key lookups in job_result_items)
+        parent_results = get_job_results(db, parent_job, vendor_names=[item.vendor_name for item in items_to_reclassify])
+        if not parent_results and not has_stored_results(db, parent_job.id) and not parent_job.detailed_results:
              err_msg = f"Parent job {review_job.parent_job_id} has no detailed results."
              logger.error(err_msg)
              final_stats["error_message"] = err_msg
@@ -113,7 +118,7 @@ async def process_reclassification(
 
         original_results_map: Dict[str, JobResultItem] = {}
         try:
-            for item_dict in parent_job.detailed_results:
+            for item_dict in parent_results:
                  # Validate each item conforms to JobResultItem before adding
                  validated_item = JobResultItem.model_validate(item_dict)
                  original_results_map[validated_item.vendor_name] = validated_item
@@ -0,0 +1,87 @@
+"""
+Unit tests for the adaptive batch size rules (services.batch_sizer.AdaptiveBatchSizer.record_batch).
+"""
+import pytest
+
+from services import batch_sizer
+from services.batch_sizer import MISSING_VENDOR_REASON, AdaptiveBatchSizer, batch_failed
+
+CLEAN = {"Acme": {"category_id": "11"}}
+ERROR = {"Acme": {"category_id": "ERROR"}}
+MISSING = {"Acme": {"category_id": "N/A", "classification_not_possible_reason": MISSING_VENDOR_REASON}}
+
+
+@pytest.fixture
+def sizer(monkeypatch):
+    monkeypatch.setattr(batch_sizer, "_learned_sizes", {})
+    for name, value in {"ADAPTIVE_BATCH_SIZING": True, "BATCH_SIZE": 5, "BATCH_SIZE_MIN": 1, "BATCH_SIZE_MAX": 8,
+                        "BATCH_SIZE_GROW_AFTER": 3, "BATCH_TARGET_LATENCY_SECONDS": 45.0}.items():
+        monkeypatch.setattr(batch_sizer.settings, name, value)
+    return AdaptiveBatchSizer(taxonomy=None, model="test/model")
+
+
+def test_batch_failed():
+    assert not batch_failed(CLEAN)
+    assert batch_failed(ERROR)
+    assert batch_failed(MISSING)
+
+
+def test_grows_after_enough_clean_full_batches(sizer):
+    for _ in range(2):
+        sizer.record_batch(1, 5, CLEAN, 1.0)
+    assert sizer.current_size(1) == 5
+    sizer.record_batch(1, 5, CLEAN, 1.0)
+    assert sizer.current_size(1) == 6
+    assert sizer.current_size(2) == 5 # Levels adapt separately
+    assert sizer.stats["grown"] == 1
+
+
+def test_partial_and_slow_batches_do_not_grow(sizer):
+    for _ in range(5):
+        sizer.record_batch(1, 2, CLEAN, 1.0) # Tail batches
+    assert sizer.current_size(1) == 5
+    sizer.record_batch(1, 5, CLEAN, 1.0)
+    sizer.record_batch(1, 5, CLEAN, 1.0)
+    sizer.record_batch(1, 5, CLEAN, 60.0) # Over the latency target: resets the streak
+    sizer.record_batch(1, 5, CLEAN, 1.0)
+    sizer.record_batch(1, 5, CLEAN, 1.0)
+    assert sizer.current_size(1) == 5
+
+
+def test_growth_stops_at_the_maximum(sizer):
+    for _ in range(30):
+        sizer.record_batch(1, sizer.current_size(1), CLEAN, 1.0)
+    assert sizer.current_size(1) == 8
+
+
+def test_failure_halves_the_size_and_resets_the_streak(sizer):
+    sizer.record_batch(1, 5, CLEAN, 1.0)
+    sizer.record_batch(1, 5, CLEAN, 1.0)
+    sizer.record_batch(1, 5, MISSING, 1.0)
+    assert sizer.current_size(1) == 2
+    sizer.record_batch(1, 2, CLEAN, 1.0) # Streak restarted: two clean batches are not enough
+    sizer.record_batch(1, 2, CLEAN, 1.0)
+    assert sizer.current_size(1) == 2
+    assert sizer.stats == {**sizer.stats, "batches": 5, "failed_batches": 1, "shrunk": 1}
+
+
+def test_failure_of_a_small_batch_halves_from_that_batch(sizer):
+    sizer.record_batch(1, 3, ERROR, 1.0)
+    assert sizer.current_size(1) == 1
+    sizer.record_batch(1, 1, ERROR, 1.0)
+    assert sizer.current_size(1) == 1 # Never below BATCH_SIZE_MIN
+
+
+def test_learned_sizes_are_shared_per_model(sizer):
+    sizer.record_batch(1, 5, ERROR, 1.0)
+    assert AdaptiveBatchSizer(taxonomy=None, model="test/model").current_size(1) == 2
+    assert AdaptiveBatchSizer(taxonomy=None, model="other/model").current_size(1) == 5
+
+
+def test_disabled_sizer_keeps_the_fixed_size(sizer, monkeypatch):
+    monkeypatch.setattr(batch_sizer.settings, "ADAPTIVE_BATCH_SIZING", False)
+    fixed = AdaptiveBatchSizer(taxonomy=None, model="test/model")
+    fixed.record_batch(1, 5, ERROR, 1.0)
+    assert fixed.current_size(1) == 5
+    assert fixed.batch_limits(1) == (5, None)
+    assert fixed.stats["failed_batches"] == 1
@@ -0,0 +1,105 @@
+"""
+Unit tests for key leasing and quarantine (services.key_pool.KeyPool).
+"""
+from types import SimpleNamespace
+
+import pytest
+
+from services import key_pool
+from services.key_pool import KeyPool
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(key_pool, "time", SimpleNamespace(monotonic=clock))
+    monkeypatch.setattr(key_pool.settings, "KEY_POOL_AUTH_COOLDOWN_SECONDS", 300.0)
+    monkeypatch.setattr(key_pool.settings, "KEY_POOL_THROTTLE_COOLDOWN_SECONDS", 60.0)
+    return clock
+
+
+def test_empty_pool_leases_nothing(clock):
+    pool = KeyPool("test", [])
+    assert pool.acquire() is None
+    pool.release(None) # No-op
+
+
+def test_leases_spread_over_in_flight_then_recent_requests(clock):
+    pool = KeyPool("test", ["a", "b", "c"])
+    assert [pool.acquire() for _ in range(3)] == [0, 1, 2]
+    pool.release(1)
+    assert pool.acquire() == 1 # Fewest in flight
+    for index in (0, 1, 2):
+        pool.release(index)
+    clock.now += 1.0
+    assert pool.acquire() == 0 # Keys 0 and 2 tie on recent requests; 0 was used longest ago
+    pool.release(0)
+    assert pool.acquire() == 2 # The only key with one request in the last minute
+
+
+def test_per_key_quota_prefers_the_key_with_most_remaining(clock):
+    pool = KeyPool("test", ["a", "b"], per_key_requests_per_minute=3)
+    for _ in range(2):
+        pool.release(pool.acquire()) # Both keys used once
+    pool.release(pool.acquire())
+    assert pool.acquire() == 1
+    clock.now += key_pool.WINDOW_SECONDS + 1 # Old requests leave the window
+    pool.release(1)
+    assert pool.get_stats()["per_key"][0]["requests_last_minute"] == 0
+
+
+@pytest.mark.parametrize("status_code, cooldown, quarantined_for", [
+    (401, None, 300.0),
+    (403, 5.0, 300.0), # Auth errors ignore the caller's cooldown
+    (429, None, 60.0),
+    (429, 12.0, 12.0), # Retry-After
+    (500, 10.0, 10.0),
+    (500, None, 0.0),
+])
+def test_release_quarantines_by_status(clock, status_code, cooldown, quarantined_for):
+    pool = KeyPool("test", ["a", "b"])
+    index = pool.acquire()
+    pool.release(index, success=False, status_code=status_code, cooldown_seconds=cooldown)
+    assert pool.get_stats()["per_key"][index]["quarantined_for_seconds"] == quarantined_for
+    assert pool.healthy_count() == (1 if quarantined_for else 2)
+
+
+def test_quarantined_keys_are_skipped_until_they_recover(clock):
+    pool = KeyPool("test", ["a", "b"])
+    pool.release(pool.acquire(), success=False, status_code=429)
+    assert all(pool.acquire() == 1 for _ in range(3))
+    clock.now += 61.0
+    assert pool.acquire() == 0
+
+
+def test_quarantine_never_shortens(clock):
+    pool = KeyPool("test", ["a"])
+    pool.quarantine(0, 100.0)
+    pool.quarantine(0, 10.0)
+    assert pool.get_stats()["per_key"][0]["quarantined_for_seconds"] == 100.0
+
+
+def test_all_quarantined_uses_the_key_that_recovers_first(clock):
+    pool = KeyPool("test", ["a", "b", "c"])
+    pool.quarantine(0, 300.0)
+    pool.quarantine(1, 20.0)
+    pool.quarantine(2, 60.0)
+    assert pool.acquire() == 1
+
+
+def test_cancel_and_release_bookkeeping(clock):
+    pool = KeyPool("test", ["a"])
+    pool.cancel(pool.acquire())
+    pool.release(pool.acquire(), success=True)
+    pool.release(pool.acquire(), success=False)
+    pool.release(0) # Extra release never drives in_flight negative
+    stats = pool.get_stats()["per_key"][0]
+    assert (stats["requests"], stats["successes"], stats["errors"], stats["in_flight"]) == (3, 2, 1, 0)
@@ -0,0 +1,93 @@
+"""
+Unit tests for streamed batch responses (services.llm_stream).
+"""
+import asyncio
+import json
+
+import httpx
+
+from services.llm_stream import IncrementalArrayParser, StreamError, parse_sse_line, read_completion_stream
+
+RESPONSE = json.dumps({"classifications": [
+    {"vendor_name": "Acme", "category_id": "11", "notes": "braces { and ] in a string"},
+    {"vendor_name": "Say \"Hi\" \\ Co", "category_id": "22", "nested": {"list": [1, 2]}},
+    {"vendor_name": "Globex", "category_id": "N/A"},
+]})
+
+
+def _feed_in_chunks(text, size):
+    parser = IncrementalArrayParser()
+    items = []
+    for start in range(0, len(text), size):
+        items.extend(parser.feed(text[start:start + size]))
+    return items
+
+
+def test_parser_yields_every_element_at_any_chunk_boundary():
+    expected = json.loads(RESPONSE)["classifications"]
+    for size in (1, 2, 3, 7, 64, len(RESPONSE)):
+        assert _feed_in_chunks(RESPONSE, size) == expected
+
+
+def test_parser_emits_elements_as_they_close():
+    parser = IncrementalArrayParser()
+    assert parser.feed('Sure: ```json\n{"classifications": [{"vendor_name": "A"}, {"vendor_') == [{"vendor_name": "A"}]
+    assert parser.feed('name": "B"}') == [{"vendor_name": "B"}]
+    assert parser.feed('], "extra": [{"vendor_name": "C"}]}\n```') == []
+
+
+def test_parser_skips_invalid_elements():
+    assert _feed_in_chunks('{"classifications": [{"a": tru}, {"b": 1}]}', 5) == [{"b": 1}]
+
+
+def test_parse_sse_line():
+    assert parse_sse_line(": keep-alive") is None
+    assert parse_sse_line("data: [DONE]") is None
+    assert parse_sse_line("event: message") is None
+    assert parse_sse_line('data: {"choices": []}') == {"choices": []}
+    try:
+        parse_sse_line('data: {"error": {"message": "overloaded"}}')
+    except StreamError as stream_error:
+        assert "overloaded" in str(stream_error)
+    else:
+        raise AssertionError("StreamError not raised")
+
+
+class _FakeResponse:
+    def __init__(self, lines, error=None):
+        self.lines = lines
+        self.error = error
+
+    async def aiter_lines(self):
+        for line in self.lines:
+            yield line
+        if self.error is not None:
+            raise self.error
+
+
+def _sse(text=None, finish_reason=None, usage=None):
+    chunk = {"choices": [{"delta": {"content": text} if text else {}, "finish_reason": finish_reason}]}
+    if usage:
+        chunk["usage"] = usage
+    return "data: " + json.dumps(chunk)
+
+
+def test_read_completion_stream_collects_content_usage_and_items():
+    lines = [": OPENROUTER PROCESSING", _sse(RESPONSE[:40]), "", _sse(RESPONSE[40:]),
+             _sse(finish_reason="stop", usage={"total_tokens": 10}), "data: [DONE]"]
+    received = []
+    completion = asyncio.run(read_completion_stream(_FakeResponse(lines), on_item=received.append,
+                                                    validate_item=lambda item: item if item["category_id"] != "N/A" else None))
+    assert completion.content == RESPONSE
+    assert completion.finish_reason == "stop"
+    assert completion.usage == {"total_tokens": 10}
+    assert [item["vendor_name"] for item in received] == ["Acme", "Say \"Hi\" \\ Co"]
+    assert completion.invalid_items == 1
+    assert completion.error is None
+
+
+def test_read_completion_stream_keeps_items_when_the_connection_drops():
+    lines = [_sse(RESPONSE[:RESPONSE.index("Globex")])]
+    completion = asyncio.run(read_completion_stream(_FakeResponse(lines, error=httpx.ReadError("connection reset"))))
+    assert isinstance(completion.error, httpx.ReadError)
+    assert completion.partial_result() == {"classifications": json.loads(RESPONSE)["classifications"][:2], "partial": True}
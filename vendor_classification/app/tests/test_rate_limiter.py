@@ -0,0 +1,130 @@
+"""
+Unit tests for the per-process token buckets and retry waits (services.rate_limiter).
+"""
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services import rate_limiter
+from services.rate_limiter import OPENROUTER_PROVIDER, RateLimiter, wait_for_shared_budget
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=clock)) # Module-local; asyncio keeps the real clock
+    for name, value in {"OPENROUTER_REQUESTS_PER_MINUTE": 0, "OPENROUTER_KEY_REQUESTS_PER_MINUTE": 0,
+                        "OPENROUTER_TOKENS_PER_MINUTE": 0, "OPENROUTER_KEY_TOKENS_PER_MINUTE": 0}.items():
+        monkeypatch.setattr(rate_limiter.settings, name, value)
+    return clock
+
+
+def _acquire(limiter, tokens=0, key_id="key-a"):
+    return limiter._try_acquire_local(OPENROUTER_PROVIDER, key_id, limiter._buckets(OPENROUTER_PROVIDER, key_id, tokens))
+
+
+def test_no_buckets_without_limits(clock):
+    limiter = RateLimiter("local")
+    assert limiter._buckets(OPENROUTER_PROVIDER, "key-a", 500) == []
+    assert _acquire(limiter, 500) == 0.0
+
+
+def test_request_bucket_empties_and_refills(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.settings, "OPENROUTER_REQUESTS_PER_MINUTE", 60)
+    limiter = RateLimiter("local")
+    for _ in range(60):
+        assert _acquire(limiter) == 0.0
+    assert _acquire(limiter) == pytest.approx(1.0)
+    clock.now += 1.0
+    assert _acquire(limiter) == 0.0
+    assert _acquire(limiter) == pytest.approx(1.0)
+
+
+def test_denied_acquire_charges_no_bucket(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.settings, "OPENROUTER_REQUESTS_PER_MINUTE", 600)
+    monkeypatch.setattr(rate_limiter.settings, "OPENROUTER_TOKENS_PER_MINUTE", 6000)
+    limiter = RateLimiter("local")
+    assert _acquire(limiter, tokens=5000) == 0.0
+    assert _acquire(limiter, tokens=2000) == pytest.approx(10.0) # 1000 tokens short at 100 tokens/s
+    # The request bucket was not charged for the denied call
+    assert limiter._local_buckets["vc:ratelimit:openrouter:*:requests"][0] == pytest.approx(599.0)
+
+
+def test_cost_above_capacity_waits_for_a_full_bucket(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.settings, "OPENROUTER_KEY_TOKENS_PER_MINUTE", 1000)
+    limiter = RateLimiter("local")
+    assert _acquire(limiter, tokens=5000) == 0.0 # A full bucket always lets one call through
+    assert _acquire(limiter, tokens=1) > 0
+    assert _acquire(limiter, tokens=1, key_id="key-b") == 0.0 # Other keys have their own bucket
+
+
+def test_block_pauses_the_key_or_the_provider(clock):
+    limiter = RateLimiter("local")
+    asyncio.run(limiter.block(OPENROUTER_PROVIDER, "raw-key", 5.0))
+    blocked_key = rate_limiter.key_fingerprint("raw-key")
+    assert _acquire(limiter, key_id=blocked_key) == pytest.approx(5.0)
+    assert _acquire(limiter, key_id="other") == 0.0
+    asyncio.run(limiter.block(OPENROUTER_PROVIDER, None, 2.0, provider_wide=True))
+    assert _acquire(limiter, key_id="other") == pytest.approx(2.0)
+    clock.now += 5.0
+    assert _acquire(limiter, key_id=blocked_key) == 0.0
+
+
+def test_adjust_tokens_reconciles_the_estimate(clock, monkeypatch):
+    monkeypatch.setattr(rate_limiter.settings, "OPENROUTER_TOKENS_PER_MINUTE", 1000)
+    limiter = RateLimiter("local")
+    assert _acquire(limiter, tokens=800) == 0.0
+    asyncio.run(limiter.adjust_tokens(OPENROUTER_PROVIDER, "raw-key", -600)) # Real usage was 200
+    assert _acquire(limiter, tokens=700) == 0.0
+
+
+class _Outcome:
+    failed = True
+
+    def __init__(self, status_code):
+        self.error = Exception("HTTP error")
+        self.error.response = SimpleNamespace(status_code=status_code)
+
+    def exception(self):
+        return self.error
+
+
+@pytest.mark.parametrize("backend, status_code, limit, short_wait", [
+    ("none", 429, 60, False),
+    ("local", 429, 0, True),
+    ("local", 503, 0, False),
+    ("local", 503, 60, True),
+    ("redis", 500, 0, False),
+])
+def test_retry_wait_uses_backoff_unless_the_limiter_waits(clock, monkeypatch, backend, status_code, limit, short_wait):
+    monkeypatch.setattr(rate_limiter, "_limiter", RateLimiter(backend))
+    monkeypatch.setattr(rate_limiter.settings, "OPENROUTER_REQUESTS_PER_MINUTE", limit)
+    wait = wait_for_shared_budget(OPENROUTER_PROVIDER, lambda retry_state: 8.0)
+    assert (wait(SimpleNamespace(outcome=_Outcome(status_code))) < 1.0) == short_wait
+
+
+def test_redis_errors_fall_back_locally_then_retry_redis(clock):
+    limiter = RateLimiter("redis")
+    redis_calls = []
+
+    async def _failing_redis(*args):
+        redis_calls.append(args)
+        raise ConnectionError("redis down")
+
+    limiter._try_acquire_redis = _failing_redis
+    assert asyncio.run(limiter.acquire(OPENROUTER_PROVIDER, "raw-key")) == 0.0
+    assert asyncio.run(limiter.acquire(OPENROUTER_PROVIDER, "raw-key")) == 0.0
+    assert len(redis_calls) == 1
+    assert limiter.get_stats() == {"backend": "redis", "redis_available": False, "redis_errors": 1, "local_fallback_acquires": 2}
+    clock.now += rate_limiter.REDIS_RETRY_INTERVAL_SECONDS
+    asyncio.run(limiter.acquire(OPENROUTER_PROVIDER, "raw-key"))
+    assert len(redis_calls) == 2
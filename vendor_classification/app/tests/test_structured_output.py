@@ -0,0 +1,70 @@
+"""
+Unit tests for response validation and response format selection (services.structured_output).
+"""
+import pytest
+
+from services import structured_output
+from services.structured_output import (ClassificationItem, ResponseSpec, mark_unsupported, parse_json, request_options,
+                                        uses_json_schema)
+
+BATCH_SPEC = ResponseSpec("level1_classification", {}, ClassificationItem)
+SINGLE_SPEC = ResponseSpec("search_level1_classification", {}, ClassificationItem, list_field=None)
+
+
+@pytest.fixture(autouse=True)
+def _fresh_unsupported_models(monkeypatch):
+    monkeypatch.setattr(structured_output, "_unsupported_models", set())
+    monkeypatch.setattr(structured_output.settings, "LLM_STRUCTURED_OUTPUT", "auto")
+
+
+def test_validate_drops_only_the_invalid_items():
+    data = {"level": 1, "batch_id": "b1", "classifications": [
+        {"vendor_name": "Acme", "category_id": "11", "confidence": 0.9},
+        {"category_id": "22"}, # vendor_name missing
+        {"vendor_name": "Globex", "confidence": 1.5}, # confidence out of range
+        {"vendor_name": "Initech"},
+    ]}
+    validated, invalid = BATCH_SPEC.validate(data)
+    assert invalid == 2
+    assert validated["batch_id"] == "b1"
+    assert [item["vendor_name"] for item in validated["classifications"]] == ["Acme", "Initech"]
+    assert validated["classifications"][1]["category_id"] == "N/A" # Model defaults are filled in
+
+
+@pytest.mark.parametrize("data", [None, [], "text", {"classifications": "none"}, {"level": 1}])
+def test_validate_rejects_the_wrong_overall_shape(data):
+    assert BATCH_SPEC.validate(data) == (None, 0)
+
+
+def test_validate_single_item_response_keeps_extra_fields():
+    validated, invalid = SINGLE_SPEC.validate({"attempt_id": "a1", "vendor_name": "Acme", "category_id": "11"})
+    assert invalid == 0
+    assert validated["attempt_id"] == "a1"
+    assert validated["category_id"] == "11"
+    assert SINGLE_SPEC.validate({"category_id": "11"}) == (None, 0)
+
+
+def test_parse_json():
+    assert parse_json('{"a": [1, 2]}') == {"a": [1, 2]}
+    assert parse_json("") is None
+    assert parse_json("Here you go: {}") is None
+
+
+def test_json_schema_selection_and_fallback():
+    spec = ResponseSpec("level1_classification", {"type": "object"}, ClassificationItem)
+    assert uses_json_schema("openai/gpt-4o-mini")
+    assert not uses_json_schema("anthropic/claude-3-haiku")
+    assert request_options("anthropic/claude-3-haiku", spec) == {"response_format": {"type": "json_object"}}
+    options = request_options("openai/gpt-4o-mini", spec)
+    assert options["response_format"]["type"] == "json_schema"
+    assert options["provider"] == {"require_parameters": True}
+
+    mark_unsupported("openai/gpt-4o-mini")
+    assert request_options("openai/gpt-4o-mini", spec) == {"response_format": {"type": "json_object"}}
+
+
+def test_structured_output_modes(monkeypatch):
+    monkeypatch.setattr(structured_output.settings, "LLM_STRUCTURED_OUTPUT", "always")
+    assert uses_json_schema("anthropic/claude-3-haiku")
+    monkeypatch.setattr(structured_output.settings, "LLM_STRUCTURED_OUTPUT", "off")
+    assert not uses_json_schema("openai/gpt-4o-mini")
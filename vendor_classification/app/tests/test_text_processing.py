@@ -0,0 +1,35 @@
+"""
+Unit tests for the vendor name dedupe keys (utils.text_processing.vendor_name_keys).
+"""
+import pytest
+
+from utils.text_processing import vendor_name_keys
+
+
+@pytest.mark.parametrize("names", [
+    ["Acme Inc", "ACME, Inc.", "Acme, Inc", "acme"],
+    ["Globex L.L.C.", "Globex LLC", "Globex"],
+    ["Initech Co. Ltd.", "Initech"],
+])
+def test_trailing_legal_forms_share_a_key(names):
+    assert len(set(vendor_name_keys(names))) == 1
+
+
+@pytest.mark.parametrize("first, second", [
+    ("AG Barr", "Barr"),
+    ("SA Recycling", "Recycling Co"),
+    ("LP Building Solutions", "Building Solutions Inc"),
+    ("Co-op Services", "OP Services LLC"),
+])
+def test_leading_and_hyphenated_legal_form_words_are_kept(first, second):
+    first_key, second_key = vendor_name_keys([first, second])
+    assert first_key != second_key
+
+
+def test_expected_keys():
+    assert vendor_name_keys(["AG Barr", "Recycling Co", "Co-op Services", "McDonald's Corp."]) == [
+        "ag barr", "recycling", "coop services", "mcdonalds"]
+
+
+def test_name_that_is_only_a_legal_form_keeps_it():
+    assert vendor_name_keys(["Inc.", "  "]) == ["inc", ""]
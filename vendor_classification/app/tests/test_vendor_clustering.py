@@ -0,0 +1,39 @@
+"""
+Regression table for fuzzy vendor clustering (services.vendor_clustering) at the default threshold.
+"""
+import pytest
+
+from services.vendor_clustering import cluster_vendor_names
+from utils.text_processing import vendor_name_keys
+
+
+def _merged(first, second):
+    members, _ = cluster_vendor_names(dict(zip([first, second], vendor_name_keys([first, second]))), threshold=0.94)
+    return members.get(second) == first
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Microsoft", "Microsfot"),
+    ("Microsoft", "Micro Soft"),
+    ("Deloitte Touche", "Touche Deloitte"),
+    ("Deloitte", "Deloite"),
+    ("Accenture", "Acentture"),
+    ("The Home Depot", "Home Depot"),
+    ("Pricewaterhousecoopers", "Pricewaterhousecooper"),
+])
+def test_must_merge(first, second):
+    assert _merged(first, second)
+
+
+@pytest.mark.parametrize("first, second", [
+    ("Johnson", "Johnston"),
+    ("Anderson", "Andersen"),
+    ("Peterson", "Petersen"),
+    ("Johnson Controls", "Johnston Controls"),
+    ("Allied Electric", "Allied Electronics"),
+    ("Acme Services", "Acme Solutions"),
+    ("Siemens", "Siemens Energy"),
+    ("Store 12", "Store 13"),
+])
+def test_must_not_merge(first, second):
+    assert not _merged(first, second)
@@ -4,7 +4,7 @@ import os
 import json
 import pandas as pd
 import re # <<< Added import
-from typing import Dict, Any
+from typing import Dict, Any, Callable, List
 
 # --- ADDED: Import logging for the main script part ---
 import logging
@@ -21,6 +21,31 @@ logger = get_logger("vendor_classification.taxonomy_loader")
 
 # --- Global cache for taxonomy ---
 _taxonomy_cache: Taxonomy | None = None
+# --- Callbacks run when a cached taxonomy is replaced (force_reload) ---
+_taxonomy_reload_hooks: List[Callable[[Taxonomy], None]] = []
+
+def register_taxonomy_reload_hook(hook: Callable[[Taxonomy], None]) -> None:
+    """
+    Registers a callback invoked with the new Taxonomy whenever a previously cached taxonomy is replaced.
+    Used to invalidate data derived from the taxonomy (e.g. cached classifications).
+    """
+    if hook not in _taxonomy_reload_hooks:
+        _taxonomy_reload_hooks.append(hook)
+
+def _update_taxonomy_cache(taxonomy: Taxonomy) -> None:
+    """Indexes and caches the taxonomy, notifying reload hooks if it replaces an existing one."""
+    global _taxonomy_cache
+    taxonomy.build_index() # Flat lookup tables, built once per loaded taxonomy
+    previous = _taxonomy_cache
+    _taxonomy_cache = taxonomy
+    if previous is None or previous is taxonomy:
+        return
+    logger.info(f"Taxonomy reloaded. Running {len(_taxonomy_reload_hooks)} reload hook(s).")
+    for hook in _taxonomy_reload_hooks:
+        try:
+            hook(taxonomy)
+        except Exception as hook_err:
+            logger.error(f"Taxonomy reload hook {getattr(hook, '__name__', hook)} failed: {hook_err}", exc_info=True)
 
 def load_taxonomy(force_reload: bool = False) -> Taxonomy:
     """
@@ -37,7 +62,6 @@ def load_taxonomy(force_reload: bool = False) -> Taxonomy:
         FileNotFoundError: If neither JSON nor Excel file can be found.
         ValueError: If both JSON and Excel loading fail or result in empty taxonomy.
     """
-    global _taxonomy_cache
     if _taxonomy_cache is not None and not force_reload:
         logger.info("Returning cached taxonomy.")
         return _taxonomy_cache
@@ -60,7 +84,7 @@ def load_taxonomy(force_reload: bool = False) -> Taxonomy:
 
             taxonomy = Taxonomy(**taxonomy_data)
             logger.info(f"Taxonomy loaded successfully from JSON with {len(taxonomy.categories)} top-level categories.")
-            _taxonomy_cache = taxonomy # Update cache
+            _update_taxonomy_cache(taxonomy) # Update cache
             return taxonomy
         except json.JSONDecodeError as json_err:
             logger.error(f"Failed to decode JSON from {json_path}: {json_err}", exc_info=False)
@@ -84,7 +108,7 @@ def load_taxonomy(force_reload: bool = False) -> Taxonomy:
                 json.dump(taxonomy.model_dump(exclude_none=True, mode='json'), f, indent=2) # Added mode='json'
 
             logger.info(f"Taxonomy loaded successfully from Excel with {len(taxonomy.categories)} top-level categories and saved to JSON.")
-            _taxonomy_cache = taxonomy # Update cache
+            _update_taxonomy_cache(taxonomy) # Update cache
             return taxonomy
         except Exception as e:
             logger.error(f"Error loading taxonomy from Excel after JSON failure: {e}", exc_info=True)
@@ -96,7 +120,7 @@ def load_taxonomy(force_reload: bool = False) -> Taxonomy:
         logger.warning(f"Failed to load taxonomy from both JSON and Excel. Falling back to sample taxonomy.")
         try:
             taxonomy = create_sample_taxonomy()
-            _taxonomy_cache = taxonomy # Cache the sample
+            _update_taxonomy_cache(taxonomy) # Cache the sample
             return taxonomy
         except Exception as sample_err:
             error_msg = f"Failed to load taxonomy from files and also failed to create sample taxonomy: {sample_err}"
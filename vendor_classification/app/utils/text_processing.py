@@ -1,6 +1,42 @@
 import re
 import unicodedata
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Union
+
+import pandas as pd
+
+# Legal entity indicators removed by normalize_vendor_name, as one compiled alternation (was one re.sub per entry)
+_ENTITY_INDICATORS = [
+    r'llc', r'inc', r'ltd', r'corp', r'corporation',
+    r'co', r'company', r'group', r'holdings', r'services',
+    r'solutions', r'systems', r'technologies', r'tech',
+    r'enterprises', r'limited', r'partners', r'associates',
+    r'gmbh', r'plc', r'pte', r'pty', r'ag', r'sa',
+    r'srl', r's\.r\.l', r's\.p\.a', r's\.a', r's\.a\.s',
+    r'b\.v', r'lp', r'llp', r'l\.p', r'l\.l\.c',
+    r'l\.l\.p', r'incorporated'
+]
+_ENTITY_INDICATOR_RE = re.compile(r'\b(?:' + '|'.join(_ENTITY_INDICATORS) + r')\b')
+_NON_WORD_RE = re.compile(r'[^\w\s]')
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Legal forms only (not descriptive words like 'services' or 'group'), for the dedupe key
+_LEGAL_FORMS = [
+    'llc', 'inc', 'incorporated', 'ltd', 'limited', 'corp', 'corporation', 'co', 'company',
+    'gmbh', 'plc', 'pte', 'pty', 'ag', 'sa', 'srl', 'sarl', 'spa', 'sas', 'bv', 'nv', 'lp', 'llp'
+]
+# Trailing legal forms only: a leading 'AG'/'SA'/'LP' is part of the name ("AG Barr", "SA Recycling")
+_TRAILING_LEGAL_FORMS_RE = re.compile(r'(?:\s(?:' + '|'.join(_LEGAL_FORMS) + r'))+$')
+_KEY_DROP_RE = re.compile(r"[.'’]|(?<=\w)-(?=\w)") # Dropped outright so 'L.L.C.' -> 'llc', "McDonald's" -> 'mcdonalds', 'Co-op' -> 'coop'
+_COMBINING_MARKS_RE = re.compile(r'[\u0300-\u036f]')
+
+# Word tokens and the legal-form/filler words that say nothing about a vendor's industry
+# (TF-IDF pre-classifier features and search context ranking)
+WORD_TOKEN_RE = re.compile(r"[a-z0-9]+")
+INDUSTRY_STOPWORDS = frozenset({
+    "a", "an", "and", "the", "of", "for", "in", "on", "to", "by", "with", "or", "at",
+    "inc", "llc", "ltd", "corp", "corporation", "co", "company", "plc", "gmbh", "sa", "ag", "lp", "llp",
+    "group", "holdings", "intl", "international", "except", "other", "all",
+})
 
 def normalize_vendor_name(name: str) -> str:
     """
@@ -24,34 +60,22 @@ def normalize_vendor_name(name: str) -> str:
     normalized = ''.join([c for c in normalized if not unicodedata.combining(c)])
     
     # Remove legal entity indicators
-    entity_indicators = [
-        r'\bllc\b', r'\binc\b', r'\bltd\b', r'\bcorp\b', r'\bcorporation\b',
-        r'\bco\b', r'\bcompany\b', r'\bgroup\b', r'\bholdings\b', r'\bservices\b',
-        r'\bsolutions\b', r'\bsystems\b', r'\btechnologies\b', r'\btech\b',
-        r'\benterprises\b', r'\blimited\b', r'\bpartners\b', r'\bassociates\b',
-        r'\bgmbh\b', r'\bplc\b', r'\bpte\b', r'\bpty\b', r'\bag\b', r'\bsa\b',
-        r'\bsrl\b', r'\bs\.r\.l\b', r'\bs\.p\.a\b', r'\bs\.a\b', r'\bs\.a\.s\b',
-        r'\bb\.v\b', r'\blp\b', r'\bllp\b', r'\blp\b', r'\bl\.p\b', r'\bl\.l\.c\b',
-        r'\bl\.l\.p\b', r'\bincorporated\b'
-    ]
-    
-    for indicator in entity_indicators:
-        normalized = re.sub(indicator, '', normalized)
+    normalized = _ENTITY_INDICATOR_RE.sub('', normalized)
     
     # Remove special characters and replace with space
-    normalized = re.sub(r'[^\w\s]', ' ', normalized)
+    normalized = _NON_WORD_RE.sub(' ', normalized)
     
     # Replace multiple spaces with a single space
-    normalized = re.sub(r'\s+', ' ', normalized)
+    normalized = _WHITESPACE_RE.sub(' ', normalized)
     
     # Remove leading/trailing whitespace
     normalized = normalized.strip()
     
     return normalized
 
-def normalize_vendor_names(vendors: List[str]) -> List[str]:
+def normalize_vendor_names(vendors: Union[List[str], pd.Series]) -> List[str]:
     """
-    Normalize a list of vendor names.
+    Normalize a list (or pandas Series) of vendor names. Each distinct name is normalized once.
     
     Args:
         vendors: List of vendor names
@@ -59,7 +83,33 @@ def normalize_vendor_names(vendors: List[str]) -> List[str]:
     Returns:
         List of normalized vendor names
     """
-    return [normalize_vendor_name(vendor) for vendor in vendors]
+    vendors = vendors.tolist() if isinstance(vendors, pd.Series) else vendors
+    normalized = {vendor: normalize_vendor_name(vendor) for vendor in dict.fromkeys(vendors)}
+    return [normalized[vendor] for vendor in vendors]
+
+def vendor_name_keys(names: Union[List[str], pd.Series]) -> List[str]:
+    """
+    Dedupe keys for vendor names, computed in one vectorized pass: lowercase, accents, dots, apostrophes
+    and hyphens inside words dropped, other punctuation as spaces, trailing legal forms (Inc, LLC, GmbH, ...)
+    removed. "Acme Inc", "ACME, Inc." and "Acme, Inc" all map to 'acme'. Legal-form words elsewhere in the
+    name are kept ("AG Barr" stays 'ag barr', "Co-op Services" is 'coop services'), as are descriptive words
+    ('services', 'group'), so different businesses stay apart. A name that is only a legal form keeps it.
+    
+    Args:
+        names: List or Series of vendor names
+        
+    Returns:
+        List of keys, aligned with names
+    """
+    series = names if isinstance(names, pd.Series) else pd.Series(list(names), dtype=object)
+    base = (series.fillna('').astype(str).str.lower()
+            .str.normalize('NFKD')
+            .str.replace(_COMBINING_MARKS_RE, '', regex=True)
+            .str.replace(_KEY_DROP_RE, '', regex=True)
+            .str.replace(_NON_WORD_RE, ' ', regex=True)
+            .str.replace(_WHITESPACE_RE, ' ', regex=True).str.strip())
+    stripped = base.str.replace(_TRAILING_LEGAL_FORMS_RE, '', regex=True)
+    return stripped.where(stripped != '', base).tolist()
 
 def extract_vendor_names_from_dataframe(df: Any, column_name: str = 'vendor_name') -> List[str]:
     """
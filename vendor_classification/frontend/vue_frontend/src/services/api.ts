@@ -96,6 +96,21 @@ export interface JobResultsResponse {
     job_id: string;
     job_type: 'CLASSIFICATION' | 'REVIEW';
     results: JobResultItem[] | ReviewResultItem[]; // Union type
+    total: number; // Results matching the filters (before skip/limit)
+    skip: number;
+    limit: number | null; // null = all remaining results
+}
+
+// Optional server-side paging/filtering for getJobResults (CLASSIFICATION jobs)
+export interface JobResultsQuery {
+    skip?: number;
+    limit?: number;
+    status?: string; // final_status
+    source?: string; // classification_source
+    achieved_level?: number;
+    search?: string;
+    sort_by?: string; // Any JobResultItem field, or 'position' (input order)
+    sort_desc?: boolean;
 }
 // --- END ADDED ---
 
@@ -400,10 +415,10 @@ const apiService = {
      * Fetches the detailed classification results for a specific job.
      * Returns the JobResultsResponse structure containing job type and results list.
      */
-    async getJobResults(jobId: string): Promise<JobResultsResponse> {
-        console.log(`[api.ts getJobResults] Fetching detailed results for job ID: ${jobId}`); // LOGGING
-        const response = await axiosInstance.get<JobResultsResponse>(`/jobs/${jobId}/results`);
-        console.log(`[api.ts getJobResults] Received ${response.data.results.length} detailed result items for job ${jobId} (Type: ${response.data.job_type}).`); // LOGGING
+    async getJobResults(jobId: string, query?: JobResultsQuery): Promise<JobResultsResponse> {
+        console.log(`[api.ts getJobResults] Fetching detailed results for job ID: ${jobId}`, query ?? {}); // LOGGING
+        const response = await axiosInstance.get<JobResultsResponse>(`/jobs/${jobId}/results`, { params: query });
+        console.log(`[api.ts getJobResults] Received ${response.data.results.length} of ${response.data.total} detailed result items for job ${jobId} (Type: ${response.data.job_type}).`); // LOGGING
         return response.data;
     },
 
@@ -46,6 +46,7 @@ export interface JobResultItem {
     classification_source: string | null; // 'Initial', 'Search', 'Review'
     classification_notes_or_reason: string | null;
     achieved_level: number | null; // 0-5
+    cluster_representative?: string | null; // Vendor whose result was reused (duplicate/fuzzy cluster)
 }
 
 // Interface for a single detailed result item (for REVIEW jobs)